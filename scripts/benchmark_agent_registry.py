@@ -0,0 +1,118 @@
+"""
+Benchmark: per-request agent build vs pooled AgentRegistry.
+
+Measures the setup time paid before the first token of every /api/stream_query
+request: ChatGoogleGenerativeAI construction + create_react_agent compilation.
+With --live it also measures the real time-to-first-token against Gemini,
+comparing a fresh client per request with a pooled one (TLS reuse).
+
+Usage:
+    python scripts/benchmark_agent_registry.py
+    python scripts/benchmark_agent_registry.py --iterations 50
+    python scripts/benchmark_agent_registry.py --live --iterations 5  # requires GOOGLE_API_KEY
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path for imports
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+
+def _summary(label: str, samples_ms: list) -> None:
+    samples = sorted(samples_ms)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"  {label:<28} avg={statistics.mean(samples):>9.2f} ms  "
+        f"p50={statistics.median(samples):>9.2f} ms  p95={p95:>9.2f} ms"
+    )
+
+
+def bench_build(iterations: int) -> None:
+    """Time agent acquisition with and without the registry (no network)."""
+    from langgraph.checkpoint.memory import InMemorySaver
+    from src.agent.agent_manager import AgentManager
+    from src.agent.agent_registry import AgentRegistry
+    from src.env import FORCED_MODEL, VERTEX_AI_REGION
+    from src.tools import domanda_teoria
+
+    tools = [domanda_teoria]
+    checkpointer = InMemorySaver()
+
+    per_request = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        AgentManager._build_agent(FORCED_MODEL, tools, checkpointer)
+        per_request.append((time.perf_counter() - start) * 1000)
+
+    registry = AgentRegistry()
+    key = AgentRegistry.build_key(FORCED_MODEL, VERTEX_AI_REGION, 1, ("domanda_teoria",), checkpointer)
+    pooled = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        registry.get_or_create(key, lambda: AgentManager._build_agent(FORCED_MODEL, tools, checkpointer))
+        pooled.append((time.perf_counter() - start) * 1000)
+
+    print(f"\n--- Agent setup per request ({iterations} iterations) ---")
+    _summary("per-request build", per_request)
+    _summary("registry (first = build)", pooled)
+    _summary("registry (warm only)", pooled[1:] or pooled)
+    saved = statistics.mean(per_request) - statistics.mean(pooled[1:] or pooled)
+    print(f"  Saved per warm request:      {saved:>9.2f} ms")
+
+
+async def _first_token_ms(llm) -> float:
+    start = time.perf_counter()
+    async for chunk in llm.astream("Rispondi solo: OK"):
+        if chunk.text:
+            break
+    return (time.perf_counter() - start) * 1000
+
+
+async def bench_live(iterations: int) -> None:
+    """Time-to-first-token with a fresh client per request vs a pooled client."""
+    from src.agent.agent_manager import AgentManager
+    from src.env import FORCED_MODEL
+
+    fresh = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        llm = AgentManager._build_llm(FORCED_MODEL)
+        build_ms = (time.perf_counter() - start) * 1000
+        fresh.append(build_ms + await _first_token_ms(llm))
+
+    pooled_llm = AgentManager._build_llm(FORCED_MODEL)
+    await _first_token_ms(pooled_llm)  # warm connection
+    pooled = [await _first_token_ms(pooled_llm) for _ in range(iterations)]
+
+    print(f"\n--- Live time-to-first-token ({iterations} iterations, model={FORCED_MODEL}) ---")
+    _summary("fresh client", fresh)
+    _summary("pooled client", pooled)
+    print(f"  Saved per request:           {statistics.mean(fresh) - statistics.mean(pooled):>9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pooled agent registry")
+    parser.add_argument("--iterations", type=int, default=20, help="Iterations per scenario (default: 20)")
+    parser.add_argument("--live", action="store_true", help="Also measure real TTFT against Gemini")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv(Path(PROJECT_ROOT) / ".env")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark-offline")
+
+    bench_build(args.iterations)
+
+    if args.live:
+        asyncio.run(bench_live(args.iterations))
+
+    print()
+
+
+if __name__ == "__main__":
+    main()
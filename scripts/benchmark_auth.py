@@ -0,0 +1,118 @@
+"""
+Benchmark: auth overhead of VerifyToken on the /api/stream_query hot path.
+
+Keys and tokens are generated locally and the JWKS endpoint is simulated (with an
+optional network delay), so the numbers isolate the verification work:
+
+- before: PyJWKClient.get_signing_key_from_jwt + full RS256 jwt.decode on every request
+  (the previous VerifyToken.verify), with PyJWKClient's own 5-minute JWKS cache;
+- after, new token: JWKSCache lookup by kid + RS256 decode (first request of a token);
+- after, repeated token: verified-token cache hit (every later request until exp).
+
+Usage:
+    python scripts/benchmark_auth.py
+    python scripts/benchmark_auth.py --iterations 2000 --jwks-delay-ms 80
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# Add project root to path for imports
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+AUDIENCE = "https://api.benchmark"
+ISSUER = "https://tenant.benchmark/"
+
+
+def _summary(label: str, samples_ms: list) -> None:
+    samples = sorted(samples_ms)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"  {label:<28} avg={statistics.mean(samples):>9.3f} ms  "
+        f"p50={statistics.median(samples):>9.3f} ms  p95={p95:>9.3f} ms"
+    )
+
+
+def _make_key():
+    import jwt
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private.public_key()))
+    return private, {**jwk, "kid": "bench", "use": "sig", "alg": "RS256"}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark VerifyToken auth overhead")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--jwks-delay-ms", type=float, default=0.0, help="Simulated JWKS endpoint latency")
+    args = parser.parse_args()
+
+    import jwt
+    from fastapi.security import HTTPAuthorizationCredentials, SecurityScopes
+    from src.auth import VerifyToken
+    from src.jwks import JWKSCache, VerifiedTokenCache
+
+    private, jwk = _make_key()
+    jwks = {"keys": [jwk]}
+
+    def fetch_jwks():
+        time.sleep(args.jwks_delay_ms / 1000)
+        return jwks
+
+    def token(i: int) -> str:
+        payload = {"sub": f"user{i}", "aud": AUDIENCE, "iss": ISSUER, "exp": int(time.time()) + 3600}
+        return jwt.encode(payload, private, algorithm="RS256", headers={"kid": "bench"})
+
+    tokens = [token(i) for i in range(args.iterations)]
+    print(f"AUTH benchmark: {args.iterations} requests, JWKS delay {args.jwks_delay_ms} ms")
+
+    # Before: per-request key lookup + RS256 decode
+    client = jwt.PyJWKClient("https://tenant.benchmark/.well-known/jwks.json")
+    before = []
+    with patch.object(client, "fetch_data", fetch_jwks):
+        for t in tokens:
+            start = time.perf_counter()
+            signing_key = client.get_signing_key_from_jwt(t).key
+            jwt.decode(t, signing_key, algorithms=["RS256"], audience=AUDIENCE, issuer=ISSUER)
+            before.append((time.perf_counter() - start) * 1000)
+
+    # After: VerifyToken with JWKS and verified-token caches
+    verifier = VerifyToken()
+    verifier.config = SimpleNamespace(auth0_algorithms=["RS256"], auth0_api_audience=AUDIENCE, auth0_issuer=ISSUER)
+    verifier.jwks = JWKSCache("https://tenant.benchmark/.well-known/jwks.json", fetch=fetch_jwks)
+    verifier.verified_tokens = VerifiedTokenCache(maxsize=args.iterations * 2)
+
+    async def timed(samples: list, t: str) -> None:
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=t)
+        start = time.perf_counter()
+        await verifier.verify(SecurityScopes(), credentials)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    async def run_after():
+        new_token, repeated = [], []
+        for t in tokens:
+            await timed(new_token, t)
+        for t in tokens:
+            await timed(repeated, t)
+        return new_token, repeated
+
+    new_token, repeated = asyncio.run(run_after())
+
+    _summary("before (per request)", before)
+    _summary("after, new token", new_token)
+    _summary("after, repeated token", repeated)
+    print(f"\n  Speedup on repeated tokens: {statistics.mean(before) / statistics.mean(repeated):.1f}x")
+    print(f"  JWKS cache: {verifier.jwks.stats()}")
+    print(f"  Token cache: {verifier.verified_tokens.stats()}")
+
+
+if __name__ == "__main__":
+    main()
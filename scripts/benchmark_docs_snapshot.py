@@ -0,0 +1,111 @@
+"""
+Benchmark: cold start of the system prompt with and without the local docs snapshot.
+
+Measures the time a fresh process needs before it can serve the first
+/api/stream_query: _DocsCache construction (snapshot load via mmap) +
+_PromptManager.ensure_initialized. Without a snapshot this includes the full S3
+download; with a snapshot S3 is revalidated in background and is not on the path.
+
+By default S3 is simulated with synthetic docs and a fixed latency; with --live
+the real bucket is used (requires AWS credentials and BUCKET_NAME).
+
+Usage:
+    python scripts/benchmark_docs_snapshot.py
+    python scripts/benchmark_docs_snapshot.py --iterations 50 --docs-kb 800 --s3-latency-ms 1500
+    python scripts/benchmark_docs_snapshot.py --live --iterations 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to path for imports
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+
+def _summary(label: str, samples_ms: list) -> None:
+    samples = sorted(samples_ms)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"  {label:<28} avg={statistics.mean(samples):>9.2f} ms  "
+        f"p50={statistics.median(samples):>9.2f} ms  p95={p95:>9.2f} ms"
+    )
+
+
+def _synthetic_fetch(docs_kb: int, latency_ms: int):
+    paragraph = "Il paracadutista deve controllare altimetro, imbracatura e maniglie prima dell'imbarco. "
+    docs = [f"# Documento {i}\n\n" + paragraph * (docs_kb * 1024 // len(paragraph) // 10) for i in range(10)]
+    result = {
+        "combined_docs": "\n\n".join(docs),
+        "docs_meta": [{"title": f"doc_{i}.md", "last_modified": "2026-01-01 00:00:00"} for i in range(10)],
+        "sync_stats": {},
+    }
+
+    def fetch():
+        time.sleep(latency_ms / 1000)
+        return result
+
+    return fetch
+
+
+def _cold_start_ms(snapshot_path: str, snapshot_enabled: bool) -> float:
+    from src.utils import _DocsCache, _PromptManager
+
+    start = time.perf_counter()
+    docs_cache = _DocsCache(snapshot_path=snapshot_path, bundled_snapshot_path="", snapshot_enabled=snapshot_enabled)
+    prompt_manager = _PromptManager(docs_cache)
+    prompt_manager.ensure_initialized()
+    elapsed = (time.perf_counter() - start) * 1000
+    assert prompt_manager.get(), "system prompt vuoto"
+    prompt_manager.wait_for_revalidation()
+    return elapsed
+
+
+def bench(iterations: int, fetch) -> None:
+    with tempfile.TemporaryDirectory() as tmp, patch("src.utils.fetch_docs_from_s3", fetch):
+        snapshot_path = os.path.join(tmp, "docs_snapshot.bin")
+
+        without = [_cold_start_ms(snapshot_path, snapshot_enabled=False) for _ in range(iterations)]
+
+        _cold_start_ms(snapshot_path, snapshot_enabled=True)  # primo avvio: scrive lo snapshot
+        size_kb = os.path.getsize(snapshot_path) / 1024
+        with_snapshot = [_cold_start_ms(snapshot_path, snapshot_enabled=True) for _ in range(iterations)]
+
+    print(f"\n--- Cold start to first prompt ({iterations} iterations, snapshot {size_kb:.0f} KB) ---")
+    _summary("S3 fetch (no snapshot)", without)
+    _summary("mmap snapshot", with_snapshot)
+    print(f"  Saved per cold start:        {statistics.mean(without) - statistics.mean(with_snapshot):>9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark docs snapshot cold start")
+    parser.add_argument("--iterations", type=int, default=20, help="Iterations per scenario (default: 20)")
+    parser.add_argument("--docs-kb", type=int, default=500, help="Synthetic knowledge base size in KB (default: 500)")
+    parser.add_argument("--s3-latency-ms", type=int, default=800, help="Simulated S3 download time (default: 800)")
+    parser.add_argument("--live", action="store_true", help="Use the real S3 bucket instead of synthetic docs")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv(Path(PROJECT_ROOT) / ".env")
+
+    if args.live:
+        from src.s3_utils import DocsSync
+
+        def fetch():
+            # Cache locale nuova a ogni avvio: simula un'istanza serverless fredda
+            with tempfile.TemporaryDirectory() as cache_dir:
+                return DocsSync(cache_dir=cache_dir).sync()
+    else:
+        fetch = _synthetic_fetch(args.docs_kb, args.s3_latency_ms)
+
+    bench(args.iterations, fetch)
+    print()
+
+
+if __name__ == "__main__":
+    main()
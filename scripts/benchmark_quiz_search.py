@@ -0,0 +1,157 @@
+"""
+Benchmark: quiz text search (domanda_teoria mode 4) on a synthetic question bank.
+
+Compares, for the same queries:
+- the chained case-insensitive $regex path (emulated in-process as the collection
+  scan MongoDB performs: every keyword regex on every question, all matches returned);
+- the in-memory inverted index of QuizBank (BM25, limit pushed down).
+
+It also reports the QuizBank build time (indexes are built once per load).
+With --mongo the regex and $text backends are also timed against the configured
+MongoDB, on a scratch collection that is dropped at the end.
+
+Usage:
+    python scripts/benchmark_quiz_search.py
+    python scripts/benchmark_quiz_search.py --questions 10000 --iterations 200
+    python scripts/benchmark_quiz_search.py --mongo  # requires MONGODB_URI
+"""
+import argparse
+import random
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path for imports
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+VOCABULARY = (
+    "quota apertura vela principale riserva sgancio altimetro vento nubi cumuli fronte temporale "
+    "velocità caduta libera assetto uscita aereo direttore lancio istruttore licenza normativa "
+    "atterraggio pendenza turbolenza collisione formazione separazione imbracatura AAD emergenza "
+    "malfunzionamento twist comandi freni planata visibilità pressione temperatura umidità"
+).split()
+
+QUERIES = [
+    "quota di apertura",
+    "malfunzionamento della vela principale",
+    "vento in quota",
+    "direttore di lancio",
+    "apertura della riserva dopo lo sgancio",
+    "velocità di caduta libera",
+]
+
+
+def _summary(label: str, samples_ms: list) -> None:
+    samples = sorted(samples_ms)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"  {label:<28} avg={statistics.mean(samples):>9.3f} ms  "
+        f"p50={statistics.median(samples):>9.3f} ms  p95={p95:>9.3f} ms"
+    )
+
+
+def synthetic_questions(count: int, seed: int = 11) -> list:
+    """Questions mixing domain terms with a Zipf-distributed filler vocabulary, as in real text."""
+    rng = random.Random(seed)
+    filler = [f"termine{n}" for n in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(len(filler))]
+    questions = []
+    for i in range(count):
+        capitolo = i % 10 + 1
+        words = " ".join(
+            rng.choice(VOCABULARY) if rng.random() < 0.3 else rng.choices(filler, weights)[0]
+            for _ in range(rng.randint(8, 16))
+        )
+        questions.append({
+            "_id": f"bench_{i}",
+            "capitolo": capitolo,
+            "numero": i // 10 + 1,
+            "testo": f"Domanda sulla {words}?",
+            "opzioni": [
+                {"id": letter, "testo": " ".join(rng.choice(VOCABULARY) for _ in range(4))}
+                for letter in "ABC"
+            ],
+            "risposta_corretta": rng.choice("ABC"),
+        })
+    return questions
+
+
+def regex_scan(questions: list, testo: str) -> list:
+    """In-process equivalent of {"$and": [{"testo": {"$regex": w, "$options": "i"}}, ...]}."""
+    patterns = [re.compile(w, re.IGNORECASE) for w in testo.lower().split() if len(w) > 2]
+    return [q for q in questions if all(p.search(q["testo"]) for p in patterns)]
+
+
+def bench_local(questions: list, iterations: int) -> None:
+    from src.services.database.quiz_bank import QuizBank
+
+    builds = []
+    for _ in range(3):
+        start = time.perf_counter()
+        bank = QuizBank(questions, "bench")
+        builds.append((time.perf_counter() - start) * 1000)
+
+    regex_ms, index_ms = [], []
+    for i in range(iterations):
+        query = QUERIES[i % len(QUERIES)]
+        start = time.perf_counter()
+        regex_scan(questions, query)
+        regex_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        bank.search(query, limit=1)
+        index_ms.append((time.perf_counter() - start) * 1000)
+
+    print(f"\n--- In-process ({len(questions):,} questions, {iterations} queries) ---")
+    _summary("QuizBank build (indexes)", builds)
+    _summary("regex scan (all matches)", regex_ms)
+    _summary("inverted index (limit=1)", index_ms)
+    print(f"  Speedup:                     {statistics.mean(regex_ms) / statistics.mean(index_ms):>9.1f}x")
+
+
+def bench_mongo(questions: list, iterations: int) -> None:
+    from src.services.database.connection_pool import get_mongo_client
+    from src.services.database.database_quiz_service import QuizMongoDBService
+    from unittest.mock import patch
+
+    collection_name = "benchmark_search"
+    service = QuizMongoDBService(database_name="quiz", collection_name=collection_name)
+    collection = get_mongo_client()["quiz"][collection_name]
+    collection.drop()
+    collection.insert_many([dict(q) for q in questions])
+    try:
+        service.ensure_text_index()
+        timings = {}
+        for backend in ("regex", "text"):
+            samples = []
+            with patch("src.services.database.database_quiz_service.settings.QUIZ_SEARCH_BACKEND", backend):
+                for i in range(iterations):
+                    start = time.perf_counter()
+                    service.search_questions_by_text(QUERIES[i % len(QUERIES)], limit=0 if backend == "regex" else 1)
+                    samples.append((time.perf_counter() - start) * 1000)
+            timings[backend] = samples
+        print(f"\n--- MongoDB ({len(questions):,} questions, {iterations} queries, includes round trip) ---")
+        _summary("$regex (all matches)", timings["regex"])
+        _summary("$text (limit=1)", timings["text"])
+    finally:
+        collection.drop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quiz text search")
+    parser.add_argument("--questions", type=int, default=10000, help="Synthetic bank size (default: 10000)")
+    parser.add_argument("--iterations", type=int, default=100, help="Queries per backend (default: 100)")
+    parser.add_argument("--mongo", action="store_true", help="Also time $regex and $text on MongoDB")
+    args = parser.parse_args()
+
+    questions = synthetic_questions(args.questions)
+    bench_local(questions, args.iterations)
+    if args.mongo:
+        bench_mongo(questions, args.iterations)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark: full-context prompt vs retrieval mode (core section + top-k BM25 chunks).
+
+Measures, for the same knowledge base and a set of sample questions:
+- chunking + BM25 index build time (paid once per prompt version, at update_docs);
+- per-query retrieval latency;
+- system prompt size per request (characters and estimated tokens, ~4 chars/token;
+  use scripts/count_tokens.py for exact Gemini counts).
+
+By default a synthetic Italian knowledge base is generated; --local uses the real
+Markdown docs from a directory.
+
+Usage:
+    python scripts/benchmark_retrieval.py
+    python scripts/benchmark_retrieval.py --local ../Knowledge-AIR-Coach/docs/ --top-k 8
+    python scripts/benchmark_retrieval.py --chapters 40 --iterations 200
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path for imports
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+TOPICS = {
+    "Meteorologia": ["nubi", "cumuli", "vento in quota", "turbolenza", "fronte freddo", "visibilità", "temporale"],
+    "Aerodinamica": ["portanza", "resistenza", "velocità terminale", "assetto", "profilo alare", "stallo"],
+    "Materiali": ["vela principale", "vela di riserva", "imbracatura", "altimetro", "AAD", "fune di vincolo"],
+    "Procedure di emergenza": ["malfunzionamento", "sgancio", "apertura della riserva", "twist", "collisione"],
+    "Normativa": ["licenza", "direttore di lancio", "istruttore", "certificato medico", "quota minima"],
+    "Tecnica di lancio": ["uscita dall'aereo", "caduta libera", "separazione", "apertura", "atterraggio"],
+}
+
+QUERIES = [
+    "A quale quota si formano i cumuli?",
+    "Cosa fare in caso di malfunzionamento della vela principale?",
+    "Come funziona l'AAD?",
+    "Quali sono i requisiti per diventare direttore di lancio?",
+    "Come si esegue un atterraggio con vento forte?",
+    "Che cos'è la velocità terminale?",
+    "Quando serve il certificato medico?",
+    "Come si gestisce un twist dopo l'apertura?",
+]
+
+
+def _summary(label: str, samples_ms: list) -> None:
+    samples = sorted(samples_ms)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"  {label:<28} avg={statistics.mean(samples):>9.3f} ms  "
+        f"p50={statistics.median(samples):>9.3f} ms  p95={p95:>9.3f} ms"
+    )
+
+
+def synthetic_docs(chapters: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    filler = (
+        "Il paracadutista deve conoscere questa parte del programma teorico e saperla applicare "
+        "in ogni situazione, rispettando le indicazioni dell'istruttore e del direttore di lancio."
+    )
+    parts = ["# AIR Coach\n\nSei AIR Coach, assistente per la teoria del paracadutismo. Rispondi in italiano."]
+    topics = list(TOPICS.items())
+    for i in range(chapters):
+        topic, terms = topics[i % len(topics)]
+        parts.append(f"# {topic} - parte {i // len(topics) + 1}")
+        for term in terms:
+            sentences = [f"La sezione tratta {term} nel contesto di {topic.lower()}."]
+            sentences += [f"{filler} Riferimento: {rng.choice(terms)}." for _ in range(rng.randint(4, 9))]
+            parts.append(f"## {term.capitalize()}\n\n" + " ".join(sentences))
+    return "\n\n".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval mode vs full context")
+    parser.add_argument("--local", help="Directory with Markdown docs (default: synthetic corpus)")
+    parser.add_argument("--chapters", type=int, default=30, help="Synthetic chapters (default: 30)")
+    parser.add_argument("--top-k", type=int, default=6, help="Chunks injected per request (default: 6)")
+    parser.add_argument("--iterations", type=int, default=100, help="Queries to time (default: 100)")
+    args = parser.parse_args()
+
+    from src.prompt_personalization import build_personalized_prompt
+    from src.retrieval import DocsRetriever
+
+    if args.local:
+        from scripts.count_tokens import load_local_docs
+        docs = "\n\n".join(load_local_docs(args.local).values())
+    else:
+        docs = synthetic_docs(args.chapters)
+
+    builds = []
+    for _ in range(5):
+        start = time.perf_counter()
+        retriever = DocsRetriever(docs, prompt_version=1)
+        builds.append((time.perf_counter() - start) * 1000)
+
+    full_prompt_ms, retrieval_prompt_ms, retrieval_sizes = [], [], []
+    for i in range(args.iterations):
+        query = QUERIES[i % len(QUERIES)]
+
+        start = time.perf_counter()
+        full_prompt = build_personalized_prompt(docs, "Nome: Marco")
+        full_prompt_ms.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        retrieved = retriever.render(retriever.search(query, args.top_k))
+        prompt = build_personalized_prompt(retriever.core, "Nome: Marco", retrieved_docs=retrieved)
+        retrieval_prompt_ms.append((time.perf_counter() - start) * 1000)
+        retrieval_sizes.append(len(prompt))
+
+    avg_retrieval_chars = statistics.mean(retrieval_sizes)
+    print(f"\n--- Knowledge base: {len(docs):,} chars, {len(retriever.chunks)} chunks, core {len(retriever.core):,} chars ---")
+    _summary("chunk + BM25 index build", builds)
+    print(f"\n--- Prompt per request ({args.iterations} queries, top-k={args.top_k}) ---")
+    _summary("full context", full_prompt_ms)
+    _summary("retrieval (search + build)", retrieval_prompt_ms)
+    print(f"  {'full context size':<28} {len(full_prompt):>10,} chars  ~{len(full_prompt) // 4:>9,} tokens")
+    print(f"  {'retrieval size (avg)':<28} {avg_retrieval_chars:>10,.0f} chars  ~{avg_retrieval_chars / 4:>9,.0f} tokens")
+    print(f"  Input reduction:             {100 * (1 - avg_retrieval_chars / len(full_prompt)):>9.1f} %")
+    print()
+
+
+if __name__ == "__main__":
+    main()
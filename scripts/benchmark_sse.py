@@ -0,0 +1,108 @@
+"""
+Benchmark: SSE framing of agent_message chunks on /api/stream_query.
+
+A fake chat model streams --tokens small chunks through a real LangGraph ReAct agent and
+StreamingHandler, so the numbers isolate framing and serialization:
+
+- before: one json.dumps + one `data:` frame per chunk (previous StreamingHandler);
+- after: orjson encoding, first chunk sent immediately, later chunks coalesced up to
+  SSE_COALESCE_MAX_BYTES / SSE_COALESCE_MAX_MS.
+
+Frames/sec and bytes/sec are what the client, proxy and event loop have to process.
+
+Usage:
+    python scripts/benchmark_sse.py
+    python scripts/benchmark_sse.py --tokens 2000 --token-delay-ms 1 --coalesce-ms 50
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import List
+from unittest.mock import patch
+
+# Add project root to path for imports
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+
+def _json_frame(payload) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _make_agent(tokens: int, token_delay: float):
+    from langgraph.checkpoint.memory import InMemorySaver
+    from langgraph.prebuilt import create_react_agent
+    from tests.fakes import FakeChatModel
+
+    words = ["Il", " paracadute", " si", " apre", " a", " quota", " di", " sicurezza,", " controlla", " la", " vela."]
+    model = FakeChatModel(chunks=[words[i % len(words)] for i in range(tokens)], delay=token_delay)
+    return create_react_agent(model, [], checkpointer=InMemorySaver())
+
+
+async def _run(agent, coalesce_bytes: int, coalesce_ms: int, legacy_encoding: bool) -> dict:
+    from src.agent import streaming_handler
+    from src.agent.streaming_handler import StreamingHandler
+
+    handler = StreamingHandler(message_id="bench")
+    handler.heartbeat_seconds = 0
+    handler.coalesce_bytes = coalesce_bytes
+    handler.coalesce_seconds = coalesce_ms / 1000
+
+    frames, size = 0, 0
+    encoder = _json_frame if legacy_encoding else streaming_handler.encode_sse
+    with patch.object(streaming_handler, "encode_sse", encoder):
+        start = time.perf_counter()
+        async for frame in handler.handle_stream_events(agent, "ciao", {"configurable": {"thread_id": f"t{time.time_ns()}"}}):
+            frames += 1
+            size += len(frame.encode())
+        elapsed = time.perf_counter() - start
+    return {"frames": frames, "bytes": size, "elapsed": elapsed}
+
+
+def _encode_us(encoder, payloads: List[dict], rounds: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            encoder(payload)
+    return (time.perf_counter() - start) / (rounds * len(payloads)) * 1e6
+
+
+def _print(label: str, result: dict) -> None:
+    print(
+        f"  {label:<30} frames={result['frames']:>6,}  bytes={result['bytes']:>9,}  "
+        f"elapsed={result['elapsed'] * 1000:>8.1f} ms  "
+        f"frames/s={result['frames'] / result['elapsed']:>10,.0f}  bytes/s={result['bytes'] / result['elapsed']:>12,.0f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark SSE framing of streamed answers")
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--token-delay-ms", type=float, default=0.5, help="Delay between model chunks")
+    parser.add_argument("--coalesce-ms", type=int, default=50)
+    parser.add_argument("--coalesce-bytes", type=int, default=512)
+    args = parser.parse_args()
+
+    from src.agent.streaming_handler import encode_sse
+
+    delay = args.token_delay_ms / 1000
+    print(f"SSE benchmark: {args.tokens} chunks, {args.token_delay_ms} ms between chunks")
+
+    before = asyncio.run(_run(_make_agent(args.tokens, delay), 0, 0, legacy_encoding=True))
+    after = asyncio.run(_run(_make_agent(args.tokens, delay), args.coalesce_bytes, args.coalesce_ms, legacy_encoding=False))
+
+    _print("before (json, frame per chunk)", before)
+    _print("after (orjson, coalesced)", after)
+    print(f"\n  Frames per answer: {before['frames'] / after['frames']:.1f}x fewer")
+    print(f"  Bytes per answer:  {before['bytes'] / after['bytes']:.1f}x fewer")
+
+    payloads = [{"type": "agent_message", "data": " paracadute", "message_id": "bench"}] * 1000
+    print(f"\n  Encoding per frame: json {_encode_us(_json_frame, payloads):.2f} us, "
+          f"orjson {_encode_us(encode_sse, payloads):.2f} us")
+
+
+if __name__ == "__main__":
+    main()
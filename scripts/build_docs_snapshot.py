@@ -0,0 +1,40 @@
+"""
+Genera lo snapshot dei docs da distribuire insieme al codice (fase di build).
+
+Scarica i docs da S3 e scrive il file letto all'avvio tramite DOCS_SNAPSHOT_BUNDLED_PATH,
+così anche la prima istanza dopo un deploy parte senza attendere S3.
+
+Usage:
+    python scripts/build_docs_snapshot.py --output data/docs_snapshot.bin
+"""
+import argparse
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the bundled docs snapshot")
+    parser.add_argument("--output", default="data/docs_snapshot.bin", help="Snapshot path (default: data/docs_snapshot.bin)")
+    parser.add_argument("--prompt-version", type=int, default=1, help="Prompt version stored in the snapshot (default: 1)")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv(Path(PROJECT_ROOT) / ".env")
+
+    from src.docs_snapshot import write_snapshot
+    from src.s3_utils import fetch_docs_from_s3
+
+    result = fetch_docs_from_s3()
+    if not result["combined_docs"]:
+        print("Nessun documento scaricato da S3: snapshot non generato.")
+        sys.exit(1)
+    if not write_snapshot(args.output, result["combined_docs"], result["docs_meta"], args.prompt_version):
+        sys.exit(1)
+    print(f"Snapshot v{args.prompt_version} scritto in {args.output} ({len(result['docs_meta'])} file).")
+
+
+if __name__ == "__main__":
+    main()
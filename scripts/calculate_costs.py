@@ -34,7 +34,7 @@ def main():
     from dotenv import load_dotenv
     load_dotenv(Path(PROJECT_ROOT) / ".env")
 
-    from src.monitoring.token_logger import get_token_metrics
+    from src.monitoring.token_logger import get_token_metrics, metric_calls
 
     print(f"Fetching token metrics for the last {args.hours} hours...")
     if args.user:
@@ -46,10 +46,12 @@ def main():
         print("No token metrics found for the specified period.")
         sys.exit(0)
 
-    # Aggregate
-    total_input = sum(m.get("input_tokens", 0) for m in metrics)
-    total_output = sum(m.get("output_tokens", 0) for m in metrics)
-    total_cached = sum(m.get("cached_tokens", 0) for m in metrics)
+    # Aggregate over every LLM call (a ReAct turn with tools makes several)
+    calls = [c for m in metrics for c in metric_calls(m)]
+    total_input = sum(c.get("input_tokens", 0) for c in calls)
+    total_output = sum(c.get("output_tokens", 0) for c in calls)
+    total_cached = sum(c.get("cached_tokens", 0) for c in calls)
+    total_thinking = sum(c.get("thinking_tokens", 0) for c in calls)
     total_requests = len(metrics)
     non_cached_input = total_input - total_cached
 
@@ -77,9 +79,30 @@ def main():
     print(f"  Total input tokens:   {total_input:>10,}")
     print(f"  Total output tokens:  {total_output:>10,}")
     print(f"  Total cached tokens:  {total_cached:>10,}")
+    print(f"  Total thinking tokens:{total_thinking:>10,}")
     print(f"  Avg input/request:    {total_input // total_requests:>10,}")
     print(f"  Avg output/request:   {total_output // total_requests:>10,}")
 
+    print(f"\n--- LLM Calls ---")
+    print(f"  Total LLM calls:      {len(calls):>10,}")
+    print(f"  Avg calls/request:    {len(calls) / total_requests:>10.2f}")
+    by_index = {}
+    for c in calls:
+        by_index.setdefault(c.get("call_index", 0), []).append(c)
+    for index, group in sorted(by_index.items()):
+        group_cached = sum(c.get("cached_tokens", 0) for c in group)
+        group_cost = (
+            ((sum(c.get("input_tokens", 0) for c in group) - group_cached) / 1_000_000 * PRICING["input"])
+            + (group_cached / 1_000_000 * PRICING["cached_input"])
+            + (sum(c.get("output_tokens", 0) for c in group) / 1_000_000 * PRICING["output"])
+        )
+        print(
+            f"    call #{index}: {len(group):>6,} calls, "
+            f"in={sum(c.get('input_tokens', 0) for c in group):,} "
+            f"out={sum(c.get('output_tokens', 0) for c in group):,} "
+            f"cached={group_cached:,} cost=${group_cost:.4f}"
+        )
+
     if durations:
         avg_duration = sum(durations) / len(durations)
         print(f"\n--- Latency ---")
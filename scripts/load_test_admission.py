@@ -0,0 +1,160 @@
+"""
+Load test: admission control on /api/stream_query under a burst of requests.
+
+A fake Gemini serves at most --quota concurrent generations and answers 429 above it;
+callers retry 429s with exponential backoff, as the LLM client does. A burst of
+--requests requests from --users users arrives within --burst-seconds:
+
+- without admission control every request hits the model at once: the calls over quota
+  get 429, retry together and collide again (cascading 429s, long and unbounded tail);
+- with AdmissionController (global limit = quota, bounded queue, deadline) requests wait
+  their turn or get 503 + Retry-After (immediately once the estimated wait is past the
+  deadline), and the latency of the admitted ones stays bounded by the queue deadline
+  plus one generation.
+
+Usage:
+    python scripts/load_test_admission.py
+    python scripts/load_test_admission.py --requests 500 --quota 10 --llm-seconds 0.5
+"""
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add project root to path for imports
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class RateLimited(Exception):
+    """429 RESOURCE_EXHAUSTED from the fake model."""
+
+
+class FakeGemini:
+    """Slow fake LLM with a concurrency quota: calls over the quota fail with 429."""
+
+    def __init__(self, quota: int, llm_seconds: float):
+        self.quota = quota
+        self.llm_seconds = llm_seconds
+        self.in_flight = 0
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def generate(self) -> None:
+        self.calls += 1
+        if self.in_flight >= self.quota:
+            self.rate_limited += 1
+            await asyncio.sleep(0.01)  # round trip of the 429
+            raise RateLimited()
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.llm_seconds * random.uniform(0.8, 1.2))
+        finally:
+            self.in_flight -= 1
+
+
+async def _call_with_retries(model: FakeGemini, retries: int, backoff: float) -> bool:
+    for attempt in range(retries + 1):
+        try:
+            await model.generate()
+            return True
+        except RateLimited:
+            if attempt == retries:
+                return False
+            await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    return False
+
+
+async def _scenario(args, controller) -> Dict[str, object]:
+    from src.admission import AdmissionRejected
+
+    model = FakeGemini(args.quota, args.llm_seconds)
+    latencies: List[float] = []
+    outcome = {"ok": 0, "failed_429": 0, "rejected_503": 0, "rejected_429": 0}
+    retry_after: List[int] = []
+
+    async def request(i: int) -> None:
+        await asyncio.sleep(random.uniform(0, args.burst_seconds))
+        start = time.perf_counter()
+        admission = None
+        if controller is not None:
+            try:
+                admission = await controller.acquire(f"user{i % args.users}")
+            except AdmissionRejected as e:
+                outcome["rejected_503" if e.status_code == 503 else "rejected_429"] += 1
+                retry_after.append(e.retry_after)
+                return
+        try:
+            ok = await _call_with_retries(model, args.retries, args.backoff)
+        finally:
+            if admission is not None:
+                admission.release()
+        outcome["ok" if ok else "failed_429"] += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request(i) for i in range(args.requests)))
+    return {
+        **outcome,
+        "llm_429": model.rate_limited,
+        "llm_calls": model.calls,
+        "latencies": latencies,
+        "retry_after": retry_after,
+        "elapsed": time.perf_counter() - start,
+    }
+
+
+def _print(label: str, result: Dict[str, object]) -> None:
+    from src.monitoring.tracing import percentiles
+
+    p = percentiles(result["latencies"], (50, 95, 99, 100))
+    print(f"\n  {label}")
+    print(
+        f"    completed={result['ok']:>4}  failed after retries={result['failed_429']:>4}  "
+        f"503={result['rejected_503']:>4}  429 (user)={result['rejected_429']:>4}"
+    )
+    print(f"    LLM calls={result['llm_calls']:>5}  LLM 429s={result['llm_429']:>5}  elapsed={result['elapsed']:.1f} s")
+    print(f"    latency ms  p50={p['p50']:>8.0f}  p95={p['p95']:>8.0f}  p99={p['p99']:>8.0f}  max={p['p100']:>8.0f}")
+    if result["retry_after"]:
+        print(f"    Retry-After s: min={min(result['retry_after'])} max={max(result['retry_after'])}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load test of admission control with a fake slow LLM")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--burst-seconds", type=float, default=1.0, help="Window in which the requests arrive")
+    parser.add_argument("--quota", type=int, default=10, help="Concurrent generations the model accepts")
+    parser.add_argument("--llm-seconds", type=float, default=0.3, help="Duration of one generation")
+    parser.add_argument("--retries", type=int, default=6, help="429 retries of the LLM client")
+    parser.add_argument("--backoff", type=float, default=0.1, help="First retry delay (doubles each time)")
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--max-wait", type=float, default=3.0, help="ADMISSION_MAX_WAIT_SECONDS")
+    args = parser.parse_args(argv)
+
+    from src.admission import AdmissionController
+
+    logging.getLogger("uvicorn").setLevel(logging.ERROR)  # one warning per rejected request
+    print(
+        f"Admission load test: {args.requests} requests in {args.burst_seconds} s, "
+        f"model quota {args.quota} concurrent, {args.llm_seconds} s per generation"
+    )
+    random.seed(42)
+    before = asyncio.run(_scenario(args, None))
+    random.seed(42)
+    controller = AdmissionController(
+        max_concurrent=args.quota, queue_size=args.queue_size, max_wait_seconds=args.max_wait,
+        user_rate_per_minute=0,
+    )
+    after = asyncio.run(_scenario(args, controller))
+
+    _print("without admission control", before)
+    _print(f"with admission control (max_concurrent={args.quota}, queue={args.queue_size}, max_wait={args.max_wait} s)", after)
+
+
+if __name__ == "__main__":
+    main()
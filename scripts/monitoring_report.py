@@ -54,6 +54,15 @@ def main():
     print(f"  Avg output/request:   {usage['avg_output_tokens']:>10,}")
     print(f"  Avg duration:         {usage['avg_duration_ms']:>10.1f} ms")
 
+    # Latency
+    latency = report["latency"]
+    print(f"\n--- Latency (p50 / p95 / p99 ms) ---")
+    print(f"  Traced requests:      {latency['traced_requests']:>10,}")
+    rows = [("time to first token", latency["ttft_ms"]), ("last token", latency["last_token_ms"])]
+    rows += [(name, values) for name, values in latency["phases"].items()]
+    for name, values in rows:
+        print(f"  {name:<21} {values['p50']:>8.1f} / {values['p95']:>8.1f} / {values['p99']:>8.1f}")
+
     # Cache Analysis
     cache = report["cache_analysis"]
     print(f"\n--- Cache Analysis ---")
@@ -0,0 +1,246 @@
+"""
+Controllo di ammissione per /api/stream_query.
+
+Limita i run LLM concorrenti del processo e la frequenza delle richieste di ogni utente:
+un picco di traffico aspetta in coda, o viene respinto subito con Retry-After, invece di
+diventare una raffica di 429 da Gemini (che rate_limit_monitor vede solo a posteriori).
+
+- semaforo globale: al massimo ADMISSION_MAX_CONCURRENT run in corso (0 = nessun limite);
+- token bucket per utente: ADMISSION_USER_BURST richieste di fila, poi
+  ADMISSION_USER_RATE_PER_MINUTE (oltre: 429);
+- coda FIFO di al massimo ADMISSION_QUEUE_SIZE richieste: chi non parte entro
+  ADMISSION_MAX_WAIT_SECONDS viene respinto con 503. Se l'attesa stimata (durata media
+  di un run, posti liberi) supera già la scadenza, la richiesta è respinta subito.
+
+Il posto resta occupato per tutto il run (anche oltre la risposta HTTP, vedi event_log) e
+va rilasciato con Admission.release(); AdmissionStreamingResponse lo rilascia se il run
+non parte mai. L'attesa in coda finisce nelle metriche token
+(queue_wait_ms) e nella fase "admission" del trace.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from cachetools import LRUCache
+from starlette.responses import StreamingResponse
+
+from .env import settings
+
+logger = logging.getLogger("uvicorn")
+
+
+class AdmissionRejected(Exception):
+    """Richiesta respinta: status HTTP, codice ErrorResponse e secondi per Retry-After."""
+
+    def __init__(self, status_code: int, code: str, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class Admission:
+    """Posto ottenuto da acquire(); release() è idempotente."""
+
+    def __init__(self, controller: Optional["AdmissionController"], wait_ms: float, holds_slot: bool = True):
+        self.wait_ms = wait_ms
+        self._controller = controller
+        self._holds_slot = holds_slot
+        self._admitted_at = controller._timer() if controller is not None else 0.0
+        self.released = False
+        self.run_attached = False  # il rilascio spetta al run (vedi attach_run)
+
+    def attach_run(self) -> None:
+        """Il run è partito e rilascerà il posto alla sua fine."""
+        self.run_attached = True
+
+    def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        if self._controller is not None and self._holds_slot:
+            self._controller._release(self._controller._timer() - self._admitted_at)
+
+
+class AdmissionStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse che rilascia il posto se il run non è mai partito: quando il client
+    se ne va prima di http.response.start, Starlette non itera il body e il finally del
+    generatore non viene mai eseguito.
+    """
+
+    def __init__(self, content: Any, admission: Admission, **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.admission = admission
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if not self.admission.run_attached:
+                self.admission.release()
+
+
+class AdmissionController:
+    """Semaforo globale con coda limitata e token bucket per utente."""
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        max_wait_seconds: Optional[float] = None,
+        user_rate_per_minute: Optional[float] = None,
+        user_burst: Optional[int] = None,
+        max_users: int = 10000,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.max_concurrent = max_concurrent if max_concurrent is not None else settings.ADMISSION_MAX_CONCURRENT
+        self.queue_size = queue_size if queue_size is not None else settings.ADMISSION_QUEUE_SIZE
+        self.max_wait_seconds = max_wait_seconds if max_wait_seconds is not None else settings.ADMISSION_MAX_WAIT_SECONDS
+        self.user_rate_per_minute = (
+            user_rate_per_minute if user_rate_per_minute is not None else settings.ADMISSION_USER_RATE_PER_MINUTE
+        )
+        self.user_burst = user_burst if user_burst is not None else settings.ADMISSION_USER_BURST
+        self._timer = timer
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._buckets: LRUCache = LRUCache(maxsize=max_users)  # user_id -> (token, aggiornato_a)
+        self._avg_run_seconds: Optional[float] = None  # media mobile della durata di un run
+        self._waits_ms: Deque[float] = deque(maxlen=1000)
+        self._stats = dict.fromkeys(
+            ("admitted", "queued", "rejected_user_rate", "rejected_queue_full", "rejected_deadline", "max_waiting"), 0,
+        )
+
+    async def acquire(self, user_id: str) -> Admission:
+        """
+        Attende un posto per un nuovo run di user_id.
+
+        Raises:
+            AdmissionRejected: 429 se l'utente ha esaurito il suo bucket, 503 se la coda è
+                piena o il posto non si libera entro max_wait_seconds
+        """
+        self._take_user_token(user_id)
+        if self.max_concurrent <= 0:
+            return self._admit(Admission(self, 0.0, holds_slot=False))
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            return self._admit(Admission(self, 0.0))
+
+        position = len(self._waiters) + 1
+        estimate = self._estimated_wait(position)
+        if position > self.queue_size:
+            self._reject(user_id, "rejected_queue_full", estimate)
+        if estimate is not None and estimate > self.max_wait_seconds:
+            self._reject(user_id, "rejected_deadline", estimate)
+
+        start = self._timer()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        self._stats["max_waiting"] = max(self._stats["max_waiting"], len(self._waiters))
+        try:
+            await asyncio.wait({waiter}, timeout=self.max_wait_seconds)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(None)  # posto passato a una richiesta che se ne va
+            else:
+                self._drop_waiter(waiter)
+            raise
+        if not waiter.done():
+            self._drop_waiter(waiter)
+            self._reject(user_id, "rejected_deadline", self._estimated_wait(len(self._waiters) + 1))
+        wait_ms = (self._timer() - start) * 1000
+        self._waits_ms.append(wait_ms)
+        return self._admit(Admission(self, wait_ms))
+
+    def _admit(self, admission: Admission) -> Admission:
+        self._stats["admitted"] += 1
+        return admission
+
+    def _release(self, run_seconds: Optional[float]) -> None:
+        """Il posto passa al primo in coda, altrimenti torna libero."""
+        if run_seconds is not None:
+            if self._avg_run_seconds is None:
+                self._avg_run_seconds = run_seconds
+            else:
+                self._avg_run_seconds = 0.9 * self._avg_run_seconds + 0.1 * run_seconds
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active = max(0, self._active - 1)
+
+    def _drop_waiter(self, waiter: asyncio.Future) -> None:
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _estimated_wait(self, position: int) -> Optional[float]:
+        """Secondi prima che si liberi il posto per la richiesta in coda alla posizione data."""
+        if self._avg_run_seconds is None or self.max_concurrent <= 0:
+            return None
+        return position * self._avg_run_seconds / self.max_concurrent
+
+    def _reject(self, user_id: str, reason: str, estimate: Optional[float]) -> None:
+        self._stats[reason] += 1
+        self._refund_user_token(user_id)  # la richiesta non è partita: non conta per l'utente
+        retry_after = max(1, math.ceil(estimate if estimate is not None else self.max_wait_seconds))
+        logger.warning(
+            f"ADMISSION - Richiesta di {user_id} respinta ({reason}): "
+            f"{self._active} run in corso, {len(self._waiters)} in coda, Retry-After {retry_after}s"
+        )
+        raise AdmissionRejected(503, "OVERLOADED", "Server occupato, riprova tra poco", retry_after)
+
+    def _take_user_token(self, user_id: str) -> None:
+        if self.user_rate_per_minute <= 0:
+            return
+        now = self._timer()
+        tokens, updated_at = self._buckets.get(user_id, (float(self.user_burst), now))
+        tokens = min(float(self.user_burst), tokens + (now - updated_at) * self.user_rate_per_minute / 60)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            self._stats["rejected_user_rate"] += 1
+            retry_after = max(1, math.ceil((1 - tokens) * 60 / self.user_rate_per_minute))
+            logger.warning(f"ADMISSION - {user_id} oltre {self.user_rate_per_minute} richieste/min, Retry-After {retry_after}s")
+            raise AdmissionRejected(429, "RATE_LIMITED", "Troppe richieste, riprova tra poco", retry_after)
+        self._buckets[user_id] = (tokens - 1, now)
+
+    def _refund_user_token(self, user_id: str) -> None:
+        if self.user_rate_per_minute <= 0 or user_id not in self._buckets:
+            return
+        tokens, updated_at = self._buckets[user_id]
+        self._buckets[user_id] = (min(float(self.user_burst), tokens + 1), updated_at)
+
+    def stats(self) -> Dict[str, Any]:
+        from .monitoring.tracing import percentiles
+        waits: List[float] = list(self._waits_ms)
+        return {
+            **self._stats,
+            "max_concurrent": self.max_concurrent,
+            "active": self._active,
+            "waiting": len(self._waiters),
+            "avg_run_seconds": round(self._avg_run_seconds or 0, 2),
+            "queue_wait_ms": percentiles(waits),
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Controller di processo (creato al primo uso)."""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
+
+
+def get_admission_stats() -> Dict[str, Any]:
+    return get_admission_controller().stats()
@@ -1,79 +1,168 @@
-from typing import Optional
+from typing import Any, Dict, List, Optional
+from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import InMemorySaver
-from ..env import FORCED_MODEL, HISTORY_LIMIT, VERTEX_AI_REGION, CACHE_DEBUG_LOGGING
-from ..tools import domanda_teoria
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from ..env import FORCED_MODEL, HISTORY_LIMIT, VERTEX_AI_REGION, CACHE_DEBUG_LOGGING, settings
+from ..tools import USER_ID_CONFIG_KEY, domanda_teoria
 from ..history_hooks import build_llm_input_window_hook
-from ..prompt_personalization import get_personalized_prompt_for_user, generate_thread_id
+from ..prompt_personalization import (
+    aget_personalized_prompt_for_user,
+    get_personalized_prompt_for_user,
+    generate_thread_id,
+    prefix_hash_for,
+)
+from .agent_registry import AgentRegistry, get_agent_registry
+from .context_cache import ContextCachedChatGoogleGenerativeAI, get_context_cache
 import logging
 logger = logging.getLogger("uvicorn")
 
 
+# Chiave in config["configurable"] con il system prompt personalizzato della richiesta.
+# Il valore è un SystemMessage (non una stringa) così LangGraph non lo copia nei metadata
+# dei checkpoint né nei metadata di tracing.
+SYSTEM_MESSAGE_CONFIG_KEY = "system_message"
+# Hash del prefisso statico del system prompt, riportato nelle metriche di token.
+PROMPT_PREFIX_HASH_CONFIG_KEY = "prompt_prefix_hash"
+
+
+def inject_system_prompt(state: Dict[str, Any], config: RunnableConfig) -> List:
+    """
+    Prompt runnable dell'agente: antepone ai messaggi il system prompt passato a invoke-time.
+    Permette di condividere lo stesso grafo compilato tra utenti diversi.
+    """
+    messages = state["messages"] if isinstance(state, dict) else state.messages
+    system_message = (config or {}).get("configurable", {}).get(SYSTEM_MESSAGE_CONFIG_KEY)
+    if system_message is None:
+        return list(messages)
+    return [system_message] + list(messages)
+
+
 class AgentManager:
     """
-    Factory per la creazione di agenti LangGraph configurati per-request.
-    Gestisce la creazione di LLM, tools e configurazione agente.
+    Factory per gli agenti LangGraph.
+    Il grafo compilato (LLM + tools + hook) è condiviso a livello di processo tramite
+    AgentRegistry; la personalizzazione per utente viaggia nella config di ogni richiesta.
     """
-    
+
+    @staticmethod
+    def _build_llm(model: str) -> ChatGoogleGenerativeAI:
+        """
+        Crea il client LLM con region unificata per caching implicito.
+        Con ENABLE_EXPLICIT_CACHING le richieste usano la cache esplicita dei docs (vedi context_cache).
+        """
+        if settings.ENABLE_EXPLICIT_CACHING:
+            llm_class, extra = ContextCachedChatGoogleGenerativeAI, {"context_cache": get_context_cache()}
+        else:
+            llm_class, extra = ChatGoogleGenerativeAI, {}
+        return llm_class(
+            model=model,
+            # thinking_level omesso: il default per Gemini 3 è "high" e funziona correttamente.
+            # I livelli bassi ("low"/"minimal") causano bug server-side 500 su grandi contesti
+            # + function calling per thought signatures malformate. Vedi ERROR.md per dettagli.
+            temperature=0.7,
+            # CRITICO: Stessa region per inferenza e cache per massimizzare cache hits
+            location=VERTEX_AI_REGION,  # "europe-west8"
+            # Parametri per ottimizzare caching implicito (automatico in Vertex AI)
+            **extra,
+        )
+
+    @staticmethod
+    def _build_agent(model: str, tools: List, checkpointer: Optional[BaseCheckpointSaver]):
+        """Compila il grafo ReAct (operazione costosa, eseguita una volta per chiave di registry)."""
+        logger.info(f"Building agent graph: model={model}, region={VERTEX_AI_REGION}")
+        llm = AgentManager._build_llm(model)
+        return create_react_agent(
+            llm, tools,
+            prompt=inject_system_prompt,
+            pre_model_hook=build_llm_input_window_hook(HISTORY_LIMIT),
+            checkpointer=checkpointer,
+        )
+
     @staticmethod
     def create_agent(
         user_id: str,
         token: Optional[str] = None,
         user_data: bool = False,
-        checkpointer: Optional[InMemorySaver] = None
+        checkpointer: Optional[BaseCheckpointSaver] = None,
+        registry: Optional[AgentRegistry] = None,
+        query: Optional[str] = None,
     ):
         """
-        Crea un agente LangGraph configurato per l'utente specifico.
+        Ritorna l'agente LangGraph condiviso e la config per l'utente specifico.
         
         Args:
             user_id: ID dell'utente per personalizzazione prompt
             token: Token Auth0 per recupero metadata utente  
             user_data: Se recuperare i metadata utente
             checkpointer: Checkpointer per memoria conversazione
+            registry: Registry degli agenti compilati (default: registry di processo)
+            query: Messaggio dell'utente (usato per il retrieval dei docs, se attivo)
             
         Returns:
             Tupla (agent_executor, config, prompt_version)
         """
-        # Configurazione LLM con region unificata per caching implicito
+        # Prompt personalizzato per utente
+        personalized_prompt, prompt_version, _ = get_personalized_prompt_for_user(
+            user_id=user_id, 
+            token=token, 
+            fetch_user_data=user_data,
+            query=query,
+        )
+        return AgentManager._assemble(user_id, personalized_prompt, prompt_version, checkpointer, registry)
+
+    @staticmethod
+    async def acreate_agent(
+        user_id: str,
+        token: Optional[str] = None,
+        user_data: bool = False,
+        checkpointer: Optional[BaseCheckpointSaver] = None,
+        registry: Optional[AgentRegistry] = None,
+        query: Optional[str] = None,
+    ):
+        """
+        Variante async di create_agent per il percorso di richiesta: i metadata utente
+        vengono letti da Auth0 senza bloccare l'event loop. Stessi argomenti e ritorno.
+        """
+        personalized_prompt, prompt_version, _ = await aget_personalized_prompt_for_user(
+            user_id=user_id,
+            token=token,
+            fetch_user_data=user_data,
+            query=query,
+        )
+        return AgentManager._assemble(user_id, personalized_prompt, prompt_version, checkpointer, registry)
+
+    @staticmethod
+    def _assemble(
+        user_id: str,
+        personalized_prompt: str,
+        prompt_version: int,
+        checkpointer: Optional[BaseCheckpointSaver],
+        registry: Optional[AgentRegistry],
+    ):
+        """Agente condiviso dal registry e config della richiesta per il prompt già personalizzato."""
         model = FORCED_MODEL
         logger.info(f"Selected LLM model: {model}")
-        logger.info(f"Using Vertex AI region: {VERTEX_AI_REGION}")
 
-        # Configurazione ottimizzata per caching implicito con region unificata
-        llm = ChatGoogleGenerativeAI(
-            model=model,
-            # thinking_level omesso: il default per Gemini 3 è "high" e funziona correttamente.
-            # I livelli bassi ("low"/"minimal") causano bug server-side 500 su grandi contesti
-            # + function calling per thought signatures malformate. Vedi ERROR.md per dettagli.
-            temperature=0.7,
-            # CRITICO: Stessa region per inferenza e cache per massimizzare cache hits
-            location=VERTEX_AI_REGION,  # "europe-west8"
-            # Parametri per ottimizzare caching implicito (automatico in Vertex AI)
-        )
-        
         # Tools disponibili
         tools = [domanda_teoria]
-        
-        # Prompt personalizzato per utente
-        personalized_prompt, prompt_version, _ = get_personalized_prompt_for_user(
-            user_id=user_id, 
-            token=token, 
-            fetch_user_data=user_data
+
+        # Agente compilato condiviso (creato solo al primo uso per questa chiave)
+        registry = registry or get_agent_registry()
+        key = AgentRegistry.build_key(
+            model, VERTEX_AI_REGION, prompt_version,
+            tuple(t.name for t in tools), checkpointer,
         )
-        
-        # Creazione agente
-        agent_executor = create_react_agent(
-            llm, tools,
-            prompt=personalized_prompt,
-            pre_model_hook=build_llm_input_window_hook(HISTORY_LIMIT),
-            checkpointer=checkpointer,
+        agent_executor = registry.get_or_create(
+            key, lambda: AgentManager._build_agent(model, tools, checkpointer)
         )
 
         # Log configurazione caching
         if CACHE_DEBUG_LOGGING:
             logger.info(f"Caching configuration: region={VERTEX_AI_REGION}")
             logger.info("Google Cloud implicit caching enabled for LLM calls")
+            logger.info(f"Agent registry stats: {registry.stats()}")
         
         # Configurazione thread
         # NB: recursion_limit DEVE essere top-level (LangGraph ignora valori sotto "configurable").
@@ -83,7 +172,10 @@ class AgentManager:
             "recursion_limit": 10,
             "configurable": {
                 "thread_id": generate_thread_id(user_id, prompt_version),
+                SYSTEM_MESSAGE_CONFIG_KEY: SystemMessage(content=personalized_prompt),
+                PROMPT_PREFIX_HASH_CONFIG_KEY: prefix_hash_for(personalized_prompt),
+                USER_ID_CONFIG_KEY: user_id,
             }
         }
         
-        return agent_executor, config, prompt_version
\ No newline at end of file
+        return agent_executor, config, prompt_version
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import weakref
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import logging
+logger = logging.getLogger("uvicorn")
+
+
+RegistryKey = Tuple[Hashable, ...]
+
+
+def _current_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """Ritorna l'event loop in esecuzione, o None se chiamato fuori da un loop."""
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class AgentRegistry:
+    """
+    Registry process-level di agenti LangGraph già compilati.
+
+    Le entry sono indicizzate per (model, region, prompt_version, tools, checkpointer)
+    e, in aggiunta, per event loop: il client async di google-genai si lega al loop
+    in cui viene usato la prima volta, quindi un grafo creato su un loop non viene mai
+    riutilizzato su un altro (caso tipico dei worker serverless che ricreano il loop).
+    Le entry di loop chiusi o di versioni di prompt superate vengono rimosse.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[RegistryKey, Tuple[Optional[weakref.ref], Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def build_key(
+        model: str,
+        region: str,
+        prompt_version: int,
+        tool_names: Tuple[str, ...],
+        checkpointer: Any = None,
+    ) -> RegistryKey:
+        """Costruisce la chiave di registry (i tool sono ordinati per stabilità)."""
+        return (model, region, prompt_version, tuple(sorted(tool_names)), id(checkpointer))
+
+    def get_or_create(self, key: RegistryKey, factory: Callable[[], Any]) -> Any:
+        """
+        Ritorna l'agente compilato per `key` sul loop corrente, creandolo con `factory` se assente.
+        """
+        loop = _current_loop()
+        full_key = key + (id(loop) if loop is not None else None,)
+
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None and self._is_alive(entry[0], loop):
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            agent = factory()
+            loop_ref = weakref.ref(loop) if loop is not None else None
+            self._entries[full_key] = (loop_ref, agent)
+            self._evict_stale(full_key)
+            logger.info(
+                f"AGENT_REGISTRY - Nuovo agente compilato (prompt_version={key[2]}), "
+                f"entries={len(self._entries)}"
+            )
+            return agent
+
+    @staticmethod
+    def _is_alive(loop_ref: Optional[weakref.ref], loop: Optional[asyncio.AbstractEventLoop]) -> bool:
+        if loop_ref is None:
+            return loop is None
+        cached_loop = loop_ref()
+        return cached_loop is not None and cached_loop is loop and not cached_loop.is_closed()
+
+    def _evict_stale(self, current_key: RegistryKey) -> None:
+        """Rimuove entry con loop chiusi e versioni di prompt precedenti a quella corrente."""
+        current_version = current_key[2]
+        stale = []
+        for key, (loop_ref, _) in self._entries.items():
+            if key == current_key:
+                continue
+            loop_dead = loop_ref is not None and (loop_ref() is None or loop_ref().is_closed())
+            same_config = key[:2] == current_key[:2] and key[3:5] == current_key[3:5]
+            if loop_dead or (same_config and key[2] < current_version):
+                stale.append(key)
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            logger.debug(f"AGENT_REGISTRY - Rimosse {len(stale)} entry obsolete")
+
+    def clear(self) -> None:
+        """Svuota il registry (utile per test e dopo aggiornamento configurazione)."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Statistiche di utilizzo del registry."""
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_agent_registry = AgentRegistry()
+
+
+def get_agent_registry() -> AgentRegistry:
+    """Ritorna il registry di processo."""
+    return _agent_registry
@@ -0,0 +1,277 @@
+"""
+InMemorySaver con limiti di memoria per il backend "memory".
+
+L'InMemorySaver di LangGraph conserva ogni checkpoint di ogni turno per ogni
+thread_id per tutta la vita del processo. BoundedInMemorySaver:
+
+- tiene solo l'ultimo checkpoint per thread (con i suoi blob e pending writes);
+- rimuove i thread delle versioni di prompt superate (thread_id "user_id:vN");
+- applica un TTL di inattività e un budget globale in byte con eviction LRU;
+- scarta alla lettura i thread oltre il size cap, lasciando il fallback al seeding;
+- espone la memoria residente (byte serializzati) per il report di monitoring.
+
+I thread usati negli ultimi `protect_recent_s` secondi non vengono mai rimossi per
+LRU/TTL né per cambio di versione di prompt (la rimozione è rimandata a un put
+successivo): InMemorySaver salva solo i blob dei canali cambiati, quindi togliere lo
+stato a una run in corso la corromperebbe.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple, get_checkpoint_id
+from langgraph.checkpoint.memory import InMemorySaver
+
+import logging
+logger = logging.getLogger("uvicorn")
+
+_THREAD_VERSION_RE = re.compile(r"^(?P<user>.*):v(?P<version>\d+)$")
+
+
+def parse_prompt_version(thread_id: str) -> Optional[int]:
+    """Estrae la versione di prompt da un thread_id di generate_thread_id ("user_id:vN")."""
+    match = _THREAD_VERSION_RE.match(thread_id)
+    return int(match.group("version")) if match else None
+
+
+class BoundedInMemorySaver(InMemorySaver):
+    """InMemorySaver con compattazione, eviction LRU/TTL e budget di memoria globale."""
+
+    def __init__(
+        self,
+        *,
+        memory_budget_bytes: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+        max_thread_bytes: Optional[int] = None,
+        protect_recent_s: float = 60,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_thread_bytes = max_thread_bytes
+        self.protect_recent_s = protect_recent_s
+        self._lock = threading.RLock()
+        # thread_id -> (ultimo accesso monotonic, byte residenti), in ordine LRU
+        self._threads: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        self._blob_keys: Dict[str, Set[tuple]] = {}
+        self._write_keys: Dict[str, Set[tuple]] = {}
+        self._resident_bytes = 0
+        self._current_prompt_version = 0
+        self._deferred_purge: Set[str] = set()  # thread di versioni superate ancora in uso
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.compacted = 0
+        self.evicted_lru = 0
+        self.evicted_ttl = 0
+        self.evicted_oversized = 0
+        self.purged_versions = 0
+
+    # Accounting
+    def _thread_bytes(self, thread_id: str) -> int:
+        size = 0
+        for checkpoints in self.storage.get(thread_id, {}).values():
+            for checkpoint, metadata, _ in checkpoints.values():
+                size += len(checkpoint[1]) + len(metadata[1])
+        for key in self._blob_keys.get(thread_id, ()):
+            blob = self.blobs.get(key)
+            if blob is not None:
+                size += len(blob[1])
+        for key in self._write_keys.get(thread_id, ()):
+            for _, _, value, _ in self.writes.get(key, {}).values():
+                size += len(value[1])
+        return size
+
+    def _touch(self, thread_id: str, size: Optional[int] = None) -> None:
+        previous = self._threads.pop(thread_id, None)
+        if size is None:
+            size = previous[1] if previous else 0
+        self._resident_bytes += size - (previous[1] if previous else 0)
+        self._threads[thread_id] = (time.monotonic(), size)
+
+    def _drop(self, thread_id: str) -> None:
+        """Rimuove un thread usando le chiavi tracciate (senza scandire tutti i blob)."""
+        self.storage.pop(thread_id, None)
+        for key in self._blob_keys.pop(thread_id, ()):
+            self.blobs.pop(key, None)
+        for key in self._write_keys.pop(thread_id, ()):
+            self.writes.pop(key, None)
+        entry = self._threads.pop(thread_id, None)
+        if entry is not None:
+            self._resident_bytes -= entry[1]
+        self._deferred_purge.discard(thread_id)
+
+    # Compattazione e eviction
+    def _compact(self, thread_id: str, checkpoint_ns: str, checkpoint: Checkpoint) -> None:
+        """Tiene solo `checkpoint` per (thread, ns), con i soli blob che referenzia."""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        stale = [checkpoint_id for checkpoint_id in checkpoints if checkpoint_id != checkpoint["id"]]
+        for checkpoint_id in stale:
+            del checkpoints[checkpoint_id]
+            write_key = (thread_id, checkpoint_ns, checkpoint_id)
+            self.writes.pop(write_key, None)
+            self._write_keys.get(thread_id, set()).discard(write_key)
+        self.compacted += len(stale)
+
+        live = {(thread_id, checkpoint_ns, channel, version) for channel, version in checkpoint["channel_versions"].items()}
+        blob_keys = self._blob_keys.get(thread_id, set())
+        for key in [k for k in blob_keys if k[1] == checkpoint_ns and k not in live]:
+            self.blobs.pop(key, None)
+            blob_keys.discard(key)
+
+    def _evict(self, current_thread_id: str) -> None:
+        now = time.monotonic()
+        protected_since = now - self.protect_recent_s
+
+        if self._deferred_purge:
+            self._purge_threads(list(self._deferred_purge), self._current_prompt_version, current_thread_id)
+
+        if self.ttl_seconds:
+            expired_before = now - self.ttl_seconds
+            for thread_id, (last_access, _) in list(self._threads.items()):
+                if last_access >= expired_before:
+                    break  # Ordine LRU: i successivi sono più recenti
+                if last_access < protected_since and thread_id != current_thread_id:
+                    self._drop(thread_id)
+                    self.evicted_ttl += 1
+
+        if self.memory_budget_bytes:
+            for thread_id, (last_access, _) in list(self._threads.items()):
+                if self._resident_bytes <= self.memory_budget_bytes:
+                    break
+                if last_access >= protected_since or thread_id == current_thread_id:
+                    continue
+                self._drop(thread_id)
+                self.evicted_lru += 1
+            if self._resident_bytes > self.memory_budget_bytes:
+                logger.warning(
+                    f"CHECKPOINT - Budget di memoria superato ({self._resident_bytes} > {self.memory_budget_bytes} byte) "
+                    f"solo da thread attivi"
+                )
+
+    def _purge_older_versions(self, current_version: int, current_thread_id: Optional[str] = None) -> int:
+        stale = [
+            thread_id for thread_id in list(self.storage.keys())
+            if (version := parse_prompt_version(thread_id)) is not None and version < current_version
+        ]
+        return self._purge_threads(stale, current_version, current_thread_id)
+
+    def _purge_threads(self, stale: Sequence[str], current_version: int, current_thread_id: Optional[str]) -> int:
+        """Rimuove i thread superati non protetti; gli altri restano in _deferred_purge."""
+        protected_since = time.monotonic() - self.protect_recent_s
+        purged = 0
+        for thread_id in stale:
+            entry = self._threads.get(thread_id)
+            if thread_id == current_thread_id or (entry is not None and entry[0] >= protected_since):
+                self._deferred_purge.add(thread_id)
+                continue
+            self._drop(thread_id)
+            purged += 1
+        self.purged_versions += purged
+        if purged:
+            logger.info(f"CHECKPOINT - Rimossi {purged} thread di versioni di prompt precedenti a v{current_version}")
+        return purged
+
+    def purge_superseded(self, current_version: int) -> int:
+        """Rimuove i thread delle versioni di prompt precedenti a `current_version` (hook di update_docs)."""
+        with self._lock:
+            self._current_prompt_version = max(self._current_prompt_version, current_version)
+            return self._purge_older_versions(current_version)
+
+    # Override InMemorySaver
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        latest = get_checkpoint_id(config) is None
+        with self._lock:
+            if thread_id in self._threads:
+                last_access, size = self._threads[thread_id]
+                if latest and self.max_thread_bytes and size > self.max_thread_bytes:
+                    logger.info(f"CHECKPOINT - Thread {thread_id} oltre il size cap ({size} byte), fallback su seeding da DB")
+                    self._drop(thread_id)
+                    self.evicted_oversized += 1
+                elif latest and self.ttl_seconds and time.monotonic() - last_access > self.ttl_seconds:
+                    self._drop(thread_id)
+                    self.evicted_ttl += 1
+                else:
+                    self._touch(thread_id)
+            result = super().get_tuple(config)
+            if result is None and not any(self.storage.get(thread_id, {}).values()):
+                self.storage.pop(thread_id, None)  # InMemorySaver usa defaultdict: niente entry vuote per i miss
+            if latest:
+                if result is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            return result
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            version = parse_prompt_version(thread_id)
+            if version is not None and version > self._current_prompt_version:
+                self._current_prompt_version = version
+                self._purge_older_versions(version)
+
+            result = super().put(config, checkpoint, metadata, new_versions)
+            self._blob_keys.setdefault(thread_id, set()).update(
+                (thread_id, checkpoint_ns, channel, v) for channel, v in new_versions.items()
+            )
+            self._compact(thread_id, checkpoint_ns, checkpoint)
+            self._touch(thread_id, self._thread_bytes(thread_id))
+            self._evict(thread_id)
+            return result
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            self._write_keys.setdefault(thread_id, set()).add(
+                (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+            )
+            self._touch(thread_id, self._thread_bytes(thread_id))
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._drop(thread_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Memoria residente, eviction e hit/miss, per il report di monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            sizes = [size for _, size in self._threads.values()]
+            return {
+                "backend": type(self).__name__,
+                "threads": len(self._threads),
+                "resident_bytes": self._resident_bytes,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "largest_thread_bytes": max(sizes) if sizes else 0,
+                "current_prompt_version": self._current_prompt_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+                "compacted": self.compacted,
+                "evicted_lru": self.evicted_lru,
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_oversized": self.evicted_oversized,
+                "purged_versions": self.purged_versions,
+                "deferred_purges": len(self._deferred_purge),
+            }
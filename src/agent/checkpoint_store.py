@@ -0,0 +1,489 @@
+"""
+Backend di storage per PersistentCheckpointSaver.
+
+I record sono già serializzati dal saver (checkpoint e metadata come coppie
+(type, bytes) di SerializerProtocol): gli store si limitano a salvarli, leggerli,
+compattarli e scadere per thread.
+
+- MongoCheckpointStore: condiviso tra istanze serverless (pymongo per le chiamate
+  sync, Motor per quelle async), scadenza nativa con indice TTL.
+- SQLiteCheckpointStore: file locale (o ":memory:") per test e sviluppo.
+"""
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import pymongo
+
+import logging
+logger = logging.getLogger("uvicorn")
+
+# Record di checkpoint: thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+# checkpoint_type, checkpoint, metadata_type, metadata, size, updated_at (datetime UTC)
+CheckpointRecord = Dict[str, Any]
+# Record di write: thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel,
+# value_type, value, task_path, updated_at (datetime UTC)
+WriteRecord = Dict[str, Any]
+
+
+class CheckpointStore(ABC):
+    """
+    Interfaccia degli store di checkpoint. Le varianti async di default eseguono
+    quelle sync in un thread; gli store con un driver async nativo le sovrascrivono.
+    """
+
+    @abstractmethod
+    def get_checkpoint(self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str] = None) -> Optional[CheckpointRecord]:
+        """Ritorna il checkpoint richiesto, o l'ultimo del thread se checkpoint_id è None."""
+        pass
+
+    @abstractmethod
+    def list_checkpoints(
+        self,
+        thread_id: Optional[str],
+        checkpoint_ns: Optional[str] = None,
+        before_id: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[CheckpointRecord]:
+        """Ritorna i checkpoint in ordine dal più recente."""
+        pass
+
+    @abstractmethod
+    def put_checkpoint(self, record: CheckpointRecord) -> None:
+        pass
+
+    @abstractmethod
+    def get_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[WriteRecord]:
+        pass
+
+    @abstractmethod
+    def put_writes(self, records: List[WriteRecord]) -> None:
+        """Salva i pending writes; quelli con idx >= 0 già presenti non vengono sovrascritti."""
+        pass
+
+    @abstractmethod
+    def compact(self, thread_id: str, checkpoint_ns: str, keep: int) -> int:
+        """Tiene solo gli ultimi `keep` checkpoint del thread (con i loro writes). Ritorna i rimossi."""
+        pass
+
+    @abstractmethod
+    def delete_thread(self, thread_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def purge_expired(self, cutoff: datetime) -> int:
+        """Rimuove i checkpoint aggiornati prima di `cutoff`. Ritorna i rimossi."""
+        pass
+
+    async def aget_checkpoint(self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str] = None) -> Optional[CheckpointRecord]:
+        return await asyncio.to_thread(self.get_checkpoint, thread_id, checkpoint_ns, checkpoint_id)
+
+    async def alist_checkpoints(
+        self,
+        thread_id: Optional[str],
+        checkpoint_ns: Optional[str] = None,
+        before_id: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[CheckpointRecord]:
+        return await asyncio.to_thread(self.list_checkpoints, thread_id, checkpoint_ns, before_id, limit)
+
+    async def aput_checkpoint(self, record: CheckpointRecord) -> None:
+        await asyncio.to_thread(self.put_checkpoint, record)
+
+    async def aget_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[WriteRecord]:
+        return await asyncio.to_thread(self.get_writes, thread_id, checkpoint_ns, checkpoint_id)
+
+    async def aput_writes(self, records: List[WriteRecord]) -> None:
+        await asyncio.to_thread(self.put_writes, records)
+
+    async def acompact(self, thread_id: str, checkpoint_ns: str, keep: int) -> int:
+        return await asyncio.to_thread(self.compact, thread_id, checkpoint_ns, keep)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    async def apurge_expired(self, cutoff: datetime) -> int:
+        return await asyncio.to_thread(self.purge_expired, cutoff)
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """Store su SQLite (stdlib): una connessione protetta da lock, usabile da più thread."""
+
+    _CHECKPOINT_COLUMNS = (
+        "thread_id", "checkpoint_ns", "checkpoint_id", "parent_checkpoint_id",
+        "checkpoint_type", "checkpoint", "metadata_type", "metadata", "size", "updated_at",
+    )
+    _WRITE_COLUMNS = (
+        "thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx",
+        "channel", "value_type", "value", "task_path", "updated_at",
+    )
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, "
+                "parent_checkpoint_id TEXT, checkpoint_type TEXT, checkpoint BLOB, "
+                "metadata_type TEXT, metadata BLOB, size INTEGER, updated_at TEXT, "
+                "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS writes ("
+                "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, "
+                "task_id TEXT NOT NULL, idx INTEGER NOT NULL, channel TEXT, value_type TEXT, "
+                "value BLOB, task_path TEXT, updated_at TEXT, "
+                "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS checkpoints_updated_at ON checkpoints (updated_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS writes_updated_at ON writes (updated_at)")
+
+    def _checkpoint_from_row(self, row) -> CheckpointRecord:
+        record = dict(zip(self._CHECKPOINT_COLUMNS, row))
+        record["updated_at"] = datetime.fromisoformat(record["updated_at"])
+        return record
+
+    def get_checkpoint(self, thread_id, checkpoint_ns, checkpoint_id=None):
+        columns = ", ".join(self._CHECKPOINT_COLUMNS)
+        with self._lock:
+            if checkpoint_id:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+        return self._checkpoint_from_row(row) if row else None
+
+    def list_checkpoints(self, thread_id, checkpoint_ns=None, before_id=None, limit=None):
+        query = f"SELECT {', '.join(self._CHECKPOINT_COLUMNS)} FROM checkpoints WHERE 1 = 1"
+        params: List[Any] = []
+        if thread_id is not None:
+            query += " AND thread_id = ?"
+            params.append(thread_id)
+        if checkpoint_ns is not None:
+            query += " AND checkpoint_ns = ?"
+            params.append(checkpoint_ns)
+        if before_id is not None:
+            query += " AND checkpoint_id < ?"
+            params.append(before_id)
+        query += " ORDER BY checkpoint_id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._checkpoint_from_row(row) for row in rows]
+
+    def put_checkpoint(self, record):
+        values = [record[c] for c in self._CHECKPOINT_COLUMNS]
+        values[-1] = record["updated_at"].isoformat()
+        placeholders = ", ".join("?" for _ in self._CHECKPOINT_COLUMNS)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO checkpoints ({', '.join(self._CHECKPOINT_COLUMNS)}) VALUES ({placeholders})",
+                values,
+            )
+
+    def get_writes(self, thread_id, checkpoint_ns, checkpoint_id):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self._WRITE_COLUMNS)} FROM writes "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            ).fetchall()
+        return [dict(zip(self._WRITE_COLUMNS, row)) for row in rows]
+
+    def _write_values(self, record: WriteRecord) -> List[Any]:
+        values = [record[c] for c in self._WRITE_COLUMNS]
+        values[-1] = record["updated_at"].isoformat()
+        return values
+
+    def put_writes(self, records):
+        placeholders = ", ".join("?" for _ in self._WRITE_COLUMNS)
+        columns = ", ".join(self._WRITE_COLUMNS)
+        with self._lock, self._conn:
+            for record in records:
+                verb = "INSERT OR IGNORE" if record["idx"] >= 0 else "INSERT OR REPLACE"
+                self._conn.execute(
+                    f"{verb} INTO writes ({columns}) VALUES ({placeholders})",
+                    self._write_values(record),
+                )
+
+    def compact(self, thread_id, checkpoint_ns, keep):
+        with self._lock, self._conn:
+            stale = [
+                row[0] for row in self._conn.execute(
+                    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+                    (thread_id, checkpoint_ns, keep),
+                ).fetchall()
+            ]
+            for checkpoint_id in stale:
+                params = (thread_id, checkpoint_ns, checkpoint_id)
+                self._conn.execute(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params
+                )
+                self._conn.execute(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params
+                )
+        return len(stale)
+
+    def delete_thread(self, thread_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+
+    def purge_expired(self, cutoff):
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM checkpoints WHERE updated_at < ?", (cutoff.isoformat(),)
+            ).rowcount
+            self._conn.execute("DELETE FROM writes WHERE updated_at < ?", (cutoff.isoformat(),))
+        return deleted
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class MongoCheckpointStore(CheckpointStore):
+    """
+    Store su MongoDB condiviso tra istanze: pymongo (client di processo) per le chiamate
+    sync, Motor (client per event loop) per quelle async usate dallo streaming.
+
+    Gli indici vengono creati alla prima operazione; l'indice TTL su updated_at fa
+    scadere i thread inattivi senza job esterni.
+    """
+
+    def __init__(
+        self,
+        database_name: str,
+        collection_name: str = "agent_checkpoints",
+        ttl_seconds: Optional[int] = None,
+        client: Optional[pymongo.MongoClient] = None,
+        async_client: Any = None,
+    ):
+        self.database_name = database_name
+        self.collection_name = collection_name
+        self.writes_collection_name = f"{collection_name}_writes"
+        self.ttl_seconds = ttl_seconds
+        self._client = client
+        self._async_client = async_client
+        self._indexes_ready = False
+
+    # Collection helpers
+    def _sync_db(self):
+        if self._client is None:
+            from ..services.database.connection_pool import get_mongo_client
+            return get_mongo_client()[self.database_name]
+        return self._client[self.database_name]
+
+    def _async_db(self):
+        if self._async_client is None:
+            from ..services.database.connection_pool import get_async_client
+            return get_async_client()[self.database_name]
+        return self._async_client[self.database_name]
+
+    def _index_specs(self):
+        checkpoint_indexes = [
+            ([("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", -1)], {}),
+        ]
+        if self.ttl_seconds:
+            checkpoint_indexes.append(([("updated_at", 1)], {"expireAfterSeconds": self.ttl_seconds}))
+        writes_indexes = [([("thread_id", 1), ("checkpoint_ns", 1), ("checkpoint_id", 1)], {})]
+        if self.ttl_seconds:
+            writes_indexes.append(([("updated_at", 1)], {"expireAfterSeconds": self.ttl_seconds}))
+        return checkpoint_indexes, writes_indexes
+
+    def _ensure_indexes(self, db) -> None:
+        if self._indexes_ready:
+            return
+        checkpoint_indexes, writes_indexes = self._index_specs()
+        for keys, options in checkpoint_indexes:
+            db[self.collection_name].create_index(keys, **options)
+        for keys, options in writes_indexes:
+            db[self.writes_collection_name].create_index(keys, **options)
+        self._indexes_ready = True
+
+    async def _aensure_indexes(self, db) -> None:
+        if self._indexes_ready:
+            return
+        checkpoint_indexes, writes_indexes = self._index_specs()
+        for keys, options in checkpoint_indexes:
+            await db[self.collection_name].create_index(keys, **options)
+        for keys, options in writes_indexes:
+            await db[self.writes_collection_name].create_index(keys, **options)
+        self._indexes_ready = True
+
+    # Query helpers (condivisi da sync e async)
+    @staticmethod
+    def _checkpoint_key(thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> str:
+        return f"{thread_id}|{checkpoint_ns}|{checkpoint_id}"
+
+    @staticmethod
+    def _write_key(record: WriteRecord) -> str:
+        return f"{record['thread_id']}|{record['checkpoint_ns']}|{record['checkpoint_id']}|{record['task_id']}|{record['idx']}"
+
+    @staticmethod
+    def _latest_query(thread_id, checkpoint_ns, checkpoint_id):
+        query = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}
+        if checkpoint_id:
+            query["checkpoint_id"] = checkpoint_id
+        return query
+
+    @staticmethod
+    def _list_query(thread_id, checkpoint_ns, before_id):
+        query: Dict[str, Any] = {}
+        if thread_id is not None:
+            query["thread_id"] = thread_id
+        if checkpoint_ns is not None:
+            query["checkpoint_ns"] = checkpoint_ns
+        if before_id is not None:
+            query["checkpoint_id"] = {"$lt": before_id}
+        return query
+
+    @staticmethod
+    def _strip(document: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if document is None:
+            return None
+        document.pop("_id", None)
+        if document.get("updated_at") is not None and document["updated_at"].tzinfo is None:
+            document["updated_at"] = document["updated_at"].replace(tzinfo=timezone.utc)
+        return document
+
+    def _write_operations(self, records: List[WriteRecord]) -> List[Any]:
+        operations = []
+        for record in records:
+            key = self._write_key(record)
+            if record["idx"] >= 0:
+                operations.append(pymongo.UpdateOne({"_id": key}, {"$setOnInsert": record}, upsert=True))
+            else:
+                operations.append(pymongo.ReplaceOne({"_id": key}, record, upsert=True))
+        return operations
+
+    @staticmethod
+    def _stale_ids(documents: List[Dict[str, Any]], keep: int) -> List[str]:
+        return [doc["checkpoint_id"] for doc in documents[keep:]]
+
+    # Sync API
+    def get_checkpoint(self, thread_id, checkpoint_ns, checkpoint_id=None):
+        db = self._sync_db()
+        self._ensure_indexes(db)
+        return self._strip(db[self.collection_name].find_one(
+            self._latest_query(thread_id, checkpoint_ns, checkpoint_id),
+            sort=[("checkpoint_id", -1)],
+        ))
+
+    def list_checkpoints(self, thread_id, checkpoint_ns=None, before_id=None, limit=None):
+        db = self._sync_db()
+        cursor = db[self.collection_name].find(self._list_query(thread_id, checkpoint_ns, before_id)).sort("checkpoint_id", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return [self._strip(doc) for doc in cursor]
+
+    def put_checkpoint(self, record):
+        db = self._sync_db()
+        self._ensure_indexes(db)
+        key = self._checkpoint_key(record["thread_id"], record["checkpoint_ns"], record["checkpoint_id"])
+        db[self.collection_name].replace_one({"_id": key}, record, upsert=True)
+
+    def get_writes(self, thread_id, checkpoint_ns, checkpoint_id):
+        db = self._sync_db()
+        cursor = db[self.writes_collection_name].find(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}
+        ).sort([("task_id", 1), ("idx", 1)])
+        return [self._strip(doc) for doc in cursor]
+
+    def put_writes(self, records):
+        if records:
+            self._sync_db()[self.writes_collection_name].bulk_write(self._write_operations(records), ordered=False)
+
+    def compact(self, thread_id, checkpoint_ns, keep):
+        db = self._sync_db()
+        documents = list(db[self.collection_name].find(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}, {"checkpoint_id": 1}
+        ).sort("checkpoint_id", -1))
+        stale = self._stale_ids(documents, keep)
+        if stale:
+            query = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": {"$in": stale}}
+            db[self.collection_name].delete_many(query)
+            db[self.writes_collection_name].delete_many(query)
+        return len(stale)
+
+    def delete_thread(self, thread_id):
+        db = self._sync_db()
+        db[self.collection_name].delete_many({"thread_id": thread_id})
+        db[self.writes_collection_name].delete_many({"thread_id": thread_id})
+
+    def purge_expired(self, cutoff):
+        # Normalmente ci pensa l'indice TTL (il monitor gira ogni ~60s): qui la rimozione è immediata
+        db = self._sync_db()
+        result = db[self.collection_name].delete_many({"updated_at": {"$lt": cutoff}})
+        db[self.writes_collection_name].delete_many({"updated_at": {"$lt": cutoff}})
+        return result.deleted_count
+
+    # Async API (Motor)
+    async def aget_checkpoint(self, thread_id, checkpoint_ns, checkpoint_id=None):
+        db = self._async_db()
+        await self._aensure_indexes(db)
+        return self._strip(await db[self.collection_name].find_one(
+            self._latest_query(thread_id, checkpoint_ns, checkpoint_id),
+            sort=[("checkpoint_id", -1)],
+        ))
+
+    async def alist_checkpoints(self, thread_id, checkpoint_ns=None, before_id=None, limit=None):
+        db = self._async_db()
+        cursor = db[self.collection_name].find(self._list_query(thread_id, checkpoint_ns, before_id)).sort("checkpoint_id", -1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return [self._strip(doc) for doc in await cursor.to_list(length=None)]
+
+    async def aput_checkpoint(self, record):
+        db = self._async_db()
+        await self._aensure_indexes(db)
+        key = self._checkpoint_key(record["thread_id"], record["checkpoint_ns"], record["checkpoint_id"])
+        await db[self.collection_name].replace_one({"_id": key}, record, upsert=True)
+
+    async def aget_writes(self, thread_id, checkpoint_ns, checkpoint_id):
+        db = self._async_db()
+        cursor = db[self.writes_collection_name].find(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}
+        ).sort([("task_id", 1), ("idx", 1)])
+        return [self._strip(doc) for doc in await cursor.to_list(length=None)]
+
+    async def aput_writes(self, records):
+        if records:
+            await self._async_db()[self.writes_collection_name].bulk_write(self._write_operations(records), ordered=False)
+
+    async def acompact(self, thread_id, checkpoint_ns, keep):
+        db = self._async_db()
+        documents = await db[self.collection_name].find(
+            {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}, {"checkpoint_id": 1}
+        ).sort("checkpoint_id", -1).to_list(length=None)
+        stale = self._stale_ids(documents, keep)
+        if stale:
+            query = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": {"$in": stale}}
+            await db[self.collection_name].delete_many(query)
+            await db[self.writes_collection_name].delete_many(query)
+        return len(stale)
+
+    async def adelete_thread(self, thread_id):
+        db = self._async_db()
+        await db[self.collection_name].delete_many({"thread_id": thread_id})
+        await db[self.writes_collection_name].delete_many({"thread_id": thread_id})
+
+    async def apurge_expired(self, cutoff):
+        db = self._async_db()
+        result = await db[self.collection_name].delete_many({"updated_at": {"$lt": cutoff}})
+        await db[self.writes_collection_name].delete_many({"updated_at": {"$lt": cutoff}})
+        return result.deleted_count
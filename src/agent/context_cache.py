@@ -0,0 +1,319 @@
+"""
+Caching esplicito del contesto Gemini per la parte statica del system prompt.
+
+Il caching implicito dipende dal prefisso identico tra richieste e non dà garanzie di
+hit. Con ENABLE_EXPLICIT_CACHING il manager crea un CachedContent per versione di
+prompt che contiene:
+
+- il prefisso statico del system prompt (docs + istruzioni, identico per tutti gli
+  utenti, vedi prompt_personalization) come system_instruction;
+- le dichiarazioni dei tool: l'API non accetta tools/tool_config/system_instruction
+  in una richiesta che usa cached_content, quindi devono stare nella cache.
+
+La personalizzazione per utente resta fuori dal prefisso in cache: la parte del system
+prompt che segue il prefisso statico viene spostata in testa al primo turno utente.
+
+Creazione e rinnovo del TTL avvengono in un thread in background: una richiesta non
+attende mai l'API di caching, al massimo viene servita senza cache esplicita (fallback
+sul caching implicito). Le entry delle versioni superate vengono eliminate alla
+creazione della nuova versione e su /api/update_docs.
+"""
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.genai import types
+from langchain_google_genai import ChatGoogleGenerativeAI
+from pydantic import Field
+
+from ..env import settings
+
+import logging
+logger = logging.getLogger("uvicorn")
+
+# Margine prima della scadenza oltre il quale una entry non viene più usata
+EXPIRY_SAFETY_S = 30
+
+
+def _fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _tools_fingerprint(tools: Optional[List[Any]], tool_config: Any) -> str:
+    parts = [t.model_dump_json(exclude_none=True) if hasattr(t, "model_dump_json") else repr(t) for t in tools or []]
+    if tool_config is not None:
+        parts.append(tool_config.model_dump_json(exclude_none=True) if hasattr(tool_config, "model_dump_json") else repr(tool_config))
+    return _fingerprint("\n".join(parts))
+
+
+def _content_text(content: Optional[types.Content]) -> str:
+    if content is None:
+        return ""
+    return "".join(part.text or "" for part in content.parts or [])
+
+
+@dataclass
+class _CacheEntry:
+    name: str
+    model: str
+    prompt_version: int
+    prefix_sha: str
+    tools_sha: str
+    client: Any
+    expires_at: float
+    refreshing: bool = field(default=False)
+
+
+class GeminiContextCache:
+    """Ciclo di vita delle entry CachedContent: una per (modello, versione di prompt)."""
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[int] = None,
+        refresh_margin_s: Optional[int] = None,
+        retry_after_s: float = 60,
+        background: bool = True,
+    ):
+        self.ttl_seconds = ttl_seconds or settings.EXPLICIT_CACHE_TTL_SECONDS
+        self.refresh_margin_s = settings.EXPLICIT_CACHE_REFRESH_MARGIN_SECONDS if refresh_margin_s is None else refresh_margin_s
+        self.retry_after_s = retry_after_s
+        self.background = background
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, int], _CacheEntry] = {}
+        self._pending: set = set()
+        self._failed_at: Dict[Tuple[str, int], float] = {}
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.refreshed = 0
+        self.deleted = 0
+        self.failures = 0
+
+    # Scheduling
+    def _run(self, target, *args) -> None:
+        if self.background:
+            threading.Thread(target=target, args=args, name="context-cache", daemon=True).start()
+        else:
+            target(*args)
+
+    def lookup(
+        self,
+        client: Any,
+        model: str,
+        prompt_version: int,
+        prefix: str,
+        tools: Optional[List[Any]] = None,
+        tool_config: Any = None,
+    ) -> Optional[str]:
+        """
+        Ritorna il nome della cache valida per (model, prompt_version), senza chiamate di rete.
+        Se manca o sta per scadere, ne programma la creazione o il rinnovo.
+        """
+        key = (model, prompt_version)
+        prefix_sha = _fingerprint(prefix)
+        tools_sha = _tools_fingerprint(tools, tool_config)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.prefix_sha != prefix_sha or entry.tools_sha != tools_sha):
+                entry = None  # Contenuto diverso a parità di versione: la entry non è riutilizzabile
+            usable = entry is not None and now < entry.expires_at - EXPIRY_SAFETY_S
+            if entry is not None and usable and entry.expires_at - now < self.refresh_margin_s and not entry.refreshing:
+                entry.refreshing = True
+                refresh = entry
+            else:
+                refresh = None
+            create = (
+                not usable
+                and key not in self._pending
+                and now - self._failed_at.get(key, float("-inf")) >= self.retry_after_s
+            )
+            if create:
+                self._pending.add(key)
+            if usable:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if refresh is not None:
+            self._run(self._refresh, refresh)
+        if create:
+            self._run(self._create, client, model, prompt_version, prefix, tools, tool_config, prefix_sha, tools_sha)
+        return entry.name if usable else None
+
+    # Operazioni remote
+    def _create(self, client, model, prompt_version, prefix, tools, tool_config, prefix_sha, tools_sha) -> None:
+        key = (model, prompt_version)
+        try:
+            cache = client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"air-coach-docs-v{prompt_version}",
+                    system_instruction=types.Content(parts=[types.Part(text=prefix)]),
+                    tools=tools or None,
+                    tool_config=tool_config,
+                    ttl=f"{self.ttl_seconds}s",
+                ),
+            )
+        except Exception as e:
+            with self._lock:
+                self._pending.discard(key)
+                self._failed_at[key] = time.monotonic()
+                self.failures += 1
+            logger.warning(f"CONTEXT_CACHE - Creazione cache v{prompt_version} fallita, uso il caching implicito: {e}")
+            return
+
+        entry = _CacheEntry(
+            name=cache.name, model=model, prompt_version=prompt_version, prefix_sha=prefix_sha,
+            tools_sha=tools_sha, client=client, expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = entry
+            self._pending.discard(key)
+            self._failed_at.pop(key, None)
+            self.created += 1
+        logger.info(f"CONTEXT_CACHE - Creata cache {cache.name} per prompt v{prompt_version} (TTL {self.ttl_seconds}s)")
+        if previous is not None:
+            self._delete(previous)
+        self.invalidate(keep_version=prompt_version)
+
+    def _refresh(self, entry: _CacheEntry) -> None:
+        try:
+            entry.client.caches.update(
+                name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+            )
+        except Exception as e:
+            logger.warning(f"CONTEXT_CACHE - Rinnovo TTL di {entry.name} fallito, la cache verrà ricreata: {e}")
+            with self._lock:
+                if self._entries.get((entry.model, entry.prompt_version)) is entry:
+                    del self._entries[(entry.model, entry.prompt_version)]
+                self.failures += 1
+            return
+        with self._lock:
+            entry.expires_at = time.monotonic() + self.ttl_seconds
+            entry.refreshing = False
+            self.refreshed += 1
+        logger.debug(f"CONTEXT_CACHE - TTL di {entry.name} rinnovato")
+
+    def _delete(self, entry: _CacheEntry) -> None:
+        try:
+            entry.client.caches.delete(name=entry.name)
+        except Exception as e:
+            logger.warning(f"CONTEXT_CACHE - Eliminazione di {entry.name} fallita (scadrà col TTL): {e}")
+            return
+        with self._lock:
+            self.deleted += 1
+
+    def invalidate(self, keep_version: Optional[int] = None) -> int:
+        """Elimina le entry con versione < keep_version (tutte se None). Hook di update_docs."""
+        with self._lock:
+            stale = [
+                key for key in self._entries
+                if keep_version is None or key[1] < keep_version
+            ]
+            entries = [self._entries.pop(key) for key in stale]
+        for entry in entries:
+            self._delete(entry)
+        if entries:
+            logger.info(f"CONTEXT_CACHE - Invalidate {len(entries)} cache di versioni di prompt superate")
+        return len(entries)
+
+    def is_active(self, prompt_version: int) -> bool:
+        """True se esiste una cache valida per la versione (per le metriche di token)."""
+        now = time.monotonic()
+        with self._lock:
+            return any(
+                key[1] == prompt_version and now < entry.expires_at - EXPIRY_SAFETY_S
+                for key, entry in self._entries.items()
+            )
+
+    # Riscrittura della richiesta
+    def apply(self, request: Dict[str, Any], client: Any, prefix: str, prompt_version: int) -> Dict[str, Any]:
+        """
+        Riscrive una richiesta generate_content per usare la cache esplicita, se disponibile.
+        La richiesta resta invariata se il system prompt non inizia con `prefix` o la cache non è pronta.
+        """
+        config = request["config"]
+        if config.cached_content or not prefix:
+            return request
+        system_text = _content_text(config.system_instruction)
+        if not system_text.startswith(prefix):
+            return request
+        name = self.lookup(client, request["model"], prompt_version, prefix, config.tools, config.tool_config)
+        if name is None:
+            return request
+
+        contents = list(request["contents"])
+        user_section = system_text[len(prefix):].strip()
+        if user_section:
+            if contents and contents[0].role == "user":
+                first = contents[0]
+                contents[0] = first.model_copy(update={"parts": [types.Part(text=user_section)] + list(first.parts or [])})
+            else:
+                contents.insert(0, types.Content(role="user", parts=[types.Part(text=user_section)]))
+        config = config.model_copy(
+            update={"cached_content": name, "system_instruction": None, "tools": None, "tool_config": None}
+        )
+        return {**request, "contents": contents, "config": config}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": settings.ENABLE_EXPLICIT_CACHING,
+                "entries": [
+                    {"name": e.name, "prompt_version": e.prompt_version,
+                     "expires_in_s": round(e.expires_at - time.monotonic())}
+                    for e in self._entries.values()
+                ],
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+                "created": self.created,
+                "refreshed": self.refreshed,
+                "deleted": self.deleted,
+                "failures": self.failures,
+            }
+
+
+class ContextCachedChatGoogleGenerativeAI(ChatGoogleGenerativeAI):
+    """ChatGoogleGenerativeAI che instrada le richieste sulla cache esplicita del prefisso statico corrente."""
+
+    context_cache: Optional[Any] = Field(default=None, exclude=True)
+
+    def _prepare_request(self, messages, **kwargs) -> Dict[str, Any]:
+        request = super()._prepare_request(messages, **kwargs)
+        if self.context_cache is None:
+            return request
+        from ..prompt_personalization import get_static_prompt_prefix
+        prefix, prompt_version = get_static_prompt_prefix()
+        return self.context_cache.apply(request, self.client, prefix, prompt_version)
+
+
+_context_cache: Optional[GeminiContextCache] = None
+
+
+def get_context_cache() -> GeminiContextCache:
+    """Manager di processo delle cache esplicite (creato al primo uso)."""
+    global _context_cache
+    if _context_cache is None:
+        _context_cache = GeminiContextCache()
+    return _context_cache
+
+
+def invalidate_context_cache(keep_version: Optional[int] = None) -> int:
+    if _context_cache is None:
+        return 0
+    return _context_cache.invalidate(keep_version)
+
+
+def get_context_cache_stats() -> Dict[str, Any]:
+    if _context_cache is None:
+        return {"enabled": settings.ENABLE_EXPLICIT_CACHING, "entries": []}
+    return _context_cache.stats()
@@ -0,0 +1,409 @@
+"""
+Log degli eventi SSE per messaggio, per riprendere uno stream dopo una disconnessione.
+
+Ogni frame emesso da StreamingHandler riceve un id sequenziale (`id: <message_id>:<n>`) e
+resta in un buffer in memoria di al massimo STREAM_EVENT_BUFFER_SIZE frame. Con
+STREAM_EVENT_SPILL attivo i frame che escono dal buffer, e il log completo a fine run,
+vengono copiati su MongoDB (coda write-behind): la ripresa funziona anche su un'altra
+istanza o dopo che il log è uscito dalla memoria.
+
+Il run non è legato alla connessione: gira in un task che scrive nel log e le risposte
+HTTP lo seguono con follow(). Un client che si riconnette con Last-Event-ID riceve i frame
+persi e poi quelli live. Se nessun client segue il run per STREAM_RESUME_GRACE_SECONDS,
+il run viene cancellato (risposta parziale salvata come interrupted).
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from cachetools import TTLCache
+
+from ..env import DATABASE_NAME, settings
+
+logger = logging.getLogger("uvicorn")
+
+_DONE = object()  # fine del run per i client collegati
+
+EventStoreResult = Tuple[List[Tuple[int, str]], bool]
+
+
+def format_event_id(message_id: str, seq: int) -> str:
+    return f"{message_id}:{seq}"
+
+
+def parse_event_id(value: str) -> Tuple[Optional[str], int]:
+    """
+    Legge un Last-Event-ID: `<message_id>:<n>` oppure solo `<n>`.
+    Il message_id contiene ':' (timestamp), quindi si separa sull'ultimo.
+
+    Raises:
+        ValueError: se la parte finale non è un numero
+    """
+    message_id, _, seq = value.strip().rpartition(":")
+    return message_id or None, int(seq)
+
+
+def resume_unavailable_frame(message_id: str) -> str:
+    """Frame di errore quando i frame mancanti non sono più disponibili: il client deve rifare la domanda."""
+    from .streaming_handler import encode_sse
+    return encode_sse({
+        "type": "error",
+        "code": "RESUME_UNAVAILABLE",
+        "message": "Lo stream non può essere ripreso, invia di nuovo la domanda",
+        "message_id": message_id,
+    })
+
+
+class MongoEventStore:
+    """Spill dei frame su una collection MongoDB: scritture in coda write-behind, letture Motor."""
+
+    def __init__(
+        self,
+        collection_name: Optional[str] = None,
+        database_name: str = DATABASE_NAME,
+        ttl_seconds: Optional[int] = None,
+        client: Any = None,
+    ):
+        self.collection_name = collection_name or settings.STREAM_EVENT_COLLECTION
+        self.database_name = database_name
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.STREAM_EVENT_TTL_SECONDS
+        self._client = client
+        self._indexed = False
+
+    def _collection(self):
+        from ..services.database.connection_pool import get_async_client
+        client = self._client if self._client is not None else get_async_client()
+        return client[self.database_name][self.collection_name]
+
+    async def _ensure_index(self) -> None:
+        if self._indexed:
+            return
+        self._indexed = True
+        try:
+            collection = self._collection()
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            await collection.create_index([("message_id", 1), ("seq", 1)])
+        except Exception as e:
+            self._indexed = False
+            logger.warning(f"STREAM_EVENTS - Creazione indici fallita: {e}")
+
+    def save(self, message_id: str, user_id: str, events: List[Tuple[int, str]], done: bool = False) -> None:
+        """Accoda i frame (e, a fine run, il marker done) senza attendere la scrittura."""
+        from ..services.database.write_behind import get_write_behind_queue
+        queue = get_write_behind_queue()
+        expires_at = datetime.fromtimestamp(time.time() + self.ttl_seconds, tz=timezone.utc)
+        base = {"message_id": message_id, "user_id": user_id, "expires_at": expires_at}
+        for seq, frame in events:
+            queue.enqueue(self.database_name, self.collection_name, {**base, "seq": seq, "frame": frame})
+        if done:
+            last = events[-1][0] if events else 0
+            queue.enqueue(self.database_name, self.collection_name, {**base, "seq": last + 1, "done": True})
+        if not self._indexed:
+            asyncio.ensure_future(self._ensure_index())
+
+    async def load(self, message_id: str, user_id: str, after_id: int) -> Optional[EventStoreResult]:
+        """Frame con id > after_id e flag di run concluso; None se il messaggio non è nello store."""
+        await self._ensure_index()
+        cursor = self._collection().find(
+            {"message_id": message_id, "user_id": user_id, "seq": {"$gt": after_id}},
+            projection={"_id": False, "seq": True, "frame": True, "done": True},
+        ).sort("seq", 1)
+        docs = await cursor.to_list(length=None)
+        if not docs:
+            return None
+        events = [(d["seq"], d["frame"]) for d in docs if d.get("frame") is not None]
+        return events, any(d.get("done") for d in docs)
+
+
+class MessageEventLog:
+    """
+    Frame di un messaggio con id sequenziali, buffer limitato e client collegati.
+
+    I commenti SSE (heartbeat) vanno solo ai client collegati: non hanno id e non si
+    riprendono.
+    """
+
+    def __init__(
+        self,
+        message_id: str,
+        user_id: str,
+        maxlen: Optional[int] = None,
+        grace_seconds: Optional[float] = None,
+        store: Optional[MongoEventStore] = None,
+        on_close: Optional[Callable[["MessageEventLog"], None]] = None,
+    ):
+        self.message_id = message_id
+        self.user_id = user_id
+        self.maxlen = maxlen if maxlen is not None else settings.STREAM_EVENT_BUFFER_SIZE
+        self.grace_seconds = grace_seconds if grace_seconds is not None else settings.STREAM_RESUME_GRACE_SECONDS
+        self.store = store
+        self.events: Deque[Tuple[int, str]] = deque()
+        self.last_id = 0
+        self.done = False
+        self.expired = False  # run cancellato perché nessun client lo seguiva
+        self.producer: Optional[asyncio.Task] = None
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._expiry: Optional[asyncio.TimerHandle] = None
+        self._on_close = on_close
+
+    @property
+    def first_id(self) -> int:
+        """Primo id ancora nel buffer in memoria."""
+        return self.events[0][0] if self.events else self.last_id + 1
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def append(self, frame: str) -> str:
+        """Assegna l'id al frame, lo conserva e lo inoltra ai client collegati."""
+        if frame.startswith(":"):
+            self._publish(frame)
+            return frame
+        self.last_id += 1
+        framed = f"id: {format_event_id(self.message_id, self.last_id)}\n{frame}"
+        self.events.append((self.last_id, framed))
+        if len(self.events) > self.maxlen:
+            evicted = self.events.popleft()
+            if self.store is not None:
+                self.store.save(self.message_id, self.user_id, [evicted])
+        self._publish(framed)
+        return framed
+
+    def _publish(self, item: Any) -> None:
+        for queue in self._subscribers:
+            queue.put_nowait(item)
+
+    def close(self) -> None:
+        """Fine del run: i client collegati terminano, il log completo va nello store."""
+        if self.done:
+            return
+        self.done = True
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        self._publish(_DONE)
+        if self.store is not None:
+            self.store.save(self.message_id, self.user_id, list(self.events), done=True)
+        if self._on_close is not None:
+            self._on_close(self)
+
+    async def follow(
+        self,
+        after_id: int = 0,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Frame con id > after_id: prima quelli già emessi (buffer, poi store se usciti dal
+        buffer), quindi quelli live fino alla fine del run o alla disconnessione del client.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        # Iscrizione e copia del buffer senza await in mezzo: nessun frame perso o duplicato
+        self._subscribers.add(queue)
+        self._cancel_expiry()
+        buffered = [frame for seq, frame in self.events if seq > after_id]
+        if self.done:
+            queue.put_nowait(_DONE)
+        missing_up_to = self.first_id - 1
+        try:
+            if after_id < missing_up_to:
+                stored = await self._load_missing(after_id, missing_up_to)
+                if stored is None:
+                    yield resume_unavailable_frame(self.message_id)
+                    return
+                for frame in stored:
+                    yield frame
+            for frame in buffered:
+                yield frame
+            poll = settings.DISCONNECT_POLL_SECONDS if is_disconnected is not None else None
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=poll)
+                except asyncio.TimeoutError:
+                    if await _client_gone(is_disconnected):
+                        return
+                    continue
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self._subscribers.discard(queue)
+            if not self._subscribers and not self.done:
+                self.schedule_expiry()
+
+    async def _load_missing(self, after_id: int, up_to: int) -> Optional[List[str]]:
+        """Frame (after_id, up_to] usciti dal buffer; None se lo store non li ha tutti."""
+        if self.store is None:
+            return None
+        try:
+            result = await self.store.load(self.message_id, self.user_id, after_id)
+        except Exception as e:
+            logger.warning(f"STREAM_EVENTS - Lettura dello store fallita per {self.message_id}: {e}")
+            return None
+        events = [(seq, frame) for seq, frame in (result[0] if result else []) if seq <= up_to]
+        if [seq for seq, _ in events] != list(range(after_id + 1, up_to + 1)):
+            return None  # scritture write-behind non ancora arrivate o scartate
+        return [frame for _, frame in events]
+
+    def schedule_expiry(self) -> None:
+        """Cancella il run se nessun client si collega entro grace_seconds."""
+        self._cancel_expiry()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._expiry = loop.call_later(self.grace_seconds, self._expire)
+
+    def _cancel_expiry(self) -> None:
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+    def _expire(self) -> None:
+        self._expiry = None
+        if self._subscribers or self.done or self.producer is None or self.producer.done():
+            return
+        logger.info(f"STREAM - Nessun client per {self.grace_seconds}s, run {self.message_id} cancellato")
+        self.expired = True
+        self.producer.cancel()
+
+
+async def _client_gone(is_disconnected: Optional[Callable[[], Awaitable[bool]]]) -> bool:
+    try:
+        return bool(await is_disconnected())
+    except Exception as e:
+        logger.warning(f"STREAM - Controllo disconnessione fallito: {e}")
+        return False
+
+
+class EventLogRegistry:
+    """
+    Log dei messaggi del processo: quelli dei run in corso restano finché il run non
+    termina, quelli conclusi in una TTLCache (STREAM_EVENT_MAX_LOGS, STREAM_EVENT_TTL_SECONDS).
+    """
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        store: Optional[MongoEventStore] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.store = store
+        self._active: Dict[str, MessageEventLog] = {}
+        self._finished: TTLCache = TTLCache(
+            maxsize=maxsize if maxsize is not None else settings.STREAM_EVENT_MAX_LOGS,
+            ttl=ttl_seconds if ttl_seconds is not None else settings.STREAM_EVENT_TTL_SECONDS,
+            timer=timer,
+        )
+        self._runs: Set[asyncio.Task] = set()
+        self._stats = dict.fromkeys(
+            ("runs", "resumes", "live_attaches", "replayed_events", "store_resumes", "resume_misses", "expired_runs"), 0,
+        )
+
+    def create(self, message_id: str, user_id: str) -> MessageEventLog:
+        log = MessageEventLog(message_id, user_id, store=self.store, on_close=self._finish)
+        self._active[message_id] = log
+        return log
+
+    def _finish(self, log: MessageEventLog) -> None:
+        self._active.pop(log.message_id, None)
+        self._finished[log.message_id] = log
+        if log.expired:
+            self._stats["expired_runs"] += 1
+
+    def get(self, message_id: str) -> Optional[MessageEventLog]:
+        return self._active.get(message_id) or self._finished.get(message_id)
+
+    def run(self, log: MessageEventLog, stream: AsyncGenerator[str, None]) -> asyncio.Task:
+        """Esegue lo stream in un task indipendente dalla connessione; i frame arrivano nel log."""
+
+        async def drain():
+            try:
+                async for _ in stream:
+                    pass
+            except Exception as e:
+                logger.error(f"STREAM - Errore nel run {log.message_id}: {e}")
+                log.append(f"data: {{'error': 'Errore nello streaming: {str(e)}'}}\n\n")
+            finally:
+                log.close()
+
+        task = asyncio.ensure_future(drain())
+        log.producer = task
+        self._runs.add(task)
+        task.add_done_callback(self._runs.discard)
+        self._stats["runs"] += 1
+        log.schedule_expiry()  # nessun client ancora collegato
+        return task
+
+    async def resume(
+        self,
+        message_id: str,
+        user_id: str,
+        after_id: int,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> Optional[AsyncGenerator[str, None]]:
+        """
+        Stream di ripresa dopo after_id: dal log in memoria (con aggancio al run se ancora
+        in corso) o, se il messaggio non è in questo processo, dallo store.
+        None se il messaggio non esiste o appartiene a un altro utente.
+        """
+        log = self.get(message_id)
+        if log is not None and log.user_id == user_id:
+            self._stats["resumes"] += 1
+            self._stats["replayed_events"] += max(0, log.last_id - after_id)
+            if not log.done:
+                self._stats["live_attaches"] += 1
+            return log.follow(after_id, is_disconnected)
+
+        result = None
+        if log is None and self.store is not None:
+            try:
+                result = await self.store.load(message_id, user_id, after_id)
+            except Exception as e:
+                logger.warning(f"STREAM_EVENTS - Lettura dello store fallita per {message_id}: {e}")
+        if result is None:
+            self._stats["resume_misses"] += 1
+            return None
+
+        events, done = result
+        self._stats["resumes"] += 1
+        self._stats["store_resumes"] += 1
+        self._stats["replayed_events"] += len(events)
+
+        async def replay():
+            for _, frame in events:
+                yield frame
+            if not done:
+                # Run in corso su un'altra istanza o interrotto: i frame successivi non sono qui
+                yield resume_unavailable_frame(message_id)
+
+        return replay()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "enabled": settings.STREAM_RESUME_ENABLED,
+            "spill": self.store is not None,
+            "active_logs": len(self._active),
+            "finished_logs": len(self._finished),
+            "buffered_events": sum(len(log.events) for log in (*self._active.values(), *self._finished.values())),
+        }
+
+
+_registry: Optional[EventLogRegistry] = None
+
+
+def get_event_log_registry() -> EventLogRegistry:
+    """Registry di processo dei log degli eventi (creato al primo uso)."""
+    global _registry
+    if _registry is None:
+        _registry = EventLogRegistry(store=MongoEventStore() if settings.STREAM_EVENT_SPILL else None)
+    return _registry
+
+
+def get_event_log_stats() -> Dict[str, Any]:
+    return get_event_log_registry().stats()
@@ -0,0 +1,413 @@
+"""
+Checkpointer LangGraph persistente, condiviso tra istanze serverless.
+
+Lo stato "caldo" delle conversazioni (per thread_id) sopravvive ai cold start:
+un'istanza nuova trova l'ultimo checkpoint su MongoDB invece di ricostruire la
+cronologia con MemorySeeder, che resta solo come fallback (miss, thread scaduti
+o troppo grandi).
+
+Il backend si sceglie con CHECKPOINTER_BACKEND: "memory" (BoundedInMemorySaver,
+default), "mongo" o "sqlite" (file locale, per test e sviluppo).
+"""
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+from ..env import settings, DATABASE_NAME
+from .bounded_checkpointer import BoundedInMemorySaver
+from .checkpoint_store import (
+    CheckpointRecord,
+    CheckpointStore,
+    MongoCheckpointStore,
+    SQLiteCheckpointStore,
+    WriteRecord,
+)
+
+import logging
+logger = logging.getLogger("uvicorn")
+
+CHECKPOINTER_BACKENDS = ("memory", "mongo", "sqlite")
+
+
+class PersistentCheckpointSaver(BaseCheckpointSaver[str]):
+    """
+    BaseCheckpointSaver su un CheckpointStore.
+
+    - Compattazione: dopo ogni put restano solo gli ultimi `max_checkpoints_per_thread`
+      checkpoint del thread (ogni checkpoint contiene lo stato completo).
+    - TTL: i thread non aggiornati da `ttl_seconds` sono trattati come miss e rimossi.
+    - Size cap: un thread il cui ultimo checkpoint supera `max_thread_bytes` viene
+      rimosso alla lettura, così il seeding lo ricostruisce con la finestra HISTORY_LIMIT.
+    - Contatori di hit/miss sulle letture dell'ultimo checkpoint di un thread.
+    """
+
+    def __init__(
+        self,
+        store: CheckpointStore,
+        *,
+        max_checkpoints_per_thread: int = 1,
+        ttl_seconds: Optional[int] = None,
+        max_thread_bytes: Optional[int] = None,
+        purge_interval_s: float = 300,
+        serde: Optional[SerializerProtocol] = None,
+    ):
+        super().__init__(serde=serde)
+        self.store = store
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self.ttl_seconds = ttl_seconds
+        self.max_thread_bytes = max_thread_bytes
+        self.purge_interval_s = purge_interval_s
+        self._last_purge = time.monotonic()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.oversized = 0
+        self.puts = 0
+        self.compacted = 0
+
+    # Serializzazione
+    @staticmethod
+    def _thread_config(config: RunnableConfig):
+        configurable = config["configurable"]
+        return configurable["thread_id"], configurable.get("checkpoint_ns", ""), get_checkpoint_id(config)
+
+    def _build_record(
+        self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata
+    ) -> CheckpointRecord:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_type, checkpoint_bytes = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_bytes = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        return {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint["id"],
+            "parent_checkpoint_id": config["configurable"].get("checkpoint_id"),
+            "checkpoint_type": checkpoint_type,
+            "checkpoint": checkpoint_bytes,
+            "metadata_type": metadata_type,
+            "metadata": metadata_bytes,
+            "size": len(checkpoint_bytes),
+            "updated_at": datetime.now(timezone.utc),
+        }
+
+    def _build_writes(
+        self, config: RunnableConfig, writes: Sequence[tuple], task_id: str, task_path: str
+    ) -> List[WriteRecord]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        now = datetime.now(timezone.utc)
+        records = []
+        for idx, (channel, value) in enumerate(writes):
+            value_type, value_bytes = self.serde.dumps_typed(value)
+            records.append({
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+                "task_id": task_id,
+                "idx": WRITES_IDX_MAP.get(channel, idx),
+                "channel": channel,
+                "value_type": value_type,
+                "value": value_bytes,
+                "task_path": task_path,
+                "updated_at": now,
+            })
+        return records
+
+    def _to_tuple(self, record: CheckpointRecord, writes: List[WriteRecord]) -> CheckpointTuple:
+        thread_id = record["thread_id"]
+        checkpoint_ns = record["checkpoint_ns"]
+        parent_checkpoint_id = record.get("parent_checkpoint_id")
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": record["checkpoint_id"],
+                }
+            },
+            checkpoint=self.serde.loads_typed((record["checkpoint_type"], record["checkpoint"])),
+            metadata=self.serde.loads_typed((record["metadata_type"], record["metadata"])),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+            pending_writes=[
+                (w["task_id"], w["channel"], self.serde.loads_typed((w["value_type"], w["value"])))
+                for w in writes
+            ],
+        )
+
+    # Policy (TTL, size cap, contatori)
+    def _rejection_reason(self, record: CheckpointRecord) -> Optional[str]:
+        if self.ttl_seconds and record["updated_at"] < datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds):
+            return "expired"
+        if self.max_thread_bytes and (record.get("size") or 0) > self.max_thread_bytes:
+            return "oversized"
+        return None
+
+    def _record_lookup(self, record: Optional[CheckpointRecord], reason: Optional[str], latest: bool) -> None:
+        with self._lock:
+            if reason == "expired":
+                self.expired += 1
+            elif reason == "oversized":
+                self.oversized += 1
+            if latest:
+                if record is not None and reason is None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        if reason:
+            logger.info(f"CHECKPOINT - Thread {record['thread_id']} scartato ({reason}), fallback su seeding da DB")
+
+    def _purge_due(self) -> Optional[datetime]:
+        if not self.ttl_seconds:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_purge < self.purge_interval_s:
+                return None
+            self._last_purge = now
+        return datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+
+    def _record_put(self, compacted: int) -> None:
+        with self._lock:
+            self.puts += 1
+            self.compacted += compacted
+
+    # Sync API
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id, checkpoint_ns, checkpoint_id = self._thread_config(config)
+        record = self.store.get_checkpoint(thread_id, checkpoint_ns, checkpoint_id)
+        reason = self._rejection_reason(record) if record else None
+        self._record_lookup(record, reason, latest=not checkpoint_id)
+        if record is None:
+            return None
+        if reason:
+            self.store.delete_thread(thread_id)
+            return None
+        writes = self.store.get_writes(thread_id, checkpoint_ns, record["checkpoint_id"])
+        return self._to_tuple(record, writes)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"] if config else None
+        checkpoint_ns = config["configurable"].get("checkpoint_ns") if config else None
+        records = self.store.list_checkpoints(
+            thread_id, checkpoint_ns, get_checkpoint_id(before) if before else None, None if filter else limit
+        )
+        for record in self._filter_records(records, config, filter, limit):
+            writes = self.store.get_writes(record["thread_id"], record["checkpoint_ns"], record["checkpoint_id"])
+            yield self._to_tuple(record, writes)
+
+    def _filter_records(
+        self,
+        records: List[CheckpointRecord],
+        config: Optional[RunnableConfig],
+        filter: Optional[Dict[str, Any]],
+        limit: Optional[int],
+    ) -> List[CheckpointRecord]:
+        config_checkpoint_id = get_checkpoint_id(config) if config else None
+        selected = []
+        for record in records:
+            if config_checkpoint_id and record["checkpoint_id"] != config_checkpoint_id:
+                continue
+            if filter:
+                metadata = self.serde.loads_typed((record["metadata_type"], record["metadata"]))
+                if not all(metadata.get(k) == v for k, v in filter.items()):
+                    continue
+            selected.append(record)
+            if limit is not None and len(selected) >= limit:
+                break
+        return selected
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        record = self._build_record(config, checkpoint, metadata)
+        self.store.put_checkpoint(record)
+        compacted = 0
+        if self.max_checkpoints_per_thread:
+            compacted = self.store.compact(record["thread_id"], record["checkpoint_ns"], self.max_checkpoints_per_thread)
+        self._record_put(compacted)
+        if (cutoff := self._purge_due()) is not None:
+            self.store.purge_expired(cutoff)
+        return {
+            "configurable": {
+                "thread_id": record["thread_id"],
+                "checkpoint_ns": record["checkpoint_ns"],
+                "checkpoint_id": record["checkpoint_id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        self.store.put_writes(self._build_writes(config, writes, task_id, task_path))
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.store.delete_thread(thread_id)
+
+    # Async API
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id, checkpoint_ns, checkpoint_id = self._thread_config(config)
+        record = await self.store.aget_checkpoint(thread_id, checkpoint_ns, checkpoint_id)
+        reason = self._rejection_reason(record) if record else None
+        self._record_lookup(record, reason, latest=not checkpoint_id)
+        if record is None:
+            return None
+        if reason:
+            await self.store.adelete_thread(thread_id)
+            return None
+        writes = await self.store.aget_writes(thread_id, checkpoint_ns, record["checkpoint_id"])
+        return self._to_tuple(record, writes)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"] if config else None
+        checkpoint_ns = config["configurable"].get("checkpoint_ns") if config else None
+        records = await self.store.alist_checkpoints(
+            thread_id, checkpoint_ns, get_checkpoint_id(before) if before else None, None if filter else limit
+        )
+        for record in self._filter_records(records, config, filter, limit):
+            writes = await self.store.aget_writes(record["thread_id"], record["checkpoint_ns"], record["checkpoint_id"])
+            yield self._to_tuple(record, writes)
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        record = self._build_record(config, checkpoint, metadata)
+        await self.store.aput_checkpoint(record)
+        compacted = 0
+        if self.max_checkpoints_per_thread:
+            compacted = await self.store.acompact(
+                record["thread_id"], record["checkpoint_ns"], self.max_checkpoints_per_thread
+            )
+        self._record_put(compacted)
+        if (cutoff := self._purge_due()) is not None:
+            await self.store.apurge_expired(cutoff)
+        return {
+            "configurable": {
+                "thread_id": record["thread_id"],
+                "checkpoint_ns": record["checkpoint_ns"],
+                "checkpoint_id": record["checkpoint_id"],
+            }
+        }
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await self.store.aput_writes(self._build_writes(config, writes, task_id, task_path))
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self.store.adelete_thread(thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # Stesso formato di InMemorySaver: versioni stringa ordinabili
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    def stats(self) -> Dict[str, Any]:
+        """Contatori di hit/miss e compattazione, per il report di monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self.store).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+                "expired": self.expired,
+                "oversized": self.oversized,
+                "puts": self.puts,
+                "compacted": self.compacted,
+            }
+
+
+def create_checkpointer(backend: Optional[str] = None) -> BaseCheckpointSaver:
+    """
+    Crea il checkpointer configurato (CHECKPOINTER_BACKEND se `backend` è None).
+    """
+    backend = (backend or settings.CHECKPOINTER_BACKEND).lower()
+    if backend == "memory":
+        return BoundedInMemorySaver(
+            memory_budget_bytes=settings.CHECKPOINT_MEMORY_BUDGET_BYTES or None,
+            ttl_seconds=settings.CHECKPOINT_MEMORY_TTL_SECONDS or None,
+            max_thread_bytes=settings.CHECKPOINT_MAX_THREAD_BYTES or None,
+        )
+
+    options = {
+        "max_checkpoints_per_thread": settings.CHECKPOINT_MAX_PER_THREAD,
+        "ttl_seconds": settings.CHECKPOINT_TTL_SECONDS or None,
+        "max_thread_bytes": settings.CHECKPOINT_MAX_THREAD_BYTES or None,
+    }
+    if backend == "mongo":
+        store = MongoCheckpointStore(
+            DATABASE_NAME, settings.CHECKPOINT_COLLECTION, ttl_seconds=options["ttl_seconds"]
+        )
+    elif backend == "sqlite":
+        store = SQLiteCheckpointStore(settings.CHECKPOINT_SQLITE_PATH)
+    else:
+        raise ValueError(f"Unknown checkpointer backend: {backend}. Use one of {CHECKPOINTER_BACKENDS}")
+
+    logger.info(f"CHECKPOINT - Checkpointer persistente attivo (backend={backend})")
+    return PersistentCheckpointSaver(store, **options)
@@ -0,0 +1,118 @@
+"""
+Pre-router deterministico per i comandi quiz espliciti.
+
+Richieste come "domanda 5 del capitolo 2" o "fammi una domanda" producono sempre e solo
+una chiamata a domanda_teoria (return_direct: il modello non aggiunge testo dopo il tool).
+Farle passare da Gemini costa un'inferenza completa con l'intera knowledge base in
+contesto. Il router riconosce i comandi non ambigui e li instrada direttamente sul tool;
+il resto del flusso (evento tool_result, record su MongoDB, stato del thread) resta
+identico a quello del percorso LLM.
+
+Le regole privilegiano la precisione: il messaggio deve essere per intero un comando
+(formule di cortesia ammesse), altrimenti decide l'LLM. La ricerca per argomento
+("una domanda sulla VNE") non è instradata, perché si confonde con le domande di teoria.
+Precisione e copertura sono misurate sul set etichettato di tests/test_quiz_router.py.
+"""
+import re
+import unicodedata
+import threading
+from collections import Counter
+from typing import Any, Dict, NamedTuple, Optional
+
+NUMBER_WORDS = {
+    "uno": 1, "una": 1, "due": 2, "tre": 3, "quattro": 4, "cinque": 5, "sei": 6, "sette": 7,
+    "otto": 8, "nove": 9, "dieci": 10, "undici": 11, "dodici": 12, "tredici": 13,
+    "quattordici": 14, "quindici": 15, "sedici": 16, "diciassette": 17, "diciotto": 18,
+    "diciannove": 19, "venti": 20,
+}
+
+_NUM = r"(\d{1,3}|" + "|".join(sorted(NUMBER_WORDS, key=len, reverse=True)) + r")"
+_PREFIX = (
+    r"^(?:(?:ok|okay|va bene|bene|perfetto|allora|ora|adesso|ciao|si|dai)\s+)*"
+    r"(?:(?:per favore|perfavore|puoi|potresti|mi)\s+)*"
+    r"(?:(?:fammi|dammi|mostrami|farmi|darmi|mostrarmi|fai|dai|mostra|fare|dare|mostrare|voglio|vorrei|passa|passiamo a|vai con|vai alla|vai a)\s+)?"
+)
+_SUFFIX = r"(?:\s+(?:per favore|perfavore|grazie|please))*$"
+_QUESTION = r"(?:domanda|quesito)"
+_CHAPTER = r"(?:capitolo|cap)"
+_NUMBER_MARK = r"(?:(?:numero|num|nr|n)\s+)?"
+_RANDOM = r"(?:casuale|a caso|random)"
+# Niente "la" da solo: "la domanda?" di solito si riferisce alla domanda già mostrata
+_ARTICLE = r"(?:(?:una|un altra|l altra|altra|la prossima|prossima|nuova|una nuova|la nuova)\s+)?"
+
+_SPECIFIC = re.compile(
+    _PREFIX + rf"(?:la\s+)?{_QUESTION}\s+{_NUMBER_MARK}{_NUM}\s+(?:(?:del|dal|di|nel)\s+)?{_CHAPTER}\s+{_NUM}" + _SUFFIX
+)
+_SPECIFIC_CHAPTER_FIRST = re.compile(
+    _PREFIX + rf"(?:(?:del|dal|nel)\s+)?{_CHAPTER}\s+{_NUM}\s+(?:la\s+)?{_QUESTION}\s+{_NUMBER_MARK}{_NUM}" + _SUFFIX
+)
+_BY_CHAPTER = re.compile(
+    _PREFIX + rf"{_ARTICLE}{_QUESTION}(?:\s+{_RANDOM})?\s+(?:del|dal|sul|di|nel)\s+{_CHAPTER}\s+{_NUM}(?:\s+{_RANDOM})?" + _SUFFIX
+)
+_RANDOM_QUESTION = re.compile(
+    _PREFIX + rf"{_ARTICLE}{_QUESTION}(?:\s+(?:{_RANDOM}|di teoria|d esame|di esame|del quiz|dell esame))?" + _SUFFIX
+)
+_START_QUIZ = re.compile(
+    _PREFIX + r"(?:simuliamo|simula|facciamo|fai|iniziamo|inizia|avvia|cominciamo|continuiamo|continua)\s+"
+    r"(?:(?:il|un|una|la|lo|l)\s+)?(?:quiz|esame|simulazione)(?:\s+(?:d esame|di esame|dell esame|di teoria))?" + _SUFFIX
+)
+
+
+class QuizCommand(NamedTuple):
+    """Comando riconosciuto: modalità di domanda_teoria e relativi argomenti."""
+    mode: str  # "specifica" | "capitolo" | "casuale"
+    args: Dict[str, int]
+
+
+def normalize_command(text: str) -> str:
+    """Minuscolo, senza accenti né punteggiatura, spazi compattati."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def _number(token: str) -> int:
+    return int(token) if token.isdigit() else NUMBER_WORDS[token]
+
+
+def route_quiz_command(query: str) -> Optional[QuizCommand]:
+    """Ritorna il comando quiz se `query` è un comando esplicito e non ambiguo, altrimenti None."""
+    command = _match(query)
+    with _lock:
+        _routed[command.mode if command else "llm"] += 1
+    return command
+
+
+def _match(query: str) -> Optional[QuizCommand]:
+    if not query or len(query) > 120:
+        return None
+    text = normalize_command(query)
+
+    match = _SPECIFIC.match(text)
+    if match:
+        return QuizCommand("specifica", {"capitolo": _number(match.group(2)), "domanda": _number(match.group(1))})
+    match = _SPECIFIC_CHAPTER_FIRST.match(text)
+    if match:
+        return QuizCommand("specifica", {"capitolo": _number(match.group(1)), "domanda": _number(match.group(2))})
+    match = _BY_CHAPTER.match(text)
+    if match:
+        return QuizCommand("capitolo", {"capitolo": _number(match.group(1))})
+    if _RANDOM_QUESTION.match(text) or _START_QUIZ.match(text):
+        return QuizCommand("casuale", {})
+    return None
+
+
+_lock = threading.Lock()
+_routed: Counter = Counter()
+
+
+def get_quiz_router_stats() -> Dict[str, Any]:
+    """Messaggi instradati senza LLM per modalità, e quelli lasciati all'agente."""
+    with _lock:
+        fast = sum(n for mode, n in _routed.items() if mode != "llm")
+        total = fast + _routed["llm"]
+        return {
+            "routed": dict(_routed),
+            "fast_path_rate": round(fast / total, 3) if total else 0,
+        }
@@ -1,5 +1,7 @@
-from typing import Optional
-from langgraph.checkpoint.memory import InMemorySaver
+from typing import Any, Dict, Optional
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from .persistent_checkpointer import create_checkpointer
 
 import logging
 logger = logging.getLogger("uvicorn")
@@ -12,24 +14,45 @@ class AgentStateManager:
     """
     
     _instance: Optional['AgentStateManager'] = None
-    _checkpointer: Optional[InMemorySaver] = None
+    _checkpointer: Optional[BaseCheckpointSaver] = None
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(AgentStateManager, cls).__new__(cls)
         return cls._instance
     
-    def get_checkpointer(self) -> InMemorySaver:
+    def get_checkpointer(self) -> BaseCheckpointSaver:
         """
         Ritorna un checkpointer condiviso a livello di processo (thread-safe best-effort).
-        InMemorySaver non dipende dall'event loop, quindi è sicuro riutilizzarlo tra richieste
-        per mantenere la memoria volatile dei thread (per `thread_id`).
+        Il backend dipende da CHECKPOINTER_BACKEND: InMemorySaver (memoria volatile per
+        `thread_id`) oppure un saver persistente su MongoDB/SQLite che sopravvive ai cold start.
+        Nessuno dei due dipende dall'event loop, quindi è sicuro riutilizzarlo tra richieste.
         """
         if self._checkpointer is None:
-            self._checkpointer = InMemorySaver()
+            self._checkpointer = create_checkpointer()
             logger.debug("AgentStateManager: nuovo checkpointer creato")
         return self._checkpointer
     
+    def get_stats(self) -> Dict[str, Any]:
+        """Statistiche del checkpointer (hit/miss per i backend persistenti)."""
+        checkpointer = self._checkpointer
+        if checkpointer is None:
+            return {"initialized": False}
+        if hasattr(checkpointer, "stats"):
+            return {"initialized": True, **checkpointer.stats()}
+        return {"initialized": True, "backend": type(checkpointer).__name__}
+
+    def purge_superseded(self, prompt_version: int) -> int:
+        """
+        Rimuove lo stato dei thread di versioni di prompt precedenti (backend memory).
+        I backend persistenti sono condivisi tra istanze con contatori di versione
+        indipendenti, quindi lì ci si affida a TTL e compattazione.
+        """
+        checkpointer = self._checkpointer
+        if checkpointer is None or not hasattr(checkpointer, "purge_superseded"):
+            return 0
+        return checkpointer.purge_superseded(prompt_version)
+
     def clear_checkpointer(self):
         """Resetta il checkpointer (utile per test)."""
         self._checkpointer = None
@@ -37,6 +60,16 @@ class AgentStateManager:
 
 
 # Instance globale per compatibilità con codice esistente
-def _get_checkpointer() -> InMemorySaver:
+def _get_checkpointer() -> BaseCheckpointSaver:
     """Funzione di compatibilità per il codice esistente."""
-    return AgentStateManager().get_checkpointer()
\ No newline at end of file
+    return AgentStateManager().get_checkpointer()
+
+
+def purge_superseded_threads(prompt_version: int) -> int:
+    """Hook di update_docs: libera i thread delle versioni di prompt superate."""
+    return AgentStateManager().purge_superseded(prompt_version)
+
+
+def get_checkpointer_stats() -> Dict[str, Any]:
+    """Statistiche del checkpointer di processo, per il report di monitoring."""
+    return AgentStateManager().get_stats()
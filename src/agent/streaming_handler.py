@@ -1,18 +1,54 @@
+import asyncio
 import json
-from typing import AsyncGenerator, List, Dict, Any
-from langchain_core.messages import HumanMessage, AIMessageChunk
+import time
+import uuid
 
+import orjson
+from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterator, Awaitable, Callable, List, Dict, Any, Optional, Set
+from langchain_core.messages import AIMessage, HumanMessage, AIMessageChunk, ToolMessage
+
+from ..env import settings
 from ..tools import _serialize_tool_output
+from ..monitoring.disconnect_monitor import record_completed_call, record_interrupted_request
+from ..monitoring.token_logger import sum_usage, usage_counts
+from ..monitoring.tracing import RequestTrace
+
+if TYPE_CHECKING:
+    from .event_log import MessageEventLog
+
 import logging
 logger = logging.getLogger("uvicorn")
 
+# Task di chiusura dei run interrotti (riferimento forte fino al termine)
+_cleanup_tasks: Set[asyncio.Task] = set()
+
+# Commento SSE (ignorato dai client) per tenere viva la connessione durante il thinking
+HEARTBEAT_FRAME = ": keep-alive\n\n"
+_TICK = {"event": "tick"}  # scadenza di heartbeat/coalescing senza nuovi eventi
+_END = object()
+
+
+def encode_sse(payload: Dict[str, Any]) -> str:
+    """Frame SSE `data:` con il payload JSON (orjson; json per i tipi che orjson non gestisce)."""
+    try:
+        data = orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError:
+        data = json.dumps(payload, default=str)
+    return f"data: {data}\n\n"
+
 
 class StreamingHandler:
     """
     Gestisce gli eventi di streaming dell'agente LangGraph e l'elaborazione dei tool.
     """
     
-    def __init__(self, message_id: str):
+    def __init__(
+        self,
+        message_id: str,
+        trace: Optional[RequestTrace] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        event_log: Optional["MessageEventLog"] = None,
+    ):
         if not message_id:
             raise ValueError("message_id is required for StreamingHandler")
         self.response_chunks: List[str] = []
@@ -20,9 +56,29 @@ class StreamingHandler:
         self.tool_executed = False
         self.serialized_output = None
         self.message_id = message_id  # REQUIRED: Store for chunk injection
-        self.usage_metadata: Dict[str, Any] = {}  # Token usage from LLM response
+        self.usage_metadata: Dict[str, Any] = {}  # Token usage sommato su tutte le chiamate LLM
+        self.llm_calls: List[Dict[str, Any]] = []  # Una entry per chiamata LLM del run ReAct
+        self._usages: List[Dict[str, Any]] = []  # usage_metadata grezzo delle chiamate in llm_calls
+        self.trace = trace  # Span tool e marks primo/ultimo token (opzionale)
+        self._tool_starts: Dict[str, int] = {}
+        self._model_calls: Dict[str, Dict[str, Any]] = {}  # Chiamate LLM in corso per run_id
+        self.is_disconnected = is_disconnected  # es. Request.is_disconnected di Starlette
+        self.interrupted = False  # Client disconnesso prima della fine della risposta
+        self._interrupt_recorded = False
+        # Heartbeat e coalescing dei chunk di testo (0 = disattivati)
+        self.heartbeat_seconds = settings.SSE_HEARTBEAT_SECONDS
+        self.coalesce_seconds = settings.SSE_COALESCE_MAX_MS / 1000
+        self.coalesce_bytes = settings.SSE_COALESCE_MAX_BYTES
+        self._pending_text: List[str] = []
+        self._pending_bytes = 0
+        self._flush_at: Optional[float] = None
+        self._last_frame_at = 0.0
+        self._text_frames = 0
+        self.frames_sent = 0
+        self.heartbeats_sent = 0
+        self.event_log = event_log  # id sequenziali sui frame e ripresa con Last-Event-ID (opzionale)
     
-    async def handle_stream_events(
+    def handle_stream_events(
         self, 
         agent_executor, 
         query: str, 
@@ -37,18 +93,40 @@ class StreamingHandler:
             config: Configurazione dell'agente (thread_id, etc.)
             
         Yields:
-            Stringhe JSON formattate per il client
+            Stringhe JSON formattate per il client (con id se c'è un event_log)
         """
+        return self._logged(self._stream_events(agent_executor, query, config))
+
+    async def _logged(self, frames: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+        """Frame passati dall'event_log, che assegna gli id e li conserva per la ripresa."""
+        try:
+            async for frame in frames:
+                yield self.event_log.append(frame) if self.event_log is not None else frame
+        finally:
+            await frames.aclose()
+
+    async def _stream_events(self, agent_executor, query: str, config: Dict[str, Any]) -> AsyncGenerator[str, None]:
         self._reset_state()
+        self._last_frame_at = asyncio.get_running_loop().time()
         
+        watcher = self._watch(agent_executor.astream_events(
+            {"messages": [HumanMessage(query)]},
+            config=config,
+            version="v2",
+        ))
         try:
-            async for event in agent_executor.astream_events(
-                {"messages": [HumanMessage(query)]},
-                config=config,
-                version="v2",
-            ):
+            async for event in watcher:
                 kind = event.get("event")
-                
+
+                if kind == "tick":
+                    for frame in self._due_frames():
+                        yield frame
+                    continue
+
+                # Il testo in attesa esce a fine chiamata LLM e prima di un tool_result
+                if kind in ("on_chat_model_end", "on_tool_end") and self._pending_text:
+                    yield self._flush_text()
+
                 if kind == "on_tool_start":
                     async for chunk in self._handle_tool_start(event):
                         yield chunk
@@ -57,6 +135,9 @@ class StreamingHandler:
                     async for chunk in self._handle_tool_end(event):
                         yield chunk
                     
+                elif kind == "on_chat_model_start":
+                    self._handle_model_start(event)
+
                 elif kind == "on_chat_model_stream":
                     async for chunk in self._handle_model_stream(event):
                         yield chunk
@@ -64,6 +145,9 @@ class StreamingHandler:
                 elif kind == "on_chat_model_end":
                     self._handle_model_end(event)
 
+            if self._pending_text:
+                yield self._flush_text()
+
         except Exception as e:
             import traceback
             # Esponi l'errore originale quando mascherato (es. Gemini 500 → TypeError chain)
@@ -75,8 +159,175 @@ class StreamingHandler:
             from ..monitoring.rate_limit_monitor import is_rate_limited
             if is_rate_limited(e):
                 self._rate_limit_error = str(e)
+            if self._pending_text:
+                yield self._flush_text()
             yield f"data: {{'error': 'Errore nello streaming: {str(e)}'}}\n\n"
+        finally:
+            # Chiusura immediata del run anche quando lo stream viene chiuso dall'esterno
+            await watcher.aclose()
     
+    async def _watch(self, events: AsyncIterator[Dict]) -> AsyncGenerator[Dict, None]:
+        """
+        Inoltra gli eventi dell'agente letti da un task separato, così il silenzio (thinking,
+        tool lenti) non blocca il resto:
+        - quando scade un heartbeat o un coalescing senza nuovi eventi produce _TICK;
+        - ogni DISCONNECT_POLL_SECONDS controlla il client: alla disconnessione il run
+          LangGraph viene cancellato (la generazione Gemini in corso si interrompe) e
+          l'iterazione termina con self.interrupted = True.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def produce():
+            try:
+                async for event in events:
+                    queue.put_nowait(event)
+                queue.put_nowait(_END)
+            except Exception as e:
+                queue.put_nowait(e)  # rilanciata dal consumer (frame di errore)
+
+        producer = asyncio.ensure_future(produce())
+        poll = settings.DISCONNECT_POLL_SECONDS if self.is_disconnected is not None else None
+        next_check = loop.time() + poll if poll else None
+        try:
+            while True:
+                if queue.empty():
+                    deadlines = [d for d in (next_check, self._next_deadline()) if d is not None]
+                    timeout = max(0.0, min(deadlines) - loop.time()) if deadlines else None
+                    getter = asyncio.ensure_future(queue.get())
+                    done, _ = await asyncio.wait({getter}, timeout=timeout)
+                    item = getter.result() if done else None
+                    if not done:
+                        getter.cancel()
+                else:
+                    item = queue.get_nowait()
+
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                # Con eventi frequenti il timeout non scade mai: il controllo va fatto anche qui
+                if next_check is not None and loop.time() >= next_check:
+                    next_check = loop.time() + poll
+                    if await self._disconnected():
+                        producer.cancel()  # CancelledError dentro astream_events: il run si ferma
+                        await asyncio.wait({producer})
+                        return
+                if item is None:
+                    yield _TICK
+                    continue
+                deadline = self._next_deadline()
+                if deadline is not None and loop.time() >= deadline:
+                    yield _TICK  # scadenza passata mentre arrivavano eventi senza testo
+                yield item
+        except (GeneratorExit, asyncio.CancelledError):
+            # Uscita dall'esterno (es. Starlette cancella lo stream): il run non resta orfano
+            producer.cancel()
+            raise
+
+    async def _disconnected(self) -> bool:
+        try:
+            disconnected = await self.is_disconnected()
+        except Exception as e:
+            logger.warning(f"STREAM - Controllo disconnessione fallito: {e}")
+            return False
+        if disconnected:
+            logger.info(f"STREAM - Client disconnesso, run {self.message_id} cancellato")
+            self.interrupted = True
+        return disconnected
+
+    def mark_interrupted(self, agent_executor=None, config: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Registra l'interruzione della richiesta: le chiamate LLM in corso vengono chiuse
+        come cancellate e contate nelle metriche. Con agent_executor e config, il thread
+        viene riportato in uno stato valido in background (vedi _close_interrupted_run).
+        """
+        self.interrupted = True
+        if self._interrupt_recorded:
+            return
+        self._interrupt_recorded = True
+
+        in_flight = list(self._model_calls.values())
+        first_cancelled = len(self.llm_calls)
+        self._flush_model_calls(cancelled=True)
+        record_interrupted_request(self.llm_calls[first_cancelled:], in_flight=len(in_flight))
+
+        if agent_executor is not None and config is not None:
+            task = asyncio.ensure_future(self._close_interrupted_run(agent_executor, config))
+            _cleanup_tasks.add(task)
+            task.add_done_callback(_cleanup_tasks.discard)
+
+    async def _close_interrupted_run(self, agent_executor, config: Dict[str, Any]) -> None:
+        """
+        Un run cancellato durante un tool lascia nel thread una chiamata senza risultato,
+        che Gemini rifiuterebbe al turno successivo: si aggiungono i ToolMessage mancanti
+        e la risposta parziale, così la conversazione resta coerente.
+        """
+        try:
+            state = await agent_executor.aget_state(config)
+            messages = state.values.get("messages", []) if state else []
+            answered = {m.tool_call_id for m in messages if isinstance(m, ToolMessage)}
+            last_ai = next((m for m in reversed(messages) if isinstance(m, AIMessage)), None)
+            missing = [c for c in (last_ai.tool_calls if last_ai else []) if c["id"] not in answered]
+            if missing:
+                await agent_executor.aupdate_state(
+                    config,
+                    {"messages": [
+                        ToolMessage(content="Interrotto: il client si è disconnesso", tool_call_id=c["id"], name=c["name"])
+                        for c in missing
+                    ]},
+                    as_node="tools",
+                )
+            partial = self.get_final_response()
+            if partial and (missing or not messages or not isinstance(messages[-1], AIMessage)):
+                await agent_executor.aupdate_state(config, {"messages": [AIMessage(content=partial)]}, as_node="agent")
+        except Exception as e:
+            logger.error(f"STREAM - Errore nel chiudere il run interrotto {self.message_id}: {e}")
+
+    def handle_direct_tool_call(
+        self,
+        agent_executor,
+        query: str,
+        config: Dict[str, Any],
+        tool,
+        args: Dict[str, Any],
+    ) -> AsyncGenerator[str, None]:
+        """
+        Percorso senza LLM per i comandi riconosciuti dal pre-router quiz: esegue il tool
+        ed emette lo stesso evento tool_result del percorso agente. Nel thread vengono
+        registrati gli stessi messaggi che avrebbe prodotto l'agente (richiesta, chiamata
+        al tool, risultato), così il turno successivo può valutare la risposta dell'utente.
+        """
+        return self._logged(self._direct_tool_call(agent_executor, query, config, tool, args))
+
+    async def _direct_tool_call(
+        self, agent_executor, query: str, config: Dict[str, Any], tool, args: Dict[str, Any]
+    ) -> AsyncGenerator[str, None]:
+        self._reset_state()
+        tool_call = {"name": tool.name, "args": args, "id": str(uuid.uuid4()), "type": "tool_call"}
+        logger.info(f"TOOL - {tool.name} started with input: {args} (pre-router, senza LLM)")
+        start_ns = self.trace.now_ns() if self.trace else 0
+        try:
+            tool_message = await tool.ainvoke(tool_call, config=config)
+            if self.trace:
+                self.trace.add_span("tool", start_ns, tool=tool.name)
+        except Exception as e:
+            logger.error(f"Errore nell'esecuzione diretta di {tool.name}: {e}")
+            yield f"data: {{'error': 'Errore nello streaming: {str(e)}'}}\n\n"
+            return
+
+        try:
+            await agent_executor.aupdate_state(
+                config,
+                {"messages": [HumanMessage(query), AIMessage(content="", tool_calls=[tool_call]), tool_message]},
+                as_node="tools",
+            )
+        except Exception as e:
+            logger.error(f"Errore nell'aggiornare lo stato dell'agente dopo {tool.name}: {e}")
+
+        async for chunk in self._handle_tool_end({"name": tool.name, "data": {"output": tool_message}}):
+            yield chunk
+
     def _reset_state(self):
         """Reset dello stato interno per nuovo streaming."""
         self.response_chunks = []
@@ -84,12 +335,24 @@ class StreamingHandler:
         self.tool_executed = False
         self.serialized_output = None
         self.usage_metadata = {}
+        self.llm_calls = []
+        self._usages = []
+        self.interrupted = False
+        self._interrupt_recorded = False
+        self._pending_text = []
+        self._pending_bytes = 0
+        self._flush_at = None
+        self._text_frames = 0
+        self._tool_starts = {}
+        self._model_calls = {}
     
     async def _handle_tool_start(self, event: Dict) -> AsyncGenerator[str, None]:
         """Gestisce l'evento di inizio esecuzione tool (logging only)."""
         tool_name = event.get("name")
         tool_input = event.get("data", {}).get("input", {})
         logger.info(f"TOOL - {tool_name} started with input: {tool_input}")
+        if self.trace:
+            self._tool_starts[event.get("run_id", "")] = self.trace.now_ns()
         # Empty generator - no output yielded for tool start events
         if False:
             yield
@@ -100,6 +363,9 @@ class StreamingHandler:
         tool_name = event.get("name")
         tool_data = event.get("data", {})
         tool_output = tool_data.get("output")
+        start_ns = self._tool_starts.pop(event.get("run_id", ""), None)
+        if self.trace and start_ns is not None:
+            self.trace.add_span("tool", start_ns, tool=tool_name)
 
         if tool_output:
             # Serializza correttamente l'output del tool
@@ -118,32 +384,125 @@ class StreamingHandler:
                 "final": True,
                 "message_id": self.message_id  # REQUIRED field
             }
-            yield f"data: {json.dumps(structured_response)}\n\n"
+            self._mark_output()
+            yield encode_sse(structured_response)
             logger.info(f"TOOL - {tool_name} output processed")
     
     async def _handle_model_stream(self, event: Dict) -> AsyncGenerator[str, None]:
         """Gestisce l'evento di streaming del modello."""
         chunk = event["data"].get("chunk")
         if isinstance(chunk, AIMessageChunk):
-            # Capture usage_metadata from the chunk (typically on the last chunk)
+            # I chunk portano l'usage incrementale della chiamata: fallback se manca on_chat_model_end
             if hasattr(chunk, "usage_metadata") and chunk.usage_metadata:
-                self.usage_metadata = chunk.usage_metadata
+                call = self._model_call(event)
+                call["usage"] = sum_usage([call["usage"], chunk.usage_metadata]) if call["usage"] else dict(chunk.usage_metadata)
             content_text = chunk.text
             if content_text:
                 self.response_chunks.append(content_text)
-                ai_response = {
-                    "type": "agent_message",
-                    "data": content_text,
-                    "message_id": self.message_id  # REQUIRED field
-                }
-                yield f"data: {json.dumps(ai_response)}\n\n"
+                self._pending_text.append(content_text)
+                self._pending_bytes += len(content_text.encode())
+                # Il primo frame parte subito (time-to-first-token), i successivi vengono
+                # accorpati fino a coalesce_bytes o coalesce_seconds: con token lenti la
+                # scadenza passa prima del chunk successivo e ogni chunk ha il suo frame
+                if not self._text_frames or self._pending_bytes >= self.coalesce_bytes:
+                    yield self._flush_text()
+                elif self._flush_at is None:
+                    self._flush_at = asyncio.get_running_loop().time() + self.coalesce_seconds
+
+    def _flush_text(self) -> str:
+        """Frame agent_message con il testo accumulato."""
+        ai_response = {
+            "type": "agent_message",
+            "data": "".join(self._pending_text),
+            "message_id": self.message_id  # REQUIRED field
+        }
+        self._pending_text = []
+        self._pending_bytes = 0
+        self._flush_at = None
+        self._text_frames += 1
+        self._mark_output()
+        return encode_sse(ai_response)
+
+    def _next_deadline(self) -> Optional[float]:
+        """Prossimo istante (loop.time) in cui serve un frame anche senza nuovi eventi."""
+        deadlines = []
+        if self._flush_at is not None:
+            deadlines.append(self._flush_at)
+        if self.heartbeat_seconds > 0:
+            deadlines.append(self._last_frame_at + self.heartbeat_seconds)
+        return min(deadlines) if deadlines else None
+
+    def _due_frames(self) -> List[str]:
+        """Frame scaduti a un _TICK: testo accumulato e/o heartbeat."""
+        now = asyncio.get_running_loop().time()
+        frames = []
+        if self._flush_at is not None and now >= self._flush_at:
+            frames.append(self._flush_text())
+        if self.heartbeat_seconds > 0 and now >= self._last_frame_at + self.heartbeat_seconds:
+            self.heartbeats_sent += 1
+            self._last_frame_at = now
+            frames.append(HEARTBEAT_FRAME)
+        return frames
+
+    def _mark_output(self) -> None:
+        """Primo e ultimo evento inviato al client (time-to-first-token e fine dello stream)."""
+        self.frames_sent += 1
+        try:
+            self._last_frame_at = asyncio.get_running_loop().time()
+        except RuntimeError:
+            pass
+        if self.trace:
+            self.trace.mark("first_token", first_only=True)
+            self.trace.mark("last_token")
+
+    def _handle_model_start(self, event: Dict) -> None:
+        self._model_call(event)
+
+    def _model_call(self, event: Dict) -> Dict[str, Any]:
+        """Chiamata LLM in corso per il run_id dell'evento (creata al primo evento)."""
+        run_id = event.get("run_id", "")
+        call = self._model_calls.get(run_id)
+        if call is None:
+            call = {
+                "node": (event.get("metadata") or {}).get("langgraph_node"),
+                "start": time.perf_counter(),
+                "usage": None,
+            }
+            self._model_calls[run_id] = call
+        return call
 
     def _handle_model_end(self, event: Dict) -> None:
-        """Capture usage_metadata from the complete model response."""
+        """Chiude la chiamata LLM: l'usage della risposta completa è quello definitivo."""
+        call = self._model_calls.pop(event.get("run_id", ""), None)
         output = event.get("data", {}).get("output")
-        if output and hasattr(output, "usage_metadata") and output.usage_metadata:
-            self.usage_metadata = output.usage_metadata
-            logger.debug(f"STREAM - Captured usage_metadata: {self.usage_metadata}")
+        usage = output.usage_metadata if output is not None and getattr(output, "usage_metadata", None) else None
+        if usage is None and call is not None:
+            usage = call["usage"]
+        self._record_call(call, usage)
+
+    def _record_call(self, call: Optional[Dict[str, Any]], usage: Optional[Dict[str, Any]], cancelled: bool = False) -> None:
+        if not usage:
+            return
+        record = {
+            "call_index": len(self.llm_calls),
+            "node": call["node"] if call else None,
+            **usage_counts(usage),
+            "latency_ms": round((time.perf_counter() - call["start"]) * 1000, 1) if call else None,
+        }
+        if cancelled:
+            record["cancelled"] = True
+        else:
+            record_completed_call(record["output_tokens"])  # output_tokens include il thinking
+        self.llm_calls.append(record)
+        self._usages.append(dict(usage))
+        self.usage_metadata = sum_usage(self._usages)
+        logger.debug(f"STREAM - LLM call {record['call_index']} usage: {record}")
+
+    def _flush_model_calls(self, cancelled: bool = False) -> None:
+        """Registra le chiamate interrotte prima di on_chat_model_end (errore o disconnessione)."""
+        for call in list(self._model_calls.values()):
+            self._record_call(call, call["usage"], cancelled=cancelled)
+        self._model_calls = {}
 
     def get_final_response(self) -> str:
         """Restituisce la risposta finale concatenata."""
@@ -162,5 +521,12 @@ class StreamingHandler:
         return self.serialized_output
 
     def get_usage_metadata(self) -> Dict[str, Any]:
-        """Returns captured token usage metadata from the LLM response."""
-        return self.usage_metadata
\ No newline at end of file
+        """Token usage sommato su tutte le chiamate LLM della richiesta."""
+        self._flush_model_calls()
+        return self.usage_metadata
+
+    def get_llm_calls(self) -> List[Dict[str, Any]]:
+        """Usage per chiamata LLM (call_index, nodo, token, latenza), in ordine di chiusura."""
+        self._flush_model_calls()
+        return self.llm_calls
+
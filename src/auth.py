@@ -5,6 +5,8 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import SecurityScopes, HTTPAuthorizationCredentials, HTTPBearer 
 
 from .env import get_settings
+from .jwks import JWKSCache, VerifiedTokenCache
+from .monitoring.tracing import start_trace, trace_span
 
 class UnauthorizedException(HTTPException):
     def __init__(self, detail: str, **kwargs):
@@ -25,9 +27,11 @@ class VerifyToken:
         self.config = get_settings()
 
         # This gets the JWKS from a given URL and does processing so you can
-        # use any of the keys available
+        # use any of the keys available (cached by kid, refreshed in background)
         jwks_url = f'https://{self.config.auth0_domain}/.well-known/jwks.json'
-        self.jwks_client = jwt.PyJWKClient(jwks_url)
+        self.jwks = JWKSCache(jwks_url)
+        # Verified payloads by token hash, until exp: repeated requests skip RS256
+        self.verified_tokens = VerifiedTokenCache()
 
         # 👇 new code
     async def verify(self,
@@ -37,19 +41,33 @@ class VerifyToken:
         if token is None:
             raise UnauthenticatedException
 
+        # The request trace starts here: auth is the first phase of every request
+        start_trace()
+        with trace_span("auth") as span:
+            payload = self.verified_tokens.get(token.credentials)
+            span["cached"] = payload is not None
+            if payload is None:
+                payload = await self._verify(token.credentials)
+                self.verified_tokens.set(token.credentials, payload)
+    
+        # Restituisci sia il payload che il token originale
+        return {**payload, 'token': token.credentials}
+
+    async def _verify(self, credentials: str) -> dict:
+        """Full verification: signing key by kid, then signature and claims."""
         # This gets the 'kid' from the passed token
         try:
-            signing_key = self.jwks_client.get_signing_key_from_jwt(
-                token.credentials
-            ).key
+            kid = jwt.get_unverified_header(credentials).get("kid")
+            with trace_span("jwks"):
+                signing_key = (await self.jwks.get_signing_key(kid)).key
         except jwt.exceptions.PyJWKClientError as error:
             raise UnauthorizedException(str(error))
         except jwt.exceptions.DecodeError as error:
             raise UnauthorizedException(str(error))
 
         try:
-            payload = jwt.decode(
-                token.credentials,
+            return jwt.decode(
+                credentials,
                 signing_key,
                 algorithms=self.config.auth0_algorithms,
                 audience=self.config.auth0_api_audience,
@@ -57,6 +75,3 @@ class VerifyToken:
             )
         except Exception as error:
             raise UnauthorizedException(str(error))
-    
-        # Restituisci sia il payload che il token originale
-        return {**payload, 'token': token.credentials}
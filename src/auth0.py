@@ -1,76 +1,284 @@
-import requests
-from .env import AUTH0_DOMAIN, AUTH0_SECRET
+"""
+Client Auth0 (token client_credentials e Management API per i metadata utente).
+
+Le richieste passano da client httpx condivisi, con connessioni keep-alive e timeout:
+- le varianti async (aget_auth0_token, aget_user_metadata) sono quelle del percorso di
+  richiesta e non bloccano l'event loop; fetch concorrenti dello stesso utente e rinnovi
+  concorrenti del token sono accorpati in un'unica chiamata (single-flight);
+- le varianti sync restano per script e test.
+
+Il token è in cache per il suo expires_in (meno un margine), non per un TTL fisso; un 401
+della Management API invalida il token e la richiesta viene ripetuta una volta.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from .env import AUTH0_DOMAIN, AUTH0_SECRET, settings
 import logging
 logger = logging.getLogger("uvicorn")
-from .cache import set_cached_auth0_token, get_cached_auth0_token
-from typing import Optional
+from .cache import clear_cached_auth0_token, set_cached_auth0_token, get_cached_auth0_token
 
-def get_auth0_token() -> Optional[str]:
-    """
-    Ottiene un token di accesso da Auth0 utilizzando le credenziali client.
-    
-    :return: Token di accesso come stringa oppure None in caso di errore.
-    """
-    # Verifica se il token è già presente nella cache
-    token = get_cached_auth0_token()
-    if token:
-        logger.info("Auth0: Token trovato in cache.")
-        return token
-
-    url = f"https://{AUTH0_DOMAIN}/oauth/token"
-    headers = {
-        'content-type': 'application/x-www-form-urlencoded'
-    }
-    payload = {
-        'grant_type': 'client_credentials',
-        'client_id': 'MRSjewKmL15bVGQoBWJlEFUTK57lykvj',
-        'client_secret': AUTH0_SECRET,
-        'audience': f"https://{AUTH0_DOMAIN}/api/v2/"
-    }
-
-    try:
-        response = requests.post(url, headers=headers, data=payload)
+AUTH0_CLIENT_ID = 'MRSjewKmL15bVGQoBWJlEFUTK57lykvj'
+_TOKEN_KEY = "__token__"
+
+
+class Auth0Error(Exception):
+    """Auth0 non ha risposto (token non ottenibile, timeout, errore HTTP)."""
+
+
+def is_valid_user_id(user_id: str) -> bool:
+    if user_id == "string" or not user_id:
+        logger.info(f"Auth0: user id fornito non valido: {user_id}")
+        return False
+    return True
+
+
+class Auth0Client:
+    """Client Auth0 con pool di connessioni, timeout e single-flight delle richieste."""
+
+    def __init__(
+        self,
+        domain: str = AUTH0_DOMAIN,
+        client_secret: Optional[str] = AUTH0_SECRET,
+        transport: Optional[httpx.BaseTransport] = None,
+        async_transport: Optional[httpx.AsyncBaseTransport] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.domain = domain
+        self.client_secret = client_secret
+        self._transport = transport
+        self._async_transport = async_transport
+        self._timeout = httpx.Timeout(timeout or settings.AUTH0_TIMEOUT_SECONDS)
+        self._limits = httpx.Limits(
+            max_connections=settings.AUTH0_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.AUTH0_MAX_CONNECTIONS,
+        )
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    # -- client HTTP condivisi -------------------------------------------------------
+
+    def _sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(timeout=self._timeout, limits=self._limits, transport=self._transport)
+            return self._client
+
+    def _aclient(self) -> httpx.AsyncClient:
+        # Un AsyncClient è legato all'event loop in cui apre le connessioni
+        loop = asyncio.get_running_loop()
+        client = self._async_client
+        if client is None or client.is_closed or self._async_loop is not loop:
+            if client is not None and not client.is_closed:
+                self._close_superseded(client, self._async_loop)
+            client = httpx.AsyncClient(timeout=self._timeout, limits=self._limits, transport=self._async_transport)
+            self._async_client, self._async_loop = client, loop
+        return client
+
+    @staticmethod
+    def _close_superseded(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        """Chiude il client di un event loop precedente, sul suo loop se è ancora attivo."""
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            # Loop chiuso: le sue connessioni non sono più utilizzabili né chiudibili da qui
+            logger.info("Auth0: event loop cambiato, AsyncClient precedente abbandonato senza chiusura")
+
+    async def aclose(self) -> None:
+        async_client, self._async_client, self._async_loop = self._async_client, None, None
+        if async_client is not None and not async_client.is_closed:
+            await async_client.aclose()
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    async def _single_flight(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Le richieste concorrenti con la stessa chiave attendono la stessa chiamata."""
+        task = self._inflight.get(key)
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None)
+        else:
+            self.coalesced += 1
+        # shield: la cancellazione di un chiamante non interrompe la chiamata per gli altri
+        return await asyncio.shield(task)
+
+    # -- richieste -------------------------------------------------------------------
+
+    def _token_request(self) -> Tuple[str, Dict[str, str]]:
+        url = f"https://{self.domain}/oauth/token"
+        payload = {
+            'grant_type': 'client_credentials',
+            'client_id': AUTH0_CLIENT_ID,
+            'client_secret': self.client_secret,
+            'audience': f"https://{self.domain}/api/v2/"
+        }
+        return url, payload
+
+    def _store_token(self, response: httpx.Response) -> Optional[str]:
         response.raise_for_status()
         token_response = response.json()
         access_token = token_response.get('access_token')
         if access_token:
-            # Salva il token nella cache con TTL di 86400 secondi (24 ore)
-            set_cached_auth0_token(access_token)
-            logger.info(f"Auth0: Token ottenuto e salvato in cache")
+            set_cached_auth0_token(access_token, token_response.get('expires_in'))
+            logger.info(f"Auth0: Token ottenuto e salvato in cache (expires_in={token_response.get('expires_in')})")
             return access_token
-        else:
-            logger.error("Auth0: Token non presente nella risposta.")
-            return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Auth0: Errore durante l'ottenimento del token: {e}")
+        logger.error("Auth0: Token non presente nella risposta.")
         return None
 
+    def _user_url(self, user_id: str) -> str:
+        return f"https://{self.domain}/api/v2/users/{user_id}"
+
+    @staticmethod
+    def _auth_headers(token: str) -> Dict[str, str]:
+        return {'Accept': 'application/json', 'Authorization': f"Bearer {token}"}
+
+    def token(self) -> Optional[str]:
+        """Token della Management API (cache, altrimenti client_credentials)."""
+        token = get_cached_auth0_token()
+        if token:
+            return token
+        url, payload = self._token_request()
+        try:
+            self.requests += 1
+            return self._store_token(self._sync_client().post(url, data=payload))
+        except httpx.HTTPError as e:
+            self.errors += 1
+            logger.error(f"Auth0: Errore durante l'ottenimento del token: {e}")
+            return None
+
+    async def atoken(self) -> Optional[str]:
+        token = get_cached_auth0_token()
+        if token:
+            return token
+        return await self._single_flight(_TOKEN_KEY, self._afetch_token)
+
+    async def _afetch_token(self) -> Optional[str]:
+        url, payload = self._token_request()
+        try:
+            self.requests += 1
+            return self._store_token(await self._aclient().post(url, data=payload))
+        except httpx.HTTPError as e:
+            self.errors += 1
+            logger.error(f"Auth0: Errore durante l'ottenimento del token: {e}")
+            return None
+
+    def user_metadata(self, user_id: str) -> dict:
+        if not is_valid_user_id(user_id):
+            return {}
+        for attempt in range(2):
+            token = self.token()
+            if not token:
+                logger.error("Auth0: Impossibile ottenere il token Auth0. Non è possibile recuperare i metadata utente.")
+                return {}
+            try:
+                self.requests += 1
+                response = self._sync_client().get(self._user_url(user_id), headers=self._auth_headers(token))
+                if response.status_code == 401 and attempt == 0:
+                    clear_cached_auth0_token()  # Token revocato o scaduto prima del previsto
+                    continue
+                response.raise_for_status()
+                return response.json().get("user_metadata", {})
+            except httpx.HTTPError as e:
+                self.errors += 1
+                logger.error(f"Auth0: Errore nella chiamata API di Auth0 per l'userid {user_id}: {e}")
+                return {}
+        return {}
+
+    async def auser_metadata(self, user_id: str) -> dict:
+        if not is_valid_user_id(user_id):
+            return {}
+        try:
+            return await self.afetch_user_metadata(user_id) or {}
+        except Auth0Error:
+            return {}
+
+    async def afetch_user_metadata(self, user_id: str) -> Optional[dict]:
+        """
+        Come auser_metadata, ma distingue i casi: None se l'utente non esiste su Auth0,
+        Auth0Error se Auth0 non ha risposto (usato dalla cache dei profili).
+        """
+        return await self._single_flight(f"user:{user_id}", lambda: self._afetch_user_metadata(user_id))
+
+    async def _afetch_user_metadata(self, user_id: str) -> Optional[dict]:
+        for attempt in range(2):
+            token = await self.atoken()
+            if not token:
+                logger.error("Auth0: Impossibile ottenere il token Auth0. Non è possibile recuperare i metadata utente.")
+                raise Auth0Error("token Auth0 non disponibile")
+            try:
+                self.requests += 1
+                response = await self._aclient().get(self._user_url(user_id), headers=self._auth_headers(token))
+                if response.status_code == 401 and attempt == 0:
+                    clear_cached_auth0_token()  # Token revocato o scaduto prima del previsto
+                    continue
+                if response.status_code == 404:
+                    logger.info(f"Auth0: utente {user_id} non trovato")
+                    return None
+                response.raise_for_status()
+                return response.json().get("user_metadata", {})
+            except httpx.HTTPError as e:
+                self.errors += 1
+                logger.error(f"Auth0: Errore nella chiamata API di Auth0 per l'userid {user_id}: {e}")
+                raise Auth0Error(str(e)) from e
+        raise Auth0Error("token Auth0 rifiutato")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "inflight": len(self._inflight),
+        }
+
+
+_client: Optional[Auth0Client] = None
+
+
+def get_auth0_client() -> Auth0Client:
+    """Client Auth0 di processo (creato al primo uso)."""
+    global _client
+    if _client is None:
+        _client = Auth0Client()
+    return _client
+
+
+def get_auth0_token() -> Optional[str]:
+    """
+    Ottiene un token di accesso da Auth0 utilizzando le credenziali client.
+
+    :return: Token di accesso come stringa oppure None in caso di errore.
+    """
+    return get_auth0_client().token()
+
+
+async def aget_auth0_token() -> Optional[str]:
+    """Variante async di get_auth0_token (rinnovi concorrenti accorpati)."""
+    return await get_auth0_client().atoken()
+
+
 def get_user_metadata(user_id: str, token: Optional[str] = None) -> dict:
     """
     Recupera i metadata dell'utente da Auth0 utilizzando il token fornito o quello gestito tramite la cache.
-    
+
     :param user_id: L'ID dell'utente.
     :param token: (opzionale) Token di accesso già verificato.
     :return: Dizionario contenente i metadata dell'utente.
     """
-    if user_id == "string" or not user_id:
-        logger.info(f"Auth0: user id fornito non valido: {user_id}")
-        return {}
+    return get_auth0_client().user_metadata(user_id)
 
-    token = get_auth0_token()
-    if not token:
-        logger.error("Auth0: Impossibile ottenere il token Auth0. Non è possibile recuperare i metadata utente.")
-        return {}
-    url = f"https://{AUTH0_DOMAIN}/api/v2/users/{user_id}"
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f"Bearer {token}"
-    }
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        user_data = response.json()
-        return user_data.get("user_metadata", {})
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Auth0: Errore nella chiamata API di Auth0 per l'userid {user_id}: {e}")
-        return {}
\ No newline at end of file
+
+async def aget_user_metadata(user_id: str, token: Optional[str] = None) -> dict:
+    """Variante async di get_user_metadata: fetch concorrenti dello stesso utente accorpati."""
+    return await get_auth0_client().auser_metadata(user_id)
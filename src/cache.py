@@ -1,14 +1,19 @@
 # Gestisce la cache degli user data e del token Auth0
 # TODO: inserire anche la cache dei docs
 
-from cachetools import TTLCache
+from cachetools import TLRUCache, TTLCache
 from typing import Optional
 
 # Cache per i dati utente con TTL di 600 secondi (10 minuti)
 user_metadata_cache = TTLCache(maxsize=1000, ttl=600)
 
-# Cache per il token Auth0 con TTL di 86400 secondi (24 ore)
-auth0_token_cache = TTLCache(maxsize=1, ttl=86400)
+# Margine prima della scadenza del token Auth0: rinnovo anticipato, mai un token scaduto in uso
+AUTH0_TOKEN_EXPIRY_MARGIN = 60
+# Default quando la risposta di Auth0 non riporta expires_in (24 ore)
+AUTH0_TOKEN_DEFAULT_TTL = 86400
+
+# Cache per il token Auth0: valore (token, ttl), ogni token scade secondo il proprio expires_in
+auth0_token_cache = TLRUCache(maxsize=1, ttu=lambda _key, value, now: now + value[1])
 
 def get_cached_user_data(user_id: str) -> Optional[str]:
     """
@@ -34,12 +39,21 @@ def get_cached_auth0_token() -> Optional[str]:
     
     :return: Token Auth0 come stringa o None se non presente.
     """
-    return auth0_token_cache.get('auth0_token')
+    cached = auth0_token_cache.get('auth0_token')
+    return cached[0] if cached else None
 
-def set_cached_auth0_token(token: str):
+def set_cached_auth0_token(token: str, expires_in: Optional[float] = None):
     """
     Inserisce il token Auth0 nella cache.
     
     :param token: Token Auth0 come stringa.
+    :param expires_in: Validità in secondi riportata da Auth0 (default 24 ore).
     """
-    auth0_token_cache['auth0_token'] = token
\ No newline at end of file
+    expires_in = expires_in or AUTH0_TOKEN_DEFAULT_TTL
+    ttl = expires_in - min(AUTH0_TOKEN_EXPIRY_MARGIN, expires_in / 2)
+    if ttl > 0:
+        auth0_token_cache['auth0_token'] = (token, ttl)
+
+def clear_cached_auth0_token():
+    """Rimuove il token Auth0 dalla cache (es. dopo un 401 della Management API)."""
+    auth0_token_cache.pop('auth0_token', None)
\ No newline at end of file
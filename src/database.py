@@ -1,22 +1,18 @@
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
 from pymongo.collection import Collection
 from pymongo.results import InsertOneResult, InsertManyResult
 from bson import ObjectId
 from typing import Dict, List, Any, Union, Optional
 from .env import URI
+from .services.database.connection_pool import get_mongo_client
 import logging
 logger = logging.getLogger("uvicorn")
 
 if not URI:
     raise ValueError("No MongoDB URI found. Please set the MONGODB_URI environment variable.")
 
-try:
-    # Create a new client and connect to the server
-    client = MongoClient(URI, server_api=ServerApi('1'))
-    # logger.info("Connected to MongoDB successfully.") # Antonio sistemalo
-except Exception as e:
-    print(f"An error occurred while connecting to MongoDB: {e}")
+# Shared, pooled client (same instance used by MongoDBService and the monitoring writers).
+# MongoClient connects lazily: nothing is opened until the first operation or warmup.
+client = get_mongo_client()
     
 def get_collection(database_name: str, collection_name: str) -> Collection:
         """
@@ -26,7 +22,7 @@ def get_collection(database_name: str, collection_name: str) -> Collection:
         :param collection_name: Name of the collection
         :return: Collection object
         """
-        db = client[database_name]
+        db = get_mongo_client()[database_name]
         collection = db[collection_name]
         return collection
 
@@ -54,7 +50,7 @@ def create_collection(database_name: str, collection_name: str) -> Collection:
     :param collection_name: Name of the collection
     :return: Collection object
     """
-    db = client[database_name]
+    db = get_mongo_client()[database_name]
     collection = db.create_collection(collection_name)
     return collection
 
@@ -66,7 +62,7 @@ def drop_collection(database_name: str, collection_name: str) -> bool:
     :param collection_name: Name of the collection
     :return: True if successful, False otherwise
     """
-    db = client[database_name]
+    db = get_mongo_client()[database_name]
     try:
         db.drop_collection(collection_name)
         return True
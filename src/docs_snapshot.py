@@ -0,0 +1,127 @@
+"""
+Snapshot locale della knowledge base per cold start senza download da S3.
+
+Il file contiene combined_docs, docs_meta e la versione del prompt. Il formato è:
+
+    MAGIC (8 byte) | lunghezza header (4 byte, big endian) | header JSON | corpo UTF-8
+
+L'header riporta schema, prompt_version, docs_meta, created_at, lunghezza e sha256
+del corpo. La lettura avviene via memory-map: il corpo viene verificato con lo sha256
+e decodificato senza copie intermedie del file. La scrittura è atomica (tmp + os.replace),
+quindi un processo concorrente legge sempre lo snapshot precedente o quello nuovo.
+
+Lo snapshot può stare in /tmp (scritto a runtime dopo ogni sync S3) oppure essere
+generato in fase di build con scripts/build_docs_snapshot.py e distribuito col codice.
+"""
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+import logging
+logger = logging.getLogger("uvicorn")
+
+SNAPSHOT_MAGIC = b"AIRDOCS\x01"
+SNAPSHOT_SCHEMA = 1
+_HEADER_LEN = struct.Struct(">I")
+
+
+@dataclass(frozen=True)
+class DocsSnapshot:
+    """Contenuto di uno snapshot valido."""
+    combined_docs: str
+    prompt_version: int
+    sha256: str
+    created_at: str
+    path: str
+    docs_meta: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def created_at_dt(self) -> Optional[datetime.datetime]:
+        try:
+            return datetime.datetime.fromisoformat(self.created_at)
+        except (TypeError, ValueError):
+            return None
+
+
+def docs_fingerprint(combined_docs: str) -> str:
+    """sha256 del contenuto combinato (usato per riconoscere docs invariati)."""
+    return hashlib.sha256(combined_docs.encode("utf-8")).hexdigest()
+
+
+def write_snapshot(path: str, combined_docs: str, docs_meta: List[Dict[str, Any]], prompt_version: int) -> bool:
+    """Scrive lo snapshot in modo atomico. Ritorna False (con warning) se la scrittura fallisce."""
+    body = combined_docs.encode("utf-8")
+    header = json.dumps({
+        "schema": SNAPSHOT_SCHEMA,
+        "prompt_version": prompt_version,
+        "docs_meta": docs_meta,
+        "created_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "length": len(body),
+        "sha256": hashlib.sha256(body).hexdigest(),
+    }).encode("utf-8")
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(_HEADER_LEN.pack(len(header)))
+            f.write(header)
+            f.write(body)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Docs: impossibile scrivere lo snapshot {path}: {e}")
+        return False
+    logger.info(f"Docs: snapshot v{prompt_version} salvato in {path} ({len(body)} byte)")
+    return True
+
+
+def read_snapshot(path: str) -> Optional[DocsSnapshot]:
+    """Legge lo snapshot via mmap. Ritorna None se assente, di schema diverso o corrotto."""
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            prefix = len(SNAPSHOT_MAGIC)
+            if mm[:prefix] != SNAPSHOT_MAGIC:
+                raise ValueError("magic non valido")
+            (header_len,) = _HEADER_LEN.unpack(mm[prefix:prefix + _HEADER_LEN.size])
+            body_start = prefix + _HEADER_LEN.size + header_len
+            header = json.loads(mm[prefix + _HEADER_LEN.size:body_start])
+            if header.get("schema") != SNAPSHOT_SCHEMA:
+                raise ValueError(f"schema {header.get('schema')} non supportato")
+            body = memoryview(mm)[body_start:body_start + header["length"]]
+            try:
+                if len(body) != header["length"] or hashlib.sha256(body).hexdigest() != header["sha256"]:
+                    raise ValueError("checksum non valido")
+                combined_docs = str(body, "utf-8")
+            finally:
+                body.release()
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        logger.warning(f"Docs: snapshot {path} ignorato: {e}")
+        return None
+    return DocsSnapshot(
+        combined_docs=combined_docs,
+        prompt_version=int(header.get("prompt_version") or 1),
+        sha256=header["sha256"],
+        created_at=header.get("created_at", ""),
+        path=path,
+        docs_meta=header.get("docs_meta") or [],
+    )
+
+
+def load_snapshot(paths: Iterable[Optional[str]]) -> Optional[DocsSnapshot]:
+    """Ritorna il primo snapshot valido tra `paths` (es. /tmp prima, poi quello di build)."""
+    for path in paths:
+        if path:
+            snapshot = read_snapshot(path)
+            if snapshot is not None:
+                return snapshot
+    return None
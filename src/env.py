@@ -17,17 +17,60 @@ class Settings(BaseSettings):
     ENABLE_GOOGLE_CACHING: bool = os.getenv("ENABLE_GOOGLE_CACHING", "true").lower() == "true"
     CACHE_REGION: str = os.getenv("CACHE_REGION", "europe-west8")  # Stessa region per massimizzare cache hits
     CACHE_DEBUG_LOGGING: bool = os.getenv("CACHE_DEBUG_LOGGING", "false").lower() == "true"
+    ENABLE_EXPLICIT_CACHING: bool = os.getenv("ENABLE_EXPLICIT_CACHING", "false").lower() == "true"  # CachedContent per versione di prompt
+    EXPLICIT_CACHE_TTL_SECONDS: int = int(os.getenv("EXPLICIT_CACHE_TTL_SECONDS", "3600"))
+    EXPLICIT_CACHE_REFRESH_MARGIN_SECONDS: int = int(os.getenv("EXPLICIT_CACHE_REFRESH_MARGIN_SECONDS", "600"))
     
     # MongoDB Configuration
     URI: str = os.getenv("MONGODB_URI", '')
     DATABASE_NAME: str = os.getenv("DATABASE_NAME", '')
     COLLECTION_NAME: str = os.getenv("COLLECTION_NAME", '')
+    MONGO_MAX_POOL_SIZE: int = int(os.getenv("MONGO_MAX_POOL_SIZE", "20"))
+    MONGO_MIN_POOL_SIZE: int = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    MONGO_MAX_IDLE_TIME_MS: int = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+    QUIZ_BANK_ENABLED: bool = os.getenv("QUIZ_BANK_ENABLED", "true").lower() == "true"  # domande quiz servite dalla memoria
+    QUIZ_BANK_REFRESH_SECONDS: int = int(os.getenv("QUIZ_BANK_REFRESH_SECONDS", "300"))  # intervallo di controllo versione
+    QUIZ_SEARCH_BACKEND: str = os.getenv("QUIZ_SEARCH_BACKEND", "memory")  # memory | text | regex
+    QUIZ_EXAM_QUESTIONS: int = int(os.getenv("QUIZ_EXAM_QUESTIONS", "30"))  # domande per simulazione d'esame
+    QUIZ_SESSION_TTL_SECONDS: int = int(os.getenv("QUIZ_SESSION_TTL_SECONDS", "7200"))  # scadenza per inattività
+    QUIZ_SESSION_MAX_USERS: int = int(os.getenv("QUIZ_SESSION_MAX_USERS", "10000"))
+    QUIZ_FAST_PATH_ENABLED: bool = os.getenv("QUIZ_FAST_PATH_ENABLED", "true").lower() == "true"  # comandi quiz senza LLM
+
+    # LangGraph checkpointer (memory | mongo | sqlite)
+    CHECKPOINTER_BACKEND: str = os.getenv("CHECKPOINTER_BACKEND", "memory")
+    CHECKPOINT_COLLECTION: str = os.getenv("CHECKPOINT_COLLECTION", "agent_checkpoints")
+    CHECKPOINT_SQLITE_PATH: str = os.getenv("CHECKPOINT_SQLITE_PATH", "/tmp/air_coach_checkpoints.sqlite")
+    CHECKPOINT_TTL_SECONDS: int = int(os.getenv("CHECKPOINT_TTL_SECONDS", "604800"))  # 7 giorni, 0 = nessuna scadenza
+    CHECKPOINT_MAX_PER_THREAD: int = int(os.getenv("CHECKPOINT_MAX_PER_THREAD", "1"))
+    CHECKPOINT_MAX_THREAD_BYTES: int = int(os.getenv("CHECKPOINT_MAX_THREAD_BYTES", "2000000"))  # 0 = nessun limite
+    CHECKPOINT_MEMORY_BUDGET_BYTES: int = int(os.getenv("CHECKPOINT_MEMORY_BUDGET_BYTES", "134217728"))  # 128MB, backend memory
+    CHECKPOINT_MEMORY_TTL_SECONDS: int = int(os.getenv("CHECKPOINT_MEMORY_TTL_SECONDS", "21600"))  # 6 ore, backend memory
+
+    # Write-behind queue (post-stream persistence and metrics)
+    WRITE_BEHIND_MAX_QUEUE_SIZE: int = int(os.getenv("WRITE_BEHIND_MAX_QUEUE_SIZE", "1000"))
+    WRITE_BEHIND_BATCH_SIZE: int = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "50"))
+    WRITE_BEHIND_FLUSH_INTERVAL_MS: int = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "100"))
+    WRITE_BEHIND_MAX_RETRIES: int = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "3"))
+    WRITE_BEHIND_RETRY_BACKOFF_MS: int = int(os.getenv("WRITE_BEHIND_RETRY_BACKOFF_MS", "200"))
+    WRITE_BEHIND_OVERFLOW_POLICY: str = os.getenv("WRITE_BEHIND_OVERFLOW_POLICY", "drop_oldest")  # drop_oldest | drop_newest
+    WRITE_BEHIND_SHUTDOWN_TIMEOUT_MS: int = int(os.getenv("WRITE_BEHIND_SHUTDOWN_TIMEOUT_MS", "5000"))
     
     # AWS Configuration
     AWS_ACCESS_KEY_ID: str = os.getenv("AWS_ACCESS_KEY_ID", '')
     AWS_SECRET_ACCESS_KEY: str = os.getenv("AWS_SECRET_ACCESS_KEY", '')
     BUCKET_NAME: str = os.getenv("BUCKET_NAME", '')
     CACHE_TTL: int = 300
+    DOCS_CACHE_DIR: str = os.getenv("DOCS_CACHE_DIR", "/tmp/air_coach_docs_cache")  # cache locale content-addressed dei docs S3
+    S3_SYNC_MAX_WORKERS: int = int(os.getenv("S3_SYNC_MAX_WORKERS", "8"))
+    DOCS_SNAPSHOT_ENABLED: bool = os.getenv("DOCS_SNAPSHOT_ENABLED", "true").lower() == "true"
+    DOCS_SNAPSHOT_PATH: str = os.getenv("DOCS_SNAPSHOT_PATH", "/tmp/air_coach_docs_snapshot.bin")  # snapshot scritto a runtime
+    DOCS_SNAPSHOT_BUNDLED_PATH: str = os.getenv("DOCS_SNAPSHOT_BUNDLED_PATH", "")  # snapshot generato in build (opzionale)
+    RETRIEVAL_MODE: bool = os.getenv("RETRIEVAL_MODE", "false").lower() == "true"  # top-k chunk invece dell'intera knowledge base
+    RETRIEVAL_TOP_K: int = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+    RETRIEVAL_CHUNK_CHARS: int = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "2000"))
+    RETRIEVAL_CORE_CHARS: int = int(os.getenv("RETRIEVAL_CORE_CHARS", "4000"))  # inizio dei docs sempre incluso
     
     # Auth0 Configuration
     AUTH0_SECRET: Optional[str] = os.getenv("AUTH0_SECRET")
@@ -35,13 +78,45 @@ class Settings(BaseSettings):
     auth0_api_audience: str = os.getenv("AUTH0_API_AUDIENCE", "your-auth0-api-audience")
     auth0_issuer: str = os.getenv("AUTH0_ISSUER", "https://your-auth0-domain/")
     auth0_algorithms: List[str] = os.getenv("AUTH0_ALGORITHMS", "RS256").split(",")
+    AUTH0_TIMEOUT_SECONDS: float = float(os.getenv("AUTH0_TIMEOUT_SECONDS", "5"))  # timeout delle chiamate a Auth0
+    AUTH0_MAX_CONNECTIONS: int = int(os.getenv("AUTH0_MAX_CONNECTIONS", "20"))  # connessioni keep-alive verso Auth0
+
+    # Cache dei profili utente (L1 in processo + L2 condiviso)
+    USER_PROFILE_STORE: str = os.getenv("USER_PROFILE_STORE", "mongo")  # mongo | redis | local | none
+    USER_PROFILE_COLLECTION: str = os.getenv("USER_PROFILE_COLLECTION", "user_profiles")
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")  # solo con USER_PROFILE_STORE=redis
+    USER_PROFILE_CACHE_SIZE: int = int(os.getenv("USER_PROFILE_CACHE_SIZE", "1000"))
+    USER_PROFILE_FRESH_SECONDS: int = int(os.getenv("USER_PROFILE_FRESH_SECONDS", "600"))  # oltre: servito e aggiornato in background
+    USER_PROFILE_STALE_SECONDS: int = int(os.getenv("USER_PROFILE_STALE_SECONDS", "86400"))  # oltre: la richiesta attende Auth0
+    USER_PROFILE_NEGATIVE_SECONDS: int = int(os.getenv("USER_PROFILE_NEGATIVE_SECONDS", "300"))  # utenti senza profilo
+    JWKS_REFRESH_SECONDS: int = int(os.getenv("JWKS_REFRESH_SECONDS", "3600"))  # rinnovo in background delle chiavi
+    JWKS_MIN_REFETCH_SECONDS: int = int(os.getenv("JWKS_MIN_REFETCH_SECONDS", "30"))  # limite ai refetch per kid sconosciuti
+    AUTH_TOKEN_CACHE_SIZE: int = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))  # token verificati in cache fino a exp
     
     # Application Configuration
     is_production: bool = os.getenv("ENVIRONMENT", "development").lower() == "production"
     HISTORY_LIMIT: int = int(os.getenv("HISTORY_LIMIT", "10"))
+    DISCONNECT_POLL_SECONDS: float = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))  # controllo client SSE disconnesso
+    SSE_HEARTBEAT_SECONDS: float = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))  # commento keep-alive nei silenzi, 0 = off
+    SSE_COALESCE_MAX_MS: int = int(os.getenv("SSE_COALESCE_MAX_MS", "50"))  # attesa massima del testo accorpato
+    SSE_COALESCE_MAX_BYTES: int = int(os.getenv("SSE_COALESCE_MAX_BYTES", "512"))  # 0 = un frame per chunk
+    STREAM_RESUME_ENABLED: bool = os.getenv("STREAM_RESUME_ENABLED", "true").lower() == "true"  # id sui frame e ripresa con Last-Event-ID
+    STREAM_RESUME_GRACE_SECONDS: float = float(os.getenv("STREAM_RESUME_GRACE_SECONDS", "10"))  # run senza client: poi cancellato
+    STREAM_EVENT_BUFFER_SIZE: int = int(os.getenv("STREAM_EVENT_BUFFER_SIZE", "500"))  # frame in memoria per messaggio
+    STREAM_EVENT_MAX_LOGS: int = int(os.getenv("STREAM_EVENT_MAX_LOGS", "1000"))  # log di run conclusi tenuti in memoria
+    STREAM_EVENT_TTL_SECONDS: int = int(os.getenv("STREAM_EVENT_TTL_SECONDS", "300"))  # durata dei log conclusi (memoria e MongoDB)
+    STREAM_EVENT_SPILL: bool = os.getenv("STREAM_EVENT_SPILL", "false").lower() == "true"  # copia dei frame su MongoDB
+    STREAM_EVENT_COLLECTION: str = os.getenv("STREAM_EVENT_COLLECTION", "stream_events")
+    ADMISSION_MAX_CONCURRENT: int = int(os.getenv("ADMISSION_MAX_CONCURRENT", "20"))  # run LLM in corso per processo, 0 = nessun limite
+    ADMISSION_QUEUE_SIZE: int = int(os.getenv("ADMISSION_QUEUE_SIZE", "50"))  # richieste in attesa di un posto
+    ADMISSION_MAX_WAIT_SECONDS: float = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))  # oltre: 503 con Retry-After
+    ADMISSION_USER_RATE_PER_MINUTE: float = float(os.getenv("ADMISSION_USER_RATE_PER_MINUTE", "20"))  # 0 = nessun limite per utente
+    ADMISSION_USER_BURST: int = int(os.getenv("ADMISSION_USER_BURST", "5"))  # richieste di fila prima del limite per utente
 
     # Monitoring Configuration
     ENABLE_TOKEN_LOGGING: bool = os.getenv("ENABLE_TOKEN_LOGGING", "true").lower() == "true"
+    TRACING_ENABLED: bool = os.getenv("TRACING_ENABLED", "true").lower() == "true"  # span per fase, salvati con le metriche di token
+    TRACE_EXPORT_FILE: str = os.getenv("TRACE_EXPORT_FILE", "")  # file OTLP/JSON (una riga per richiesta), vuoto = disattivato
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,143 @@
+"""
+Signing-key and verified-token caches used by VerifyToken.
+
+- JWKSCache keeps the Auth0 JWKS indexed by kid. Keys older than JWKS_REFRESH_SECONDS
+  are still served while a background task refetches them; a token signed with an
+  unknown kid (key rotation) triggers one refetch, coalesced across concurrent requests
+  and rate limited so random kids cannot make us hammer the JWKS endpoint. The HTTP
+  fetch runs in a worker thread, never on the event loop.
+- VerifiedTokenCache maps sha256(token) to the decoded payload until the token's exp,
+  so repeated requests with the same bearer token skip the RS256 verification.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+import jwt
+from cachetools import TLRUCache
+from jwt.exceptions import PyJWKClientError
+
+from .env import settings
+
+logger = logging.getLogger("uvicorn")
+
+
+class JWKSCache:
+    """Signing keys of a JWKS endpoint, indexed by kid."""
+
+    def __init__(
+        self,
+        jwks_url: str,
+        refresh_seconds: Optional[float] = None,
+        min_refetch_seconds: Optional[float] = None,
+        fetch: Optional[Callable[[], Dict[str, Any]]] = None,
+    ):
+        self.jwks_url = jwks_url
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else settings.JWKS_REFRESH_SECONDS
+        self.min_refetch_seconds = (
+            min_refetch_seconds if min_refetch_seconds is not None else settings.JWKS_MIN_REFETCH_SECONDS
+        )
+        self._fetch = fetch or jwt.PyJWKClient(jwks_url, cache_jwk_set=False).fetch_data
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._fetched_at = float("-inf")
+        self._inflight: Optional[asyncio.Task] = None
+        self.fetches = 0
+        self.failures = 0
+        self.rotation_misses = 0
+
+    async def get_signing_key(self, kid: Optional[str]) -> jwt.PyJWK:
+        """Key for `kid`; raises PyJWKClientError when the JWKS does not contain it."""
+        key = self._keys.get(kid) if kid else None
+        if key is not None:
+            if time.monotonic() - self._fetched_at >= self.refresh_seconds:
+                self._refresh()  # Background: the current keys keep serving meanwhile
+            return key
+
+        if not kid:
+            raise PyJWKClientError("Token header has no kid")
+        if not self._keys or time.monotonic() - self._fetched_at >= self.min_refetch_seconds:
+            self.rotation_misses += 1
+            await self._refresh()
+        key = self._keys.get(kid)
+        if key is None:
+            raise PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+    def _refresh(self) -> asyncio.Task:
+        """Single-flight JWKS fetch: concurrent callers share the same task."""
+        task = self._inflight
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._inflight = asyncio.ensure_future(self._load())
+        return task
+
+    async def _load(self) -> None:
+        try:
+            data = await asyncio.to_thread(self._fetch)
+            keys = {
+                key.key_id: key
+                for key in jwt.PyJWKSet.from_dict(data).keys
+                if key.public_key_use in ("sig", None) and key.key_id
+            }
+            if not keys:
+                raise PyJWKClientError("The JWKS endpoint did not contain any signing keys")
+            self._keys = keys
+            self.fetches += 1
+            logger.info(f"AUTH - JWKS caricato: {len(keys)} chiavi ({', '.join(keys)})")
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"AUTH - Errore nel caricamento del JWKS da {self.jwks_url}: {e}")
+        finally:
+            # Also after a failure: keep serving the known keys and retry after min_refetch_seconds
+            self._fetched_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self._keys),
+            "age_s": round(time.monotonic() - self._fetched_at, 1) if self._keys else None,
+            "fetches": self.fetches,
+            "failures": self.failures,
+            "rotation_misses": self.rotation_misses,
+        }
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class VerifiedTokenCache:
+    """Bounded cache of verified token payloads, each valid until the token's exp."""
+
+    def __init__(self, maxsize: Optional[int] = None, timer: Callable[[], float] = time.time):
+        self._cache: TLRUCache = TLRUCache(
+            maxsize=maxsize or settings.AUTH_TOKEN_CACHE_SIZE,
+            ttu=lambda _key, payload, _now: float(payload["exp"]),
+            timer=timer,
+        )
+        self._timer = timer
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        payload = self._cache.get(_token_hash(token))
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return payload
+
+    def set(self, token: str, payload: Dict[str, Any]) -> None:
+        """Tokens without a numeric exp are never cached (they would never expire)."""
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)) and exp > self._timer():
+            self._cache[_token_hash(token)] = payload
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0,
+        }
@@ -1,14 +1,37 @@
-from fastapi import FastAPI, HTTPException, APIRouter, Security, Query
+from fastapi import FastAPI, HTTPException, APIRouter, Security, Query, Request, Header
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio
 import logging
 logger = logging.getLogger("uvicorn")
-from src.models import MessageRequest, FeedbackRequest, ErrorResponse
+from src.models import MessageRequest, FeedbackRequest, ErrorResponse, UserProfileInvalidateRequest
 from src.auth import VerifyToken
 
 auth = VerifyToken()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup: warmup del pool MongoDB condiviso (server discovery + prima connessione)
+    e caricamento della banca domande quiz.
+    Shutdown: flush della coda write-behind, poi chiusura dei client (Auth0 e MongoDB).
+    """
+    from src.services.database.connection_pool import get_client_manager
+    from src.services.database.write_behind import get_write_behind_queue
+    from src.tools import warm_quiz_bank
+    from src.auth0 import get_auth0_client
+    if await asyncio.to_thread(get_client_manager().warmup):
+        await asyncio.to_thread(warm_quiz_bank)
+    yield
+    await get_write_behind_queue().close()
+    await get_auth0_client().aclose()
+    get_client_manager().close()
+
+
 app = FastAPI(
     title='AIR Coach API',
     version='0.4',
@@ -17,7 +40,8 @@ app = FastAPI(
 
     ''',
     docs_url="/api/docs",  # Swagger enabled in production
-    redoc_url="/api/redoc"  # ReDoc enabled in production
+    redoc_url="/api/redoc",  # ReDoc enabled in production
+    lifespan=lifespan,
     )
 
 api_router = APIRouter(prefix="/api")
@@ -64,6 +88,7 @@ async def test():
 @api_router.post("/stream_query")
 async def stream_endpoint(
     request: MessageRequest,
+    http_request: Request,
     auth_result: dict = Security(auth.verify)
 ):
     """
@@ -98,9 +123,13 @@ async def stream_endpoint(
 
     The stream produces JSON events with different types. Each event is prefixed with `data:` per SSE specification.
 
+    During long silences (e.g. model thinking) the server sends `: keep-alive` comment lines
+    every `SSE_HEARTBEAT_SECONDS`: clients must ignore lines that start with `:`.
+
     ### Event Type 1: `agent_message`
 
     Incremental text chunks from the AI response. Clients should concatenate these to build the complete message.
+    After the first one, consecutive chunks are coalesced (up to `SSE_COALESCE_MAX_MS` / `SSE_COALESCE_MAX_BYTES`).
 
     ```json
     data: {"type": "agent_message", "data": "Ecco", "message_id": "userid_2026-01-19T14:26:03.779"}
@@ -138,18 +167,137 @@ async def stream_endpoint(
     - **200**: Stream started successfully
     - **401/403**: Invalid or missing authentication token
     - **422**: Invalid request payload (missing userid or empty message)
+    - **429**: Too many requests from this user (`ADMISSION_USER_RATE_PER_MINUTE`), see `Retry-After`
     - **500**: Internal server error
+    - **503**: Server busy: no LLM slot within `ADMISSION_MAX_WAIT_SECONDS`, see `Retry-After`
+
+    Error bodies use the `ErrorResponse` format (`RATE_LIMITED`, `OVERLOADED`).
+
+    If the client disconnects mid-answer the generation is cancelled and the partial
+    response is saved with `interrupted: true`.
+
+    ## Resuming a dropped stream
+
+    With `STREAM_RESUME_ENABLED` every event carries an SSE `id:` line
+    (`id: <message_id>:<n>`, sequential per message). After a disconnect the run keeps going
+    for `STREAM_RESUME_GRACE_SECONDS`: the client can reconnect to `GET /api/stream_query/resume`
+    with the last id it received and get the missed events, then the live ones. If nobody
+    reconnects in time the generation is cancelled as above.
     """
+    from src.admission import AdmissionRejected, AdmissionStreamingResponse, get_admission_controller
+    from src.monitoring.tracing import trace_span
     try:
-        from src.rag import ask
+        # Posto per il run LLM: attesa in coda limitata, poi 503/429 con Retry-After
+        with trace_span("admission"):
+            admission = await get_admission_controller().acquire(request.userid)
+    except AdmissionRejected as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            headers={"Retry-After": str(e.retry_after)},
+            content=ErrorResponse(code=e.code, message=e.message).model_dump()
+        )
+    try:
+        from src.rag import aask, initialize_agent_state
+        # Cold start fuori dall'event loop: le richieste concorrenti condividono un solo fetch S3
+        with trace_span("prompt_init"):
+            await asyncio.to_thread(initialize_agent_state)
         token = auth_result.get('access_token') or auth_result.get('token')
         logger.info(f"Request received: \ntoken_len= {len(token)}\nmessage= {request.message}\nuserid= {request.userid}")
-        stream_response = ask(request.message, request.userid, chat_history=True, user_data=True, token=token)
+        stream_response = await aask(
+            request.message, request.userid, chat_history=True, user_data=True, token=token,
+            is_disconnected=http_request.is_disconnected,  # chiusura del client: generazione cancellata
+            admission=admission,  # rilasciato a fine run
+        )
         logger.info("Starting streaming response...")
-        return StreamingResponse(stream_response, media_type="text/event-stream")
+        # Rilascia il posto anche se il body non viene mai iterato (client già disconnesso)
+        return AdmissionStreamingResponse(stream_response, admission, media_type="text/event-stream")
     except Exception as e:
+        admission.release()
         logger.error(f"Exception occurred in /stream_query: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
+    except BaseException:
+        admission.release()  # richiesta cancellata prima della risposta
+        raise
+
+@api_router.get("/stream_query/resume")
+async def stream_resume_endpoint(
+    http_request: Request,
+    userid: str = Query(..., min_length=1, description="User identifier"),
+    message_id: Optional[str] = Query(None, description="Message to resume (default: from the event id)"),
+    last_event_id: Optional[str] = Query(None, description="Last event id received, if the Last-Event-ID header cannot be set"),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    auth_result: dict = Security(auth.verify)
+):
+    """
+    Resume an interrupted /api/stream_query stream
+
+    Replays the events emitted after `Last-Event-ID` and, if the answer is still being
+    generated, keeps streaming the live events until the end (same SSE format and event
+    types as /api/stream_query).
+
+    ## Authentication
+
+    **Required**: Bearer JWT token (same Auth0 authentication as /api/stream_query)
+
+    ## Request Format
+
+    **Headers**:
+    - `Last-Event-ID` (optional): id of the last event received, e.g. `userid_2026-01-19T14:26:03.779:12`
+
+    **Query parameters**:
+    - `userid` (string, required): User identifier of the original request
+    - `message_id` (string, optional): required only if the event id does not include it
+    - `last_event_id` (string, optional): same as the header, for clients that cannot set it
+
+    Without an event id the whole answer is replayed.
+
+    ## Response
+
+    The missed events (with their `id:` lines), then the live ones. If the missed events are
+    no longer available the stream contains a single error event and the client should send
+    the question again:
+
+    ```json
+    data: {"type": "error", "code": "RESUME_UNAVAILABLE", "message": "...", "message_id": "..."}
+    ```
+
+    ## Response Status Codes
+
+    - **200**: Stream resumed
+    - **400**: Invalid event id, or no message_id
+    - **401/403**: Invalid or missing authentication token
+    - **404**: Unknown or expired message
+    - **500**: Internal server error
+    """
+    from src.agent.event_log import get_event_log_registry, parse_event_id
+    raw_event_id = last_event_id_header or last_event_id
+    after_id = 0
+    if raw_event_id:
+        try:
+            event_message_id, after_id = parse_event_id(raw_event_id)
+        except ValueError:
+            return JSONResponse(
+                status_code=400,
+                content=ErrorResponse(code="BAD_REQUEST", message=f"Last-Event-ID non valido: {raw_event_id}").model_dump()
+            )
+        message_id = message_id or event_message_id
+    if not message_id:
+        return JSONResponse(
+            status_code=400,
+            content=ErrorResponse(code="BAD_REQUEST", message="message_id mancante").model_dump()
+        )
+    try:
+        stream = await get_event_log_registry().resume(message_id, userid, after_id, http_request.is_disconnected)
+    except Exception as e:
+        logger.error(f"Exception occurred in /stream_query/resume: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    if stream is None:
+        return JSONResponse(
+            status_code=404,
+            content=ErrorResponse(code="NOT_FOUND", message=f"Stream non trovato: {message_id}").model_dump()
+        )
+    logger.info(f"Resuming stream {message_id} after event {after_id}")
+    return StreamingResponse(stream, media_type="text/event-stream")
 
 @api_router.post("/update_docs")
 async def update_docs_endpoint():
@@ -159,15 +307,17 @@ async def update_docs_endpoint():
     - A success message
     - The total number of documents
     - Details for each document (title and last modified date)
+    - Sync statistics (files downloaded vs unchanged, bytes transferred, duration)
     """
     try:
         from src.update_docs import update_docs
         from src.s3_utils import create_prompt_file
-        update_result = update_docs()
+        # Il download gira in un thread: le richieste in corso continuano a usare i docs correnti
+        update_result = await asyncio.to_thread(update_docs)
         system_prompt = update_result["system_prompt"]
 
         try:
-            file = create_prompt_file(system_prompt)
+            file = await asyncio.to_thread(create_prompt_file, system_prompt)
         except Exception as file_error:
             logger.error(f"Error creating prompt file: {str(file_error)}")
             raise HTTPException(status_code=500, detail="Error creating prompt file")
@@ -176,6 +326,7 @@ async def update_docs_endpoint():
             "message": update_result["message"],
             "docs_count": update_result["docs_count"],
             "docs_details": update_result["docs_details"],
+            "sync_stats": update_result.get("sync_stats", {}),
             "prompt_file": file,
             "system_prompt": system_prompt
         }
@@ -289,6 +440,41 @@ async def feedback_user_endpoint(
             ).model_dump()
         )
 
+@api_router.post("/user_profile/invalidate")
+async def invalidate_user_profile_endpoint(
+    request: UserProfileInvalidateRequest,
+    auth_result: dict = Security(auth.verify)
+):
+    """
+    Drop the cached Auth0 profile of a user after it has been changed.
+
+    The profile is removed from the in-process cache and from the shared store, so
+    the next request of the user (on any instance) reads it again from Auth0.
+
+    ## Authentication
+
+    **Required**: Bearer JWT token (same Auth0 authentication as /api/stream_query)
+
+    ## Request Format
+
+    **Body**:
+    - `userid` (string, required): User identifier
+
+    ## Response Status Codes
+
+    - **200**: Profile invalidated
+    - **401/403**: Invalid or missing authentication token
+    - **422**: Invalid request payload
+    - **500**: Internal server error
+    """
+    try:
+        from src.user_profile_cache import get_user_profile_cache
+        await get_user_profile_cache().invalidate(request.userid)
+        return {"message": "Profilo invalidato", "userid": request.userid}
+    except Exception as e:
+        logger.error(f"Error invalidating user profile {request.userid}: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 
 app.include_router(api_router) # for /api/ prefix
 
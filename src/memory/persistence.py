@@ -5,6 +5,7 @@ from pymongo.errors import DuplicateKeyError
 
 from ..env import DATABASE_NAME, COLLECTION_NAME
 from ..database import insert_data
+from ..services.database.write_behind import get_write_behind_queue
 import logging
 logger = logging.getLogger("uvicorn")
 
@@ -20,7 +21,8 @@ class ConversationPersistence:
         response: str,
         user_id: str, 
         tool_records: Optional[List[Dict]] = None,
-        message_id: Optional[str] = None
+        message_id: Optional[str] = None,
+        interrupted: bool = False,
     ) -> bool:
         """
         Salva una conversazione (query + response) su MongoDB.
@@ -30,28 +32,15 @@ class ConversationPersistence:
             response: La risposta dell'agente
             user_id: ID dell'utente
             tool_records: Lista dei tool eseguiti durante la conversazione
+            interrupted: Risposta parziale, il client si è disconnesso durante lo streaming
             
         Returns:
             True se il salvataggio è avvenuto con successo, False altrimenti
         """
-        if not response and not tool_records:
-            logger.warning("DB - Nessuna risposta o tool da salvare, skip persistenza")
+        data = ConversationPersistence._build_record(query, response, user_id, tool_records, message_id, interrupted)
+        if data is None:
             return False
-            
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        data = {
-            "_id": message_id,
-            "human": query,
-            "system": response,
-            "userId": user_id,
-            "timestamp": timestamp,
-        }
-        
-        # Aggiungi tool record se presente (solo l'ultimo)
-        if tool_records:
-            data["tool"] = tool_records[-1]
-        
+
         try:
             message_id = insert_data(DATABASE_NAME, COLLECTION_NAME, data)
             logger.info(f"DB - Risposta {message_id} inserita nella collection: {DATABASE_NAME} - {COLLECTION_NAME}")
@@ -73,6 +62,64 @@ class ConversationPersistence:
             logger.error(f"DB - Errore nell'inserire i dati nella collection: {e}")
             return False
     
+    @staticmethod
+    def queue_conversation(
+        query: str,
+        response: str,
+        user_id: str,
+        tool_records: Optional[List[Dict]] = None,
+        message_id: Optional[str] = None,
+        interrupted: bool = False,
+    ) -> bool:
+        """
+        Accoda il documento di save_conversation nella coda write-behind: la scrittura
+        (con fallback su ObjectId in caso di message_id duplicato) avviene in background.
+
+        Returns:
+            True se il documento è stato accodato, False altrimenti
+        """
+        data = ConversationPersistence._build_record(query, response, user_id, tool_records, message_id, interrupted)
+        if data is None:
+            return False
+
+        queued = get_write_behind_queue().enqueue(DATABASE_NAME, COLLECTION_NAME, data)
+        if queued:
+            logger.info(f"DB - Risposta {message_id} accodata per la collection: {DATABASE_NAME} - {COLLECTION_NAME}")
+        return queued
+
+    @staticmethod
+    def _build_record(
+        query: str,
+        response: str,
+        user_id: str,
+        tool_records: Optional[List[Dict]] = None,
+        message_id: Optional[str] = None,
+        interrupted: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """Costruisce il documento da salvare, o None se non c'è nulla da persistere."""
+        if not response and not tool_records:
+            logger.warning("DB - Nessuna risposta o tool da salvare, skip persistenza")
+            return None
+
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        data = {
+            "_id": message_id,
+            "human": query,
+            "system": response,
+            "userId": user_id,
+            "timestamp": timestamp,
+        }
+
+        if interrupted:
+            data["interrupted"] = True
+
+        # Aggiungi tool record se presente (solo l'ultimo)
+        if tool_records:
+            data["tool"] = tool_records[-1]
+
+        return data
+
     @staticmethod
     def log_run_completion(
         response: str, 
@@ -4,6 +4,7 @@ from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 
 from ..env import DATABASE_NAME, COLLECTION_NAME, HISTORY_LIMIT
 from ..database import get_data
+from ..services.database.async_database_service import AsyncMongoDBService
 import logging
 logger = logging.getLogger("uvicorn")
 
@@ -11,6 +12,10 @@ logger = logging.getLogger("uvicorn")
 class MemorySeeder:
     """
     Gestisce il seeding della memoria dell'agente con la cronologia da MongoDB.
+
+    Con un checkpointer persistente (CHECKPOINTER_BACKEND=mongo) lo stato del thread
+    sopravvive ai cold start: il seeding scatta solo come fallback (thread nuovo,
+    scaduto o oltre il size cap).
     """
     
     @staticmethod
@@ -51,6 +56,34 @@ class MemorySeeder:
             
         return False
     
+    @staticmethod
+    async def aseed_agent_memory(
+        agent_executor,
+        config: Dict[str, Any],
+        user_id: str,
+        chat_history: bool = True
+    ) -> bool:
+        """
+        Versione async di seed_agent_memory per lo streaming: stato agente e cronologia
+        MongoDB vengono letti senza bloccare l'event loop.
+        """
+        if not chat_history:
+            return False
+
+        existing_messages = await MemorySeeder._aget_existing_messages(agent_executor, config)
+        if existing_messages:
+            msg_count = len(existing_messages)
+            logger.info(f"HISTORY - Recupero lo stato dell'agente. Numero di messaggi in memoria: {msg_count}")
+            return False  # Memoria già presente (warm path)
+
+        logger.info("HISTORY - Nessun messaggio trovato in memoria volatile")
+        seed_messages = await MemorySeeder._abuild_seed_messages(user_id)
+
+        if seed_messages:
+            return await MemorySeeder._aapply_seeding(agent_executor, config, seed_messages)
+
+        return False
+
     @staticmethod
     def _get_existing_messages(agent_executor, config: Dict[str, Any]) -> List:
         """Recupera i messaggi esistenti dallo stato dell'agente."""
@@ -61,11 +94,19 @@ class MemorySeeder:
             logger.error(f"Errore nel recuperare lo stato dell'agente: {e}")
             return None
     
+    @staticmethod
+    async def _aget_existing_messages(agent_executor, config: Dict[str, Any]) -> List:
+        """Recupera i messaggi esistenti dallo stato dell'agente (async)."""
+        try:
+            state = await agent_executor.aget_state(config)
+            return state.values.get("messages") if state and hasattr(state, "values") else None
+        except Exception as e:
+            logger.error(f"Errore nel recuperare lo stato dell'agente: {e}")
+            return None
+
     @staticmethod 
     def _build_seed_messages(user_id: str) -> List:
         """Costruisce i messaggi di seeding dalla cronologia MongoDB."""
-        seed_messages = []
-        
         logger.info("HISTORY - Cerco cronologia conversazione su DB...")
         try:
             history = get_data(
@@ -74,7 +115,31 @@ class MemorySeeder:
                 filters={"userId": user_id},
                 limit=HISTORY_LIMIT,
             )
-            
+            return MemorySeeder._messages_from_history(history)
+        except Exception as e:
+            logger.error(f"Errore nel recuperare la chat history: {e}")
+            return []
+
+    @staticmethod
+    async def _abuild_seed_messages(user_id: str) -> List:
+        """Costruisce i messaggi di seeding dalla cronologia MongoDB (Motor, non bloccante)."""
+        logger.info("HISTORY - Cerco cronologia conversazione su DB...")
+        try:
+            history = await AsyncMongoDBService(DATABASE_NAME).get_latest_items(
+                COLLECTION_NAME,
+                {"userId": user_id},
+                limit=HISTORY_LIMIT,
+            )
+            return MemorySeeder._messages_from_history(history)
+        except Exception as e:
+            logger.error(f"Errore nel recuperare la chat history: {e}")
+            return []
+
+    @staticmethod
+    def _messages_from_history(history: List[Dict]) -> List:
+        """Converte i documenti della cronologia in messaggi LangChain."""
+        seed_messages = []
+        try:
             for msg in history:
                 # Aggiungi messaggio umano
                 if msg.get("human"):
@@ -98,7 +163,7 @@ class MemorySeeder:
             logger.error(f"Errore nel recuperare la chat history: {e}")
             
         return seed_messages
-    
+
     @staticmethod
     def _create_tool_message(tool_entry, msg: Dict) -> ToolMessage:
         """Crea un ToolMessage dalla voce tool nel DB."""
@@ -140,6 +205,17 @@ class MemorySeeder:
             agent_executor.update_state(config, {"messages": seed_messages})
             logger.info(f"HISTORY - Seeding completato con {len(seed_messages)} messaggi")
             return True
+        except Exception as e:
+            logger.error(f"Error seeding agent state: {e}")
+            return False
+
+    @staticmethod
+    async def _aapply_seeding(agent_executor, config: Dict[str, Any], seed_messages: List) -> bool:
+        """Applica i messaggi di seeding allo stato dell'agente (async)."""
+        try:
+            await agent_executor.aupdate_state(config, {"messages": seed_messages})
+            logger.info(f"HISTORY - Seeding completato con {len(seed_messages)} messaggi")
+            return True
         except Exception as e:
             logger.error(f"Error seeding agent state: {e}")
             return False
\ No newline at end of file
@@ -71,6 +71,9 @@ class QuizQuestion(BaseModel):
     testo: str = Field(..., description="Question text")
     opzioni: List[QuizOption] = Field(..., description="Answer options (typically 3-4 options)")
     risposta_corretta: str = Field(..., description="Correct answer letter (A, B, C, or D)")
+    esame: Optional[Dict[str, int]] = Field(
+        None, description="Exam simulation progress ('domanda', 'totale'), only for random questions"
+    )
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -132,6 +135,10 @@ class FeedbackRequest(BaseModel):
     feedback: Literal["positive", "negative"] = Field(..., description="Feedback utente: 'positive' o 'negative'")
 
 
+class UserProfileInvalidateRequest(BaseModel):
+    userid: str = Field(..., min_length=1, description="User identifier il cui profilo è cambiato")
+
+
 class ErrorResponse(BaseModel):
     type: Literal["error"] = "error"
     code: str = Field(..., description="Codice errore (es. BAD_REQUEST, NOT_FOUND, INTERNAL_ERROR)")
@@ -8,8 +8,23 @@ import logging
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional
 
-from .token_logger import get_token_metrics
+from .token_logger import get_token_metrics, metric_calls
 from .rate_limit_monitor import get_rate_limit_events
+from .tracing import percentiles
+from .disconnect_monitor import get_disconnect_stats
+from ..services.database.connection_pool import get_pool_stats
+from ..services.database.write_behind import get_write_behind_stats
+from ..services.database.quiz_bank import get_quiz_bank_stats
+from ..agent.state_manager import get_checkpointer_stats
+from ..s3_utils import get_docs_sync_stats
+from ..utils import get_docs_cache_stats
+from ..agent.context_cache import get_context_cache_stats
+from ..agent.event_log import get_event_log_stats
+from ..retrieval import get_retrieval_stats
+from ..quiz_session import get_quiz_session_stats
+from ..agent.quiz_router import get_quiz_router_stats
+from ..user_profile_cache import get_user_profile_stats
+from ..admission import get_admission_stats
 
 logger = logging.getLogger("uvicorn")
 
@@ -33,14 +48,32 @@ def get_monitoring_report(hours: int = 24) -> Dict[str, Any]:
     """
     metrics = get_token_metrics(hours=hours)
     rate_events = get_rate_limit_events(hours=hours)
+    # Requests without LLM calls (quiz fast path, cancelled early) only count for latency
+    llm_metrics = [m for m in metrics if m.get("llm_call_count") != 0]
 
     report = {
         "period_hours": hours,
         "generated_at": datetime.now(timezone.utc).isoformat(),
-        "token_usage": _aggregate_token_usage(metrics),
-        "cache_analysis": _analyze_cache(metrics),
-        "cost_analysis": _calculate_costs(metrics),
+        "token_usage": _aggregate_token_usage(llm_metrics),
+        "latency": _aggregate_latency(metrics),
+        "llm_calls": _aggregate_llm_calls(llm_metrics),
+        "cache_analysis": _analyze_cache(llm_metrics),
+        "cost_analysis": _calculate_costs(llm_metrics),
         "rate_limits": _summarize_rate_limits(rate_events),
+        "connection_pool": get_pool_stats(),
+        "write_behind": get_write_behind_stats(),
+        "checkpointer": get_checkpointer_stats(),
+        "docs_sync": get_docs_sync_stats(),
+        "docs_cache": get_docs_cache_stats(),
+        "context_cache": get_context_cache_stats(),
+        "retrieval": get_retrieval_stats(),
+        "quiz_bank": get_quiz_bank_stats(),
+        "quiz_sessions": get_quiz_session_stats(),
+        "quiz_router": get_quiz_router_stats(),
+        "user_profiles": get_user_profile_stats(),
+        "disconnects": get_disconnect_stats(),
+        "stream_resume": get_event_log_stats(),
+        "admission": get_admission_stats(),
         "recommendations": [],
     }
 
@@ -60,11 +93,16 @@ def _aggregate_token_usage(metrics: List[Dict]) -> Dict[str, Any]:
             "avg_input_tokens": 0,
             "avg_output_tokens": 0,
             "avg_duration_ms": 0,
+            "total_thinking_tokens": 0,
+            "total_llm_calls": 0,
+            "avg_llm_calls_per_request": 0,
+            "interrupted_requests": 0,
         }
 
-    total_input = sum(m.get("input_tokens", 0) for m in metrics)
-    total_output = sum(m.get("output_tokens", 0) for m in metrics)
-    total_tokens = sum(m.get("total_tokens", 0) for m in metrics)
+    calls = [c for m in metrics for c in metric_calls(m)]
+    total_input = sum(c.get("input_tokens", 0) for c in calls)
+    total_output = sum(c.get("output_tokens", 0) for c in calls)
+    total_tokens = sum(c.get("total_tokens", 0) for c in calls)
     durations = [m["request_duration_ms"] for m in metrics if m.get("request_duration_ms")]
 
     return {
@@ -75,6 +113,63 @@ def _aggregate_token_usage(metrics: List[Dict]) -> Dict[str, Any]:
         "avg_input_tokens": total_input // len(metrics) if metrics else 0,
         "avg_output_tokens": total_output // len(metrics) if metrics else 0,
         "avg_duration_ms": round(sum(durations) / len(durations), 1) if durations else 0,
+        "total_thinking_tokens": sum(c.get("thinking_tokens", 0) for c in calls),
+        "total_llm_calls": len(calls),
+        "avg_llm_calls_per_request": round(len(calls) / len(metrics), 2),
+        # Client disconnected mid-answer: tokens are counted up to the cancellation
+        "interrupted_requests": sum(1 for m in metrics if m.get("interrupted")),
+    }
+
+
+def _aggregate_llm_calls(metrics: List[Dict]) -> Dict[str, Any]:
+    """
+    Per-call breakdown of ReAct runs: tokens, cost and latency by position in the run
+    (call 0 answers or picks a tool, later calls follow tool results).
+    """
+    by_index: Dict[int, List[Dict]] = {}
+    for m in metrics:
+        for call in metric_calls(m):
+            by_index.setdefault(call.get("call_index", 0), []).append(call)
+
+    return {
+        "requests_with_breakdown": sum(1 for m in metrics if m.get("llm_calls")),
+        "multi_call_requests": sum(1 for m in metrics if len(metric_calls(m)) > 1),
+        "by_call_index": {
+            str(index): {
+                "calls": len(calls),
+                "input_tokens": sum(c.get("input_tokens", 0) for c in calls),
+                "output_tokens": sum(c.get("output_tokens", 0) for c in calls),
+                "cached_tokens": sum(c.get("cached_tokens", 0) for c in calls),
+                "thinking_tokens": sum(c.get("thinking_tokens", 0) for c in calls),
+                "cost_usd": round(sum(_call_cost(c) for c in calls), 4),
+                "latency_ms": percentiles([c["latency_ms"] for c in calls if c.get("latency_ms") is not None]),
+            }
+            for index, calls in sorted(by_index.items())
+        },
+    }
+
+
+def _aggregate_latency(metrics: List[Dict]) -> Dict[str, Any]:
+    """p50/p95/p99 of time-to-first-token, stream end and each traced phase (milliseconds)."""
+    traced = [m for m in metrics if m.get("phases_ms")]
+    marks: Dict[str, List[float]] = {}
+    phases: Dict[str, List[float]] = {}
+    for m in traced:
+        for name, ms in (m.get("marks_ms") or {}).items():
+            marks.setdefault(name, []).append(ms)
+        for name, ms in m["phases_ms"].items():
+            phases.setdefault(name, []).append(ms)
+
+    queue_waits = [m["queue_wait_ms"] for m in metrics if m.get("queue_wait_ms") is not None]
+    return {
+        "traced_requests": len(traced),
+        "queue_wait_ms": percentiles(queue_waits),
+        "ttft_ms": percentiles(marks.get("first_token", [])),
+        "last_token_ms": percentiles(marks.get("last_token", [])),
+        "phases": {
+            name: {"count": len(values), **percentiles(values)}
+            for name, values in sorted(phases.items())
+        },
     }
 
 
@@ -87,6 +182,9 @@ def _analyze_cache(metrics: List[Dict]) -> Dict[str, Any]:
             "cache_hit_rate_percent": 0,
             "avg_cache_ratio_percent": 0,
             "caching_active": False,
+            "explicit_cache_requests": 0,
+            "explicit_cached_tokens": 0,
+            "by_prefix_hash": {},
         }
 
     total_cached = sum(m.get("cached_tokens", 0) for m in metrics)
@@ -94,6 +192,7 @@ def _analyze_cache(metrics: List[Dict]) -> Dict[str, Any]:
     total_input = sum(m.get("input_tokens", 0) for m in metrics)
 
     cache_ratio = (total_cached / total_input * 100) if total_input > 0 else 0
+    explicit = [m for m in metrics if m.get("explicit_cache")]
 
     return {
         "total_cached_tokens": total_cached,
@@ -101,9 +200,31 @@ def _analyze_cache(metrics: List[Dict]) -> Dict[str, Any]:
         "cache_hit_rate_percent": round(cache_hits / len(metrics) * 100, 1) if metrics else 0,
         "avg_cache_ratio_percent": round(cache_ratio, 1),
         "caching_active": total_cached > 0,
+        "explicit_cache_requests": len(explicit),
+        "explicit_cached_tokens": sum(m.get("cached_tokens", 0) for m in explicit),
+        "by_prefix_hash": _cache_by_prefix_hash(metrics),
     }
 
 
+def _cache_by_prefix_hash(metrics: List[Dict]) -> Dict[str, Dict[str, Any]]:
+    """Cache hit rate per static prompt prefix: a stable prefix should show one dominant hash."""
+    groups: Dict[str, List[Dict]] = {}
+    for m in metrics:
+        if m.get("prompt_prefix_hash"):
+            groups.setdefault(m["prompt_prefix_hash"], []).append(m)
+
+    result = {}
+    for prefix_hash, group in groups.items():
+        cached = sum(m.get("cached_tokens", 0) for m in group)
+        total_input = sum(m.get("input_tokens", 0) for m in group)
+        result[prefix_hash] = {
+            "requests": len(group),
+            "cache_hit_rate_percent": round(sum(1 for m in group if m.get("cached_tokens", 0) > 0) / len(group) * 100, 1),
+            "avg_cache_ratio_percent": round(cached / total_input * 100, 1) if total_input else 0,
+        }
+    return result
+
+
 def _calculate_costs(metrics: List[Dict]) -> Dict[str, Any]:
     """Calculate actual and projected costs."""
     if not metrics:
@@ -114,17 +235,13 @@ def _calculate_costs(metrics: List[Dict]) -> Dict[str, Any]:
             "projected_monthly_usd": 0,
         }
 
-    total_input = sum(m.get("input_tokens", 0) for m in metrics)
-    total_output = sum(m.get("output_tokens", 0) for m in metrics)
-    total_cached = sum(m.get("cached_tokens", 0) for m in metrics)
-    non_cached_input = total_input - total_cached
+    # Every LLM call of a request is billed, not only the last one
+    calls = [c for m in metrics for c in metric_calls(m)]
+    total_input = sum(c.get("input_tokens", 0) for c in calls)
+    total_output = sum(c.get("output_tokens", 0) for c in calls)
 
     # Actual cost (non-cached input at full price + cached at discounted price + output)
-    actual_cost = (
-        (non_cached_input / 1_000_000 * PRICING["input"])
-        + (total_cached / 1_000_000 * PRICING["cached_input"])
-        + (total_output / 1_000_000 * PRICING["output"])
-    )
+    actual_cost = sum(_call_cost(c) for c in calls)
 
     # Cost without cache (all input at full price + output)
     cost_no_cache = (
@@ -151,6 +268,16 @@ def _calculate_costs(metrics: List[Dict]) -> Dict[str, Any]:
     }
 
 
+def _call_cost(call: Dict) -> float:
+    """Cost of one LLM call in USD."""
+    cached = call.get("cached_tokens", 0)
+    return (
+        ((call.get("input_tokens", 0) - cached) / 1_000_000 * PRICING["input"])
+        + (cached / 1_000_000 * PRICING["cached_input"])
+        + (call.get("output_tokens", 0) / 1_000_000 * PRICING["output"])
+    )
+
+
 def _summarize_rate_limits(events: List[Dict]) -> Dict[str, Any]:
     """Summarize rate limit events."""
     if not events:
@@ -189,7 +316,7 @@ def _generate_recommendations(report: Dict) -> List[str]:
             "CACHING: Implicit caching is NOT active. "
             "Consider enabling explicit caching to reduce costs by up to 75%."
         )
-    elif cache["avg_cache_ratio_percent"] < 30:
+    elif cache["avg_cache_ratio_percent"] < 30 and not cache.get("explicit_cache_requests"):
         recs.append(
             f"CACHING: Cache ratio is low ({cache['avg_cache_ratio_percent']:.1f}%). "
             "Consider explicit caching for the static system prompt."
@@ -206,14 +333,32 @@ def _generate_recommendations(report: Dict) -> List[str]:
     if rate["total_events"] > 0:
         recs.append(
             f"RATE LIMITS: {rate['total_events']} rate limit events detected. "
-            f"Types: {rate['by_type']}. Consider implementing request throttling."
+            f"Types: {rate['by_type']}. Consider lowering ADMISSION_MAX_CONCURRENT "
+            "or ADMISSION_USER_RATE_PER_MINUTE."
+        )
+
+    # Admission control recommendations
+    admission = report["admission"]
+    rejected = admission["rejected_queue_full"] + admission["rejected_deadline"]
+    if rejected:
+        recs.append(
+            f"ADMISSION: {rejected} requests rejected with 503 (queue wait p95 "
+            f"{admission['queue_wait_ms']['p95']:.0f} ms). If Gemini quota allows, raise "
+            "ADMISSION_MAX_CONCURRENT or add instances."
+        )
+
+    # Agent loop recommendations
+    if usage["avg_llm_calls_per_request"] > 2.5:
+        recs.append(
+            f"AGENT LOOPS: Requests make {usage['avg_llm_calls_per_request']:.1f} LLM calls on average. "
+            "Check llm_calls.by_call_index for tool round-trips that could be routed without the LLM."
         )
 
     # Token usage recommendations
     if usage["avg_input_tokens"] > 200_000:
         recs.append(
             f"CONTEXT SIZE: Average input is {usage['avg_input_tokens']:,} tokens. "
-            "Consider reducing static context or implementing selective document loading."
+            "Consider reducing static context or enabling RETRIEVAL_MODE (selective document loading)."
         )
 
     if not recs:
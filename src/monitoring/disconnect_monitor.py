@@ -0,0 +1,59 @@
+"""
+Disconnect monitor for AIR Coach API.
+
+Counts requests interrupted because the SSE client went away, the LLM calls cancelled
+with them, the tokens they had already used and an estimate of the output tokens saved
+by cancelling instead of letting the model finish. Process-local, exposed on the
+monitoring dashboard.
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+_lock = threading.Lock()
+_stats: Dict[str, int] = dict.fromkeys(
+    ("interrupted_requests", "cancelled_llm_calls", "tokens_used_before_cancel", "estimated_tokens_saved"), 0,
+)
+# Moving average of the output tokens (thinking included) of a completed LLM call
+_avg_call_output_tokens: Optional[float] = None
+
+
+def record_completed_call(output_tokens: int) -> None:
+    """Feed the per-call output average used to estimate the tokens saved by a cancel."""
+    global _avg_call_output_tokens
+    with _lock:
+        if _avg_call_output_tokens is None:
+            _avg_call_output_tokens = float(output_tokens)
+        else:
+            _avg_call_output_tokens = 0.9 * _avg_call_output_tokens + 0.1 * output_tokens
+
+
+def record_interrupted_request(cancelled_calls: List[Dict[str, Any]], in_flight: int) -> None:
+    """
+    Record an interrupted request.
+
+    Args:
+        cancelled_calls: Usage records of the in-flight calls that had reported tokens
+        in_flight: Number of LLM calls running at the time of the disconnect
+    """
+    with _lock:
+        average = _avg_call_output_tokens or 0
+        if in_flight:
+            # Each cancelled call would have produced about an average call's output
+            saved = sum(max(0, average - c.get("output_tokens", 0)) for c in cancelled_calls)
+            saved += average * max(0, in_flight - len(cancelled_calls))
+        else:
+            # Disconnected during a tool: the follow-up LLM call is skipped
+            saved = average
+        _stats["interrupted_requests"] += 1
+        _stats["cancelled_llm_calls"] += in_flight
+        _stats["tokens_used_before_cancel"] += sum(c.get("total_tokens", 0) for c in cancelled_calls)
+        _stats["estimated_tokens_saved"] += int(saved)
+
+
+def get_disconnect_stats() -> Dict[str, Any]:
+    """Interrupted requests, cancelled LLM calls and estimated tokens saved."""
+    with _lock:
+        return {
+            **_stats,
+            "avg_call_output_tokens": round(_avg_call_output_tokens or 0, 1),
+        }
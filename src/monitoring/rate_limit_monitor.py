@@ -32,25 +32,33 @@ def log_rate_limit_event(
         The saved event document, or None if failed
     """
     try:
-        # Try to detect limit type from error message
-        if limit_type == "unknown":
-            limit_type = _detect_limit_type(error_message)
-
-        event = {
-            "user_id": user_id,
-            "limit_type": limit_type,
-            "model": model,
-            "error_message": str(error_message)[:500],  # Truncate long messages
-            "timestamp": datetime.now(timezone.utc),
-        }
-
+        event = _build_event(user_id, model, error_message, limit_type)
         _save_event(event)
+        _log_event(event)
+        return event
+
+    except Exception as e:
+        logger.error(f"RATE_LIMIT - Error logging rate limit event: {e}")
+        return None
 
-        logger.warning(
-            f"RATE_LIMIT - User: {user_id}, Type: {limit_type}, "
-            f"Model: {model}, Error: {str(error_message)[:200]}"
-        )
 
+def queue_rate_limit_event(
+    user_id: str,
+    model: str,
+    error_message: str,
+    limit_type: str = "unknown",
+) -> Optional[Dict[str, Any]]:
+    """
+    Variant of log_rate_limit_event for the end of a stream: the event is handed to the
+    write-behind queue and persisted in the background. Same arguments and return value.
+    """
+    from .token_logger import TOKEN_METRICS_DB
+    from ..services.database.write_behind import get_write_behind_queue
+
+    try:
+        event = _build_event(user_id, model, error_message, limit_type)
+        get_write_behind_queue().enqueue(TOKEN_METRICS_DB, RATE_LIMIT_COLLECTION, event)
+        _log_event(event)
         return event
 
     except Exception as e:
@@ -58,6 +66,28 @@ def log_rate_limit_event(
         return None
 
 
+def _build_event(user_id: str, model: str, error_message: str, limit_type: str) -> Dict[str, Any]:
+    """Build the rate limit event document."""
+    # Try to detect limit type from error message
+    if limit_type == "unknown":
+        limit_type = _detect_limit_type(error_message)
+
+    return {
+        "user_id": user_id,
+        "limit_type": limit_type,
+        "model": model,
+        "error_message": str(error_message)[:500],  # Truncate long messages
+        "timestamp": datetime.now(timezone.utc),
+    }
+
+
+def _log_event(event: Dict[str, Any]) -> None:
+    logger.warning(
+        f"RATE_LIMIT - User: {event['user_id']}, Type: {event['limit_type']}, "
+        f"Model: {event['model']}, Error: {event['error_message'][:200]}"
+    )
+
+
 def _detect_limit_type(error_message: str) -> str:
     """Detect the type of rate limit from the error message."""
     msg = str(error_message).lower()
@@ -7,7 +7,7 @@ Enabled via ENABLE_TOKEN_LOGGING env var (default: true).
 import time
 import logging
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 logger = logging.getLogger("uvicorn")
 
@@ -21,6 +21,7 @@ def log_token_usage(
     usage_metadata: Optional[Dict[str, Any]],
     request_duration_ms: Optional[float] = None,
     metadata: Optional[Dict[str, Any]] = None,
+    llm_calls: Optional[List[Dict[str, Any]]] = None,
 ) -> Optional[Dict[str, Any]]:
     """
     Log token usage metrics to MongoDB.
@@ -31,74 +32,48 @@ def log_token_usage(
         usage_metadata: Token usage data from the LLM response
         request_duration_ms: Request duration in milliseconds
         metadata: Additional metadata (e.g., thread_id, message_id)
+        llm_calls: Per-call breakdown of usage_metadata (see StreamingHandler.get_llm_calls)
 
     Returns:
         The saved metric document, or None if logging is disabled/failed
     """
-    from ..env import settings
+    try:
+        metric = _build_metric(user_id, model, usage_metadata, request_duration_ms, metadata, llm_calls)
+        if metric is None:
+            return None
 
-    if not getattr(settings, "ENABLE_TOKEN_LOGGING", True):
-        return None
+        # Persist to MongoDB
+        _save_metric(metric)
+        _log_metric(metric)
+        return metric
 
-    if not usage_metadata:
-        logger.debug("TOKEN_LOGGER - No usage_metadata provided, skipping")
+    except Exception as e:
+        logger.error(f"TOKEN_LOGGER - Error logging token usage: {e}")
         return None
 
-    try:
-        logger.debug(
-            f"TOKEN_LOGGER - Raw usage_metadata keys: {list(usage_metadata.keys())}"
-            + (f", input_token_details: {usage_metadata.get('input_token_details')}"
-               if "input_token_details" in usage_metadata else "")
-        )
-
-        # Extract token counts from usage_metadata
-        input_tokens = (
-            usage_metadata.get("input_tokens")
-            or usage_metadata.get("prompt_token_count")
-            or 0
-        )
-        output_tokens = (
-            usage_metadata.get("output_tokens")
-            or usage_metadata.get("candidates_token_count")
-            or 0
-        )
-        total_tokens = (
-            usage_metadata.get("total_tokens")
-            or usage_metadata.get("total_token_count")
-            or (input_tokens + output_tokens)
-        )
-        cached_tokens = (
-            usage_metadata.get("input_token_details", {}).get("cache_read")
-            or usage_metadata.get("cached_tokens")
-            or usage_metadata.get("cached_content_token_count")
-            or 0
-        )
-
-        metric = {
-            "user_id": user_id,
-            "model": model,
-            "input_tokens": input_tokens,
-            "output_tokens": output_tokens,
-            "total_tokens": total_tokens,
-            "cached_tokens": cached_tokens,
-            "request_duration_ms": request_duration_ms,
-            "timestamp": datetime.now(timezone.utc),
-            "metadata": metadata or {},
-        }
 
-        # Persist to MongoDB
-        _save_metric(metric)
+def queue_token_usage(
+    user_id: str,
+    model: str,
+    usage_metadata: Optional[Dict[str, Any]],
+    request_duration_ms: Optional[float] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+    llm_calls: Optional[List[Dict[str, Any]]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Variant of log_token_usage for the end of a stream: the metric is handed to the
+    write-behind queue and persisted in the background. Same arguments and return value.
+    """
+    from ..env import COLLECTION_NAME
+    from ..services.database.write_behind import get_write_behind_queue
 
-        logger.info(
-            f"TOKEN_LOGGER - User: {user_id}, "
-            f"Input: {input_tokens}, Output: {output_tokens}, "
-            f"Cached: {cached_tokens}, Duration: {request_duration_ms:.0f}ms"
-            if request_duration_ms
-            else f"TOKEN_LOGGER - User: {user_id}, "
-            f"Input: {input_tokens}, Output: {output_tokens}, "
-            f"Cached: {cached_tokens}"
-        )
+    try:
+        metric = _build_metric(user_id, model, usage_metadata, request_duration_ms, metadata, llm_calls)
+        if metric is None:
+            return None
 
+        get_write_behind_queue().enqueue(TOKEN_METRICS_DB, COLLECTION_NAME, metric)
+        _log_metric(metric)
         return metric
 
     except Exception as e:
@@ -106,6 +81,164 @@ def log_token_usage(
         return None
 
 
+def usage_counts(usage_metadata: Dict[str, Any]) -> Dict[str, int]:
+    """Normalize LangChain / Google AI usage fields to input/output/total/cached/thinking counts."""
+    input_tokens = (
+        usage_metadata.get("input_tokens")
+        or usage_metadata.get("prompt_token_count")
+        or 0
+    )
+    output_tokens = (
+        usage_metadata.get("output_tokens")
+        or usage_metadata.get("candidates_token_count")
+        or 0
+    )
+    total_tokens = (
+        usage_metadata.get("total_tokens")
+        or usage_metadata.get("total_token_count")
+        or (input_tokens + output_tokens)
+    )
+    cached_tokens = (
+        usage_metadata.get("input_token_details", {}).get("cache_read")
+        or usage_metadata.get("cached_tokens")
+        or usage_metadata.get("cached_content_token_count")
+        or 0
+    )
+    thinking_tokens = (
+        usage_metadata.get("output_token_details", {}).get("reasoning")
+        or usage_metadata.get("thoughts_token_count")
+        or 0
+    )
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": total_tokens,
+        "cached_tokens": cached_tokens,
+        "thinking_tokens": thinking_tokens,
+    }
+
+
+def sum_usage(usages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Field-by-field sum of usage_metadata dicts (nested details included)."""
+    total: Dict[str, Any] = {}
+    for usage in usages:
+        for key, value in usage.items():
+            if isinstance(value, dict):
+                total[key] = sum_usage([total.get(key) or {}, value])
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                total[key] = total.get(key, 0) + value
+            else:
+                total.setdefault(key, value)
+    return total
+
+
+def metric_calls(metric: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Per-call breakdown of a metric document. Documents written before the breakdown
+    existed are returned as a single call with the top-level counts; requests that made
+    no LLM call have none.
+    """
+    if metric.get("llm_call_count") == 0:
+        return []
+    if metric.get("llm_calls"):
+        return metric["llm_calls"]
+    return [{
+        "call_index": 0,
+        "node": None,
+        "input_tokens": metric.get("input_tokens", 0),
+        "output_tokens": metric.get("output_tokens", 0),
+        "total_tokens": metric.get("total_tokens", 0),
+        "cached_tokens": metric.get("cached_tokens", 0),
+        "thinking_tokens": metric.get("thinking_tokens", 0),
+        "latency_ms": None,
+    }]
+
+
+def _build_metric(
+    user_id: str,
+    model: str,
+    usage_metadata: Optional[Dict[str, Any]],
+    request_duration_ms: Optional[float],
+    metadata: Optional[Dict[str, Any]],
+    llm_calls: Optional[List[Dict[str, Any]]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Build the metric document, or None if logging is disabled or there is nothing to record.
+
+    usage_metadata is the sum over all LLM calls of the request; llm_calls keeps the
+    per-call breakdown (a ReAct turn with tools makes several calls). A request without
+    usage (quiz fast path, cancelled before the first usage chunk) is still recorded when
+    it has a trace or a queue wait, with zero tokens and llm_call_count 0, so that the
+    latency percentiles cover every request.
+    """
+    from ..env import settings
+
+    if not getattr(settings, "ENABLE_TOKEN_LOGGING", True):
+        return None
+
+    metadata = dict(metadata or {})
+    trace = metadata.pop("trace", None) or {}
+
+    if not usage_metadata:
+        if not trace and metadata.get("queue_wait_ms") is None:
+            logger.debug("TOKEN_LOGGER - No usage_metadata or trace provided, skipping")
+            return None
+        usage_metadata, llm_calls = {}, []
+        llm_call_count = 0
+    else:
+        logger.debug(
+            f"TOKEN_LOGGER - Raw usage_metadata keys: {list(usage_metadata.keys())}"
+            + (f", input_token_details: {usage_metadata.get('input_token_details')}"
+               if "input_token_details" in usage_metadata else "")
+        )
+        llm_call_count = len(llm_calls) if llm_calls else 1
+
+    return {
+        "user_id": user_id,
+        "model": model,
+        **usage_counts(usage_metadata),
+        "llm_call_count": llm_call_count,
+        "llm_calls": list(llm_calls or []),
+        "explicit_cache": bool(metadata.get("explicit_cache")),
+        "interrupted": bool(metadata.get("interrupted")),
+        "prompt_prefix_hash": metadata.get("prompt_prefix_hash"),
+        "request_duration_ms": request_duration_ms,
+        "queue_wait_ms": metadata.get("queue_wait_ms"),  # Time spent in the admission queue
+        # Per-phase latency (see tracing.RequestTrace.to_document)
+        "trace_id": trace.get("trace_id"),
+        "ttft_ms": trace.get("marks_ms", {}).get("first_token"),
+        "marks_ms": trace.get("marks_ms", {}),
+        "phases_ms": trace.get("phases_ms", {}),
+        "spans": trace.get("spans", []),
+        "timestamp": datetime.now(timezone.utc),
+        "metadata": metadata,
+    }
+
+
+def _log_metric(metric: Dict[str, Any]) -> None:
+    """Log a one-line summary of a saved metric."""
+    user_id = metric["user_id"]
+    input_tokens = metric["input_tokens"]
+    output_tokens = metric["output_tokens"]
+    cached_tokens = metric["cached_tokens"]
+    if metric.get("explicit_cache"):
+        cached_tokens = f"{cached_tokens} (explicit)"
+    request_duration_ms = metric["request_duration_ms"]
+    if metric.get("llm_call_count", 1) > 1:
+        output_tokens = f"{output_tokens} ({metric['llm_call_count']} LLM calls)"
+    if metric.get("prompt_prefix_hash"):
+        cached_tokens = f"{cached_tokens}, Prefix: {metric['prompt_prefix_hash']}"
+    logger.info(
+        f"TOKEN_LOGGER - User: {user_id}, "
+        f"Input: {input_tokens}, Output: {output_tokens}, "
+        f"Cached: {cached_tokens}, Duration: {request_duration_ms:.0f}ms"
+        if request_duration_ms
+        else f"TOKEN_LOGGER - User: {user_id}, "
+        f"Input: {input_tokens}, Output: {output_tokens}, "
+        f"Cached: {cached_tokens}"
+    )
+
+
 def _save_metric(metric: Dict[str, Any]) -> None:
     """Save a metric document to MongoDB."""
     from ..env import COLLECTION_NAME
@@ -0,0 +1,279 @@
+"""
+Per-request span tracing for AIR Coach API.
+
+A RequestTrace is started when the request is authenticated and follows it through the
+pipeline: auth/JWKS verify, prompt initialization, Auth0 metadata fetch, agent build,
+memory seeding, pre_model_hook, tool execution and persistence. Two marks record the
+first and last streamed token relative to the start of the request (time-to-first-token
+and total streaming latency).
+
+The current trace lives in a ContextVar, so code deep in the pipeline (the Auth0 fetch,
+the pre_model_hook running in LangGraph's executor) adds spans with trace_span() without
+the trace being passed around; outside a request trace_span() is a no-op.
+
+At the end of the stream the trace is stored with the token-metrics document and,
+when TRACE_EXPORT_FILE is set, appended to that file as OTLP/JSON (one
+ExportTraceServiceRequest per line, the format read by the OpenTelemetry Collector
+otlpjsonfile receiver and accepted by OTLP/HTTP JSON endpoints).
+"""
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from ..env import settings
+
+logger = logging.getLogger("uvicorn")
+
+SERVICE_NAME = "air-coach-api"
+
+# Id of the innermost open span: spans opened while it is set become its children
+_current_span: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    """A timed phase of the request. Times are perf_counter nanoseconds."""
+    name: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: int
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class RequestTrace:
+    """Spans and marks of a single request."""
+
+    def __init__(self, name: str = "request"):
+        self.name = name
+        self.trace_id = secrets.token_hex(16)
+        self.root_span_id = secrets.token_hex(8)
+        self.start_unix_ns = time.time_ns()
+        self.start_ns = time.perf_counter_ns()
+        self.spans: List[Span] = []
+        self.marks: Dict[str, float] = {}
+
+    def now_ns(self) -> int:
+        return time.perf_counter_ns()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter_ns() - self.start_ns) / 1e6
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+        """Time the enclosed block; spans opened inside it become its children."""
+        span_id = secrets.token_hex(8)
+        parent_id = _current_span.get()
+        token = _current_span.set(span_id)
+        start_ns = time.perf_counter_ns()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            self.spans.append(Span(name, span_id, parent_id, start_ns, time.perf_counter_ns(), attributes))
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                pass  # closed in a different context (e.g. async generator finalized elsewhere)
+
+    def add_span(self, name: str, start_ns: int, end_ns: Optional[int] = None, **attributes: Any) -> None:
+        """Record a span measured by the caller (e.g. between two streaming events)."""
+        self.spans.append(Span(
+            name, secrets.token_hex(8), _current_span.get(), start_ns, end_ns or time.perf_counter_ns(), attributes,
+        ))
+
+    def mark(self, name: str, first_only: bool = False) -> None:
+        """Milliseconds from the start of the request to now (first_only keeps the earliest)."""
+        if first_only and name in self.marks:
+            return
+        self.marks[name] = round(self.elapsed_ms(), 1)
+
+    def phases_ms(self) -> Dict[str, float]:
+        """Total duration per span name (a phase can run more than once, e.g. pre_model_hook)."""
+        phases: Dict[str, float] = {}
+        for span in self.spans:
+            phases[span.name] = phases.get(span.name, 0.0) + span.duration_ms
+        return {name: round(ms, 1) for name, ms in phases.items()}
+
+    def to_document(self) -> Dict[str, Any]:
+        """Representation stored with the token-metrics document."""
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": round(self.elapsed_ms(), 1),
+            "marks_ms": dict(self.marks),
+            "phases_ms": self.phases_ms(),
+            "spans": [
+                {
+                    "name": span.name,
+                    "start_ms": round((span.start_ns - self.start_ns) / 1e6, 1),
+                    "duration_ms": round(span.duration_ms, 1),
+                    **({"attributes": span.attributes} if span.attributes else {}),
+                }
+                for span in sorted(self.spans, key=lambda s: s.start_ns)
+            ],
+        }
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def start_trace(name: str = "request") -> Optional[RequestTrace]:
+    """Start a trace for the current request and make it current (None when tracing is disabled)."""
+    if not settings.TRACING_ENABLED:
+        return None
+    trace = RequestTrace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def set_current_trace(trace: Optional[RequestTrace]) -> None:
+    """Make `trace` current in this context (e.g. in the task that iterates the response stream)."""
+    _current_trace.set(trace)
+
+
+@contextmanager
+def trace_span(name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """Span on the current trace; no-op outside a traced request."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield attributes
+        return
+    with trace.span(name, **attributes) as attrs:
+        yield attrs
+
+
+def percentiles(values: Sequence[float], points: Sequence[int] = (50, 95, 99)) -> Dict[str, float]:
+    """Nearest-rank percentiles, e.g. {"p50": ..., "p95": ..., "p99": ...}."""
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{p}": 0 for p in points}
+    result = {}
+    for p in points:
+        rank = max(1, -(-p * len(ordered) // 100))  # ceil(p/100 * n)
+        result[f"p{p}"] = round(ordered[rank - 1], 1)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# OTLP/JSON file exporter
+# ---------------------------------------------------------------------------
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def to_otlp_json(trace: RequestTrace, attributes: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    OTLP ExportTraceServiceRequest (JSON encoding) for a trace: a root span for the whole
+    request, the phase spans, and the marks as events on the root span.
+    """
+    def unix_ns(perf_ns: int) -> str:
+        return str(trace.start_unix_ns + perf_ns - trace.start_ns)
+
+    end_ns = time.perf_counter_ns()
+    root = {
+        "traceId": trace.trace_id,
+        "spanId": trace.root_span_id,
+        "name": trace.name,
+        "kind": 2,  # SPAN_KIND_SERVER
+        "startTimeUnixNano": str(trace.start_unix_ns),
+        "endTimeUnixNano": unix_ns(end_ns),
+        "attributes": _otlp_attributes(attributes or {}),
+        "events": [
+            {"name": name, "timeUnixNano": str(trace.start_unix_ns + int(ms * 1e6))}
+            for name, ms in trace.marks.items()
+        ],
+    }
+    spans = [root] + [
+        {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or trace.root_span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": unix_ns(span.start_ns),
+            "endTimeUnixNano": unix_ns(span.end_ns),
+            "attributes": _otlp_attributes(span.attributes),
+            **({"status": {"code": 2, "message": str(span.attributes["error"])}} if "error" in span.attributes else {}),
+        }
+        for span in sorted(trace.spans, key=lambda s: s.start_ns)
+    ]
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]
+    }
+
+
+class OTLPJsonFileExporter:
+    """Appends each trace to a local file as one line of OTLP/JSON."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.failures = 0
+
+    def export(self, trace: RequestTrace, attributes: Optional[Dict[str, Any]] = None) -> bool:
+        line = json.dumps(to_otlp_json(trace, attributes), separators=(",", ":"))
+        try:
+            with self._lock:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                self.exported += 1
+            return True
+        except OSError as e:
+            self.failures += 1
+            logger.warning(f"TRACING - Export to {self.path} failed: {e}")
+            return False
+
+
+_exporter: Optional[OTLPJsonFileExporter] = None
+
+
+def get_trace_exporter() -> Optional[OTLPJsonFileExporter]:
+    """File exporter configured by TRACE_EXPORT_FILE (None when not set)."""
+    global _exporter
+    path = settings.TRACE_EXPORT_FILE
+    if not path:
+        return None
+    if _exporter is None or _exporter.path != path:
+        _exporter = OTLPJsonFileExporter(path)
+    return _exporter
+
+
+def export_trace(trace: Optional[RequestTrace], attributes: Optional[Dict[str, Any]] = None) -> None:
+    exporter = get_trace_exporter()
+    if trace is not None and exporter is not None:
+        exporter.export(trace, attributes)
@@ -1,62 +1,225 @@
-from typing import Optional, Tuple
+import datetime
+import hashlib
+from typing import List, NamedTuple, Optional, Tuple
 
 from .auth0 import get_user_metadata
 from .cache import get_cached_user_data, set_cached_user_data
+from .env import settings
+from .monitoring.tracing import trace_span
+from .retrieval import get_docs_retriever
+from .user_profile_cache import get_user_profile_cache
 import logging
 logger = logging.getLogger("uvicorn")
 from .utils import format_user_metadata, get_prompt_with_version
 
 
 USER_SECTION_HEADER = "## Informazioni Utente Corrente"
+USER_SECTION_INSTRUCTIONS = (
+    "Usa le informazioni seguenti per adattare tono, contenuto ed esempi alle caratteristiche dell'utente."
+)
+NO_USER_INFO = "L'utente non ha fornito informazioni su di sè."
+RETRIEVED_DOCS_HEADER = "## Estratti della documentazione rilevanti per la domanda"
+SEGMENT_SEPARATOR = "\n\n"
 
+# Ordine canonico dei segmenti dinamici: dal più condiviso (uguale per tutti nella
+# stessa giornata) al più specifico (per utente, poi per singolo messaggio).
+DYNAMIC_SEGMENT_ORDER = ("date", "user_profile", "retrieved_docs")
 
-def build_personalized_prompt(base_prompt: str, user_info: Optional[str]) -> str:
+
+class PromptSegment(NamedTuple):
+    name: str
+    text: str
+    static: bool
+
+
+def build_prompt_segments(
+    base_prompt: str,
+    user_info: Optional[str],
+    today: Optional[str] = None,
+    retrieved_docs: Optional[str] = None,
+) -> List[PromptSegment]:
+    """
+    Segmenti del system prompt. I segmenti statici (docs e istruzioni) sono identici byte
+    per byte per tutti gli utenti della stessa versione di prompt e formano il prefisso
+    cacheabile; data, profilo utente ed eventuali estratti dei docs (retrieval) seguono
+    come segmenti dinamici.
+    """
+    today = today or datetime.date.today().strftime("%Y-%m-%d")
+    segments = [
+        PromptSegment("docs", base_prompt, static=True),
+        PromptSegment("user_section", f"{USER_SECTION_HEADER}\n{USER_SECTION_INSTRUCTIONS}", static=True),
+        PromptSegment("user_profile", (user_info or "").strip() or NO_USER_INFO, static=False),
+        PromptSegment("date", f"Oggi è il {today}", static=False),
+    ]
+    if retrieved_docs:
+        segments.append(PromptSegment("retrieved_docs", f"{RETRIEVED_DOCS_HEADER}\n\n{retrieved_docs}", static=False))
+    return segments
+
+
+def _static_docs(base_prompt: str, prompt_version: int) -> str:
+    """Docs del prefisso statico: l'intera knowledge base, o la sola sezione core in modalità retrieval."""
+    if settings.RETRIEVAL_MODE and base_prompt:
+        return get_docs_retriever(base_prompt, prompt_version).core
+    return base_prompt
+
+
+def assemble_prompt(segments: List[PromptSegment]) -> Tuple[str, str]:
+    """
+    Compone il prompt: prima i segmenti statici nell'ordine dato, poi quelli dinamici
+    nell'ordine canonico. Ritorna (prompt, prefisso statico).
+    """
+    static = [s for s in segments if s.static]
+    dynamic = sorted(
+        (s for s in segments if not s.static),
+        key=lambda s: DYNAMIC_SEGMENT_ORDER.index(s.name) if s.name in DYNAMIC_SEGMENT_ORDER else len(DYNAMIC_SEGMENT_ORDER),
+    )
+    prefix = SEGMENT_SEPARATOR.join(s.text for s in static if s.text)
+    prompt = SEGMENT_SEPARATOR.join(s.text for s in static + dynamic if s.text)
+    return prompt, prefix
+
+
+def prompt_prefix_hash(prefix: str) -> str:
+    """Hash corto del prefisso statico, loggato con le metriche di token."""
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+
+
+class _StaticPrefix(NamedTuple):
+    base_prompt: str
+    prompt_version: int
+    retrieval_mode: bool
+    prefix: str
+    prefix_hash: str
+
+
+_static_prefix: Optional[_StaticPrefix] = None
+
+
+def _current_static_prefix() -> _StaticPrefix:
+    """
+    Prefisso statico della versione di prompt corrente con il suo hash, calcolati una
+    volta per versione: join e sha256 dell'intera knowledge base non si ripetono a ogni
+    richiesta né a ogni chiamata LLM.
+    """
+    global _static_prefix
+    base_prompt, prompt_version = get_prompt_with_version()
+    retrieval_mode = bool(settings.RETRIEVAL_MODE)
+    cached = _static_prefix
+    if (
+        cached is not None
+        and cached.base_prompt is base_prompt
+        and cached.prompt_version == prompt_version
+        and cached.retrieval_mode == retrieval_mode
+    ):
+        return cached
+    static_docs = _static_docs(base_prompt, prompt_version)
+    _, prefix = assemble_prompt([s for s in build_prompt_segments(static_docs, None) if s.static])
+    cached = _static_prefix = _StaticPrefix(base_prompt, prompt_version, retrieval_mode, prefix, prompt_prefix_hash(prefix))
+    return cached
+
+
+def get_static_prompt_prefix() -> Tuple[str, int]:
+    """Prefisso statico della versione di prompt corrente e relativa versione."""
+    static = _current_static_prefix()
+    return static.prefix, static.prompt_version
+
+
+def prefix_hash_for(prompt: str) -> str:
     """
-    Concatena al prompt base una sezione con i dati utente (se presenti).
+    Hash del prefisso statico effettivamente inviato. Se il prompt non inizia con il
+    prefisso della versione corrente, l'hash è quello dell'intero prompt: un prefisso
+    instabile si vede come hash diversi per richiesta.
     """
-    if not user_info:
-        return base_prompt
-    return f"""{base_prompt}
+    static = _current_static_prefix()
+    if static.prefix and prompt.startswith(static.prefix):
+        return static.prefix_hash
+    return prompt_prefix_hash(prompt)
 
-{USER_SECTION_HEADER}
-{user_info}
-Usa queste informazioni per adattare tono, contenuto ed esempi alle caratteristiche dell'utente.
-"""
+
+def build_personalized_prompt(
+    base_prompt: str,
+    user_info: Optional[str],
+    today: Optional[str] = None,
+    retrieved_docs: Optional[str] = None,
+) -> str:
+    """
+    Prompt completo: prefisso statico (docs + istruzioni) seguito da data, dati utente
+    ed eventuali estratti dei docs.
+    """
+    prompt, _ = assemble_prompt(build_prompt_segments(base_prompt, user_info, today, retrieved_docs))
+    return prompt
 
 
 def get_personalized_prompt_for_user(
     user_id: str,
     token: Optional[str],
     fetch_user_data: bool = True,
+    query: Optional[str] = None,
 ) -> Tuple[str, int, Optional[str]]:
     """
     Ritorna (prompt_personalizzato, prompt_version, user_info_formattato).
-    Il base prompt e la versione provengono dal PromptManager.
+    Il base prompt e la versione provengono dal PromptManager; in modalità retrieval
+    il prompt contiene la sezione core e i chunk più rilevanti per `query`.
     """
-    base_prompt, prompt_version = get_prompt_with_version()
+    base_prompt, prompt_version, retrieved_docs = _prompt_docs(query)
     user_info = None
 
     if fetch_user_data:
         try:
             user_info = get_cached_user_data(user_id)
-            if not user_info:
+            if user_info is None:
                 logger.info(f"Auth0: fetch metadata for user {user_id}")
-                metadata = get_user_metadata(user_id, token=token)
+                with trace_span("auth0_metadata"):
+                    metadata = get_user_metadata(user_id, token=token)
                 user_info = format_user_metadata(metadata)
-                if user_info:
-                    set_cached_user_data(user_id, user_info)
+                # Anche "nessun metadata" va in cache, per non interrogare Auth0 a ogni richiesta
+                set_cached_user_data(user_id, user_info)
+        except Exception as e:
+            logger.error(f"User metadata fetch error for {user_id}: {e}")
+            user_info = None
+
+    personalized_prompt = build_personalized_prompt(base_prompt, user_info, retrieved_docs=retrieved_docs)
+    return personalized_prompt, prompt_version, user_info
+
+
+async def aget_personalized_prompt_for_user(
+    user_id: str,
+    token: Optional[str],
+    fetch_user_data: bool = True,
+    query: Optional[str] = None,
+) -> Tuple[str, int, Optional[str]]:
+    """
+    Variante async di get_personalized_prompt_for_user per il percorso di richiesta:
+    il profilo arriva dalla cache a due livelli (vedi user_profile_cache), che interroga
+    Auth0 senza bloccare l'event loop e, per i profili scaduti, in background.
+    """
+    base_prompt, prompt_version, retrieved_docs = _prompt_docs(query)
+    user_info = None
+
+    if fetch_user_data:
+        try:
+            with trace_span("auth0_metadata"):
+                user_info = await get_user_profile_cache().get(user_id)
         except Exception as e:
             logger.error(f"User metadata fetch error for {user_id}: {e}")
             user_info = None
 
-    personalized_prompt = build_personalized_prompt(base_prompt, user_info)
+    personalized_prompt = build_personalized_prompt(base_prompt, user_info, retrieved_docs=retrieved_docs)
     return personalized_prompt, prompt_version, user_info
 
 
+def _prompt_docs(query: Optional[str]) -> Tuple[str, int, Optional[str]]:
+    """Docs del prompt, versione ed eventuali estratti per `query` (modalità retrieval)."""
+    base_prompt, prompt_version = get_prompt_with_version()
+    retrieved_docs = None
+    if settings.RETRIEVAL_MODE and base_prompt:
+        retriever = get_docs_retriever(base_prompt, prompt_version)
+        base_prompt = retriever.core
+        retrieved_docs = retriever.render(retriever.search(query or ""))
+    return base_prompt, prompt_version, retrieved_docs
+
+
 def generate_thread_id(user_id: str, prompt_version: int) -> str:
     """
     Un solo thread per utente per versione di prompt.
     """
     return f"{user_id}:v{prompt_version}"
-
-
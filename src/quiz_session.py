@@ -0,0 +1,182 @@
+"""
+Sessioni di simulazione d'esame per la modalità "domanda casuale" di domanda_teoria.
+
+Alla prima domanda casuale di un utente viene estratto un mazzo d'esame:
+- stratificato per capitolo come l'esame reale (ogni capitolo pesa in proporzione
+  al numero di domande in banca, almeno una domanda per capitolo);
+- senza ripetizioni all'interno della simulazione, in ordine casuale.
+
+Il mazzo è salvato in forma compatta (un array di chiavi capitolo/numero, 4 byte per
+domanda) in una TTLCache di processo: ogni domanda successiva è un pop O(1) dalla banca
+domande in memoria, senza chiamate al DB. La sessione scade dopo QUIZ_SESSION_TTL_SECONDS
+di inattività e, fino ad allora, riprende dal punto in cui era rimasta anche su un nuovo
+thread (es. dopo un aggiornamento dei docs). Esaurito il mazzo, ne viene estratto uno nuovo.
+"""
+import random
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+from .env import settings
+from .services.database.quiz_bank import QuizBank, as_int, copy_question
+
+import logging
+logger = logging.getLogger("uvicorn")
+
+# Chiave compatta di una domanda: capitolo * _KEY_BASE + numero
+_KEY_BASE = 100000
+
+
+def _pack(capitolo: int, numero: int) -> int:
+    return capitolo * _KEY_BASE + numero
+
+
+def _unpack(key: int) -> Tuple[int, int]:
+    return divmod(key, _KEY_BASE)
+
+
+def allocate_by_chapter(chapters: Dict[int, int], total: int) -> Dict[int, int]:
+    """
+    Numero di domande per capitolo: proporzionale alla dimensione del capitolo (metodo dei
+    resti maggiori), almeno una per capitolo se il totale lo consente e mai più di quelle
+    disponibili.
+    """
+    available = {c: n for c, n in chapters.items() if n > 0}
+    total = min(total, sum(available.values()))
+    if not available or total <= 0:
+        return {}
+    size = sum(available.values())
+    quotas = {c: total * n / size for c, n in available.items()}
+    allocation = {c: int(quota) for c, quota in quotas.items()}
+    for c in sorted(available, key=lambda c: (-(quotas[c] - allocation[c]), c)):
+        if sum(allocation.values()) >= total:
+            break
+        allocation[c] += 1
+    if total >= len(available):
+        # I capitoli rimasti a zero prendono una domanda dal capitolo più rappresentato
+        for c in [c for c in available if allocation[c] == 0]:
+            donor = max(allocation, key=lambda d: (allocation[d], -d))
+            allocation[donor] -= 1
+            allocation[c] = 1
+    return {c: n for c, n in allocation.items() if n}
+
+
+def build_exam_deck(bank: QuizBank, total: int, rng: Optional[random.Random] = None) -> array:
+    """Mazzo d'esame stratificato per capitolo, mescolato, come array di chiavi compatte."""
+    rng = rng or random
+    keys: List[int] = []
+    for capitolo, count in allocate_by_chapter(bank.chapters(), total).items():
+        numbers = [n for n in (as_int(q.get("numero")) for q in bank.chapter(capitolo)) if n is not None]
+        keys.extend(_pack(capitolo, n) for n in rng.sample(numbers, min(count, len(numbers))))
+    rng.shuffle(keys)
+    return array("I", keys)
+
+
+@dataclass
+class ExamSession:
+    """Simulazione in corso: mazzo compatto e posizione corrente."""
+    deck: array
+    position: int = 0
+    started_at: float = field(default_factory=time.time)
+
+    @property
+    def total(self) -> int:
+        return len(self.deck)
+
+    @property
+    def finished(self) -> bool:
+        return self.position >= len(self.deck)
+
+    def pop(self) -> Optional[Tuple[int, int]]:
+        if self.finished:
+            return None
+        key = self.deck[self.position]
+        self.position += 1
+        return _unpack(key)
+
+
+class QuizSessionStore:
+    """Sessioni d'esame per utente, con scadenza per inattività."""
+
+    def __init__(
+        self,
+        exam_questions: Optional[int] = None,
+        ttl_seconds: Optional[int] = None,
+        max_users: Optional[int] = None,
+        rng: Optional[random.Random] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.exam_questions = exam_questions or settings.QUIZ_EXAM_QUESTIONS
+        self._sessions: TTLCache = TTLCache(
+            maxsize=max_users or settings.QUIZ_SESSION_MAX_USERS,
+            ttl=ttl_seconds or settings.QUIZ_SESSION_TTL_SECONDS,
+            timer=timer,
+        )
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.decks_built = 0
+        self.questions_served = 0
+
+    def next_question(self, user_id: str, bank: QuizBank) -> Optional[Dict[str, Any]]:
+        """
+        Prossima domanda della simulazione dell'utente (copia del documento, con il campo
+        "esame" che riporta posizione e totale). None se la banca è vuota.
+        """
+        with self._lock:
+            session = self._sessions.get(user_id)
+            while True:
+                if session is None or session.finished:
+                    session = ExamSession(build_exam_deck(bank, self.exam_questions, self._rng))
+                    self.decks_built += 1
+                    logger.info(f"QUIZ_SESSION - Nuova simulazione per {user_id}: {session.total} domande")
+                    if not session.total:
+                        return None
+                key = session.pop()
+                question = bank.get(*key) if key else None
+                if question is not None:
+                    break
+                # Domanda rimossa da un reload della banca: si passa alla successiva
+            self._sessions[user_id] = session  # riassegnare rinnova il TTL
+            self.questions_served += 1
+            position, total = session.position, session.total
+
+        result = copy_question(question)
+        result["esame"] = {"domanda": position, "totale": total}
+        return result
+
+    def get(self, user_id: str) -> Optional[ExamSession]:
+        with self._lock:
+            return self._sessions.get(user_id)
+
+    def reset(self, user_id: str) -> None:
+        """Chiude la simulazione dell'utente: la prossima domanda casuale ne inizia una nuova."""
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "active_sessions": len(self._sessions),
+                "exam_questions": self.exam_questions,
+                "decks_built": self.decks_built,
+                "questions_served": self.questions_served,
+            }
+
+
+_store: Optional[QuizSessionStore] = None
+
+
+def get_quiz_session_store() -> QuizSessionStore:
+    """Store di processo delle sessioni d'esame (creato al primo uso)."""
+    global _store
+    if _store is None:
+        _store = QuizSessionStore()
+    return _store
+
+
+def get_quiz_session_stats() -> Dict[str, Any]:
+    return get_quiz_session_store().stats()
@@ -4,20 +4,26 @@ Handles agent creation and query processing with streaming support.
 """
 import datetime
 import json
-from typing import AsyncGenerator, Optional, Union
+from typing import AsyncGenerator, Awaitable, Callable, Optional, Union
 
 from langchain_core.messages import HumanMessage
 
-from .env import FORCED_MODEL, VERTEX_AI_REGION, CACHE_DEBUG_LOGGING
+from .env import FORCED_MODEL, VERTEX_AI_REGION, CACHE_DEBUG_LOGGING, settings
+from .admission import Admission
 from .utils import get_combined_docs, build_system_prompt, ensure_prompt_initialized
-from .agent.agent_manager import AgentManager
+from .agent.agent_manager import AgentManager, PROMPT_PREFIX_HASH_CONFIG_KEY
+from .agent.context_cache import get_context_cache
+from .agent.event_log import get_event_log_registry
+from .agent.quiz_router import QuizCommand, route_quiz_command
 from .agent.state_manager import _get_checkpointer
 from .agent.streaming_handler import StreamingHandler
 from .memory.seeding import MemorySeeder
 from .memory.persistence import ConversationPersistence
 from .monitoring.cache_monitor import log_request_context
-from .monitoring.token_logger import log_token_usage, RequestTimer
-from .monitoring.rate_limit_monitor import log_rate_limit_event
+from .monitoring.token_logger import queue_token_usage, RequestTimer
+from .monitoring.tracing import RequestTrace, current_trace, export_trace, set_current_trace, start_trace, trace_span
+from .monitoring.rate_limit_monitor import queue_rate_limit_event
+from .tools import domanda_teoria
 
 import logging
 logger = logging.getLogger("uvicorn")
@@ -37,7 +43,7 @@ def generate_message_id(user_id: str) -> str:
 def initialize_agent_state(force: bool = False) -> None:
     """
     Initialize documents and system prompt (lazy).
-    Agent/LLM are created per-request to avoid event loop issues in serverless.
+    Compiled agents/LLM clients are pooled per event loop by AgentRegistry.
     """
     global combined_docs, system_prompt
 
@@ -57,39 +63,141 @@ def ask(
     """
     Process a query via LangGraph agent and return streaming response.
     """
+    # Trace avviato da VerifyToken; le chiamate dirette (test, script) ne aprono uno qui
+    trace = current_trace() or start_trace()
     initialize_agent_state()
 
     if CACHE_DEBUG_LOGGING:
         log_request_context(user_id, FORCED_MODEL, VERTEX_AI_REGION)
 
     checkpointer = _get_checkpointer()
-    agent_executor, config, prompt_version = AgentManager.create_agent(
-        user_id=user_id,
-        token=token,
-        user_data=user_data,
-        checkpointer=checkpointer
-    )
+    with trace_span("agent_build"):
+        agent_executor, config, prompt_version = AgentManager.create_agent(
+            user_id=user_id,
+            token=token,
+            user_data=user_data,
+            checkpointer=checkpointer,
+            query=query,
+        )
 
-    return _ask_streaming(agent_executor, config, query, user_id, chat_history) # Async streaming - Streaming = False non gestito
+    return _start_stream(agent_executor, config, query, user_id, chat_history, prompt_version, trace)
 
 
+async def aask(
+    query: str,
+    user_id: str,
+    chat_history: bool = False,
+    user_data: bool = False,
+    token: Optional[str] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    admission: Optional[Admission] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Variante async di ask per l'endpoint: la creazione dell'agente (metadata utente da
+    Auth0 inclusi) non blocca l'event loop. Ritorna lo stesso generatore di streaming.
+
+    is_disconnected (es. Request.is_disconnected) permette di cancellare la generazione
+    quando il client chiude la connessione. Il posto di admission control, se presente,
+    viene rilasciato a fine run.
+    """
+    trace = current_trace() or start_trace()
+    initialize_agent_state()
+
+    if CACHE_DEBUG_LOGGING:
+        log_request_context(user_id, FORCED_MODEL, VERTEX_AI_REGION)
+
+    checkpointer = _get_checkpointer()
+    with trace_span("agent_build"):
+        agent_executor, config, prompt_version = await AgentManager.acreate_agent(
+            user_id=user_id,
+            token=token,
+            user_data=user_data,
+            checkpointer=checkpointer,
+            query=query,
+        )
+
+    return _start_stream(agent_executor, config, query, user_id, chat_history, prompt_version, trace, is_disconnected, admission)
+
+
+def _start_stream(agent_executor, config, query, user_id, chat_history, prompt_version, trace, is_disconnected=None, admission=None) -> AsyncGenerator[str, None]:
+    # Comandi quiz espliciti: il tool viene eseguito direttamente, senza inferenza LLM
+    quiz_command = route_quiz_command(query) if settings.QUIZ_FAST_PATH_ENABLED else None
+    if quiz_command is not None:
+        logger.info(f"QUIZ_ROUTER - Comando '{quiz_command.mode}' {quiz_command.args} eseguito senza LLM")
+
+    return _ask_streaming(agent_executor, config, query, user_id, chat_history, prompt_version, quiz_command, trace, is_disconnected, admission) # Async streaming - Streaming = False non gestito
+
 
-def _ask_streaming(agent_executor, config, query: str, user_id: str, chat_history: bool) -> AsyncGenerator[str, None]:
-    """Handle async streaming agent invocation."""
+
+def _explicit_cache_active(prompt_version: Optional[int]) -> bool:
+    """True se la richiesta è stata servita con la cache esplicita dei docs (per le metriche di token)."""
+    if not settings.ENABLE_EXPLICIT_CACHING or prompt_version is None:
+        return False
+    return get_context_cache().is_active(prompt_version)
+
+
+def _ask_streaming(
+    agent_executor,
+    config,
+    query: str,
+    user_id: str,
+    chat_history: bool,
+    prompt_version: Optional[int] = None,
+    quiz_command: Optional[QuizCommand] = None,
+    trace: Optional[RequestTrace] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    admission: Optional[Admission] = None,
+) -> AsyncGenerator[str, None]:
+    """
+    Handle async streaming agent invocation.
+
+    Se il client si disconnette (rilevato da is_disconnected, o dalla cancellazione dello
+    stream da parte di Starlette) il run viene cancellato e la risposta parziale salvata
+    con il flag interrupted.
+
+    Con STREAM_RESUME_ENABLED il run gira in un task che scrive nel log degli eventi del
+    messaggio e la risposta segue il log: dopo una disconnessione il run prosegue per
+    STREAM_RESUME_GRACE_SECONDS, in attesa che il client riprenda lo stream con Last-Event-ID.
+    """
+    message_id = generate_message_id(user_id)
+    event_log = get_event_log_registry().create(message_id, user_id) if settings.STREAM_RESUME_ENABLED else None
 
     async def stream_response():
-        MemorySeeder.seed_agent_memory(agent_executor, config, user_id, chat_history)
-        message_id = generate_message_id(user_id)  # MOVED: Generate before handler
-        streaming_handler = StreamingHandler(message_id=message_id)  # MODIFIED: Pass to handler
+        # Il generatore gira nel task della risposta: il trace torna corrente per pre_model_hook e tool
+        set_current_trace(trace)
+        with trace_span("memory_seed"):
+            await MemorySeeder.aseed_agent_memory(agent_executor, config, user_id, chat_history)
+        streaming_handler = StreamingHandler(
+            message_id=message_id,
+            trace=trace,
+            # Con il log degli eventi la disconnessione è gestita dal log (grace period)
+            is_disconnected=is_disconnected if event_log is None else None,
+            event_log=event_log,
+        )
         timer = RequestTimer()
+        completed = False
 
         try:
             logger.info(f"STREAM - Inizio gestione streaming per messaggio con ID= {message_id}")
             timer.__enter__()
-            async for chunk in streaming_handler.handle_stream_events(agent_executor, query, config):
+            stream_start_ns = trace.now_ns() if trace else 0
+            if quiz_command is not None:
+                stream = streaming_handler.handle_direct_tool_call(
+                    agent_executor, query, config, domanda_teoria, quiz_command.args
+                )
+            else:
+                stream = streaming_handler.handle_stream_events(agent_executor, query, config)
+            async for chunk in stream:
                 yield chunk
+            completed = True
         finally:
             timer.__exit__(None, None, None)
+            if trace:
+                trace.add_span("stream", stream_start_ns, fast_path=quiz_command is not None)
+            interrupted = streaming_handler.interrupted or not completed
+            if interrupted:
+                logger.info(f"STREAM - Risposta {message_id} interrotta dal client")
+                streaming_handler.mark_interrupted(agent_executor, config)
             response = streaming_handler.get_final_response()
             tool_records = streaming_handler.get_tool_records()
             serialized_output = streaming_handler.get_serialized_output()
@@ -97,30 +205,65 @@ def _ask_streaming(agent_executor, config, query: str, user_id: str, chat_histor
             if not response and not streaming_handler.has_tool_executed():
                 logger.warning("STREAM - Nessuna risposta dall'agente e nessun tool eseguito.")
 
-            ConversationPersistence.log_run_completion(response, tool_records, serialized_output)
-            ConversationPersistence.save_conversation(query, response, user_id, tool_records, message_id)
-
-            # Log token usage metrics
-            usage_metadata = streaming_handler.get_usage_metadata()
-            if usage_metadata:
-                log_token_usage(
-                    user_id=user_id,
-                    model=FORCED_MODEL,
-                    usage_metadata=usage_metadata,
-                    request_duration_ms=timer.duration_ms,
-                    metadata={"message_id": message_id},
+            with trace_span("persistence"):
+                ConversationPersistence.log_run_completion(response, tool_records, serialized_output)
+                # Scritture in coda write-behind: lo stream si chiude subito dopo l'ultimo evento
+                ConversationPersistence.queue_conversation(
+                    query, response, user_id, tool_records, message_id, interrupted=interrupted
                 )
 
+            # Log token usage metrics (somma e dettaglio di tutte le chiamate LLM del run); senza
+            # usage (fast path, run cancellato presto) restano trace e attesa in coda per i percentili
+            queue_token_usage(
+                user_id=user_id,
+                model=FORCED_MODEL,
+                usage_metadata=streaming_handler.get_usage_metadata(),
+                llm_calls=streaming_handler.get_llm_calls(),
+                request_duration_ms=timer.duration_ms,
+                metadata={
+                    "message_id": message_id,
+                    "prompt_version": prompt_version,
+                    "prompt_prefix_hash": config.get("configurable", {}).get(PROMPT_PREFIX_HASH_CONFIG_KEY),
+                    "explicit_cache": _explicit_cache_active(prompt_version),
+                    "interrupted": interrupted,
+                    "queue_wait_ms": admission.wait_ms if admission else None,
+                    "trace": trace.to_document() if trace else None,
+                },
+            )
+            export_trace(trace, {
+                "user_id": user_id, "message_id": message_id,
+                "fast_path": quiz_command is not None, "interrupted": interrupted,
+            })
+
             # Log rate limit events if detected
             rate_limit_error = getattr(streaming_handler, "_rate_limit_error", None)
             if rate_limit_error:
-                log_rate_limit_event(
+                queue_rate_limit_event(
                     user_id=user_id,
                     model=FORCED_MODEL,
                     error_message=rate_limit_error,
                 )
 
-    return stream_response()
+    stream = stream_response() if admission is None else _releasing(stream_response(), admission)
+    if event_log is None:
+        return stream
+    if admission is not None:
+        admission.attach_run()  # il task del run parte subito, indipendente dalla risposta
+    get_event_log_registry().run(event_log, stream)
+    return event_log.follow(0, is_disconnected)
+
+
+async def _releasing(stream: AsyncGenerator[str, None], admission: Admission) -> AsyncGenerator[str, None]:
+    """Rilascia il posto di admission control a fine run, anche se cancellato."""
+    admission.attach_run()
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        try:
+            await stream.aclose()
+        finally:
+            admission.release()
 
 
 # Re-export for unit tests
@@ -0,0 +1,216 @@
+"""
+Retrieval lessicale sui docs: alternativa all'iniezione dell'intera knowledge base.
+
+Con RETRIEVAL_MODE il system prompt contiene solo:
+- una sezione core fissa (l'inizio dei docs, fino a RETRIEVAL_CORE_CHARS), che resta
+  nel prefisso statico cacheabile;
+- i top-k chunk più rilevanti per il messaggio dell'utente, come segmento dinamico.
+
+I docs vengono divisi in chunk sui titoli Markdown (con limite di dimensione) e
+indicizzati con BM25 in puro Python, senza chiamate di rete. L'indice viene ricostruito
+a ogni nuova versione di prompt (update_docs o revalidazione dello snapshot).
+"""
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .env import settings
+
+import logging
+logger = logging.getLogger("uvicorn")
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_TOKEN_RE = re.compile(r"\w+")
+
+STOPWORDS = frozenset("""
+a ad al all alla alle allo ai agli anche che chi ci come con cosa cui da dal dalla dalle dai degli dei del della
+delle dello di e ed gli ha hanno ho i il in io la le lo lui ma mi ne nei nel nella nelle nello no non o per piu
+puo quale quali quando quanto questa queste questi questo se si sia sono su sua sue sui sul sulla suo tra tu un
+una uno vi
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenizzazione per l'italiano: minuscolo, accenti rimossi, stopword escluse e
+    vocale finale troncata (paracadute/paracadutista/paracadutisti -> stessa radice).
+    """
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    normalized = "".join(c for c in normalized if not unicodedata.combining(c))
+    tokens = []
+    for token in _TOKEN_RE.findall(normalized):
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        if len(token) > 4 and token[-1] in "aeio":
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """Indice BM25 (Okapi) su un insieme di testi, con posting list per termine."""
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths: List[int] = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self._lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._postings.setdefault(term, []).append((doc_id, tf))
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        # Normalizzazione per lunghezza precalcolata: la ricerca fa solo somme sulle posting list
+        self._norms = [k1 * (1 - b + b * length / (self._avg_length or 1)) for length in self._lengths]
+        n = len(self._lengths)
+        self._idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Ritorna fino a k coppie (indice del testo, score) in ordine di rilevanza."""
+        scores: Dict[int, float] = {}
+        norms = self._norms
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            weight = self._idf[term] * (self.k1 + 1)
+            for doc_id, tf in postings:
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf / (tf + norms[doc_id])
+        return heapq.nsmallest(k, scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class DocChunk(NamedTuple):
+    title: str
+    text: str
+    start: int  # offset nel testo dei docs, per mantenere l'ordine originale
+
+
+def _split_long(text: str, max_chars: int) -> Iterable[str]:
+    """Divide un blocco troppo lungo sui paragrafi (o a lunghezza fissa come ultima risorsa)."""
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            if current:
+                yield current
+                current = ""
+            yield paragraph[:max_chars]
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + 2 + len(paragraph) > max_chars:
+            yield current
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        yield current
+
+
+def chunk_docs(docs: str, max_chars: int = 2000) -> List[DocChunk]:
+    """
+    Divide i docs in sezioni sui titoli Markdown; il titolo di ogni chunk è il percorso
+    dei titoli che lo contengono ("Capitolo > Sezione").
+    """
+    chunks: List[DocChunk] = []
+    path: List[Tuple[int, str]] = []
+    section_lines: List[str] = []
+    section_start = 0
+    offset = 0
+
+    def flush() -> None:
+        body = "\n".join(section_lines).strip()
+        if not body:
+            return
+        title = " > ".join(text for _, text in path)
+        for piece in _split_long(body, max_chars):
+            chunks.append(DocChunk(title, piece.strip(), section_start))
+
+    for line in docs.splitlines(keepends=True):
+        match = _HEADING_RE.match(line.rstrip("\n"))
+        if match:
+            flush()
+            level = len(match.group(1))
+            path = [(lvl, text) for lvl, text in path if lvl < level] + [(level, match.group(2))]
+            section_lines = [line.rstrip("\n")]
+            section_start = offset
+        else:
+            section_lines.append(line.rstrip("\n"))
+        offset += len(line)
+    flush()
+    return chunks
+
+
+class DocsRetriever:
+    """Chunk, sezione core e indice BM25 di una versione dei docs."""
+
+    def __init__(self, docs: str, prompt_version: int = 0, chunk_chars: Optional[int] = None, core_chars: Optional[int] = None):
+        start = time.perf_counter()
+        self.prompt_version = prompt_version
+        self.docs_chars = len(docs)
+        core_chars = settings.RETRIEVAL_CORE_CHARS if core_chars is None else core_chars
+        chunks = chunk_docs(docs, chunk_chars or settings.RETRIEVAL_CHUNK_CHARS)
+
+        # Sezione core: i primi chunk dei docs fino a core_chars, sempre inclusi
+        core: List[DocChunk] = []
+        size = 0
+        for chunk in chunks:
+            if size + len(chunk.text) > core_chars:
+                break
+            core.append(chunk)
+            size += len(chunk.text)
+        self.core = "\n\n".join(chunk.text for chunk in core)
+        self.chunks = chunks[len(core):]
+        self.index = BM25Index([f"{chunk.title}\n{chunk.text}" for chunk in self.chunks])
+        self.build_ms = (time.perf_counter() - start) * 1000
+
+    def search(self, query: str, k: Optional[int] = None) -> List[DocChunk]:
+        """Top-k chunk per la query, riportati nell'ordine in cui compaiono nei docs."""
+        hits = self.index.search(query, k or settings.RETRIEVAL_TOP_K)
+        return sorted((self.chunks[doc_id] for doc_id, _ in hits), key=lambda chunk: chunk.start)
+
+    @staticmethod
+    def render(chunks: Sequence[DocChunk]) -> str:
+        return "\n\n".join(chunk.text for chunk in chunks)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "prompt_version": self.prompt_version,
+            "chunks": len(self.chunks),
+            "core_chars": len(self.core),
+            "docs_chars": self.docs_chars,
+            "build_ms": round(self.build_ms, 1),
+        }
+
+
+_lock = threading.Lock()
+_retriever: Optional[DocsRetriever] = None
+
+
+def get_docs_retriever(docs: str, prompt_version: int) -> DocsRetriever:
+    """Retriever della versione di prompt corrente (ricostruito quando la versione cambia)."""
+    global _retriever
+    retriever = _retriever
+    if retriever is not None and retriever.prompt_version == prompt_version:
+        return retriever
+    with _lock:
+        if _retriever is None or _retriever.prompt_version != prompt_version:
+            _retriever = DocsRetriever(docs, prompt_version)
+            logger.info(
+                f"RETRIEVAL - Indice v{prompt_version}: {len(_retriever.chunks)} chunk, "
+                f"core {len(_retriever.core)} caratteri, {_retriever.build_ms:.0f}ms"
+            )
+        return _retriever
+
+
+def get_retrieval_stats() -> Dict[str, object]:
+    retriever = _retriever
+    return {"enabled": settings.RETRIEVAL_MODE, **(retriever.stats() if retriever else {})}
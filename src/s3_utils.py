@@ -1,42 +1,255 @@
 import boto3
 import datetime
-from .env import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from .env import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME, settings
 import logging
 logger = logging.getLogger("uvicorn")
 
 s3_client = boto3.client('s3', aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
 
+
+class DocsSync:
+    """
+    Sincronizzazione incrementale dei documenti Markdown da S3.
+
+    - Listing paginato (continuation token) del prefisso `docs/`.
+    - Gli oggetti con ETag, LastModified e dimensione invariati non vengono riscaricati:
+      il contenuto arriva dalla cache locale content-addressed (`objects/<sha256>`),
+      indicizzata da `manifest.json`, che sopravvive anche al riavvio del processo.
+    - Gli oggetti nuovi o modificati vengono scaricati in parallelo (thread pool).
+    - Ogni refresh registra byte trasferiti e tempi in `last_stats`.
+    """
+
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(
+        self,
+        client: Any = None,
+        bucket: Optional[str] = None,
+        prefix: str = "docs/",
+        cache_dir: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        page_size: int = 1000,
+    ):
+        self._client = client
+        self.bucket = bucket or BUCKET_NAME
+        self.prefix = prefix
+        self.cache_dir = cache_dir or settings.DOCS_CACHE_DIR
+        self.max_workers = max_workers or settings.S3_SYNC_MAX_WORKERS
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._manifest: Optional[Dict[str, Dict[str, Any]]] = None
+        self._contents: Dict[str, str] = {}  # sha256 -> testo decodificato
+        self.last_stats: Dict[str, Any] = {}
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else s3_client
+
+    # Cache locale
+    def _objects_dir(self) -> str:
+        return os.path.join(self.cache_dir, "objects")
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        if self._manifest is None:
+            path = os.path.join(self.cache_dir, self.MANIFEST_FILE)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                same_source = data.get("bucket") == self.bucket and data.get("prefix") == self.prefix
+                self._manifest = data.get("objects", {}) if same_source else {}
+            except (OSError, ValueError):
+                self._manifest = {}
+        return self._manifest
+
+    def _save_manifest(self, manifest: Dict[str, Dict[str, Any]]) -> None:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = os.path.join(self.cache_dir, self.MANIFEST_FILE)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"bucket": self.bucket, "prefix": self.prefix, "objects": manifest}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Docs: impossibile salvare il manifest della cache locale: {e}")
+
+    def _read_cached(self, sha256: str) -> Optional[str]:
+        if sha256 in self._contents:
+            return self._contents[sha256]
+        try:
+            with open(os.path.join(self._objects_dir(), sha256), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if hashlib.sha256(data).hexdigest() != sha256:
+            return None
+        text = data.decode("utf-8")
+        self._contents[sha256] = text
+        return text
+
+    def _write_cached(self, sha256: str, data: bytes) -> None:
+        try:
+            os.makedirs(self._objects_dir(), exist_ok=True)
+            path = os.path.join(self._objects_dir(), sha256)
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Docs: impossibile scrivere {sha256} nella cache locale: {e}")
+
+    def _prune_objects(self, live: set) -> None:
+        """Rimuove dalla cache i contenuti non più referenziati dal manifest."""
+        for sha256 in list(self._contents):
+            if sha256 not in live:
+                del self._contents[sha256]
+        try:
+            for name in os.listdir(self._objects_dir()):
+                if name not in live and not name.endswith(".tmp"):
+                    os.remove(os.path.join(self._objects_dir(), name))
+        except OSError:
+            pass
+
+    # S3
+    def _list_objects(self) -> Tuple[List[Dict[str, Any]], int]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self.bucket, Prefix=self.prefix, PaginationConfig={"PageSize": self.page_size}
+        )
+        objects, page_count = [], 0
+        for page in pages:
+            page_count += 1
+            objects.extend(obj for obj in page.get("Contents", []) if obj["Key"].endswith(".md"))
+        return objects, page_count
+
+    def _download(self, key: str) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=key)
+        return response["Body"].read()
+
+    @staticmethod
+    def _fingerprint(obj: Dict[str, Any]) -> Dict[str, Any]:
+        last_modified = obj.get("LastModified")
+        if isinstance(last_modified, datetime.datetime):
+            last_modified = last_modified.isoformat()
+        return {"etag": obj.get("ETag"), "last_modified": last_modified, "size": obj.get("Size")}
+
+    def sync(self) -> Dict[str, Any]:
+        """
+        Sincronizza il prefisso e ritorna combined_docs, docs_meta e sync_stats.
+        Solleva eccezione se il listing fallisce o se un documento non è disponibile né su S3 né in cache.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            objects, page_count = self._list_objects()
+            list_ms = (time.perf_counter() - start) * 1000
+            previous = self._load_manifest()
+
+            contents: Dict[str, str] = {}
+            manifest: Dict[str, Dict[str, Any]] = {}
+            to_download = []
+            for obj in objects:
+                key = obj["Key"]
+                fingerprint = self._fingerprint(obj)
+                cached = previous.get(key)
+                if cached and {k: cached.get(k) for k in fingerprint} == fingerprint:
+                    text = self._read_cached(cached["sha256"])
+                    if text is not None:
+                        contents[key] = text
+                        manifest[key] = cached
+                        continue
+                to_download.append((key, fingerprint))
+
+            bytes_downloaded = downloaded = 0
+            if to_download:
+                workers = min(self.max_workers, len(to_download))
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3-sync") as pool:
+                    futures = {key: (fingerprint, pool.submit(self._download, key)) for key, fingerprint in to_download}
+                    for key, (fingerprint, future) in futures.items():
+                        try:
+                            data = future.result()
+                        except Exception as e:
+                            stale = previous.get(key)
+                            text = self._read_cached(stale["sha256"]) if stale else None
+                            if text is None:
+                                raise
+                            logger.warning(f"Docs: download di {key} fallito ({e}), uso la copia in cache")
+                            contents[key] = text
+                            manifest[key] = stale
+                            continue
+                        sha256 = hashlib.sha256(data).hexdigest()
+                        self._write_cached(sha256, data)
+                        self._contents[sha256] = data.decode("utf-8")
+                        contents[key] = self._contents[sha256]
+                        manifest[key] = {**fingerprint, "sha256": sha256}
+                        bytes_downloaded += len(data)
+                        downloaded += 1
+
+            if manifest != previous:
+                self._save_manifest(manifest)
+                self._prune_objects({entry["sha256"] for entry in manifest.values()})
+            self._manifest = manifest
+
+            docs_meta = []
+            for obj in objects:
+                last_modified = obj.get("LastModified")
+                if isinstance(last_modified, datetime.datetime):
+                    last_modified = last_modified.strftime("%Y-%m-%d %H:%M:%S")
+                docs_meta.append({"title": obj["Key"].split("/")[-1], "last_modified": last_modified})
+
+            self.last_stats = {
+                "objects": len(objects),
+                "pages": page_count,
+                "downloaded": downloaded,
+                "unchanged": len(objects) - len(to_download),
+                "removed": len(set(previous) - set(manifest)),
+                "bytes_downloaded": bytes_downloaded,
+                "list_ms": round(list_ms, 1),
+                "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                "synced_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+            }
+            logger.info(
+                f"Docs: sync S3 completata - {len(objects)} file, {downloaded} scaricati "
+                f"({bytes_downloaded} byte), {self.last_stats['unchanged']} invariati, "
+                f"{self.last_stats['duration_ms']:.0f}ms"
+            )
+            return {
+                "combined_docs": "\n\n".join(contents[obj["Key"]] for obj in objects),
+                "docs_meta": docs_meta,
+                "sync_stats": dict(self.last_stats),
+            }
+
+
+_docs_sync = DocsSync()
+
+
+def get_docs_sync_stats() -> Dict[str, Any]:
+    """Statistiche dell'ultima sincronizzazione S3 (byte trasferiti, tempi)."""
+    return dict(_docs_sync.last_stats)
+
+
 def fetch_docs_from_s3():
     """
     Scarica i file Markdown dal bucket S3, combina il contenuto e recupera i metadati dei file.
+    La sincronizzazione è incrementale (vedi DocsSync): vengono scaricati solo i file cambiati.
     Restituisce un dizionario con:
       - "combined_docs": contenuto combinato dei file (per system_prompt)
       - "docs_meta": lista di dizionari con "title" e "last_modified" per ogni file
+      - "sync_stats": byte trasferiti e tempi del refresh
     """
     try:
-        objects = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix='docs/')
-        docs_content = []
-        docs_meta = []
-
-        for obj in objects.get('Contents', []):
-            if obj['Key'].endswith('.md'):
-                response = s3_client.get_object(Bucket=BUCKET_NAME, Key=obj['Key'])
-                file_content = response['Body'].read().decode('utf-8')
-                docs_content.append(file_content)
-                title = obj['Key'].split('/')[-1]
-                last_modified = obj.get('LastModified')
-                if isinstance(last_modified, datetime.datetime):
-                    last_modified = last_modified.strftime("%Y-%m-%d %H:%M:%S")
-                docs_meta.append({
-                    "title": title,
-                    "last_modified": last_modified
-                })
-        combined_docs = "\n\n".join(docs_content)
-        logger.info(f"Docs: Found and loaded {len(docs_content)} Markdown files from S3.")
-        return {"combined_docs": combined_docs, "docs_meta": docs_meta}
+        result = _docs_sync.sync()
+        logger.info(f"Docs: Found and loaded {len(result['docs_meta'])} Markdown files from S3.")
+        return result
     except Exception as e:
         logger.error(f"Error while downloading files from S3: {e}")
-        return {"combined_docs": "", "docs_meta": []}
+        return {"combined_docs": "", "docs_meta": [], "sync_stats": {}}
 
 def create_prompt_file(system_prompt: str):
     """
@@ -0,0 +1,190 @@
+import logging
+import uuid
+from typing import Dict, List, Optional, Any
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from src.env import DATABASE_NAME
+from src.services.database.interface import AsyncDatabaseInterface
+from src.services.database.connection_pool import get_async_client
+from src.services.database.database_service import MongoDBService
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMongoDBService(AsyncDatabaseInterface):
+    """
+    Non-blocking MongoDB service (Motor) for the streaming hot path.
+
+    Covers the chat history, quiz and metrics collections with the same semantics
+    as MongoDBService and src/database.py, without stalling the event loop.
+    """
+
+    def __init__(self, database_name: str = DATABASE_NAME, client: Optional[AsyncIOMotorClient] = None):
+        """Initialize the service on the event loop's shared Motor client (or an injected one)."""
+        self.client = client if client is not None else get_async_client()
+        self.db = self.client[database_name]
+
+    _to_json_safe = MongoDBService._to_json_safe
+
+    async def get_item(self, collection: str, item_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get an item by ID from the specified collection.
+
+        Args:
+            collection: The collection to search in.
+            item_id: The ID of the item.
+
+        Returns:
+            The item document, or None if not found.
+        """
+        doc = await self.db[collection].find_one({"_id": item_id})
+        return self._to_json_safe(doc) if doc else None
+
+    async def get_items(self, collection: str, query: Dict[str, Any] = {}, limit: int = 0) -> List[Dict[str, Any]]:
+        """
+        Get all items from the specified collection that match the query.
+
+        Args:
+            collection: The collection to search in.
+            query: The query to filter items by.
+            limit: Maximum number of results to return.
+
+        Returns:
+            A list of item documents that match the query.
+        """
+        cursor = self.db[collection].find(query)
+        if limit > 0:
+            cursor = cursor.limit(limit)
+        results = await cursor.to_list(length=None)
+        return [self._to_json_safe(doc) for doc in results]
+
+    async def get_latest_items(
+        self,
+        collection: str,
+        query: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        sort_field: str = "timestamp",
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the most recent documents matching the query, returned oldest first.
+        Same contract as src.database.get_data (uses the timestamp_-1 index when limited).
+
+        Args:
+            collection: The collection to search in.
+            query: The query to filter items by.
+            limit: Number of documents to return (None for all).
+            sort_field: Field used for recency ordering.
+
+        Returns:
+            A list of documents ordered by sort_field ascending.
+        """
+        cursor = self.db[collection].find(query or {}).sort(sort_field, -1)
+        if limit:
+            cursor = cursor.limit(limit).hint(f"{sort_field}_-1")
+        documents = await cursor.to_list(length=None)
+        documents.reverse()
+        return documents
+
+    async def get_random_item(self, collection: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a random item from the specified collection.
+
+        Args:
+            collection: The collection to search in.
+
+        Returns:
+            A random item document, or None if no items are found.
+        """
+        try:
+            items = await self.db[collection].aggregate([{"$sample": {"size": 1}}]).to_list(length=1)
+            return self._to_json_safe(items[0]) if items else None
+        except Exception as e:
+            logger.error(f"Error getting random item from {collection}: {e}")
+            return None
+
+    async def get_random_item_by_field(self, field: str, value: Any, collection: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a random item from the specified collection that matches a field value.
+
+        Args:
+            field: The field to filter by.
+            value: The value to match.
+            collection: The collection to search in.
+
+        Returns:
+            A random item document that matches the field value, or None if no items are found.
+        """
+        items = await self.db[collection].aggregate([
+            {"$match": {field: value}},
+            {"$sample": {"size": 1}}
+        ]).to_list(length=1)
+        return self._to_json_safe(items[0]) if items else None
+
+    async def insert_item(self, collection: str, item: Dict[str, Any]) -> str:
+        """
+        Insert an item into the specified collection, generating a UUID _id if missing.
+
+        Args:
+            collection: The collection to insert into.
+            item: The item document to insert.
+
+        Returns:
+            The ID of the inserted item.
+        """
+        if "_id" not in item or not item["_id"]:
+            item["_id"] = str(uuid.uuid4())
+
+        result = await self.db[collection].insert_one(item)
+        return str(result.inserted_id)
+
+    async def insert_document(self, collection: str, document: Dict[str, Any]) -> Any:
+        """
+        Insert a document as-is (MongoDB generates an ObjectId when _id is missing).
+
+        Args:
+            collection: The collection to insert into.
+            document: The document to insert.
+
+        Returns:
+            The inserted _id.
+        """
+        result = await self.db[collection].insert_one(document)
+        return result.inserted_id
+
+    async def insert_documents(self, collection: str, documents: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Insert documents as-is in a single unordered insert_many (used by the write-behind queue).
+
+        Args:
+            collection: The collection to insert into.
+            documents: The documents to insert.
+
+        Returns:
+            The inserted _ids.
+        """
+        if not documents:
+            return []
+        result = await self.db[collection].insert_many(documents, ordered=False)
+        return list(result.inserted_ids)
+
+    async def insert_items(self, collection: str, items: List[Dict[str, Any]]) -> List[str]:
+        """
+        Insert multiple items into the specified collection.
+
+        Args:
+            collection: The collection to insert into.
+            items: A list of item documents to insert.
+
+        Returns:
+            A list of IDs of the inserted items.
+        """
+        if not items:
+            return []
+
+        for item in items:
+            if "_id" not in item or not item["_id"]:
+                item["_id"] = str(uuid.uuid4())
+
+        result = await self.db[collection].insert_many(items)
+        return [str(id) for id in result.inserted_ids]
@@ -0,0 +1,235 @@
+"""
+Shared MongoDB client for the whole process.
+
+A single pymongo.MongoClient (and therefore a single connection pool) is used by
+src/database.py, MongoDBService/QuizMongoDBService and the monitoring writers, so
+server discovery and TLS setup happen once per process instead of once per
+quiz question or feedback call.
+
+The async (Motor) client used on the streaming hot path is bound to the event loop
+it first runs on, so one is kept per running loop, sharing pool settings and metrics.
+"""
+import asyncio
+import threading
+import time
+import weakref
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.server_api import ServerApi
+
+from src.env import settings
+
+logger = logging.getLogger("uvicorn")
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Collects connection pool metrics: checkouts, failures and checkout wait time.
+
+    Pool events are published synchronously on the thread performing the checkout,
+    so the start timestamp is kept in a thread-local.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.checked_in = 0
+            self.connections_created = 0
+            self.connections_closed = 0
+            self.total_wait_ms = 0.0
+            self.max_wait_ms = 0.0
+
+    # Checkout lifecycle
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait_ms = self._elapsed_ms()
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def connection_check_out_failed(self, event):
+        self._elapsed_ms()
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_in += 1
+
+    # Connection lifecycle
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    # Pool lifecycle (not tracked)
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def _elapsed_ms(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return (time.perf_counter() - started) * 1000 if started else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "checked_in": self.checked_in,
+                "in_use": self.checkouts - self.checked_in,
+                "connections_created": self.connections_created,
+                "connections_closed": self.connections_closed,
+                "open_connections": self.connections_created - self.connections_closed,
+                "avg_wait_ms": round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0,
+                "max_wait_ms": round(self.max_wait_ms, 3),
+            }
+
+
+class MongoClientManager:
+    """Lazily creates and owns the process-wide MongoClient."""
+
+    def __init__(self, uri: Optional[str] = None):
+        self._uri = uri
+        self._lock = threading.Lock()
+        self._client: Optional[pymongo.MongoClient] = None
+        self._async_clients: Dict[int, Tuple[weakref.ref, AsyncIOMotorClient]] = {}
+        self.metrics = PoolMetricsListener()
+
+    def get_client(self) -> pymongo.MongoClient:
+        """Return the shared client, creating it on first use."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    def get_async_client(self) -> AsyncIOMotorClient:
+        """Return the Motor client for the running event loop, creating it on first use."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._async_clients.get(id(loop))
+            if entry is not None and entry[0]() is loop:
+                return entry[1]
+            self._prune_async_clients()
+            client = AsyncIOMotorClient(self._get_uri(), **self._client_options())
+            self._async_clients[id(loop)] = (weakref.ref(loop), client)
+            logger.info("MongoDB: client async (Motor) creato per l'event loop corrente")
+            return client
+
+    def _prune_async_clients(self) -> None:
+        """Drop Motor clients whose event loop has been closed or collected."""
+        for loop_id, (loop_ref, client) in list(self._async_clients.items()):
+            loop = loop_ref()
+            if loop is None or loop.is_closed():
+                client.close()
+                del self._async_clients[loop_id]
+
+    def _get_uri(self) -> str:
+        uri = self._uri or settings.URI
+        if not uri:
+            raise ValueError("No MongoDB URI found. Please set the MONGODB_URI environment variable.")
+        return uri
+
+    def _client_options(self) -> Dict[str, Any]:
+        return {
+            "server_api": ServerApi('1'),
+            "maxPoolSize": settings.MONGO_MAX_POOL_SIZE,
+            "minPoolSize": settings.MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": settings.MONGO_MAX_IDLE_TIME_MS,
+            "waitQueueTimeoutMS": settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "event_listeners": [self.metrics],
+        }
+
+    def _create_client(self) -> pymongo.MongoClient:
+        client = pymongo.MongoClient(self._get_uri(), **self._client_options())
+        logger.info(
+            f"MongoDB: client condiviso creato (maxPoolSize={settings.MONGO_MAX_POOL_SIZE}, "
+            f"minPoolSize={settings.MONGO_MIN_POOL_SIZE})"
+        )
+        return client
+
+    def warmup(self) -> bool:
+        """
+        Run server discovery and open the first pooled connection ahead of traffic.
+        Failures are logged, never raised: the app must still start without MongoDB.
+        """
+        start = time.perf_counter()
+        try:
+            self.get_client().admin.command("ping")
+            logger.info(f"MongoDB: warmup completato in {(time.perf_counter() - start) * 1000:.0f}ms")
+            return True
+        except Exception as e:
+            logger.error(f"MongoDB: warmup fallito: {e}")
+            return False
+
+    def close(self) -> None:
+        """Close the shared client (FastAPI shutdown)."""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+                logger.info("MongoDB: client condiviso chiuso")
+            for _, client in self._async_clients.values():
+                client.close()
+            self._async_clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool metrics plus configuration, for the monitoring report."""
+        return {
+            "max_pool_size": settings.MONGO_MAX_POOL_SIZE,
+            "min_pool_size": settings.MONGO_MIN_POOL_SIZE,
+            "client_initialized": self._client is not None,
+            **self.metrics.snapshot(),
+        }
+
+
+_client_manager = MongoClientManager()
+
+
+def get_client_manager() -> MongoClientManager:
+    return _client_manager
+
+
+def get_mongo_client() -> pymongo.MongoClient:
+    """Return the process-wide MongoClient."""
+    return _client_manager.get_client()
+
+
+def get_async_client() -> AsyncIOMotorClient:
+    """Return the Motor client bound to the running event loop."""
+    return _client_manager.get_async_client()
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Return connection pool metrics for this process."""
+    return _client_manager.stats()
@@ -1,20 +1,40 @@
-# import pymongo
+import pymongo
 import logging
+import random
 from typing import Dict, List, Optional, Any
+from src.env import settings
 from src.services.database.database_service import MongoDBService
 from src.services.database.interface import DatabaseInterface
+from src.services.database.quiz_bank import QuizBank, copy_question, get_quiz_bank_loader
 
 # from env import *
 
 logger = logging.getLogger(__name__)
 
+TEXT_INDEX_NAME = "quiz_text_search"
+
+# Collections whose $text index was already ensured by this process
+_text_indexed = set()
+
 class QuizMongoDBService(DatabaseInterface):
-    """Service for interacting with MongoDB database for quiz operations."""
+    """
+    Service for quiz operations.
+
+    Reads are served from the in-process QuizBank (see quiz_bank.py) when it is
+    enabled and loaded, otherwise from MongoDB.
+    """
     
     def __init__(self, database_name: str = "quiz", collection_name: str = "prod"):
         """Initialize the MongoDB service with credentials from settings."""
         self.db = MongoDBService(database_name)
         self.collection_name = collection_name
+        self.bank_loader = (
+            get_quiz_bank_loader(self.db, database_name, collection_name) if settings.QUIZ_BANK_ENABLED else None
+        )
+
+    def get_question_bank(self) -> Optional[QuizBank]:
+        """Loaded question bank, or None to query MongoDB."""
+        return self.bank_loader.get() if self.bank_loader is not None else None
     
     # Implementation of abstract methods from DatabaseInterface
     def get_item(self, collection: str, item_id: str) -> Optional[Dict[str, Any]]:
@@ -66,7 +86,10 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             A list of IDs of the inserted items.
         """
-        return self.db.insert_items(collection, items)
+        ids = self.db.insert_items(collection, items)
+        if collection == self.collection_name:
+            self._invalidate_bank()
+        return ids
     
     # Quiz operations
     def get_quiz_question(self, question_id: str) -> Optional[Dict[str, Any]]:
@@ -79,6 +102,10 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             The question document, or None if not found.
         """
+        bank = self.get_question_bank()
+        question = bank.get_by_id(question_id) if bank is not None else None
+        if question is not None:
+            return copy_question(question)
         return self.db.get_item(self.collection_name, question_id)
     
     def get_random_question(self) -> Optional[Dict[str, Any]]:
@@ -88,6 +115,9 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             A random question document, or None if no questions are found.
         """
+        bank = self.get_question_bank()
+        if bank is not None and len(bank):
+            return copy_question(bank.random_question())
         return self.db.get_random_item(self.collection_name)
     
     def get_random_question_by_field(self, field: str, value: str) -> Optional[Dict[str, Any]]:
@@ -101,6 +131,12 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             A random question document that matches the field value, or None if no questions are found.
         """
+        bank = self.get_question_bank()
+        if bank is not None:
+            if field == "capitolo":
+                return copy_question(bank.random_in_chapter(value))
+            matches = bank.where(**{field: value})
+            return copy_question(random.choice(matches)) if matches else None
         return self.db.get_random_item_by_field(field, value, self.collection_name)
 
     def get_category_questions(self, category: str) -> List[Dict[str, Any]]:
@@ -113,6 +149,9 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             A list of question documents in the specified category.
         """
+        bank = self.get_question_bank()
+        if bank is not None:
+            return [copy_question(q) for q in bank.where(categoria=category)]
         return self.db.get_items(self.collection_name, {"categoria": category})
     
     def get_capitolo_questions(self, capitolo: int) -> List[Dict[str, Any]]:
@@ -125,6 +164,9 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             A list of question documents in the specified chapter.
         """
+        bank = self.get_question_bank()
+        if bank is not None:
+            return [copy_question(q) for q in bank.chapter(capitolo)]
         return self.db.get_items(self.collection_name, {"capitolo.numero": capitolo})
     
     def get_capitolo_category_questions(self, capitolo: str, category: str) -> List[Dict[str, Any]]:
@@ -138,6 +180,9 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             A list of question documents in the specified chapter and category.
         """
+        bank = self.get_question_bank()
+        if bank is not None:
+            return [copy_question(q) for q in bank.chapter(capitolo) if q.get("categoria") == category]
         return self.db.get_items(self.collection_name, {"capitolo": capitolo, "categoria": category})
     
     def get_question_by_capitolo_and_number(self, capitolo: int, numero: int) -> Optional[Dict[str, Any]]:
@@ -151,18 +196,28 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             The question document, or None if not found.
         """
+        bank = self.get_question_bank()
+        question = bank.get(capitolo, numero) if bank is not None else None
+        if question is not None:
+            return copy_question(question)
+        # Miss: the question may have been added after the bank was loaded
         questions = self.db.get_items(self.collection_name, {"capitolo": capitolo, "numero": numero})
         return questions[0] if questions else None
     
-    def search_questions_by_text(self, testo: str) -> List[Dict[str, Any]]:
+    def search_questions_by_text(self, testo: str, limit: int = 10) -> List[Dict[str, Any]]:
         """
-        Search questions by text using regex pattern matching.
+        Search questions by text, most relevant first.
+
+        The backend is chosen by QUIZ_SEARCH_BACKEND: "memory" uses the inverted index
+        of the question bank (falling back to "regex" when the bank is not loaded),
+        "text" a MongoDB $text index, "regex" the chained case-insensitive $regex scan.
         
         Args:
-            testo: The text to search for in question text.
+            testo: The text to search for in question and option texts.
+            limit: Maximum number of results (0 = no limit).
             
         Returns:
-            A list of questions that match the text pattern.
+            A list of questions that match the text, ranked by relevance.
         """
         # Converti il testo in minuscolo per una ricerca case-insensitive
         testo_lower = testo.lower().strip()
@@ -173,6 +228,14 @@ class QuizMongoDBService(DatabaseInterface):
         if not parole_chiave:
             return []
         
+        backend = settings.QUIZ_SEARCH_BACKEND
+        if backend == "memory":
+            bank = self.get_question_bank()
+            if bank is not None:
+                return [copy_question(q) for q in bank.search(testo, limit)]
+        elif backend == "text":
+            return self._search_text_index(testo, limit)
+
         # Crea una query che cerca domande che contengono tutte le parole chiave
         # Usa $regex per ricerca case-insensitive
         query = {
@@ -182,7 +245,38 @@ class QuizMongoDBService(DatabaseInterface):
             ]
         }
         
-        return self.db.get_items(self.collection_name, query)
+        return self.db.get_items(self.collection_name, query, limit=limit)
+
+    def ensure_text_index(self) -> str:
+        """
+        Create (if missing) the Italian $text index on question and option texts.
+        
+        Returns:
+            The index name.
+        """
+        return self.db.db[self.collection_name].create_index(
+            [("testo", pymongo.TEXT), ("opzioni.testo", pymongo.TEXT)],
+            name=TEXT_INDEX_NAME,
+            default_language="italian",
+            weights={"testo": 3, "opzioni.testo": 1},
+        )
+
+    def _search_text_index(self, testo: str, limit: int) -> List[Dict[str, Any]]:
+        """Search through the MongoDB $text index, sorted by textScore."""
+        key = (self.db.db.name, self.collection_name)
+        if key not in _text_indexed:
+            self.ensure_text_index()
+            _text_indexed.add(key)
+        cursor = self.db.db[self.collection_name].find(
+            {"$text": {"$search": testo}}, {"_score": {"$meta": "textScore"}}
+        ).sort([("_score", {"$meta": "textScore"})])
+        if limit > 0:
+            cursor = cursor.limit(limit)
+        results = []
+        for doc in cursor:
+            doc.pop("_score", None)
+            results.append(self.db._to_json_safe(doc))
+        return results
     
     def get_all_questions(self) -> List[Dict[str, Any]]:
         """
@@ -191,6 +285,9 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             A list of all question documents.
         """
+        bank = self.get_question_bank()
+        if bank is not None:
+            return [copy_question(q) for q in bank.questions]
         return self.db.get_items(self.collection_name)
     
     def insert_quiz_questions(self, questions: List[Dict[str, Any]]) -> List[str]:
@@ -203,7 +300,9 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             A list of inserted question IDs.
         """
-        return self.db.insert_items(self.collection_name, questions)
+        ids = self.db.insert_items(self.collection_name, questions)
+        self._invalidate_bank()
+        return ids
     
     def update_quiz_question(self, question_id: str, question_data: Dict[str, Any]) -> bool:
         """
@@ -216,4 +315,11 @@ class QuizMongoDBService(DatabaseInterface):
         Returns:
             True if the update was successful, False otherwise.
         """
-        return self.db.update_item(self.collection_name, question_id, question_data)
\ No newline at end of file
+        updated = self.db.update_item(self.collection_name, question_id, question_data)
+        self._invalidate_bank()
+        return updated
+
+    def _invalidate_bank(self) -> None:
+        """Reload the question bank on next read after a write to the quiz collection."""
+        if self.bank_loader is not None:
+            self.bank_loader.invalidate()
\ No newline at end of file
@@ -1,12 +1,12 @@
-import pymongo
 from pymongo import ReturnDocument
 import logging
 from typing import Dict, List, Optional, Any
 import uuid
 from bson import ObjectId
 
-from src.env import DATABASE_NAME, URI
+from src.env import DATABASE_NAME
 from src.services.database.interface import DatabaseInterface
+from src.services.database.connection_pool import get_mongo_client
 
 logger = logging.getLogger(__name__)
 
@@ -14,8 +14,8 @@ class MongoDBService(DatabaseInterface):
     """Service for interacting with MongoDB database."""
     
     def __init__(self, database_name: str = DATABASE_NAME):
-        """Initialize the MongoDB service with credentials from settings."""
-        self.client = pymongo.MongoClient(URI)
+        """Initialize the MongoDB service on the shared, pooled client."""
+        self.client = get_mongo_client()
         self.db = self.client[database_name]
 
     def _to_json_safe(self, value: Any) -> Any:
@@ -22,4 +22,28 @@ class DatabaseInterface(ABC):
     @abstractmethod
     def insert_items(self, collection: str, items: List[Dict[str, Any]]) -> List[str]:
         """Insert multiple items into the specified collection."""
-        pass
\ No newline at end of file
+        pass
+
+
+class AsyncDatabaseInterface(ABC):
+    """Abstract interface for non-blocking database operations (event loop hot path)."""
+
+    @abstractmethod
+    async def get_item(self, collection: str, item_id: str) -> Optional[Dict[str, Any]]:
+        """Get an item by ID from the specified collection."""
+        pass
+
+    @abstractmethod
+    async def get_items(self, collection: str, query: Dict[str, Any] = {}) -> List[Dict[str, Any]]:
+        """Get all items from the specified collection that match the query."""
+        pass
+
+    @abstractmethod
+    async def get_random_item(self, collection: str) -> Optional[Dict[str, Any]]:
+        """Get a random item from the specified collection."""
+        pass
+
+    @abstractmethod
+    async def insert_items(self, collection: str, items: List[Dict[str, Any]]) -> List[str]:
+        """Insert multiple items into the specified collection."""
+        pass
@@ -0,0 +1,263 @@
+"""
+In-process quiz question bank.
+
+The quiz collection is small and changes only when questions are edited, so it is
+loaded once per process and served from memory by QuizMongoDBService:
+
+- a dict index on (capitolo, numero) for specific questions;
+- per-chapter tuples, so a random question (overall or per chapter) is one
+  random.choice instead of a $sample aggregation;
+- an index by _id;
+- a BM25 inverted index over the question and option texts (Italian tokenization
+  from src.retrieval), so text search is ranked and limited without a collection scan.
+
+A QuizBank is immutable; reloading builds a new one and swaps the reference, so
+readers never see a half-built index. Every QUIZ_BANK_REFRESH_SECONDS a background
+check compares the collection version (MongoDB dbHash when the server allows it,
+otherwise the sha256 of the loaded documents) and reloads only when it changed.
+If the bank cannot be loaded the service falls back to MongoDB queries.
+"""
+import copy
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.env import settings
+from src.retrieval import BM25Index
+
+logger = logging.getLogger("uvicorn")
+
+_QuestionKey = Tuple[int, int]
+
+
+def as_int(value: Any) -> Optional[int]:
+    """Chapter and question numbers as int ("3", 3 and {"numero": 3} are the same chapter)."""
+    if isinstance(value, dict):
+        value = value.get("numero")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def search_text(question: Dict[str, Any]) -> str:
+    """Text indexed for search: question text followed by the option texts."""
+    options = [str(o.get("testo", "")) for o in question.get("opzioni") or [] if isinstance(o, dict)]
+    return "\n".join([str(question.get("testo", ""))] + options)
+
+
+def content_version(questions: List[Dict[str, Any]]) -> str:
+    """sha256 of the question documents, used when the server does not expose dbHash."""
+    payload = json.dumps(questions, sort_keys=True, ensure_ascii=False, default=str)
+    return "sha256:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class QuizBank:
+    """Immutable snapshot of the quiz collection with precomputed indexes."""
+
+    def __init__(self, questions: List[Dict[str, Any]], version: str):
+        self.version = version
+        self.loaded_at = time.time()
+        self.questions: Tuple[Dict[str, Any], ...] = tuple(questions)
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._by_key: Dict[_QuestionKey, Dict[str, Any]] = {}
+        by_chapter: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        for question in self.questions:
+            if question.get("_id") is not None:
+                self._by_id[str(question["_id"])] = question
+            capitolo = as_int(question.get("capitolo"))
+            numero = as_int(question.get("numero"))
+            if capitolo is None:
+                continue
+            by_chapter[capitolo].append(question)
+            if numero is not None:
+                self._by_key.setdefault((capitolo, numero), question)
+        self._by_chapter: Dict[int, Tuple[Dict[str, Any], ...]] = {
+            capitolo: tuple(sorted(items, key=lambda q: as_int(q.get("numero")) or 0))
+            for capitolo, items in by_chapter.items()
+        }
+        self._search_index = BM25Index([search_text(q) for q in self.questions])
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def get(self, capitolo: Any, numero: Any) -> Optional[Dict[str, Any]]:
+        return self._by_key.get((as_int(capitolo), as_int(numero)))
+
+    def get_by_id(self, question_id: Any) -> Optional[Dict[str, Any]]:
+        return self._by_id.get(str(question_id))
+
+    def chapter(self, capitolo: Any) -> Tuple[Dict[str, Any], ...]:
+        return self._by_chapter.get(as_int(capitolo), ())
+
+    def chapters(self) -> Dict[int, int]:
+        """Number of questions per chapter."""
+        return {capitolo: len(items) for capitolo, items in sorted(self._by_chapter.items())}
+
+    def random_question(self, rng: Optional[random.Random] = None) -> Optional[Dict[str, Any]]:
+        return (rng or random).choice(self.questions) if self.questions else None
+
+    def random_in_chapter(self, capitolo: Any, rng: Optional[random.Random] = None) -> Optional[Dict[str, Any]]:
+        items = self.chapter(capitolo)
+        return (rng or random).choice(items) if items else None
+
+    def search(self, text: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Questions ranked by relevance to `text` (BM25), at most `limit`."""
+        return [self.questions[i] for i, _ in self._search_index.search(text, limit or len(self.questions))]
+
+    def where(self, **fields: Any) -> List[Dict[str, Any]]:
+        """Linear filter on exact field values (for the rarely used category queries)."""
+        return [q for q in self.questions if all(q.get(k) == v for k, v in fields.items())]
+
+
+class QuizBankLoader:
+    """
+    Holds the current QuizBank of one collection and keeps it up to date.
+
+    get() never waits for MongoDB once a bank is loaded: the periodic version check
+    runs in a background thread (synchronously when background=False, for tests).
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], List[Dict[str, Any]]],
+        probe_version: Optional[Callable[[], Optional[str]]] = None,
+        refresh_seconds: Optional[float] = None,
+        background: bool = True,
+        name: str = "quiz",
+        retry_after_s: float = 60,
+    ):
+        self._fetch = fetch
+        self._probe_version = probe_version or (lambda: None)
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else settings.QUIZ_BANK_REFRESH_SECONDS
+        self.background = background
+        self.name = name
+        self.retry_after_s = retry_after_s
+        self._failed_at = float("-inf")
+        self._bank: Optional[QuizBank] = None
+        self._load_lock = threading.Lock()
+        self._checking = threading.Lock()
+        self._checked_at = 0.0
+        self.loads = 0
+        self.reloads_skipped = 0
+        self.failures = 0
+
+    def get(self) -> Optional[QuizBank]:
+        """Current bank, loading it on first use. None if it cannot be loaded."""
+        bank = self._bank
+        if bank is None:
+            if time.monotonic() - self._failed_at < self.retry_after_s:
+                return None  # Load failed recently: use MongoDB without retrying on every call
+            return self._load_if_missing()
+        if time.monotonic() - self._checked_at >= self.refresh_seconds and self._checking.acquire(blocking=False):
+            if self.background:
+                threading.Thread(target=self._revalidate, name="quiz-bank-refresh", daemon=True).start()
+            else:
+                self._revalidate()
+        return bank
+
+    def invalidate(self) -> None:
+        """Drop the current bank: the next get() reloads it (called after writes to the collection)."""
+        self._bank = None
+
+    def _load_if_missing(self) -> Optional[QuizBank]:
+        with self._load_lock:
+            if self._bank is None:
+                try:
+                    self._bank = self._build(self._probe_version())
+                except Exception as e:
+                    self._failed_at = time.monotonic()
+                    self.failures += 1
+                    logger.error(f"QUIZ_BANK - Caricamento di {self.name} fallito, uso MongoDB: {e}")
+            return self._bank
+
+    def _build(self, version: Optional[str]) -> QuizBank:
+        start = time.perf_counter()
+        questions = self._fetch()
+        bank = QuizBank(questions, version or content_version(questions))
+        self._checked_at = time.monotonic()
+        self.loads += 1
+        logger.info(
+            f"QUIZ_BANK - Caricate {len(bank)} domande da {self.name} "
+            f"({len(bank.chapters())} capitoli, {(time.perf_counter() - start) * 1000:.0f}ms)"
+        )
+        return bank
+
+    def _revalidate(self) -> None:
+        try:
+            current = self._bank
+            version = self._probe_version()
+            if current is not None and version is not None and version == current.version:
+                self._checked_at = time.monotonic()
+                self.reloads_skipped += 1
+                return
+            bank = self._build(version)
+            if current is not None and bank.version == current.version:
+                self.reloads_skipped += 1
+                return
+            with self._load_lock:
+                self._bank = bank
+        except Exception as e:
+            self._checked_at = time.monotonic()
+            self.failures += 1
+            logger.warning(f"QUIZ_BANK - Aggiornamento di {self.name} fallito, mantengo le domande caricate: {e}")
+        finally:
+            self._checking.release()
+
+    def stats(self) -> Dict[str, Any]:
+        bank = self._bank
+        return {
+            "loaded": bank is not None,
+            "questions": len(bank) if bank else 0,
+            "chapters": bank.chapters() if bank else {},
+            "version": bank.version if bank else None,
+            "loaded_at": bank.loaded_at if bank else None,
+            "loads": self.loads,
+            "reloads_skipped": self.reloads_skipped,
+            "failures": self.failures,
+        }
+
+
+def copy_question(question: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Deep copy handed to callers, so the shared bank cannot be mutated."""
+    return copy.deepcopy(question) if question is not None else None
+
+
+_loaders: Dict[Tuple[str, str], QuizBankLoader] = {}
+_loaders_lock = threading.Lock()
+
+
+def get_quiz_bank_loader(db_service: Any, database_name: str, collection_name: str) -> QuizBankLoader:
+    """Process-wide loader for (database, collection), backed by a MongoDBService."""
+    key = (database_name, collection_name)
+    loader = _loaders.get(key)
+    if loader is not None:
+        return loader
+
+    def fetch() -> List[Dict[str, Any]]:
+        return db_service.get_items(collection_name)
+
+    def probe_version() -> Optional[str]:
+        try:
+            result = db_service.db.command("dbHash", collections=[collection_name])
+            return "dbhash:" + result["collections"][collection_name]
+        except Exception:
+            return None  # dbHash not allowed (e.g. Atlas shared tier): compare document content instead
+
+    with _loaders_lock:
+        if key not in _loaders:
+            _loaders[key] = QuizBankLoader(fetch, probe_version, name=f"{database_name}.{collection_name}")
+        return _loaders[key]
+
+
+def get_quiz_bank_stats() -> Dict[str, Any]:
+    """Return quiz bank metrics for this process."""
+    return {
+        "enabled": settings.QUIZ_BANK_ENABLED,
+        "collections": {loader.name: loader.stats() for loader in list(_loaders.values())},
+    }
@@ -0,0 +1,308 @@
+"""
+In-process write-behind queue for the streaming path.
+
+Conversation records, token metrics and rate limit events are queued when the
+SSE stream ends and written to MongoDB by a background task, so the response
+closes right after the last event instead of waiting for several round trips.
+
+Documents are grouped by (database, collection) and written with one unordered
+insert_many per group. Failed writes are retried with exponential backoff; the
+queue is bounded and drops documents according to the overflow policy. Anything
+still queued is flushed on FastAPI shutdown.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from src.env import settings
+from src.services.database.async_database_service import AsyncMongoDBService
+
+logger = logging.getLogger("uvicorn")
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest")
+DUPLICATE_KEY_ERROR = 11000
+
+# (database, collection, document, has_explicit_id)
+_Entry = Tuple[str, str, Dict[str, Any], bool]
+
+
+class WriteBehindQueue:
+    """Bounded queue of pending inserts, drained in batches by a background task."""
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval_s: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        retry_backoff_s: Optional[float] = None,
+        overflow_policy: Optional[str] = None,
+        service_factory: Callable[[str], AsyncMongoDBService] = AsyncMongoDBService,
+    ):
+        self.max_size = max_size if max_size is not None else settings.WRITE_BEHIND_MAX_QUEUE_SIZE
+        self.batch_size = batch_size if batch_size is not None else settings.WRITE_BEHIND_BATCH_SIZE
+        self.flush_interval_s = (
+            flush_interval_s if flush_interval_s is not None else settings.WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000
+        )
+        self.max_retries = max_retries if max_retries is not None else settings.WRITE_BEHIND_MAX_RETRIES
+        self.retry_backoff_s = (
+            retry_backoff_s if retry_backoff_s is not None else settings.WRITE_BEHIND_RETRY_BACKOFF_MS / 1000
+        )
+        self.overflow_policy = overflow_policy or settings.WRITE_BEHIND_OVERFLOW_POLICY
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {self.overflow_policy}. Use one of {OVERFLOW_POLICIES}")
+        self._service_factory = service_factory
+
+        self._buffer: Deque[_Entry] = deque()
+        self._worker: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._in_flight: List[_Entry] = []  # popped from _buffer, not yet written
+        self._reset_metrics()
+
+    def _reset_metrics(self) -> None:
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+        self.max_depth = 0
+        self.total_flush_ms = 0.0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def enqueue(self, database: str, collection: str, document: Dict[str, Any]) -> bool:
+        """
+        Queue a document for insertion. Never blocks and never touches the network.
+
+        Returns:
+            False if the document was dropped because the queue is full (drop_newest policy).
+        """
+        if len(self._buffer) >= self.max_size:
+            self.dropped += 1
+            if self.overflow_policy == "drop_newest":
+                logger.warning(f"WRITE_BEHIND - Coda piena ({self.max_size}), documento per {collection} scartato")
+                return False
+            _, dropped_collection, _, _ = self._buffer.popleft()
+            logger.warning(
+                f"WRITE_BEHIND - Coda piena ({self.max_size}), scartato il documento più vecchio per {dropped_collection}"
+            )
+
+        self._buffer.append((database, collection, document, document.get("_id") is not None))
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self._buffer))
+        self._ensure_worker()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def _ensure_worker(self) -> None:
+        """Start the flusher on the running event loop (one per loop, restarted after close)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # No loop: documents wait for the next flush()
+        if self._worker is not None and not self._worker.done() and self._worker.get_loop() is loop:
+            return
+        self._wakeup = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._worker = loop.create_task(self._run(self._wakeup, self._stop))
+
+    async def _run(self, wakeup: asyncio.Event, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            await wakeup.wait()
+            wakeup.clear()
+            # Linger briefly so that concurrent requests share one insert_many (cut short by close())
+            if len(self._buffer) < self.batch_size and not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=self.flush_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"WRITE_BEHIND - Errore inatteso durante il flush: {e}")
+
+    async def flush(self) -> int:
+        """
+        Write everything currently queued, batch by batch.
+
+        Returns:
+            The number of documents persisted.
+        """
+        persisted = 0
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            start = time.perf_counter()
+            try:
+                persisted += await self._write_batch(batch)
+            except asyncio.CancelledError:
+                self._requeue_in_flight()
+                raise
+            self._record_flush((time.perf_counter() - start) * 1000)
+        return persisted
+
+    async def _write_batch(self, batch: List[_Entry]) -> int:
+        groups: Dict[Tuple[str, str], List[Tuple[Dict[str, Any], bool]]] = {}
+        for database, collection, document, explicit_id in batch:
+            groups.setdefault((database, collection), []).append((document, explicit_id))
+
+        self._in_flight = list(batch)
+        persisted = 0
+        for (database, collection), entries in groups.items():
+            persisted += await self._write_group(database, collection, entries)
+            self._in_flight = [e for e in self._in_flight if (e[0], e[1]) != (database, collection)]
+        return persisted
+
+    def _requeue_in_flight(self) -> None:
+        """
+        Put the groups of a cancelled batch back at the head of the queue.
+
+        The cancelled insert_many may have reached MongoDB: requeued documents are retried
+        without the explicit-_id fallback, so a duplicate key counts as already stored.
+        """
+        if not self._in_flight:
+            return
+        logger.warning(f"WRITE_BEHIND - Flush interrotto, {len(self._in_flight)} documenti rimessi in coda")
+        self._buffer.extendleft(
+            (database, collection, document, False) for database, collection, document, _ in reversed(self._in_flight)
+        )
+        self._in_flight = []
+
+    async def _write_group(self, database: str, collection: str, entries: List[Tuple[Dict[str, Any], bool]]) -> int:
+        """Insert one (database, collection) group, retrying only the documents that failed."""
+        pending = entries
+        persisted = 0
+        last_error: Optional[Exception] = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                await asyncio.sleep(self.retry_backoff_s * 2 ** (attempt - 1))
+            try:
+                await self._service_factory(database).insert_documents(collection, [doc for doc, _ in pending])
+                persisted += len(pending)
+                pending = []
+                break
+            except BulkWriteError as e:
+                last_error = e
+                pending, already_persisted = self._pending_after_bulk_error(pending, e.details)
+                persisted += already_persisted
+                if not pending:
+                    break
+            except Exception as e:
+                last_error = e
+
+        self.written += persisted
+        if pending:
+            self.failed += len(pending)
+            logger.error(
+                f"WRITE_BEHIND - {len(pending)} documenti persi su {database}.{collection} "
+                f"dopo {self.max_retries} retry: {last_error}"
+            )
+        else:
+            logger.info(f"WRITE_BEHIND - {persisted} documenti scritti su {database}.{collection}")
+        return persisted
+
+    @staticmethod
+    def _pending_after_bulk_error(
+        pending: List[Tuple[Dict[str, Any], bool]], details: Dict[str, Any]
+    ) -> Tuple[List[Tuple[Dict[str, Any], bool]], int]:
+        """
+        Split an unordered insert_many failure into documents to retry and documents already stored.
+
+        A duplicate key on a driver-generated _id means the document was stored by an earlier
+        attempt; a duplicate on an explicit _id (message_id) falls back to a generated ObjectId,
+        like ConversationPersistence.save_conversation.
+        """
+        write_errors = details.get("writeErrors", [])
+        failed_indexes = {err["index"] for err in write_errors}
+        already_persisted = len(pending) - len(failed_indexes)
+        retry = []
+        for err in write_errors:
+            document, explicit_id = pending[err["index"]]
+            if err.get("code") == DUPLICATE_KEY_ERROR:
+                if not explicit_id:
+                    already_persisted += 1
+                    continue
+                logger.error(f"DB - Duplicate message_id detected: {document.get('_id')}. Retry con ObjectId auto-generato")
+                document.pop("_id", None)
+                explicit_id = False
+            retry.append((document, explicit_id))
+        return retry, already_persisted
+
+    def _record_flush(self, duration_ms: float) -> None:
+        self.flushes += 1
+        self.total_flush_ms += duration_ms
+        self.last_flush_ms = duration_ms
+        self.max_flush_ms = max(self.max_flush_ms, duration_ms)
+
+    async def close(self, timeout_s: Optional[float] = None) -> int:
+        """
+        Stop the flusher and write what is left (FastAPI shutdown).
+
+        The flusher is not cancelled: it is asked to stop and its current flush (a batch
+        already popped from the queue) completes. Only when timeout_s expires is the
+        flush cancelled; the unwritten documents, in-flight batch included, are counted
+        as failed.
+
+        Returns:
+            The number of documents persisted while closing.
+        """
+        timeout_s = timeout_s if timeout_s is not None else settings.WRITE_BEHIND_SHUTDOWN_TIMEOUT_MS / 1000
+        worker, wakeup, stop = self._worker, self._wakeup, self._stop
+        self._worker, self._wakeup, self._stop = None, None, None
+        written_before = self.written
+
+        async def drain() -> None:
+            if worker is not None and not worker.done() and worker.get_loop() is asyncio.get_running_loop():
+                stop.set()
+                wakeup.set()
+                await worker
+            await self.flush()
+
+        try:
+            await asyncio.wait_for(drain(), timeout=timeout_s)
+        except asyncio.TimeoutError:
+            lost = len(self._buffer)
+            self.failed += lost
+            self._buffer.clear()
+            logger.error(f"WRITE_BEHIND - Timeout flush di chiusura, {lost} documenti non scritti")
+        persisted = self.written - written_before
+        logger.info(f"WRITE_BEHIND - Coda chiusa, {persisted} documenti scritti al flush finale")
+        return persisted
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, throughput and flush latency, for the monitoring report."""
+        return {
+            "depth": len(self._buffer),
+            "max_depth": self.max_depth,
+            "max_size": self.max_size,
+            "overflow_policy": self.overflow_policy,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "retries": self.retries,
+            "flushes": self.flushes,
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
+
+
+_write_behind_queue = WriteBehindQueue()
+
+
+def get_write_behind_queue() -> WriteBehindQueue:
+    return _write_behind_queue
+
+
+def get_write_behind_stats() -> Dict[str, Any]:
+    """Return write-behind queue metrics for this process."""
+    return _write_behind_queue.stats()
@@ -7,8 +7,10 @@ from typing import Optional
 
 from langchain_core.tools import tool
 from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
 
 from src.services.database.database_quiz_service import QuizMongoDBService
+from src.quiz_session import get_quiz_session_store
 
 import logging
 logger = logging.getLogger("uvicorn")
@@ -31,6 +33,9 @@ CHAPTER_NAMES = {
 MIN_CHAPTER = 1
 MAX_CHAPTER = 10
 
+# Chiave in config["configurable"] con l'utente della richiesta (sessioni d'esame)
+USER_ID_CONFIG_KEY = "user_id"
+
 
 def _normalize_optional_param(value) -> Optional[str]:
     """Normalize parameter: treat empty strings as None."""
@@ -87,8 +92,20 @@ def _get_quiz_service() -> Optional[QuizMongoDBService]:
         return None
 
 
+def warm_quiz_bank() -> None:
+    """Carica la banca domande all'avvio, così la prima domanda non attende MongoDB."""
+    quiz = _get_quiz_service()
+    if quiz is not None and quiz.bank_loader is not None:
+        quiz.bank_loader.get()
+
+
 @tool(return_direct=True)
-def domanda_teoria(capitolo: Optional[int] = None, domanda: Optional[int] = None, testo: Optional[str] = None) -> dict:
+def domanda_teoria(
+    capitolo: Optional[int] = None,
+    domanda: Optional[int] = None,
+    testo: Optional[str] = None,
+    config: RunnableConfig = None,
+) -> dict:
     """
     Scopo:
         Recupera e presenta all'utente una domanda d'esame per la teoria della licenza di paracadutismo.
@@ -132,6 +149,7 @@ def domanda_teoria(capitolo: Optional[int] = None, domanda: Optional[int] = None
         - 'testo': (str) Testo della domanda.
         - 'opzioni': (list) Lista di opzioni, ciascuna con 'id' e 'testo'.
         - 'risposta_corretta': (str) La lettera (es. 'C') che devi usare per verificare la risposta dell'utente.
+        - 'esame': (dict, solo in modalità 1) 'domanda' e 'totale': posizione nella simulazione d'esame in corso.
     """
     quiz = _get_quiz_service()
     if quiz is None:
@@ -152,7 +170,8 @@ def domanda_teoria(capitolo: Optional[int] = None, domanda: Optional[int] = None
             return _get_by_chapter(quiz, capitolo, domanda)
 
         # Mode 1: Random question from entire database
-        return _get_random_question(quiz)
+        user_id = ((config or {}).get("configurable") or {}).get(USER_ID_CONFIG_KEY)
+        return _get_random_question(quiz, user_id)
 
     except Exception as e:
         logger.error(
@@ -165,7 +184,7 @@ def domanda_teoria(capitolo: Optional[int] = None, domanda: Optional[int] = None
 def _search_by_text(quiz: QuizMongoDBService, testo: str) -> dict:
     """Search questions by text content."""
     logger.info(f"TOOL: domanda_teoria - Ricerca per testo: {testo}")
-    questions = quiz.search_questions_by_text(testo)
+    questions = quiz.search_questions_by_text(testo, limit=1)
 
     if not questions:
         logger.warning(f"TOOL: domanda_teoria - Nessuna domanda trovata per: {testo}")
@@ -206,8 +225,18 @@ def _get_by_chapter(quiz: QuizMongoDBService, capitolo: int, domanda: Optional[i
     return question
 
 
-def _get_random_question(quiz: QuizMongoDBService) -> dict:
-    """Get random question from entire database."""
+def _get_random_question(quiz: QuizMongoDBService, user_id: Optional[str] = None) -> dict:
+    """
+    Get random question from entire database.
+    With a known user the question comes from their exam session (no repeats, no DB call).
+    """
+    bank = quiz.get_question_bank() if user_id else None
+    if bank is not None and len(bank):
+        question = get_quiz_session_store().next_question(user_id, bank)
+        if question:
+            logger.info(f"TOOL: domanda_teoria - Simulazione d'esame {question['esame']}: {question}")
+            return question
+
     logger.info("TOOL: domanda_teoria - Estraggo domanda casuale dal DB")
     question = quiz.get_random_question()
 
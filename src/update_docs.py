@@ -1,4 +1,8 @@
 from .utils import update_prompt_from_s3
+from .agent.state_manager import purge_superseded_threads
+from .agent.context_cache import invalidate_context_cache
+from .env import settings
+from .retrieval import get_docs_retriever
 import logging
 logger = logging.getLogger("uvicorn")
 
@@ -12,6 +16,11 @@ def update_docs():
     try:
         result = update_prompt_from_s3()
         logger.info("Update docs: system prompt aggiornato e versione incrementata.")
+        purge_superseded_threads(result.get("prompt_version", 0))
+        invalidate_context_cache(result.get("prompt_version", 0))
+        if settings.RETRIEVAL_MODE and result.get("combined_docs"):
+            # Chunking e indice BM25 della nuova versione, prima della prossima richiesta
+            get_docs_retriever(result["combined_docs"], result.get("prompt_version", 0))
         return result
     except Exception as e:
         logger.error(f"Update docs: errore durante l'aggiornamento del prompt: {e}")
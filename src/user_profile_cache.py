@@ -0,0 +1,321 @@
+"""
+Cache a due livelli dei profili utente (metadata Auth0 già formattati per il prompt).
+
+- L1: LRU in processo, nessuna attesa;
+- L2: store condiviso tra le istanze (collection MongoDB, oppure un client Redis o
+  compatibile; LocalKeyValueStore è il fake locale con la stessa interfaccia), così
+  un'istanza appena avviata trova i profili già letti dalle altre.
+
+Stale-while-revalidate: un profilo più vecchio di USER_PROFILE_FRESH_SECONDS viene servito
+subito e aggiornato in background; solo oltre USER_PROFILE_STALE_SECONDS (o al primo
+accesso) la richiesta attende Auth0. Gli utenti senza profilo (o inesistenti su Auth0)
+sono in cache negativa per USER_PROFILE_NEGATIVE_SECONDS. Se Auth0 non risponde si
+continua a servire il profilo in cache, anche oltre la scadenza.
+
+Quando un refresh trova un profilo diverso, o invalidate() viene chiamato (es. dal
+frontend dopo una modifica del profilo), i listener registrati con add_listener ricevono
+(user_id, vecchio, nuovo).
+"""
+import asyncio
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Protocol
+
+from cachetools import LRUCache
+
+from .env import DATABASE_NAME, settings
+
+logger = logging.getLogger("uvicorn")
+
+ProfileListener = Callable[[str, Optional[str], Optional[str]], None]
+
+
+@dataclass
+class ProfileEntry:
+    """Profilo in cache: testo formattato ("" = nessun profilo) e istante del fetch (epoch)."""
+    user_info: str
+    fetched_at: float
+
+    @property
+    def missing(self) -> bool:
+        return not self.user_info
+
+
+class ProfileStore(Protocol):
+    """Store condiviso (L2)."""
+
+    async def get(self, user_id: str) -> Optional[ProfileEntry]: ...
+
+    async def set(self, user_id: str, entry: ProfileEntry, ttl_seconds: int) -> None: ...
+
+    async def delete(self, user_id: str) -> None: ...
+
+
+class MongoProfileStore:
+    """L2 su una collection MongoDB (Motor), con indice TTL sulla scadenza."""
+
+    def __init__(self, collection_name: Optional[str] = None, database_name: str = DATABASE_NAME, client: Any = None):
+        self.collection_name = collection_name or settings.USER_PROFILE_COLLECTION
+        self.database_name = database_name
+        self._client = client
+        self._indexed = False
+
+    def _collection(self):
+        from .services.database.connection_pool import get_async_client
+        client = self._client if self._client is not None else get_async_client()
+        return client[self.database_name][self.collection_name]
+
+    async def get(self, user_id: str) -> Optional[ProfileEntry]:
+        doc = await self._collection().find_one({"_id": user_id})
+        return ProfileEntry(doc["user_info"], doc["fetched_at"]) if doc else None
+
+    async def set(self, user_id: str, entry: ProfileEntry, ttl_seconds: int) -> None:
+        collection = self._collection()
+        if not self._indexed:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+        expires_at = datetime.fromtimestamp(entry.fetched_at + ttl_seconds, tz=timezone.utc)
+        await collection.replace_one(
+            {"_id": user_id}, {**asdict(entry), "expires_at": expires_at}, upsert=True,
+        )
+
+    async def delete(self, user_id: str) -> None:
+        await self._collection().delete_one({"_id": user_id})
+
+
+class LocalKeyValueStore:
+    """Fake locale di un client Redis asincrono (get, set con ex, delete)."""
+
+    def __init__(self, timer: Callable[[], float] = time.time):
+        self._data: Dict[str, tuple] = {}
+        self._timer = timer
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= self._timer():
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ex: Optional[int] = None) -> None:
+        self._data[key] = (value, self._timer() + ex if ex else None)
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+class KeyValueProfileStore:
+    """L2 su un client Redis (redis.asyncio) o compatibile, es. LocalKeyValueStore."""
+
+    def __init__(self, client: Any, prefix: str = "air_coach:profile:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, user_id: str) -> Optional[ProfileEntry]:
+        raw = await self.client.get(self.prefix + user_id)
+        return ProfileEntry(**json.loads(raw)) if raw else None
+
+    async def set(self, user_id: str, entry: ProfileEntry, ttl_seconds: int) -> None:
+        await self.client.set(self.prefix + user_id, json.dumps(asdict(entry)), ex=max(1, int(ttl_seconds)))
+
+    async def delete(self, user_id: str) -> None:
+        await self.client.delete(self.prefix + user_id)
+
+
+def create_profile_store(backend: Optional[str] = None) -> Optional[ProfileStore]:
+    """Store L2 configurato da USER_PROFILE_STORE (mongo | redis | local | none)."""
+    backend = (backend or settings.USER_PROFILE_STORE).lower()
+    if backend == "mongo":
+        return MongoProfileStore()
+    if backend == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            logger.error("USER_PROFILE - USER_PROFILE_STORE=redis ma il pacchetto redis non è installato: solo cache L1")
+            return None
+        return KeyValueProfileStore(redis.from_url(settings.REDIS_URL))
+    if backend == "local":
+        return KeyValueProfileStore(LocalKeyValueStore())
+    return None
+
+
+class UserProfileCache:
+    """Profili utente con cache L1/L2, stale-while-revalidate e cache negativa."""
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[Optional[str]]],
+        store: Optional[ProfileStore] = None,
+        maxsize: Optional[int] = None,
+        fresh_seconds: Optional[float] = None,
+        stale_seconds: Optional[float] = None,
+        negative_seconds: Optional[float] = None,
+        timer: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            fetch: legge il profilo da Auth0; None se l'utente non esiste, eccezione se
+                Auth0 non risponde
+            store: store L2 condiviso (None = solo L1)
+        """
+        self._fetch = fetch
+        self.store = store
+        self._local: LRUCache = LRUCache(maxsize=maxsize or settings.USER_PROFILE_CACHE_SIZE)
+        self.fresh_seconds = fresh_seconds if fresh_seconds is not None else settings.USER_PROFILE_FRESH_SECONDS
+        self.stale_seconds = stale_seconds if stale_seconds is not None else settings.USER_PROFILE_STALE_SECONDS
+        self.negative_seconds = negative_seconds if negative_seconds is not None else settings.USER_PROFILE_NEGATIVE_SECONDS
+        self._timer = timer
+        self._listeners: List[ProfileListener] = []
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._counters = dict.fromkeys(
+            ("l1_hits", "l2_hits", "misses", "stale_served", "negative_hits",
+             "refreshes", "fetch_errors", "store_errors", "changes"), 0,
+        )
+
+    # -- API -------------------------------------------------------------------------
+
+    async def get(self, user_id: str) -> str:
+        """Profilo formattato dell'utente ("" se non ha un profilo)."""
+        entry = self._local.get(user_id)
+        if entry is not None:
+            self._counters["l1_hits"] += 1
+        else:
+            entry = await self._store_get(user_id)
+            if entry is not None:
+                self._counters["l2_hits"] += 1
+                self._local[user_id] = entry
+
+        if entry is not None:
+            age = self._timer() - entry.fetched_at
+            if entry.missing and age < self.negative_seconds:
+                self._counters["negative_hits"] += 1
+                return entry.user_info
+            if not entry.missing and age < self.fresh_seconds:
+                return entry.user_info
+            if not entry.missing and age < self.stale_seconds:
+                self._counters["stale_served"] += 1
+                self._schedule_refresh(user_id)
+                return entry.user_info
+
+        self._counters["misses"] += 1
+        refreshed = await self._refresh(user_id, entry)
+        return refreshed.user_info if refreshed is not None else ""
+
+    def add_listener(self, listener: ProfileListener) -> None:
+        """Registra un callback (user_id, vecchio, nuovo) per i cambi di profilo."""
+        self._listeners.append(listener)
+
+    async def invalidate(self, user_id: str) -> None:
+        """Rimuove il profilo da L1 e L2: la prossima richiesta lo rilegge da Auth0."""
+        entry = self._local.pop(user_id, None)
+        if self.store is not None:
+            try:
+                await self.store.delete(user_id)
+            except Exception as e:
+                self._counters["store_errors"] += 1
+                logger.warning(f"USER_PROFILE - Invalidazione L2 fallita per {user_id}: {e}")
+        logger.info(f"USER_PROFILE - Profilo di {user_id} invalidato")
+        self._notify(user_id, entry.user_info if entry else None, None)
+
+    def stats(self) -> Dict[str, Any]:
+        served = self._counters["l1_hits"] + self._counters["l2_hits"] + self._counters["misses"]
+        return {
+            "store": type(self.store).__name__ if self.store is not None else None,
+            "size": len(self._local),
+            **self._counters,
+            "hit_rate": round((served - self._counters["misses"]) / served, 3) if served else 0,
+        }
+
+    # -- interni ---------------------------------------------------------------------
+
+    def _schedule_refresh(self, user_id: str) -> None:
+        task = self._refreshing.get(user_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.ensure_future(self._refresh(user_id, self._local.get(user_id)))
+        self._refreshing[user_id] = task
+        task.add_done_callback(lambda t: self._refreshing.pop(user_id, None) if self._refreshing.get(user_id) is t else None)
+
+    async def _refresh(self, user_id: str, previous: Optional[ProfileEntry]) -> Optional[ProfileEntry]:
+        """Legge il profilo da Auth0 e aggiorna L1/L2; in caso di errore resta il precedente."""
+        self._counters["refreshes"] += 1
+        try:
+            user_info = await self._fetch(user_id)
+        except Exception as e:
+            self._counters["fetch_errors"] += 1
+            logger.error(f"USER_PROFILE - Fetch del profilo di {user_id} fallito: {e}")
+            return previous
+
+        entry = ProfileEntry(user_info or "", self._timer())
+        self._local[user_id] = entry
+        await self._store_set(user_id, entry)
+        if previous is not None and previous.user_info != entry.user_info:
+            self._notify(user_id, previous.user_info, entry.user_info)
+        return entry
+
+    def _notify(self, user_id: str, old: Optional[str], new: Optional[str]) -> None:
+        self._counters["changes"] += 1
+        for listener in list(self._listeners):
+            try:
+                listener(user_id, old, new)
+            except Exception as e:
+                logger.error(f"USER_PROFILE - Listener {listener!r} fallito per {user_id}: {e}")
+
+    async def _store_get(self, user_id: str) -> Optional[ProfileEntry]:
+        if self.store is None:
+            return None
+        try:
+            return await self.store.get(user_id)
+        except Exception as e:
+            self._counters["store_errors"] += 1
+            logger.warning(f"USER_PROFILE - Lettura L2 fallita per {user_id}: {e}")
+            return None
+
+    async def _store_set(self, user_id: str, entry: ProfileEntry) -> None:
+        if self.store is None:
+            return
+        ttl = self.negative_seconds if entry.missing else self.stale_seconds
+        try:
+            await self.store.set(user_id, entry, ttl)
+        except Exception as e:
+            self._counters["store_errors"] += 1
+            logger.warning(f"USER_PROFILE - Scrittura L2 fallita per {user_id}: {e}")
+
+
+async def fetch_user_profile(user_id: str) -> Optional[str]:
+    """Profilo formattato da Auth0 (None se l'utente non esiste su Auth0)."""
+    from .auth0 import get_auth0_client, is_valid_user_id
+    from .utils import format_user_metadata
+
+    if not is_valid_user_id(user_id):
+        return None
+    metadata = await get_auth0_client().afetch_user_metadata(user_id)
+    return format_user_metadata(metadata) if metadata is not None else None
+
+
+def _drop_legacy_entry(user_id: str, old: Optional[str], new: Optional[str]) -> None:
+    """Tiene allineata la cache del percorso sync (get_personalized_prompt_for_user)."""
+    from .cache import user_metadata_cache
+    user_metadata_cache.pop(user_id, None)
+
+
+_cache: Optional[UserProfileCache] = None
+
+
+def get_user_profile_cache() -> UserProfileCache:
+    """Cache di processo dei profili utente (creata al primo uso)."""
+    global _cache
+    if _cache is None:
+        _cache = UserProfileCache(fetch_user_profile, create_profile_store())
+        _cache.add_listener(_drop_legacy_entry)
+    return _cache
+
+
+def get_user_profile_stats() -> Dict[str, Any]:
+    return get_user_profile_cache().stats()
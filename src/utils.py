@@ -1,12 +1,16 @@
 """
 Utility functions for user formatting, validation, document caching, and prompt management.
 """
-from typing import Dict, Optional, Tuple
+from concurrent.futures import Future, wait
+from typing import Any, Dict, NamedTuple, Optional, Tuple
 import datetime
 import re
 import logging
 import threading
+import time
 
+from .docs_snapshot import DocsSnapshot, docs_fingerprint, load_snapshot, write_snapshot
+from .env import settings
 from .s3_utils import fetch_docs_from_s3
 
 logger = logging.getLogger("uvicorn")
@@ -53,12 +57,11 @@ def _format_field(value: Optional[str], mapping: Dict[str, str], field_name: str
 def format_user_metadata(user_metadata: Dict) -> str:
     """
     Formatta i metadata dell'utente in una stringa leggibile.
+    La data corrente non è inclusa: è un segmento separato del prompt (vedi prompt_personalization).
     """
-    date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-
     if not user_metadata:
         logger.info("USER INFO - Nessun metadata utente trovato.")
-        return f"\nOggi è il {date_str}\n"
+        return ""
 
     lines = ["I dati che l'utente ti ha fornito su di sè sono:"]
 
@@ -90,8 +93,6 @@ def format_user_metadata(user_metadata: Dict) -> str:
     if sex := _format_field(user_metadata.get("sex"), SEX_MAPPING, "Sesso"):
         lines.append(f"Sesso: {sex}")
 
-    lines.append(f"\nOggi è il {date_str}")
-
     logger.info(f"USER INFO - metadata salvati in cache per: {name} {surname}")
 
     return "\n".join(lines) + "\n"
@@ -114,39 +115,179 @@ def validate_user_id(user_id: str) -> bool:
 # Document Cache
 # ------------------------------------------------------------------------------
 
+class _DocsState(NamedTuple):
+    """Versione immutabile dei docs in cache: viene sostituita in blocco, mai modificata."""
+    content: str
+    meta: list
+    timestamp: Optional[datetime.datetime]
+
+
 class _DocsCache:
-    """Thread-safe cache for S3 documents."""
+    """
+    Thread-safe cache for S3 documents.
+
+    - Single-flight: i chiamanti concorrenti (cold start o refresh) attendono lo stesso
+      fetch in corso invece di avviare N download paralleli.
+    - Stale-while-revalidate: durante un refresh i lettori continuano a ricevere la
+      versione corrente; la nuova viene costruita a parte e sostituita atomicamente.
+      Se il fetch fallisce resta in servizio la versione precedente.
+    - All'import carica lo snapshot locale (vedi src/docs_snapshot.py), se presente:
+      il primo get() non attende il download da S3, che avviene poi in background
+      tramite revalidate().
+    """
 
-    def __init__(self):
+    def __init__(
+        self,
+        snapshot_path: Optional[str] = None,
+        bundled_snapshot_path: Optional[str] = None,
+        snapshot_enabled: Optional[bool] = None,
+    ):
         self._lock = threading.Lock()
-        self._content: Optional[str] = None
-        self._meta: Optional[list] = None
-        self._timestamp: Optional[datetime.datetime] = None
+        self._state: Optional[_DocsState] = None
+        self._inflight: Optional[Future] = None
+        self._latest: Optional[Future] = None  # ultimo fetch avviato (numero _generation)
+        self._generation = 0
+        self.fetch_count = 0
+        self.joined_count = 0
+        self.snapshot_enabled = settings.DOCS_SNAPSHOT_ENABLED if snapshot_enabled is None else snapshot_enabled
+        self.snapshot_path = settings.DOCS_SNAPSHOT_PATH if snapshot_path is None else snapshot_path
+        self.bundled_snapshot_path = (
+            settings.DOCS_SNAPSHOT_BUNDLED_PATH if bundled_snapshot_path is None else bundled_snapshot_path
+        )
+        self._snapshot: Optional[DocsSnapshot] = None
+        if self.snapshot_enabled:
+            self._load_snapshot()
+
+    def _load_snapshot(self) -> None:
+        start = time.perf_counter()
+        snapshot = load_snapshot([self.snapshot_path, self.bundled_snapshot_path])
+        if snapshot is None:
+            return
+        self._snapshot = snapshot
+        self._state = _DocsState(snapshot.combined_docs, snapshot.docs_meta, snapshot.created_at_dt)
+        logger.info(
+            f"Docs: snapshot v{snapshot.prompt_version} caricato da {snapshot.path} "
+            f"({len(snapshot.docs_meta)} file, {(time.perf_counter() - start) * 1000:.1f}ms)"
+        )
+
+    @property
+    def snapshot_version(self) -> Optional[int]:
+        """Versione del prompt dello snapshot, se il contenuto servito non è ancora stato riconciliato con S3."""
+        return self._snapshot.prompt_version if self._snapshot else None
 
     def get(self) -> Optional[str]:
-        """Get cached content, fetching from S3 if empty."""
-        if self._content is None:
-            self._fetch()
-        return self._content
+        """Get cached content; on a cold cache all callers share a single S3 fetch."""
+        state = self._state
+        if state is None:
+            self._load()
+            state = self._state
+        return state.content if state else None
 
     def update(self) -> dict:
-        """Force update from S3 and return result details."""
+        """
+        Force update from S3 and return result details. Readers keep the current docs meanwhile.
+
+        Non riusa un fetch già in corso, che potrebbe aver listato S3 prima dell'upload
+        che ha motivato l'update: lo attende e ne avvia uno nuovo (condiviso dagli
+        update concorrenti).
+        """
+        return self._load(fresh=True)
+
+    def revalidate(self) -> bool:
+        """
+        Riconcilia il contenuto dello snapshot con S3.
+        Ritorna True se i docs sono cambiati; se S3 non risponde mantiene lo snapshot.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return False  # già riconciliato da un update() concorrente
+        logger.info("Docs: revalidazione dello snapshot su S3...")
+        result = self._load()
+        if result["stale"]:
+            logger.warning("Docs: revalidazione fallita, continuo a servire lo snapshot locale.")
+            return False
+        changed = docs_fingerprint(result["combined_docs"]) != snapshot.sha256
+        logger.info(f"Docs: snapshot {'superato, docs aggiornati' if changed else 'ancora valido'}.")
+        return changed
+
+    def save_snapshot(self, prompt_version: int) -> bool:
+        """Persiste contenuto, meta e versione del prompt per il prossimo cold start."""
+        state = self._state
+        if not self.snapshot_enabled or state is None or not state.content:
+            return False
+        return write_snapshot(self.snapshot_path, state.content, state.meta, prompt_version)
+
+    def _load(self, fresh: bool = False) -> dict:
+        """
+        Single-flight: il primo chiamante esegue il fetch, gli altri ne attendono il risultato.
+        Con fresh=True si accoda solo a un fetch avviato dopo la chiamata.
+        """
+        with self._lock:
+            min_generation = self._generation + 1 if fresh else None
+        while True:
+            with self._lock:
+                future = self._inflight
+                if future is None and min_generation is not None and self._generation >= min_generation:
+                    future = self._latest  # già concluso per un update concorrente
+                if future is None:
+                    self._generation += 1
+                    future = self._inflight = self._latest = Future()
+                    break
+                joinable = min_generation is None or self._generation >= min_generation
+                if joinable:
+                    self.joined_count += 1
+            if joinable:
+                return future.result()
+            wait([future])  # fetch avviato prima della chiamata: lo lascia finire e ne avvia uno nuovo
+        # _inflight va liberato prima di risvegliare chi attende per avviare un nuovo fetch
+        try:
+            result = self._fetch()
+        except BaseException as e:
+            with self._lock:
+                self._inflight = None
+            future.set_exception(e)
+            raise
         with self._lock:
-            return self._fetch()
+            self._inflight = None
+        future.set_result(result)
+        return result
 
     def _fetch(self) -> dict:
-        """Fetch docs from S3 and update cache."""
+        """Fetch docs from S3 and swap the cached version."""
         logger.info("Docs: Fetching from S3...")
+        self.fetch_count += 1
         result = fetch_docs_from_s3()
-        self._content = result["combined_docs"]
-        self._meta = result["docs_meta"]
-        self._timestamp = datetime.datetime.utcnow()
-        logger.info("Docs: Cache updated successfully.")
+        previous = self._state
+        stale = not result["combined_docs"] and previous is not None and bool(previous.content)
+        if stale:
+            logger.warning("Docs: fetch da S3 fallito, resta in servizio la versione in cache.")
+            state = previous
+        else:
+            state = _DocsState(result["combined_docs"], result["docs_meta"], datetime.datetime.utcnow())
+            self._state = state
+            self._snapshot = None
+            logger.info("Docs: Cache updated successfully.")
+        return {
+            "message": (
+                "Document cache update failed, serving cached documents." if stale
+                else "Document cache updated successfully."
+            ),
+            "docs_count": len(state.meta),
+            "docs_details": state.meta,
+            "combined_docs": state.content,
+            "sync_stats": result.get("sync_stats", {}),
+            "stale": stale,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Fetch eseguiti e chiamanti accodati a un fetch già in corso."""
+        state = self._state
         return {
-            "message": "Document cache updated successfully.",
-            "docs_count": len(self._meta),
-            "docs_details": self._meta,
-            "combined_docs": self._content,
+            "docs_count": len(state.meta) if state else 0,
+            "updated_at": state.timestamp.isoformat(timespec="seconds") if state and state.timestamp else None,
+            "from_snapshot": self._snapshot is not None,
+            "fetches": self.fetch_count,
+            "joined_inflight": self.joined_count,
         }
 
 
@@ -163,52 +304,104 @@ def update_docs_from_s3() -> dict:
     return _docs_cache.update()
 
 
+def get_docs_cache_stats() -> Dict[str, Any]:
+    return _docs_cache.stats()
+
+
 # ------------------------------------------------------------------------------
 # Prompt Manager
 # ------------------------------------------------------------------------------
 
 class _PromptManager:
-    """Thread-safe manager for system prompt with versioning."""
+    """
+    Thread-safe manager for system prompt with versioning.
+
+    Prompt e versione sono una sola tupla sostituita atomicamente: i lettori non
+    vedono mai un prompt nuovo con la versione vecchia. Il download da S3 di
+    update_from_s3 avviene fuori dal lock.
 
-    def __init__(self):
+    Se la cache dei docs parte da uno snapshot, il prompt ne eredita la versione e
+    la revalidazione su S3 gira in un thread in background: se i docs sono cambiati
+    il prompt viene sostituito e la versione incrementata, come con update_from_s3.
+    """
+
+    def __init__(self, docs_cache: Optional[_DocsCache] = None):
         self._lock = threading.Lock()
-        self._prompt: Optional[str] = None
-        self._version: int = 0
+        self._docs = docs_cache or _docs_cache
+        self._current: Tuple[Optional[str], int] = (None, 0)
+        self._revalidation: Optional[threading.Thread] = None
 
     def get(self) -> str:
         """Get current system prompt."""
-        return self._prompt or ""
+        return self._current[0] or ""
 
     def get_with_version(self) -> Tuple[str, int]:
         """Get current prompt and version."""
-        return (self.get(), self._version)
+        prompt, version = self._current
+        return (prompt or "", version)
 
     def ensure_initialized(self) -> None:
         """Initialize prompt from docs cache if not already set."""
-        if self._prompt:
+        if self._current[0]:
             return
         with self._lock:
-            if self._prompt:
+            if self._current[0]:
                 return
-            docs = get_combined_docs()
-            self._prompt = docs
-            self._version = 1
-            logger.info("PromptManager: system prompt inizializzato (v1).")
+            snapshot_version = self._docs.snapshot_version
+            docs = self._docs.get() or ""
+            if snapshot_version:
+                self._current = (docs, snapshot_version)
+                logger.info(f"PromptManager: system prompt inizializzato da snapshot (v{snapshot_version}).")
+                self._start_revalidation()
+            else:
+                self._current = (docs, 1)
+                logger.info("PromptManager: system prompt inizializzato (v1).")
+                self._docs.save_snapshot(1)
+
+    def _start_revalidation(self) -> None:
+        self._revalidation = threading.Thread(target=self._revalidate, name="docs-revalidation", daemon=True)
+        self._revalidation.start()
+
+    def _revalidate(self) -> None:
+        try:
+            changed = self._docs.revalidate()
+        except Exception as e:
+            logger.error(f"PromptManager: revalidazione dei docs fallita: {e}")
+            return
+        if not changed:
+            return
+        with self._lock:
+            docs = self._docs.get() or ""
+            prompt, version = self._current
+            if docs == prompt:
+                return  # già applicato da un update_from_s3 concorrente
+            self._current = (docs, version + 1)
+            self._docs.save_snapshot(version + 1)
+            logger.info(f"PromptManager: system prompt aggiornato dopo revalidazione (v{version + 1}).")
+
+    def wait_for_revalidation(self, timeout: Optional[float] = None) -> None:
+        """Attende la fine della revalidazione in background (test e benchmark)."""
+        if self._revalidation is not None:
+            self._revalidation.join(timeout)
 
     def update_from_s3(self) -> dict:
-        """Force update from S3 and increment version."""
+        """Force update from S3 and increment version (unchanged if S3 is unavailable)."""
+        update = self._docs.update()
         with self._lock:
-            update = update_docs_from_s3()
-            self._prompt = update.get("combined_docs", "")
-            self._version = (self._version or 0) + 1
-            logger.info(f"PromptManager: system prompt aggiornato (v{self._version}).")
+            prompt, version = self._current
+            if not update.get("stale"):
+                prompt, version = update.get("combined_docs", ""), version + 1
+                self._current = (prompt, version)
+                self._docs.save_snapshot(version)
+                logger.info(f"PromptManager: system prompt aggiornato (v{version}).")
             return {
                 "message": update.get("message", "System prompt updated successfully."),
                 "docs_count": update.get("docs_count", 0),
                 "docs_details": update.get("docs_details", []),
-                "system_prompt": self._prompt,
-                "combined_docs": self._prompt,
-                "prompt_version": self._version,
+                "system_prompt": prompt or "",
+                "combined_docs": prompt or "",
+                "prompt_version": version,
+                "sync_stats": update.get("sync_stats", {}),
             }
 
 
@@ -0,0 +1,100 @@
+"""
+Fake condivisi dai test unitari: chat model configurabile, clock manuale, grafo eco
+per i checkpointer e risultato finto di fetch_docs_from_s3.
+"""
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langgraph.graph import START, MessagesState, StateGraph
+
+DOCS_META = [{"title": "a.md", "last_modified": "2026-01-01 00:00:00"}]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model finto per create_react_agent.
+
+    A ogni chiamata risponde con il primo messaggio di `responses`, se presente; altrimenti
+    con `tool_calls` (finché l'ultimo messaggio non è un ToolMessage) o con il testo di
+    `chunks`, in streaming un chunk ogni `delay` secondi. `usage` è lo usage_metadata del
+    primo chunk, i successivi riportano solo i loro output_tokens. Gli stream cancellati
+    finiscono in `cancelled`.
+    """
+    chunks: List[str] = []
+    delay: float = 0.0
+    tool_calls: List[dict] = []
+    responses: List[AIMessage] = []
+    usage: Optional[Dict[str, int]] = None
+    cancelled: List[bool] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    def _scripted_reply(self, messages) -> Optional[AIMessage]:
+        if self.responses:
+            return self.responses.pop(0)
+        if self.tool_calls and not isinstance(messages[-1], ToolMessage):
+            return AIMessage(content="", tool_calls=self.tool_calls)
+        return None
+
+    def _chunk_usage(self, index: int) -> Optional[Dict[str, int]]:
+        if self.usage is None or index == 0:
+            return self.usage
+        output_tokens = self.usage.get("output_tokens", 0)
+        return {"input_tokens": 0, "output_tokens": output_tokens, "total_tokens": output_tokens}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._scripted_reply(messages) or AIMessage(content="".join(self.chunks))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._scripted_reply(messages)
+        if message is not None:
+            tool_call_chunks = [
+                {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                for i, c in enumerate(message.tool_calls)
+            ]
+            yield ChatGenerationChunk(message=AIMessageChunk(content=message.content, tool_call_chunks=tool_call_chunks))
+            return
+        try:
+            for i, text in enumerate(self.chunks):
+                if i and self.delay:
+                    await asyncio.sleep(self.delay)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=text, usage_metadata=self._chunk_usage(i)))
+        except asyncio.CancelledError:
+            self.cancelled.append(True)
+            raise
+
+
+class Clock:
+    """Clock manuale da passare come `timer`: il tempo avanza solo assegnando `now`."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def echo_graph(checkpointer):
+    """Grafo a un nodo che risponde a ogni messaggio umano (al posto dell'agente ReAct)."""
+    def reply(state: MessagesState):
+        return {"messages": [AIMessage(f"eco: {state['messages'][-1].content}")]}
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("reply", reply)
+    builder.add_edge(START, "reply")
+    return builder.compile(checkpointer=checkpointer)
+
+
+def s3_result(docs, meta=DOCS_META):
+    """Valore di ritorno di fetch_docs_from_s3 con il contenuto `docs`."""
+    return {"combined_docs": docs, "docs_meta": meta, "sync_stats": {}}
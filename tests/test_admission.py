@@ -0,0 +1,257 @@
+"""
+Unit tests for src/admission.py: global concurrency limit with a bounded FIFO queue,
+deadline-based rejection (503 + Retry-After) and per-user token buckets (429).
+"""
+import asyncio
+from typing import List
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from src.admission import AdmissionController, AdmissionRejected, AdmissionStreamingResponse
+from src.monitoring.token_logger import _build_metric
+from tests.fakes import Clock, FakeChatModel
+
+pytestmark = pytest.mark.unit
+
+
+def _model():
+    return FakeChatModel(chunks=["Ciao"], usage={"input_tokens": 10, "output_tokens": 2, "total_tokens": 12})
+
+
+def _controller(**kwargs):
+    options = dict(max_concurrent=2, queue_size=2, max_wait_seconds=1.0, user_rate_per_minute=0, user_burst=5)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+class TestGlobalLimit:
+
+    def test_requests_over_the_limit_wait_in_fifo_order(self):
+        controller = _controller()
+        order = []
+
+        async def request(name, hold):
+            admission = await controller.acquire(name)
+            order.append(name)
+            await asyncio.sleep(hold)
+            admission.release()
+            return admission.wait_ms
+
+        async def run():
+            first = [asyncio.ensure_future(request(n, 0.05)) for n in ("a", "b")]
+            await asyncio.sleep(0)
+            queued = [asyncio.ensure_future(request(n, 0)) for n in ("c", "d")]
+            await asyncio.sleep(0)
+            stats = controller.stats()
+            waits = await asyncio.gather(*first, *queued)
+            return stats, waits
+
+        stats, waits = asyncio.run(run())
+        assert order == ["a", "b", "c", "d"]
+        assert stats["active"] == 2 and stats["waiting"] == 2
+        assert waits[:2] == [0.0, 0.0] and min(waits[2:]) >= 40
+        assert controller.stats()["active"] == 0
+
+    def test_full_queue_is_rejected_with_retry_after(self):
+        controller = _controller(queue_size=1)
+
+        async def run():
+            held = [await controller.acquire(u) for u in ("a", "b")]
+            waiting = asyncio.ensure_future(controller.acquire("c"))
+            await asyncio.sleep(0)
+            with pytest.raises(AdmissionRejected) as rejected:
+                await controller.acquire("d")
+            for admission in held:
+                admission.release()
+            (await waiting).release()
+            return rejected.value
+
+        rejected = asyncio.run(run())
+        assert (rejected.status_code, rejected.code) == (503, "OVERLOADED")
+        assert rejected.retry_after >= 1
+        assert controller.stats()["rejected_queue_full"] == 1
+
+    def test_waiter_past_deadline_is_rejected_and_leaves_the_queue(self):
+        controller = _controller(max_concurrent=1, max_wait_seconds=0.05)
+
+        async def run():
+            held = await controller.acquire("a")
+            with pytest.raises(AdmissionRejected):
+                await controller.acquire("b")
+            stats = controller.stats()
+            held.release()
+            return stats
+
+        stats = asyncio.run(run())
+        assert stats["rejected_deadline"] == 1 and stats["waiting"] == 0
+        assert controller.stats()["active"] == 0
+
+    def test_estimated_wait_over_deadline_is_rejected_immediately(self):
+        clock = Clock()
+        controller = _controller(max_concurrent=1, max_wait_seconds=5, timer=clock)
+
+        async def run():
+            first = await controller.acquire("a")
+            clock.now += 8  # run medio di 8 s
+            first.release()
+            await controller.acquire("b")
+            with pytest.raises(AdmissionRejected) as rejected:
+                await controller.acquire("c")  # attesa stimata 8 s > 5 s: nessuna attesa
+            return rejected.value
+
+        rejected = asyncio.run(run())
+        assert rejected.retry_after == 8
+        assert controller.stats()["queued"] == 0
+
+    def test_cancelled_waiter_does_not_leak_the_slot(self):
+        controller = _controller(max_concurrent=1)
+
+        async def run():
+            held = await controller.acquire("a")
+            waiter = asyncio.ensure_future(controller.acquire("b"))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            held.release()
+            held.release()  # idempotente
+            return controller.stats()
+
+        stats = asyncio.run(run())
+        assert stats["active"] == 0 and stats["waiting"] == 0
+
+    def test_zero_disables_the_global_limit(self):
+        controller = _controller(max_concurrent=0)
+
+        async def run():
+            return [await controller.acquire(str(i)) for i in range(50)]
+
+        assert len(asyncio.run(run())) == 50
+
+
+class TestUserBucket:
+
+    def test_burst_then_refill(self):
+        clock = Clock()
+        controller = _controller(max_concurrent=0, user_rate_per_minute=6, user_burst=2, timer=clock)
+
+        async def run():
+            await controller.acquire("u1")
+            await controller.acquire("u1")
+            await controller.acquire("u2")  # bucket separato
+            with pytest.raises(AdmissionRejected) as rejected:
+                await controller.acquire("u1")
+            clock.now += 10  # 6/min: un token ogni 10 s
+            await controller.acquire("u1")
+            return rejected.value
+
+        rejected = asyncio.run(run())
+        assert (rejected.status_code, rejected.code, rejected.retry_after) == (429, "RATE_LIMITED", 10)
+        assert controller.stats()["rejected_user_rate"] == 1
+
+    def test_rejected_request_gives_the_token_back(self):
+        controller = _controller(max_concurrent=1, queue_size=0, user_rate_per_minute=1, user_burst=1)
+
+        async def run():
+            held = await controller.acquire("a")
+            with pytest.raises(AdmissionRejected):
+                await controller.acquire("b")  # 503: il token di b non viene consumato
+            held.release()
+            return await controller.acquire("b")
+
+        assert asyncio.run(run()).wait_ms == 0.0
+
+
+@pytest.mark.parametrize("resume", [True, False], ids=["event_log", "direct"])
+def test_slot_is_released_at_end_of_run_and_wait_is_logged(resume):
+    from src.rag import _ask_streaming
+
+    controller = _controller(max_concurrent=1)
+    agent = create_react_agent(_model(), [], checkpointer=InMemorySaver())
+
+    async def run():
+        admission = await controller.acquire("u1")
+        admission.wait_ms = 12.5
+        stream = _ask_streaming(agent, {"configurable": {"thread_id": "t1"}}, "ciao", "u1", False, admission=admission)
+        active = controller.stats()["active"]
+        frames: List[str] = [f async for f in stream]
+        await asyncio.sleep(0)
+        return active, frames
+
+    with patch("src.rag.settings.STREAM_RESUME_ENABLED", resume), \
+            patch("src.rag.MemorySeeder.aseed_agent_memory", AsyncMock()), \
+            patch("src.rag.ConversationPersistence.queue_conversation"), \
+            patch("src.rag.queue_token_usage") as token_usage:
+        active, frames = asyncio.run(run())
+
+    assert active == 1 and frames
+    assert controller.stats()["active"] == 0
+    metadata = token_usage.call_args.kwargs["metadata"]
+    assert metadata["queue_wait_ms"] == 12.5
+    metric = _build_metric("u1", "m", {"input_tokens": 1, "output_tokens": 1, "total_tokens": 2}, 10, metadata)
+    assert metric["queue_wait_ms"] == 12.5
+
+
+class TestSlotLeaks:
+
+    def test_slot_is_released_when_the_body_is_never_consumed(self):
+        from starlette.requests import ClientDisconnect
+        from src.rag import _ask_streaming
+
+        controller = _controller(max_concurrent=1)
+        agent = create_react_agent(_model(), [], checkpointer=InMemorySaver())
+        seed = AsyncMock()
+
+        async def send(message):
+            raise OSError("connection reset")  # fallisce già http.response.start
+
+        async def run():
+            admission = await controller.acquire("u1")
+            stream = _ask_streaming(agent, {"configurable": {"thread_id": "t1"}}, "ciao", "u1", False, admission=admission)
+            response = AdmissionStreamingResponse(stream, admission, media_type="text/event-stream")
+            with pytest.raises(ClientDisconnect):
+                await response({"type": "http", "asgi": {"spec_version": "2.4"}}, AsyncMock(), send)
+
+        with patch("src.rag.settings.STREAM_RESUME_ENABLED", False), \
+                patch("src.rag.MemorySeeder.aseed_agent_memory", seed):
+            asyncio.run(run())
+
+        seed.assert_not_awaited()  # il run non è mai partito
+        assert controller.stats()["active"] == 0
+
+    def test_slot_held_by_a_detached_run_is_not_released_by_the_response(self):
+        controller = _controller(max_concurrent=1)
+
+        async def run():
+            admission = await controller.acquire("u1")
+            admission.attach_run()
+
+            async def body():
+                yield "data: {}\n\n"
+
+            response = AdmissionStreamingResponse(body(), admission)
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, AsyncMock(), AsyncMock())
+            return controller.stats()["active"]
+
+        assert asyncio.run(run()) == 1
+
+    def test_cancelled_request_releases_the_slot(self):
+        from starlette.requests import Request
+        from src.main import stream_endpoint
+        from src.models import MessageRequest
+
+        controller = _controller(max_concurrent=1)
+        http_request = Request({"type": "http", "method": "POST", "headers": []})
+
+        async def run():
+            with pytest.raises(asyncio.CancelledError):
+                await stream_endpoint(MessageRequest(message="ciao", userid="u1"), http_request, {"token": "t"})
+
+        with patch("src.admission.get_admission_controller", return_value=controller), \
+                patch("src.rag.initialize_agent_state"), \
+                patch("src.rag.aask", AsyncMock(side_effect=asyncio.CancelledError)):
+            asyncio.run(run())
+
+        assert controller.stats()["active"] == 0
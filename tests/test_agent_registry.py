@@ -0,0 +1,105 @@
+"""
+Unit tests for src/agent/agent_registry.py and the pooled AgentManager.create_agent.
+"""
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from src.agent.agent_registry import AgentRegistry
+from src.agent.agent_manager import AgentManager, inject_system_prompt, SYSTEM_MESSAGE_CONFIG_KEY
+
+pytestmark = pytest.mark.unit
+
+
+def _key(version: int = 1, checkpointer=None):
+    return AgentRegistry.build_key("model", "europe-west8", version, ("domanda_teoria",), checkpointer)
+
+
+class TestAgentRegistry:
+
+    def test_reuses_agent_for_same_key(self):
+        registry = AgentRegistry()
+        factory = MagicMock(side_effect=lambda: object())
+
+        first = registry.get_or_create(_key(), factory)
+        second = registry.get_or_create(_key(), factory)
+
+        assert first is second
+        factory.assert_called_once()
+        assert registry.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+    def test_new_prompt_version_evicts_previous(self):
+        registry = AgentRegistry()
+
+        v1 = registry.get_or_create(_key(1), object)
+        v2 = registry.get_or_create(_key(2), object)
+
+        assert v1 is not v2
+        assert registry.stats()["entries"] == 1
+
+    def test_separate_agents_per_event_loop(self):
+        registry = AgentRegistry()
+
+        async def _get():
+            return registry.get_or_create(_key(), object)
+
+        first = asyncio.run(_get())
+        second = asyncio.run(_get())
+
+        assert first is not second
+        # L'entry del primo loop (ormai chiuso) viene rimossa
+        assert registry.stats()["entries"] == 1
+
+    def test_same_loop_shares_agent(self):
+        registry = AgentRegistry()
+
+        async def _get_twice():
+            return (
+                registry.get_or_create(_key(), object),
+                registry.get_or_create(_key(), object),
+            )
+
+        first, second = asyncio.run(_get_twice())
+        assert first is second
+
+
+class TestInjectSystemPrompt:
+
+    def test_prepends_system_message_from_config(self):
+        system = SystemMessage(content="prompt utente")
+        messages = [HumanMessage("ciao")]
+
+        result = inject_system_prompt(
+            {"messages": messages},
+            {"configurable": {SYSTEM_MESSAGE_CONFIG_KEY: system}},
+        )
+
+        assert result == [system] + messages
+
+    def test_without_system_message_returns_messages(self):
+        messages = [HumanMessage("ciao")]
+        assert inject_system_prompt({"messages": messages}, {"configurable": {}}) == messages
+
+
+class TestCreateAgentPooling:
+
+    @patch("src.agent.agent_manager.ChatGoogleGenerativeAI")
+    @patch("src.agent.agent_manager.create_react_agent")
+    @patch("src.agent.agent_manager.get_personalized_prompt_for_user")
+    def test_graph_built_once_and_prompt_per_user(self, mock_prompt, mock_agent, mock_llm):
+        registry = AgentRegistry()
+        mock_agent.return_value = MagicMock()
+        mock_prompt.side_effect = [("prompt user-a", 1, None), ("prompt user-b", 1, None)]
+
+        agent_a, config_a, _ = AgentManager.create_agent("user-a", registry=registry)
+        agent_b, config_b, _ = AgentManager.create_agent("user-b", registry=registry)
+
+        assert agent_a is agent_b
+        mock_llm.assert_called_once()
+        mock_agent.assert_called_once()
+        assert mock_agent.call_args[1]["prompt"] is inject_system_prompt
+        assert config_a["configurable"][SYSTEM_MESSAGE_CONFIG_KEY].content == "prompt user-a"
+        assert config_b["configurable"][SYSTEM_MESSAGE_CONFIG_KEY].content == "prompt user-b"
+        assert config_a["configurable"]["thread_id"] == "user-a:v1"
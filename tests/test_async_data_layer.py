@@ -0,0 +1,123 @@
+"""
+Unit tests for the async (Motor) data access layer and the streaming path that uses it.
+
+MongoDB is replaced by an in-process stand-in: mongomock wrapped by mongomock_motor.
+"""
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from mongomock_motor import AsyncMongoMockClient
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+
+from src.services.database.async_database_service import AsyncMongoDBService
+
+pytestmark = pytest.mark.unit
+
+DATABASE_NAME = "test_conversations"
+COLLECTION_NAME = "test_chats"
+
+
+@pytest.fixture
+def mongo():
+    """
+    Patch the shared Motor client with an in-memory mongomock client, and the database and
+    collection names (read from the environment at import time) with test values.
+    """
+    client = AsyncMongoMockClient()
+    with patch("src.services.database.async_database_service.get_async_client", return_value=client), \
+            patch("src.memory.persistence.DATABASE_NAME", DATABASE_NAME), \
+            patch("src.memory.persistence.COLLECTION_NAME", COLLECTION_NAME), \
+            patch("src.memory.seeding.DATABASE_NAME", DATABASE_NAME), \
+            patch("src.memory.seeding.COLLECTION_NAME", COLLECTION_NAME), \
+            patch("src.env.COLLECTION_NAME", COLLECTION_NAME):  # collection delle metriche token
+        yield client
+
+
+class TestAsyncMongoDBService:
+
+    def test_insert_and_get_item(self, mongo):
+        async def scenario():
+            service = AsyncMongoDBService("test_db")
+            item_id = await service.insert_item("items", {"name": "a"})
+            return await service.get_item("items", item_id)
+
+        item = asyncio.run(scenario())
+        assert item["name"] == "a"
+
+    def test_get_latest_items_returns_oldest_first(self, mongo):
+        async def scenario():
+            service = AsyncMongoDBService("test_db")
+            await service.db["chat"].create_index([("timestamp", -1)])
+            for i in range(5):
+                await service.insert_document("chat", {"userId": "u1", "timestamp": f"2026-01-0{i + 1}"})
+            await service.insert_document("chat", {"userId": "u2", "timestamp": "2026-01-09"})
+            return await service.get_latest_items("chat", {"userId": "u1"}, limit=3)
+
+        docs = asyncio.run(scenario())
+        assert [d["timestamp"] for d in docs] == ["2026-01-03", "2026-01-04", "2026-01-05"]
+
+    def test_random_item_by_field(self, mongo):
+        async def scenario():
+            service = AsyncMongoDBService("quiz")
+            await service.insert_items("prod", [{"capitolo": 1}, {"capitolo": 2}])
+            return await service.get_random_item_by_field("capitolo", 2, "prod")
+
+        assert asyncio.run(scenario())["capitolo"] == 2
+
+
+class _FakeAgent:
+    """Minimal agent exposing the async API used by the streaming path."""
+
+    def __init__(self):
+        self.seeded = None
+
+    async def aget_state(self, config):
+        return SimpleNamespace(values={})
+
+    async def aupdate_state(self, config, values):
+        self.seeded = values["messages"]
+
+    async def astream_events(self, inputs, config, version):
+        yield {"event": "on_chat_model_stream", "data": {"chunk": AIMessageChunk(content="Ciao!")}}
+        yield {
+            "event": "on_chat_model_end",
+            "data": {"output": AIMessage(
+                content="Ciao!",
+                usage_metadata={"input_tokens": 200, "output_tokens": 5, "total_tokens": 205},
+            )},
+        }
+
+
+class TestStreamingPathEndToEnd:
+
+    def test_stream_seeds_from_history_and_persists(self, mongo):
+        from src.rag import _ask_streaming
+        from src.monitoring.token_logger import TOKEN_METRICS_DB
+        from src.services.database.write_behind import get_write_behind_queue
+
+        agent = _FakeAgent()
+
+        async def scenario():
+            await mongo[DATABASE_NAME][COLLECTION_NAME].insert_one({
+                "_id": "old", "human": "prima domanda", "system": "prima risposta",
+                "userId": "user-1", "timestamp": "2026-01-01 10:00:00",
+                "tool": {"tool_name": "domanda_teoria", "data": {"numero": 3}},
+            })
+            chunks = [c async for c in _ask_streaming(agent, {"configurable": {}}, "nuova", "user-1", True)]
+            await get_write_behind_queue().flush()
+            saved = await mongo[DATABASE_NAME][COLLECTION_NAME].find_one({"human": "nuova"})
+            metric = await mongo[TOKEN_METRICS_DB][COLLECTION_NAME].find_one({"user_id": "user-1"})
+            return chunks, saved, metric
+
+        with patch("src.env.settings") as mock_settings:
+            mock_settings.ENABLE_TOKEN_LOGGING = True
+            chunks, saved, metric = asyncio.run(scenario())
+
+        assert any("Ciao!" in c for c in chunks)
+        assert isinstance(agent.seeded[0], HumanMessage)
+        assert isinstance(agent.seeded[1], AIMessage)
+        assert isinstance(agent.seeded[2], ToolMessage)
+        assert saved["system"] == "Ciao!"
+        assert metric["input_tokens"] == 200
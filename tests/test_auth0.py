@@ -0,0 +1,207 @@
+"""
+Unit tests for src/auth0.py: Auth0 client on httpx with a local MockTransport
+(token cache by expires_in, single-flight, 401 retry, timeouts).
+"""
+import asyncio
+import threading
+import time
+from unittest.mock import AsyncMock, Mock, patch
+
+import httpx
+import pytest
+
+from src.auth0 import Auth0Client
+from src.cache import auth0_token_cache, get_cached_auth0_token, set_cached_auth0_token
+
+pytestmark = pytest.mark.unit
+
+METADATA = {"name": "Marco", "jumps": "11_50"}
+
+
+@pytest.fixture(autouse=True)
+def _clear_token_cache():
+    auth0_token_cache.clear()
+    yield
+    auth0_token_cache.clear()
+
+
+class _Auth0:
+    """Auth0 finto: conta le chiamate per endpoint; le risposte async attendono `delay`."""
+
+    def __init__(self, expires_in=86400, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.token_calls = 0
+        self.user_calls = []
+        self.reject_tokens = set()
+
+    def _respond(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/oauth/token":
+            self.token_calls += 1
+            assert b"grant_type=client_credentials" in request.content
+            return httpx.Response(200, json={"access_token": f"tok{self.token_calls}", "expires_in": self.expires_in})
+        user_id = request.url.path.rsplit("/", 1)[-1]
+        self.user_calls.append(user_id)
+        if request.headers["authorization"].split()[-1] in self.reject_tokens:
+            return httpx.Response(401, json={"error": "invalid_token"})
+        return httpx.Response(200, json={"user_id": user_id, "user_metadata": METADATA})
+
+    def sync(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self._respond)
+
+    def async_(self) -> httpx.MockTransport:
+        async def handler(request):
+            await asyncio.sleep(self.delay)
+            return self._respond(request)
+        return httpx.MockTransport(handler)
+
+    def client(self) -> Auth0Client:
+        return Auth0Client(domain="tenant.test", client_secret="s", transport=self.sync(), async_transport=self.async_())
+
+
+class TestTokenCache:
+
+    def test_token_lives_for_expires_in(self):
+        set_cached_auth0_token("short", expires_in=0.2)
+        assert get_cached_auth0_token() == "short"
+        time.sleep(0.25)
+        assert get_cached_auth0_token() is None
+
+    def test_token_is_renewed_before_expiry(self):
+        set_cached_auth0_token("tok", expires_in=86400)
+        ttl = auth0_token_cache["auth0_token"][1]
+        assert 86000 < ttl < 86400
+
+
+class TestSyncClient:
+
+    def test_token_reused_until_expiry(self):
+        auth0 = _Auth0(expires_in=0.2)
+        client = auth0.client()
+        assert client.token() == client.token() == "tok1"
+        time.sleep(0.25)
+        assert client.token() == "tok2"
+        assert auth0.token_calls == 2
+
+    def test_user_metadata(self):
+        auth0 = _Auth0()
+        client = auth0.client()
+        assert client.user_metadata("auth0|u1") == METADATA
+        assert client.user_metadata("string") == {}
+        assert auth0.user_calls == ["auth0|u1"]
+
+
+class TestAsyncClient:
+
+    def test_concurrent_fetches_for_same_user_are_coalesced(self):
+        auth0 = _Auth0(delay=0.02)
+        client = auth0.client()
+
+        async def run():
+            return await asyncio.gather(
+                *(client.auser_metadata("auth0|u1") for _ in range(10)),
+                client.auser_metadata("auth0|u2"),
+            )
+
+        results = asyncio.run(run())
+        assert all(r == METADATA for r in results)
+        assert sorted(auth0.user_calls) == ["auth0|u1", "auth0|u2"]
+        assert auth0.token_calls == 1
+        assert client.stats()["coalesced"] >= 9
+
+    def test_concurrent_token_refreshes_are_coalesced(self):
+        auth0 = _Auth0(delay=0.02)
+        client = auth0.client()
+
+        async def run():
+            return await asyncio.gather(*(client.atoken() for _ in range(20)))
+
+        assert set(asyncio.run(run())) == {"tok1"}
+        assert auth0.token_calls == 1
+
+    def test_sequential_fetches_are_not_coalesced(self):
+        auth0 = _Auth0()
+        client = auth0.client()
+
+        async def run():
+            await client.auser_metadata("auth0|u1")
+            await client.auser_metadata("auth0|u1")
+
+        asyncio.run(run())
+        assert auth0.user_calls == ["auth0|u1", "auth0|u1"]
+
+    def test_revoked_token_is_refreshed_once(self):
+        auth0 = _Auth0()
+        auth0.reject_tokens.add("tok1")
+        client = auth0.client()
+
+        assert asyncio.run(client.auser_metadata("auth0|u1")) == METADATA
+        assert auth0.token_calls == 2
+        assert get_cached_auth0_token() == "tok2"
+
+    def test_timeout_returns_empty_metadata(self):
+        async def slow(request):
+            raise httpx.ReadTimeout("timed out", request=request)
+
+        client = Auth0Client(domain="tenant.test", client_secret="s", async_transport=httpx.MockTransport(slow))
+        assert asyncio.run(client.auser_metadata("auth0|u1")) == {}
+        assert client.stats()["errors"] == 1
+
+    def test_one_cancelled_caller_does_not_cancel_the_others(self):
+        auth0 = _Auth0(delay=0.05)
+        client = auth0.client()
+
+        async def run():
+            first = asyncio.ensure_future(client.auser_metadata("auth0|u1"))
+            second = asyncio.ensure_future(client.auser_metadata("auth0|u1"))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await second
+
+        assert asyncio.run(run()) == METADATA
+
+
+class TestClientLifecycle:
+
+    def test_sync_client_is_usable_after_aclose(self):
+        auth0 = _Auth0()
+        client = auth0.client()
+        assert client.user_metadata("auth0|u1") == METADATA
+
+        asyncio.run(client.aclose())
+
+        assert client.user_metadata("auth0|u2") == METADATA  # nuovo client, non quello chiuso
+
+    def test_client_of_a_previous_running_loop_is_closed_on_its_loop(self):
+        client = _Auth0().client()
+        old_loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=old_loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            assert asyncio.run_coroutine_threadsafe(client.auser_metadata("auth0|u1"), old_loop).result(5) == METADATA
+            old_client = client._async_client
+
+            assert asyncio.run(client.auser_metadata("auth0|u1")) == METADATA
+
+            asyncio.run_coroutine_threadsafe(asyncio.sleep(0.05), old_loop).result(5)
+            assert old_client.is_closed and client._async_client is not old_client
+        finally:
+            old_loop.call_soon_threadsafe(old_loop.stop)
+            thread.join(5)
+            old_loop.close()
+
+
+def test_async_prompt_personalization_uses_async_fetch():
+    from src.prompt_personalization import aget_personalized_prompt_for_user
+    from src.user_profile_cache import UserProfileCache, fetch_user_profile
+
+    client = Mock()
+    client.afetch_user_metadata = AsyncMock(return_value=METADATA)
+    with patch("src.prompt_personalization.get_prompt_with_version", return_value=("DOCS", 3)), \
+            patch("src.prompt_personalization.get_user_profile_cache", return_value=UserProfileCache(fetch_user_profile)), \
+            patch("src.auth0.get_auth0_client", return_value=client), \
+            patch("src.prompt_personalization.get_user_metadata", side_effect=AssertionError("blocking fetch")):
+        prompt, version, user_info = asyncio.run(aget_personalized_prompt_for_user("auth0|u1", token="t"))
+
+    client.afetch_user_metadata.assert_awaited_once()
+    assert version == 3 and "Marco" in user_info and prompt.startswith("DOCS")
@@ -0,0 +1,163 @@
+"""
+Unit tests for src/agent/bounded_checkpointer.py
+"""
+import asyncio
+
+import pytest
+from unittest.mock import patch
+from langchain_core.messages import HumanMessage
+
+from src.agent.bounded_checkpointer import BoundedInMemorySaver, parse_prompt_version
+from tests.fakes import echo_graph
+
+pytestmark = pytest.mark.unit
+
+
+def _run(graph, thread_id, text="ciao"):
+    graph.invoke({"messages": [HumanMessage(text)]}, {"configurable": {"thread_id": thread_id}})
+
+
+def _state(graph, thread_id):
+    return graph.get_state({"configurable": {"thread_id": thread_id}}).values.get("messages", [])
+
+
+class TestBoundedInMemorySaver:
+
+    def test_keeps_only_latest_checkpoint(self):
+        saver = BoundedInMemorySaver()
+        graph = echo_graph(saver)
+
+        for text in ("uno", "due", "tre"):
+            _run(graph, "u1:v1", text)
+
+        assert len(saver.storage["u1:v1"][""]) == 1
+        assert [m.content for m in _state(graph, "u1:v1")][-2:] == ["tre", "eco: tre"]
+        assert len(_state(graph, "u1:v1")) == 6
+        # Solo i blob referenziati dall'ultimo checkpoint restano in memoria
+        latest = next(iter(saver.storage["u1:v1"][""].values()))
+        assert len(saver.blobs) <= len(saver.serde.loads_typed(latest[0])["channel_versions"])
+        assert saver.stats()["compacted"] > 0
+
+    def test_resident_bytes_tracks_threads(self):
+        saver = BoundedInMemorySaver()
+        graph = echo_graph(saver)
+
+        _run(graph, "u1:v1")
+        one_thread = saver.stats()["resident_bytes"]
+        _run(graph, "u2:v1")
+
+        stats = saver.stats()
+        assert stats["threads"] == 2
+        assert stats["resident_bytes"] > one_thread > 0
+        assert stats["largest_thread_bytes"] > 0
+
+        saver.delete_thread("u1:v1")
+        assert saver.stats()["threads"] == 1
+        assert saver.stats()["resident_bytes"] < stats["resident_bytes"]
+
+    def test_lru_eviction_under_memory_budget(self):
+        saver = BoundedInMemorySaver(protect_recent_s=0)
+        graph = echo_graph(saver)
+        _run(graph, "u1:v1")
+        saver.memory_budget_bytes = int(saver.stats()["resident_bytes"] * 2.5)
+
+        _run(graph, "u2:v1")
+        _state(graph, "u1:v1")  # u1 diventa il più recente
+        _run(graph, "u3:v1")
+
+        assert "u2:v1" not in saver.storage
+        assert _state(graph, "u1:v1")
+        assert saver.stats()["evicted_lru"] == 1
+        assert saver.stats()["resident_bytes"] <= saver.memory_budget_bytes
+
+    def test_recently_used_threads_are_protected(self):
+        saver = BoundedInMemorySaver(memory_budget_bytes=1, protect_recent_s=60)
+        graph = echo_graph(saver)
+
+        _run(graph, "u1:v1")
+        _run(graph, "u2:v1")
+
+        assert saver.stats()["threads"] == 2
+        assert saver.stats()["evicted_lru"] == 0
+
+    def test_ttl_expiry(self):
+        saver = BoundedInMemorySaver(ttl_seconds=60, protect_recent_s=0)
+        graph = echo_graph(saver)
+        _run(graph, "u1:v1")
+
+        with patch("src.agent.bounded_checkpointer.time.monotonic", return_value=10**9):
+            assert saver.get_tuple({"configurable": {"thread_id": "u1:v1"}}) is None
+
+        assert saver.stats()["evicted_ttl"] == 1
+        assert saver.stats()["threads"] == 0
+
+    def test_oversized_thread_falls_back_to_seeding(self):
+        saver = BoundedInMemorySaver(max_thread_bytes=10)
+        graph = echo_graph(saver)
+        _run(graph, "u1:v1")
+
+        assert saver.get_tuple({"configurable": {"thread_id": "u1:v1"}}) is None
+        assert saver.stats()["evicted_oversized"] == 1
+
+    def test_new_prompt_version_purges_old_threads(self):
+        saver = BoundedInMemorySaver(protect_recent_s=0)
+        graph = echo_graph(saver)
+        _run(graph, "u1:v1")
+        _run(graph, "u2:v1")
+
+        _run(graph, "u1:v2")
+
+        assert set(saver.storage) == {"u1:v2"}
+        assert saver.stats()["purged_versions"] == 2
+        assert saver.stats()["current_prompt_version"] == 2
+
+    def test_purge_superseded_hook(self):
+        saver = BoundedInMemorySaver(protect_recent_s=0)
+        graph = echo_graph(saver)
+        _run(graph, "u1:v1")
+
+        assert saver.purge_superseded(2) == 1
+        assert saver.stats()["threads"] == 0
+
+    def test_prompt_version_purge_spares_threads_in_use(self):
+        saver = BoundedInMemorySaver(protect_recent_s=60)
+        graph = echo_graph(saver)
+        _run(graph, "u1:v1")
+
+        _run(graph, "u2:v2")
+
+        assert _state(graph, "u1:v1")  # run recente sulla vecchia versione: stato intatto
+        assert saver.stats()["deferred_purges"] == 1 and saver.stats()["purged_versions"] == 0
+
+        with patch("src.agent.bounded_checkpointer.time.monotonic", return_value=10**9):
+            _run(graph, "u2:v2", "ancora")
+
+        assert set(saver.storage) == {"u2:v2"}
+        assert saver.stats()["purged_versions"] == 1 and saver.stats()["deferred_purges"] == 0
+
+    def test_misses_do_not_leave_empty_entries(self):
+        saver = BoundedInMemorySaver()
+
+        assert saver.get_tuple({"configurable": {"thread_id": "ghost:v1"}}) is None
+
+        assert "ghost:v1" not in saver.storage
+        assert saver.stats()["misses"] == 1
+
+    def test_async_api(self):
+        saver = BoundedInMemorySaver()
+        graph = echo_graph(saver)
+        config = {"configurable": {"thread_id": "u1:v1"}}
+
+        async def scenario():
+            await graph.ainvoke({"messages": [HumanMessage("uno")]}, config)
+            await graph.ainvoke({"messages": [HumanMessage("due")]}, config)
+            return await graph.aget_state(config)
+
+        state = asyncio.run(scenario())
+        assert [m.content for m in state.values["messages"]] == ["uno", "eco: uno", "due", "eco: due"]
+        assert len(saver.storage["u1:v1"][""]) == 1
+
+
+def test_parse_prompt_version():
+    assert parse_prompt_version("google-oauth2|123:v4") == 4
+    assert parse_prompt_version("no-version") is None
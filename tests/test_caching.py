@@ -45,6 +45,14 @@ class TestCachingConfiguration:
 class TestAgentManagerCaching:
     """Test configurazione LLM con parametri caching"""
 
+    @pytest.fixture(autouse=True)
+    def _clear_agent_registry(self):
+        """Il registry è process-level: va svuotato perché ogni test veda una build nuova."""
+        from src.agent.agent_registry import get_agent_registry
+        get_agent_registry().clear()
+        yield
+        get_agent_registry().clear()
+
     @mock.patch('src.agent.agent_manager.ChatGoogleGenerativeAI')
     @mock.patch('src.agent.agent_manager.create_react_agent')
     @mock.patch('src.agent.agent_manager.get_personalized_prompt_for_user')
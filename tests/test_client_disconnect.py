@@ -0,0 +1,195 @@
+"""
+Unit tests for cancelling the agent run when the SSE client disconnects
+(StreamingHandler._watch / mark_interrupted and rag._ask_streaming, with and without the
+event log of resumable streams).
+
+A fake chat model streams slowly; the client "disconnects" after the first chunk and the
+run must stop long before the model would have finished.
+"""
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import tool
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from src.agent import streaming_handler as sh
+from src.agent.streaming_handler import StreamingHandler
+from src.monitoring.disconnect_monitor import get_disconnect_stats
+from tests.fakes import FakeChatModel
+
+pytestmark = pytest.mark.unit
+
+CONFIG = {"configurable": {"thread_id": "t1"}}
+
+
+def _slow_model(**kwargs) -> FakeChatModel:
+    """Chat model lento: ogni chunk dopo il primo arriva dopo 5 s, con il suo usage."""
+    options = dict(delay=5.0, usage={"input_tokens": 1000, "output_tokens": 10, "total_tokens": 1010}, cancelled=[])
+    options.update(kwargs)
+    return FakeChatModel(**options)
+
+
+class _Client:
+    """Client SSE finto: si disconnette dopo `after` chunk ricevuti."""
+
+    def __init__(self, after: int):
+        self.after = after
+        self.received = 0
+
+    async def is_disconnected(self) -> bool:
+        return self.received >= self.after
+
+
+@pytest.fixture(autouse=True)
+def _fast_poll():
+    with patch.object(sh.settings, "DISCONNECT_POLL_SECONDS", 0.01):
+        yield
+
+
+def _consume(handler, agent, client, query="ciao"):
+    async def run():
+        chunks = []
+        async for chunk in handler.handle_stream_events(agent, query, CONFIG):
+            chunks.append(chunk)
+            client.received += 1
+        if handler.interrupted:
+            handler.mark_interrupted(agent, CONFIG)
+        await asyncio.gather(*sh._cleanup_tasks)
+        return chunks, await agent.aget_state(CONFIG)
+
+    return asyncio.run(run())
+
+
+class TestStreamingHandler:
+
+    def test_disconnect_cancels_generation(self):
+        model = _slow_model(chunks=["Ciao", " come", " stai?"])
+        agent = create_react_agent(model, [], checkpointer=InMemorySaver())
+        client = _Client(after=1)
+        handler = StreamingHandler("m1", is_disconnected=client.is_disconnected)
+
+        start = time.perf_counter()
+        chunks, state = _consume(handler, agent, client)
+
+        assert time.perf_counter() - start < 2  # il modello avrebbe impiegato 10 s
+        assert len(chunks) == 1 and handler.interrupted
+        assert model.cancelled == [True]
+        assert handler.get_final_response() == "Ciao"
+
+        calls = handler.get_llm_calls()
+        assert len(calls) == 1 and calls[0]["cancelled"] and calls[0]["output_tokens"] == 10
+
+        # La risposta parziale chiude il turno nel thread
+        messages = state.values["messages"]
+        assert [type(m) for m in messages] == [HumanMessage, AIMessage]
+        assert messages[-1].content == "Ciao"
+
+    def test_disconnect_during_tool_leaves_valid_thread(self):
+        started = []
+
+        @tool
+        async def lento(argomento: str) -> str:
+            """Tool lento."""
+            started.append(argomento)
+            await asyncio.sleep(5)
+            return "fatto"
+
+        model = _slow_model(chunks=["ok"], tool_calls=[{"name": "lento", "args": {"argomento": "x"}, "id": "c1"}])
+        agent = create_react_agent(model, [lento], checkpointer=InMemorySaver())
+        client = _Client(after=0)
+        client.is_disconnected = AsyncMock(side_effect=lambda: bool(started))
+        handler = StreamingHandler("m1", is_disconnected=client.is_disconnected)
+
+        start = time.perf_counter()
+        _, state = _consume(handler, agent, client)
+
+        assert time.perf_counter() - start < 2
+        messages = state.values["messages"]
+        assert messages[1].tool_calls[0]["id"] == "c1"
+        assert isinstance(messages[2], ToolMessage) and messages[2].tool_call_id == "c1"
+
+    def test_connected_client_gets_full_answer(self):
+        model = _slow_model(chunks=["Ciao", " come", " stai?"], delay=0.02)
+        agent = create_react_agent(model, [], checkpointer=InMemorySaver())
+        client = _Client(after=100)
+        handler = StreamingHandler("m1", is_disconnected=client.is_disconnected)
+
+        chunks, _ = _consume(handler, agent, client)
+
+        assert not handler.interrupted
+        text = "".join(json.loads(c[len("data: "):])["data"] for c in chunks)
+        assert text == handler.get_final_response() == "Ciao come stai?"
+
+    def test_disconnect_stats(self):
+        before = get_disconnect_stats()
+        model = _slow_model(chunks=["Ciao", " come"])
+        agent = create_react_agent(model, [], checkpointer=InMemorySaver())
+        client = _Client(after=1)
+        _consume(StreamingHandler("m1", is_disconnected=client.is_disconnected), agent, client)
+
+        after = get_disconnect_stats()
+        assert after["interrupted_requests"] == before["interrupted_requests"] + 1
+        assert after["cancelled_llm_calls"] == before["cancelled_llm_calls"] + 1
+        assert after["tokens_used_before_cancel"] == before["tokens_used_before_cancel"] + 1010
+
+
+class TestAskStreaming:
+
+    def _stream(self, is_disconnected=None):
+        from src.rag import _ask_streaming
+
+        model = _slow_model(chunks=["Ciao", " come", " stai?"])
+        agent = create_react_agent(model, [], checkpointer=InMemorySaver())
+        return _ask_streaming(agent, CONFIG, "ciao", "u1", chat_history=False, is_disconnected=is_disconnected)
+
+    @pytest.fixture(params=[True, False], ids=["event_log", "direct"])
+    def persisted(self, request):
+        # Con il log degli eventi il run viene cancellato alla scadenza del grace period
+        with patch.object(sh.settings, "STREAM_RESUME_ENABLED", request.param), \
+                patch.object(sh.settings, "STREAM_RESUME_GRACE_SECONDS", 0), \
+                patch("src.rag.MemorySeeder.aseed_agent_memory", AsyncMock()), \
+                patch("src.rag.ConversationPersistence.queue_conversation") as conversation, \
+                patch("src.rag.queue_token_usage") as token_usage:
+            yield conversation, token_usage
+
+    def test_partial_response_is_saved_as_interrupted(self, persisted):
+        conversation, token_usage = persisted
+        client = _Client(after=1)
+
+        async def run():
+            async for _ in self._stream(client.is_disconnected):
+                client.received += 1
+
+        asyncio.run(run())
+
+        args, kwargs = conversation.call_args
+        assert args[1] == "Ciao" and kwargs["interrupted"] is True
+        usage_kwargs = token_usage.call_args.kwargs
+        assert usage_kwargs["metadata"]["interrupted"] is True
+        assert usage_kwargs["llm_calls"][0]["cancelled"] is True
+
+    def test_stream_cancelled_by_server_is_interrupted(self, persisted):
+        conversation, _ = persisted
+
+        async def run():
+            stream = self._stream()
+
+            async def consume():
+                async for _ in stream:
+                    pass
+
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.2)  # primo chunk inviato, il modello genera il secondo
+            task.cancel()  # come fa Starlette quando riceve http.disconnect
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+
+        args, kwargs = conversation.call_args
+        assert args[1] == "Ciao" and kwargs["interrupted"] is True
@@ -0,0 +1,84 @@
+"""
+Unit tests for src/services/database/connection_pool.py
+"""
+import pytest
+from unittest.mock import MagicMock, patch
+
+from src.services.database.connection_pool import MongoClientManager, PoolMetricsListener
+
+pytestmark = pytest.mark.unit
+
+
+class TestMongoClientManager:
+
+    @patch("src.services.database.connection_pool.pymongo.MongoClient")
+    def test_client_created_once(self, mock_client_cls):
+        manager = MongoClientManager(uri="mongodb://localhost:27017")
+
+        first = manager.get_client()
+        second = manager.get_client()
+
+        assert first is second
+        mock_client_cls.assert_called_once()
+
+    @patch("src.services.database.connection_pool.pymongo.MongoClient")
+    def test_pool_options_and_listener(self, mock_client_cls):
+        from src.env import settings
+        manager = MongoClientManager(uri="mongodb://localhost:27017")
+
+        manager.get_client()
+
+        kwargs = mock_client_cls.call_args[1]
+        assert kwargs["maxPoolSize"] == settings.MONGO_MAX_POOL_SIZE
+        assert kwargs["minPoolSize"] == settings.MONGO_MIN_POOL_SIZE
+        assert kwargs["event_listeners"] == [manager.metrics]
+
+    @patch("src.services.database.connection_pool.pymongo.MongoClient")
+    def test_warmup_failure_does_not_raise(self, mock_client_cls):
+        mock_client_cls.return_value.admin.command.side_effect = Exception("no server")
+        manager = MongoClientManager(uri="mongodb://localhost:27017")
+
+        assert manager.warmup() is False
+
+    @patch("src.services.database.connection_pool.pymongo.MongoClient")
+    def test_close_resets_client(self, mock_client_cls):
+        manager = MongoClientManager(uri="mongodb://localhost:27017")
+        client = manager.get_client()
+
+        manager.close()
+
+        client.close.assert_called_once()
+        assert manager.stats()["client_initialized"] is False
+
+    def test_services_share_client(self):
+        from src.services.database.database_service import MongoDBService
+        from src.services.database.database_quiz_service import QuizMongoDBService
+        from src.services.database.connection_pool import get_mongo_client
+        import src.database as database
+
+        assert MongoDBService("test_db").client is get_mongo_client()
+        assert QuizMongoDBService().db.client is get_mongo_client()
+        assert database.client is get_mongo_client()
+
+
+class TestPoolMetricsListener:
+
+    def test_tracks_checkouts_and_wait_time(self):
+        listener = PoolMetricsListener()
+        event = MagicMock()
+
+        listener.connection_created(event)
+        listener.connection_check_out_started(event)
+        listener.connection_checked_out(event)
+        listener.connection_check_out_started(event)
+        listener.connection_check_out_failed(event)
+
+        stats = listener.snapshot()
+        assert stats["checkouts"] == 1
+        assert stats["checkout_failures"] == 1
+        assert stats["in_use"] == 1
+        assert stats["open_connections"] == 1
+        assert stats["max_wait_ms"] >= 0
+
+        listener.connection_checked_in(event)
+        assert listener.snapshot()["in_use"] == 0
@@ -0,0 +1,195 @@
+"""
+Unit tests for explicit Gemini context caching (src/agent/context_cache.py), against a fake genai client.
+"""
+import pytest
+from unittest.mock import patch
+from google.genai import types
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from src.agent.context_cache import ContextCachedChatGoogleGenerativeAI, GeminiContextCache
+from src.monitoring.token_logger import _build_metric
+from src.prompt_personalization import build_personalized_prompt, get_static_prompt_prefix
+from src.tools import domanda_teoria
+
+pytestmark = pytest.mark.unit
+
+DOCS = "# Manuale di paracadutismo\n\nRegole di sicurezza..."
+MODEL = "models/gemini-test"
+
+
+class _FakeCaches:
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.deleted = []
+        self.fail_create = False
+
+    def create(self, model, config):
+        if self.fail_create:
+            raise RuntimeError("cache troppo piccola")
+        self.created.append((model, config))
+        return types.CachedContent(name=f"cachedContents/{len(self.created)}", model=model)
+
+    def update(self, name, config):
+        self.updated.append((name, config))
+
+    def delete(self, name):
+        self.deleted.append(name)
+
+
+class _FakeModels:
+    def __init__(self):
+        self.requests = []
+
+    def generate_content(self, **request):
+        self.requests.append(request)
+        cached = 900 if request["config"].cached_content else 0
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(
+                content=types.Content(role="model", parts=[types.Part(text="Risposta")]),
+                finish_reason="STOP",
+            )],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=1000, cached_content_token_count=cached,
+                candidates_token_count=5, total_token_count=1005,
+            ),
+        )
+
+
+class _FakeClient:
+    def __init__(self):
+        self.caches = _FakeCaches()
+        self.models = _FakeModels()
+
+
+def _llm(cache, client):
+    llm = ContextCachedChatGoogleGenerativeAI(model=MODEL, google_api_key="test", context_cache=cache)
+    llm.client = client
+    return llm.bind_tools([domanda_teoria]), llm
+
+
+def _messages(user_info="Nome: Marco"):
+    return [SystemMessage(build_personalized_prompt(DOCS, user_info)), HumanMessage("Cos'è il DL?")]
+
+
+class TestCacheLifecycle:
+
+    def test_first_lookup_schedules_creation_then_hits(self):
+        cache, client = GeminiContextCache(background=False, ttl_seconds=3600), _FakeClient()
+
+        assert cache.lookup(client, MODEL, 1, DOCS) is None  # non blocca: crea la cache e prosegue
+        assert cache.lookup(client, MODEL, 1, DOCS) == "cachedContents/1"
+
+        model, config = client.caches.created[0]
+        assert model == MODEL
+        assert config.system_instruction.parts[0].text == DOCS
+        assert config.ttl == "3600s"
+        assert cache.stats()["hits"] == 1
+
+    def test_ttl_refreshed_near_expiry(self):
+        cache, client = GeminiContextCache(background=False, ttl_seconds=3600, refresh_margin_s=600), _FakeClient()
+        cache.lookup(client, MODEL, 1, DOCS)
+
+        with patch("src.agent.context_cache.time.monotonic", side_effect=lambda: 10**6):
+            cache._entries[(MODEL, 1)].expires_at = 10**6 + 300
+            assert cache.lookup(client, MODEL, 1, DOCS) == "cachedContents/1"
+
+        assert client.caches.updated[0][0] == "cachedContents/1"
+        assert cache.stats()["refreshed"] == 1
+        assert len(client.caches.created) == 1
+
+    def test_new_version_replaces_and_deletes_old_entry(self):
+        cache, client = GeminiContextCache(background=False), _FakeClient()
+        cache.lookup(client, MODEL, 1, DOCS)
+
+        cache.lookup(client, MODEL, 2, DOCS + "\nNuova sezione")
+
+        assert client.caches.deleted == ["cachedContents/1"]
+        assert not cache.is_active(1) and cache.is_active(2)
+
+    def test_invalidate_on_update_docs(self):
+        cache, client = GeminiContextCache(background=False), _FakeClient()
+        cache.lookup(client, MODEL, 1, DOCS)
+
+        with patch("src.agent.context_cache._context_cache", cache), \
+                patch("src.update_docs.update_prompt_from_s3", return_value={"prompt_version": 2}), \
+                patch("src.update_docs.purge_superseded_threads"):
+            from src.update_docs import update_docs
+            update_docs()
+
+        assert client.caches.deleted == ["cachedContents/1"]
+        assert cache.stats()["entries"] == []
+
+    def test_creation_failure_backs_off(self):
+        cache, client = GeminiContextCache(background=False, retry_after_s=60), _FakeClient()
+        client.caches.fail_create = True
+
+        assert cache.lookup(client, MODEL, 1, DOCS) is None
+        assert cache.lookup(client, MODEL, 1, DOCS) is None
+
+        assert cache.stats()["failures"] == 1  # nessun nuovo tentativo prima di retry_after_s
+
+
+class TestRequestRewrite:
+
+    @pytest.fixture(autouse=True)
+    def _prompt(self):
+        with patch("src.prompt_personalization.get_prompt_with_version", return_value=(DOCS, 1)):
+            yield
+
+    def test_request_without_cache_is_unchanged(self):
+        cache, client = GeminiContextCache(background=False, retry_after_s=60), _FakeClient()
+        client.caches.fail_create = True
+        bound, _ = _llm(cache, client)
+
+        bound.invoke(_messages())
+
+        config = client.models.requests[0]["config"]
+        assert config.cached_content is None
+        assert _text(config.system_instruction).startswith(DOCS)
+        assert config.tools
+
+    def test_cached_request_keeps_personalization_outside_prefix(self):
+        cache, client = GeminiContextCache(background=False), _FakeClient()
+        bound, _ = _llm(cache, client)
+
+        bound.invoke(_messages("Nome: Marco"))  # crea la cache
+        bound.invoke(_messages("Nome: Giulia"))
+
+        request = client.models.requests[-1]
+        config = request["config"]
+        assert config.cached_content == "cachedContents/1"
+        assert config.system_instruction is None and config.tools is None
+        assert "Nome: Giulia" in request["contents"][0].parts[0].text
+        assert DOCS not in request["contents"][0].parts[0].text
+        # Prefisso statico e tool stanno nella cache, identica per tutti gli utenti
+        _, created = client.caches.created[0]
+        assert _text(created.system_instruction) == get_static_prompt_prefix()[0]
+        assert _text(created.system_instruction).startswith(DOCS)
+        assert created.tools[0].function_declarations[0].name == "domanda_teoria"
+        assert len(client.caches.created) == 1
+
+    def test_outdated_prompt_is_not_routed_to_cache(self):
+        cache, client = GeminiContextCache(background=False), _FakeClient()
+        bound, _ = _llm(cache, client)
+        bound.invoke(_messages())
+
+        old_docs = [SystemMessage("# Docs di una versione precedente"), HumanMessage("ciao")]
+        bound.invoke(old_docs)
+
+        assert client.models.requests[-1]["config"].cached_content is None
+
+    def test_cached_tokens_reported_by_token_logger(self):
+        cache, client = GeminiContextCache(background=False), _FakeClient()
+        bound, _ = _llm(cache, client)
+        bound.invoke(_messages())
+
+        response = bound.invoke(_messages())
+        metric = _build_metric("user-1", MODEL, response.usage_metadata, 10.0, {"explicit_cache": cache.is_active(1)})
+
+        assert metric["cached_tokens"] == 900
+        assert metric["explicit_cache"] is True
+
+
+def _text(content):
+    return "".join(part.text or "" for part in content.parts)
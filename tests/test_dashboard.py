@@ -141,3 +141,72 @@ class TestCostCalculation:
         costs = report["cost_analysis"]
         assert costs["period_cost_usd"] < costs["cost_without_cache_usd"]
         assert costs["cache_savings_usd"] > 0
+
+
+@pytest.mark.unit
+class TestLLMCallBreakdown:
+    """The dashboard reads the per-call breakdown of multi-call requests."""
+
+    @patch("src.monitoring.dashboard.get_rate_limit_events")
+    @patch("src.monitoring.dashboard.get_token_metrics")
+    def test_breakdown_by_call_index(self, mock_metrics, mock_rate):
+        from src.monitoring.dashboard import get_monitoring_report
+
+        def call(index, input_tokens, output_tokens, latency_ms):
+            return {"call_index": index, "node": "agent", "input_tokens": input_tokens,
+                    "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+                    "cached_tokens": 0, "thinking_tokens": 0, "latency_ms": latency_ms}
+
+        mock_metrics.return_value = [
+            {
+                "user_id": "user1", "input_tokens": 3000, "output_tokens": 60, "total_tokens": 3060,
+                "cached_tokens": 0, "llm_calls": [call(0, 1000, 20, 800.0), call(1, 2000, 40, 1200.0)],
+                "timestamp": datetime(2026, 2, 5, 10, 0, tzinfo=timezone.utc),
+            },
+            {
+                # Documento precedente al dettaglio per chiamata
+                "user_id": "user2", "input_tokens": 1000, "output_tokens": 10, "total_tokens": 1010,
+                "cached_tokens": 0, "timestamp": datetime(2026, 2, 5, 11, 0, tzinfo=timezone.utc),
+            },
+        ]
+        mock_rate.return_value = []
+
+        report = get_monitoring_report(hours=24)
+
+        assert report["token_usage"]["total_llm_calls"] == 3
+        assert report["token_usage"]["total_input_tokens"] == 4000
+        assert report["llm_calls"]["multi_call_requests"] == 1
+        assert report["llm_calls"]["requests_with_breakdown"] == 1
+        assert report["llm_calls"]["by_call_index"]["0"]["calls"] == 2
+        assert report["llm_calls"]["by_call_index"]["1"]["input_tokens"] == 2000
+        expected_cost = 4000 / 1_000_000 * 0.10 + 70 / 1_000_000 * 0.40
+        assert report["cost_analysis"]["period_cost_usd"] == round(expected_cost, 4)
+
+    @patch("src.monitoring.dashboard.get_rate_limit_events")
+    @patch("src.monitoring.dashboard.get_token_metrics")
+    def test_requests_without_llm_calls_only_count_for_latency(self, mock_metrics, mock_rate):
+        from src.monitoring.dashboard import get_monitoring_report
+
+        mock_metrics.return_value = [
+            {
+                "user_id": "user1", "input_tokens": 1000, "output_tokens": 10, "total_tokens": 1010,
+                "cached_tokens": 0, "llm_call_count": 1, "queue_wait_ms": 5.0, "phases_ms": {"stream": 900.0},
+                "timestamp": datetime(2026, 2, 5, 10, 0, tzinfo=timezone.utc),
+            },
+            {
+                # Fast path del quiz: nessuna chiamata LLM
+                "user_id": "user2", "input_tokens": 0, "output_tokens": 0, "total_tokens": 0,
+                "cached_tokens": 0, "llm_call_count": 0, "llm_calls": [], "queue_wait_ms": 1.0,
+                "phases_ms": {"stream": 20.0}, "timestamp": datetime(2026, 2, 5, 11, 0, tzinfo=timezone.utc),
+            },
+        ]
+        mock_rate.return_value = []
+
+        report = get_monitoring_report(hours=24)
+
+        assert report["latency"]["traced_requests"] == 2
+        assert report["latency"]["queue_wait_ms"] == {"p50": 1.0, "p95": 5.0, "p99": 5.0}
+        assert report["latency"]["phases"]["stream"]["count"] == 2
+        assert report["token_usage"]["total_requests"] == 1
+        assert report["token_usage"]["avg_input_tokens"] == 1000
+        assert report["cache_analysis"]["cache_hit_rate_percent"] == 0
@@ -0,0 +1,161 @@
+"""
+Unit tests for the single-flight / stale-while-revalidate _DocsCache (src/utils.py).
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from unittest.mock import patch
+
+from src.utils import _DocsCache, _PromptManager
+from tests.fakes import s3_result
+
+pytestmark = pytest.mark.unit
+
+
+def _cache():
+    return _DocsCache(snapshot_path="", bundled_snapshot_path="", snapshot_enabled=False)
+
+
+class _SlowS3:
+    """fetch_docs_from_s3 finto: conta le chiamate e resta bloccato finché `release` non viene settato."""
+
+    def __init__(self, *docs):
+        self.docs = list(docs)
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5)
+        return s3_result(self.docs[min(self.calls, len(self.docs)) - 1])
+
+
+class TestSingleFlight:
+
+    def test_cold_burst_triggers_exactly_one_fetch(self):
+        docs_cache = _cache()
+        s3 = _SlowS3("# Docs")
+        workers = 64
+        barrier = threading.Barrier(workers)
+
+        def cold_request():
+            barrier.wait()
+            return docs_cache.get()
+
+        with patch("src.utils.fetch_docs_from_s3", s3), ThreadPoolExecutor(workers) as pool:
+            futures = [pool.submit(cold_request) for _ in range(workers)]
+            assert s3.started.wait(5)
+            time.sleep(0.05)  # lascia accodare il resto del burst sul fetch in corso
+            s3.release.set()
+            results = [f.result(timeout=5) for f in futures]
+
+        assert s3.calls == 1
+        assert results == ["# Docs"] * workers
+        assert docs_cache.stats()["fetches"] == 1
+
+    def test_async_burst_on_prompt_manager(self):
+        docs_cache = _cache()
+        manager = _PromptManager(docs_cache)
+        s3 = _SlowS3("# Docs")
+        s3.release.set()
+
+        async def burst():
+            await asyncio.gather(*(asyncio.to_thread(manager.ensure_initialized) for _ in range(50)))
+
+        with patch("src.utils.fetch_docs_from_s3", s3):
+            asyncio.run(burst())
+
+        assert s3.calls == 1
+        assert manager.get_with_version() == ("# Docs", 1)
+
+    def test_concurrent_updates_share_one_follow_up_fetch(self):
+        docs_cache = _cache()
+        s3 = _SlowS3("# Docs v1", "# Docs v2")
+
+        with patch("src.utils.fetch_docs_from_s3", s3), ThreadPoolExecutor(8) as pool:
+            first = pool.submit(docs_cache.update)
+            assert s3.started.wait(5)
+            later = [pool.submit(docs_cache.update) for _ in range(7)]
+            time.sleep(0.05)
+            s3.release.set()
+            results = [f.result(timeout=5) for f in later]
+
+        assert first.result()["combined_docs"] == "# Docs v1"
+        assert s3.calls == 2  # un solo fetch nuovo per i 7 update arrivati durante il primo
+        assert {r["combined_docs"] for r in results} == {"# Docs v2"}
+
+    def test_update_does_not_reuse_a_running_revalidation(self):
+        docs_cache = _cache()
+        s3 = _SlowS3("# Docs prima dell'upload", "# Docs dopo l'upload")
+
+        with patch("src.utils.fetch_docs_from_s3", s3), ThreadPoolExecutor(2) as pool:
+            revalidation = pool.submit(docs_cache.get)
+            assert s3.started.wait(5)
+            update = pool.submit(docs_cache.update)
+            time.sleep(0.05)
+            assert not update.done()  # attende la fine del fetch in corso
+            s3.release.set()
+            revalidation.result(timeout=5)
+            result = update.result(timeout=5)
+
+        assert s3.calls == 2
+        assert result["combined_docs"] == "# Docs dopo l'upload"
+        assert docs_cache.get() == "# Docs dopo l'upload"
+
+    def test_fetch_error_propagates_to_waiters_and_allows_retry(self):
+        docs_cache = _cache()
+
+        with patch("src.utils.fetch_docs_from_s3", side_effect=RuntimeError("boom")):
+            with pytest.raises(RuntimeError):
+                docs_cache.get()
+
+        with patch("src.utils.fetch_docs_from_s3", return_value=s3_result("# Docs")):
+            assert docs_cache.get() == "# Docs"
+
+
+class TestStaleWhileRevalidate:
+
+    def test_readers_get_old_docs_during_refresh(self):
+        docs_cache = _cache()
+        with patch("src.utils.fetch_docs_from_s3", return_value=s3_result("# Docs v1")):
+            docs_cache.get()
+
+        s3 = _SlowS3("# Docs v2")
+        with patch("src.utils.fetch_docs_from_s3", s3), ThreadPoolExecutor(1) as pool:
+            refresh = pool.submit(docs_cache.update)
+            assert s3.started.wait(5)
+
+            assert docs_cache.get() == "# Docs v1"  # non bloccato dal download in corso
+
+            s3.release.set()
+            refresh.result(timeout=5)
+
+        assert docs_cache.get() == "# Docs v2"
+
+    def test_failed_refresh_keeps_previous_docs(self):
+        docs_cache = _cache()
+        manager = _PromptManager(docs_cache)
+        with patch("src.utils.fetch_docs_from_s3", return_value=s3_result("# Docs v1")):
+            manager.ensure_initialized()
+
+        with patch("src.utils.fetch_docs_from_s3", return_value=s3_result("")):
+            result = manager.update_from_s3()
+
+        assert docs_cache.get() == "# Docs v1"
+        assert manager.get_with_version() == ("# Docs v1", 1)
+        assert result["prompt_version"] == 1
+        assert "failed" in result["message"]
+
+    def test_prompt_and_version_swap_together(self):
+        docs_cache = _cache()
+        manager = _PromptManager(docs_cache)
+        with patch("src.utils.fetch_docs_from_s3", side_effect=[s3_result("# v1"), s3_result("# v2")]):
+            manager.ensure_initialized()
+            manager.update_from_s3()
+
+        assert manager.get_with_version() == ("# v2", 2)
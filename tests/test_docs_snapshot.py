@@ -0,0 +1,127 @@
+"""
+Unit tests for the local docs snapshot (src/docs_snapshot.py) and its use by _DocsCache/_PromptManager.
+"""
+import pytest
+from unittest.mock import patch
+
+from src.docs_snapshot import read_snapshot, write_snapshot
+from src.utils import _DocsCache, _PromptManager
+from tests.fakes import DOCS_META, s3_result
+
+pytestmark = pytest.mark.unit
+
+
+def _manager(path):
+    docs_cache = _DocsCache(snapshot_path=str(path), bundled_snapshot_path="", snapshot_enabled=True)
+    return docs_cache, _PromptManager(docs_cache)
+
+
+class TestSnapshotFile:
+
+    def test_roundtrip(self, tmp_path):
+        path = tmp_path / "snapshot.bin"
+        assert write_snapshot(str(path), "# Manuale è già qui", DOCS_META, prompt_version=3)
+
+        snapshot = read_snapshot(str(path))
+
+        assert snapshot.combined_docs == "# Manuale è già qui"
+        assert snapshot.docs_meta == DOCS_META
+        assert snapshot.prompt_version == 3
+        assert snapshot.created_at_dt is not None
+
+    def test_missing_file(self, tmp_path):
+        assert read_snapshot(str(tmp_path / "assente.bin")) is None
+
+    @pytest.mark.parametrize("corrupt", [
+        lambda data: data[:-3] + b"xyz",   # corpo modificato
+        lambda data: b"NOTADOCS" + data[8:],  # magic diverso
+        lambda data: data[:20],            # file troncato
+        lambda data: b"",                  # file vuoto
+    ])
+    def test_corrupted_file_is_ignored(self, tmp_path, corrupt):
+        path = tmp_path / "snapshot.bin"
+        write_snapshot(str(path), "# Manuale", DOCS_META, prompt_version=1)
+        path.write_bytes(corrupt(path.read_bytes()))
+
+        assert read_snapshot(str(path)) is None
+
+
+class TestColdStartFromSnapshot:
+
+    def test_first_start_writes_snapshot(self, tmp_path):
+        path = tmp_path / "snapshot.bin"
+        _, manager = _manager(path)
+
+        with patch("src.utils.fetch_docs_from_s3", return_value=s3_result("# Docs v1")):
+            manager.ensure_initialized()
+
+        assert manager.get_with_version() == ("# Docs v1", 1)
+        assert read_snapshot(str(path)).combined_docs == "# Docs v1"
+
+    def test_snapshot_served_without_waiting_for_s3(self, tmp_path):
+        path = tmp_path / "snapshot.bin"
+        write_snapshot(str(path), "# Docs salvati", DOCS_META, prompt_version=4)
+
+        with patch("src.utils.fetch_docs_from_s3", return_value=s3_result("# Docs salvati")) as fetch:
+            docs_cache, manager = _manager(path)
+            assert docs_cache.snapshot_version == 4
+            manager.ensure_initialized()
+            assert manager.get_with_version() == ("# Docs salvati", 4)
+            manager.wait_for_revalidation(timeout=5)
+
+        fetch.assert_called_once()  # solo la revalidazione in background
+        assert manager.get_with_version() == ("# Docs salvati", 4)
+        assert docs_cache.snapshot_version is None
+
+    def test_revalidation_swaps_changed_docs_and_bumps_version(self, tmp_path):
+        path = tmp_path / "snapshot.bin"
+        write_snapshot(str(path), "# Docs vecchi", DOCS_META, prompt_version=2)
+        _, manager = _manager(path)
+
+        with patch("src.utils.fetch_docs_from_s3", return_value=s3_result("# Docs nuovi")):
+            manager.ensure_initialized()
+            manager.wait_for_revalidation(timeout=5)
+
+        assert manager.get_with_version() == ("# Docs nuovi", 3)
+        snapshot = read_snapshot(str(path))
+        assert (snapshot.combined_docs, snapshot.prompt_version) == ("# Docs nuovi", 3)
+
+    def test_s3_failure_keeps_snapshot(self, tmp_path):
+        path = tmp_path / "snapshot.bin"
+        write_snapshot(str(path), "# Docs salvati", DOCS_META, prompt_version=2)
+        _, manager = _manager(path)
+
+        with patch("src.utils.fetch_docs_from_s3", return_value=s3_result("")):
+            manager.ensure_initialized()
+            manager.wait_for_revalidation(timeout=5)
+
+        assert manager.get_with_version() == ("# Docs salvati", 2)
+
+    def test_update_from_s3_persists_new_version(self, tmp_path):
+        path = tmp_path / "snapshot.bin"
+        _, manager = _manager(path)
+
+        with patch("src.utils.fetch_docs_from_s3", side_effect=[s3_result("# v1"), s3_result("# v2")]):
+            manager.ensure_initialized()
+            result = manager.update_from_s3()
+
+        assert result["prompt_version"] == 2
+        assert read_snapshot(str(path)).prompt_version == 2
+
+    def test_bundled_snapshot_is_used_as_fallback(self, tmp_path):
+        bundled = tmp_path / "bundled.bin"
+        write_snapshot(str(bundled), "# Docs di build", DOCS_META, prompt_version=1)
+
+        docs_cache = _DocsCache(
+            snapshot_path=str(tmp_path / "runtime.bin"), bundled_snapshot_path=str(bundled), snapshot_enabled=True
+        )
+
+        assert docs_cache.get() == "# Docs di build"
+
+    def test_disabled_snapshot_fetches_from_s3(self, tmp_path):
+        path = tmp_path / "snapshot.bin"
+        write_snapshot(str(path), "# Docs salvati", DOCS_META, prompt_version=2)
+        docs_cache = _DocsCache(snapshot_path=str(path), bundled_snapshot_path="", snapshot_enabled=False)
+
+        with patch("src.utils.fetch_docs_from_s3", return_value=s3_result("# Docs S3")):
+            assert docs_cache.get() == "# Docs S3"
@@ -0,0 +1,219 @@
+"""
+Unit tests for src/agent/event_log.py: sequential SSE event ids, bounded per-message buffer,
+replay after Last-Event-ID with live attach, grace period and spill to a store.
+"""
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from src.agent import event_log as el
+from src.agent.event_log import EventLogRegistry, MessageEventLog, parse_event_id
+from tests.fakes import FakeChatModel
+
+pytestmark = pytest.mark.unit
+
+
+class _Store:
+    """Store finto con la stessa interfaccia di MongoEventStore."""
+
+    def __init__(self):
+        self.events = {}
+        self.done = set()
+
+    def save(self, message_id, user_id, events, done=False):
+        self.events.setdefault((message_id, user_id), {}).update(dict(events))
+        if done:
+            self.done.add(message_id)
+
+    async def load(self, message_id, user_id, after_id):
+        stored = self.events.get((message_id, user_id))
+        if stored is None:
+            return None
+        return sorted((seq, f) for seq, f in stored.items() if seq > after_id), message_id in self.done
+
+
+def _frame(text):
+    return f"data: {json.dumps({'type': 'agent_message', 'data': text})}\n\n"
+
+
+def _data(frames):
+    return [json.loads(f.split("data: ", 1)[1])["data"] for f in frames if "data: " in f]
+
+
+def _ids(frames):
+    return [parse_event_id(f.split("\n", 1)[0][len("id: "):])[1] for f in frames if f.startswith("id: ")]
+
+
+async def _produce(log, texts, delay=0.0):
+    for text in texts:
+        await asyncio.sleep(delay)
+        log.append(_frame(text))
+        yield text
+
+
+class TestMessageEventLog:
+
+    def test_ids_are_sequential_and_heartbeats_unnumbered(self):
+        log = MessageEventLog("u1_2026-01-19T14:26:03.779", "u1", maxlen=10)
+        first = log.append(_frame("a"))
+        heartbeat = log.append(": keep-alive\n\n")
+        second = log.append(_frame("b"))
+
+        assert first.startswith("id: u1_2026-01-19T14:26:03.779:1\ndata: ")
+        assert heartbeat == ": keep-alive\n\n"
+        assert parse_event_id(second.split("\n", 1)[0][len("id: "):]) == ("u1_2026-01-19T14:26:03.779", 2)
+        assert parse_event_id("7") == (None, 7)
+        with pytest.raises(ValueError):
+            parse_event_id("u1_2026-01-19T14:26:03.779")
+
+    def test_buffer_is_bounded_and_old_ids_cannot_be_replayed(self):
+        log = MessageEventLog("m1", "u1", maxlen=3)
+        for text in "abcde":
+            log.append(_frame(text))
+        log.close()
+
+        async def follow(after):
+            return [f async for f in log.follow(after)]
+
+        assert [seq for seq, _ in log.events] == [3, 4, 5]
+        assert _data(asyncio.run(follow(2))) == ["c", "d", "e"]
+        frames = asyncio.run(follow(1))
+        assert len(frames) == 1 and '"RESUME_UNAVAILABLE"' in frames[0]
+
+    def test_evicted_frames_are_replayed_from_the_store(self):
+        store = _Store()
+        log = MessageEventLog("m1", "u1", maxlen=2, store=store)
+        for text in "abcd":
+            log.append(_frame(text))
+
+        async def follow():
+            log.close()
+            return [f async for f in log.follow(0)]
+
+        frames = asyncio.run(follow())
+        assert _data(frames) == ["a", "b", "c", "d"]
+        assert _ids(frames) == [1, 2, 3, 4]
+        assert "m1" in store.done
+
+
+class TestResume:
+
+    def test_replay_then_attach_to_live_run(self):
+        registry = EventLogRegistry()
+
+        async def run():
+            log = registry.create("m1", "u1")
+            registry.run(log, _produce(log, "abcdef", delay=0.02))
+            received = []
+            first = log.follow(0)
+            async for frame in first:
+                received.append(frame)
+                if len(received) == 2:
+                    break  # connessione caduta
+            await first.aclose()
+            await asyncio.sleep(0.05)  # il run prosegue senza client
+
+            last_id = _ids(received)[-1]
+            resumed = await registry.resume("m1", "u1", last_id)
+            return received, [f async for f in resumed]
+
+        received, resumed = asyncio.run(run())
+        assert _data(received) == ["a", "b"]
+        assert _data(resumed) == ["c", "d", "e", "f"]
+        assert _ids(received + resumed) == [1, 2, 3, 4, 5, 6]
+        stats = registry.stats()
+        assert stats["live_attaches"] == 1 and stats["finished_logs"] == 1
+
+    def test_unknown_message_or_other_user(self):
+        registry = EventLogRegistry()
+
+        async def run():
+            log = registry.create("m1", "u1")
+            log.close()
+            return await registry.resume("m1", "u2", 0), await registry.resume("m2", "u1", 0)
+
+        assert asyncio.run(run()) == (None, None)
+        assert registry.stats()["resume_misses"] == 2
+
+    def test_resume_from_store_on_another_instance(self):
+        store = _Store()
+        store.save("m1", "u1", [(1, "id: m1:1\n" + _frame("a")), (2, "id: m1:2\n" + _frame("b"))])
+
+        async def run():
+            stream = await EventLogRegistry(store=store).resume("m1", "u1", 1)
+            return [f async for f in stream]
+
+        frames = asyncio.run(run())
+        assert _data(frames[:1]) == ["b"]
+        assert '"RESUME_UNAVAILABLE"' in frames[1]  # run non concluso: il resto non è qui
+
+    def test_run_without_clients_is_cancelled_after_grace(self):
+        registry = EventLogRegistry()
+        cancelled = []
+
+        async def slow(log):
+            try:
+                log.append(_frame("a"))
+                await asyncio.sleep(5)
+                yield
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def run():
+            log = registry.create("m1", "u1")
+            log.grace_seconds = 0.05
+            task = registry.run(log, slow(log))
+            await asyncio.wait({task}, timeout=2)
+            return log
+
+        log = asyncio.run(run())
+        assert cancelled == [True] and log.done and log.expired
+        assert registry.stats()["expired_runs"] == 1
+
+    def test_follower_within_grace_keeps_run_alive(self):
+        registry = EventLogRegistry()
+
+        async def run():
+            log = registry.create("m1", "u1")
+            log.grace_seconds = 0.05
+            registry.run(log, _produce(log, "abc", delay=0.04))
+            await asyncio.sleep(0.03)
+            stream = await registry.resume("m1", "u1", 0)
+            return log, [f async for f in stream]
+
+        log, frames = asyncio.run(run())
+        assert _data(frames) == ["a", "b", "c"] and not log.expired
+
+
+class TestAskStreaming:
+
+    def test_answer_survives_a_dropped_connection(self):
+        from src.rag import _ask_streaming
+
+        agent = create_react_agent(FakeChatModel(chunks=["Ciao", " come", " stai?"], delay=0.05), [], checkpointer=InMemorySaver())
+        registry = EventLogRegistry()
+
+        async def run():
+            stream = _ask_streaming(agent, {"configurable": {"thread_id": "t1"}}, "ciao", "u1", chat_history=False)
+            first = await stream.__anext__()
+            await stream.aclose()  # connessione caduta dopo il primo frame
+            message_id, last_id = parse_event_id(first.split("\n", 1)[0][len("id: "):])
+            resumed = await registry.resume(message_id, "u1", last_id)
+            return first, [f async for f in resumed]
+
+        with patch.object(el, "_registry", registry), \
+                patch.object(el.settings, "STREAM_RESUME_ENABLED", True), \
+                patch.object(el.settings, "SSE_COALESCE_MAX_BYTES", 0), \
+                patch("src.rag.MemorySeeder.aseed_agent_memory", AsyncMock()), \
+                patch("src.rag.ConversationPersistence.queue_conversation") as conversation, \
+                patch("src.rag.queue_token_usage"):
+            first, resumed = asyncio.run(run())
+
+        assert "".join(_data([first] + resumed)) == "Ciao come stai?"
+        args, kwargs = conversation.call_args
+        assert args[1] == "Ciao come stai?" and kwargs["interrupted"] is False
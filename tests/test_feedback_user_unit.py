@@ -15,7 +15,7 @@ class TestUpdateFeedback:
     @pytest.fixture(autouse=True)
     def setup(self):
         """Create a MongoDBService with mocked MongoDB client."""
-        with patch("src.services.database.database_service.pymongo.MongoClient"):
+        with patch("src.services.database.database_service.get_mongo_client"):
             from src.services.database.database_service import MongoDBService
             self.service = MongoDBService(database_name="test_db")
             self.mock_collection = MagicMock()
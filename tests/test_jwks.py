@@ -0,0 +1,197 @@
+"""
+Unit tests for src/jwks.py and the cached verification path of VerifyToken.
+Keys and tokens are generated locally: no calls to Auth0.
+"""
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi.security import HTTPAuthorizationCredentials, SecurityScopes
+from jwt.exceptions import PyJWKClientError
+
+from src.auth import UnauthorizedException, VerifyToken
+from src.jwks import JWKSCache, VerifiedTokenCache
+
+pytestmark = pytest.mark.unit
+
+AUDIENCE = "https://api.test"
+ISSUER = "https://tenant.test/"
+
+
+def _key(kid):
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private.public_key()))
+    return private, {**jwk, "kid": kid, "use": "sig", "alg": "RS256"}
+
+
+KEY_A = _key("a")
+KEY_B = _key("b")
+
+
+def _token(key, exp_in=3600, **claims):
+    private, jwk = key
+    payload = {"sub": "user1", "aud": AUDIENCE, "iss": ISSUER, "exp": int(time.time()) + exp_in, **claims}
+    return jwt.encode(payload, private, algorithm="RS256", headers={"kid": jwk["kid"]})
+
+
+class _Endpoint:
+    """JWKS endpoint finto: conta le chiamate, le chiavi pubblicate si possono cambiare."""
+
+    def __init__(self, *keys):
+        self.keys = list(keys)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(0.01)
+        return {"keys": [jwk for _, jwk in self.keys]}
+
+
+class TestJWKSCache:
+
+    def test_keys_are_fetched_once(self):
+        endpoint = _Endpoint(KEY_A)
+        cache = JWKSCache("https://tenant.test/jwks", fetch=endpoint)
+
+        async def run():
+            return [await cache.get_signing_key("a") for _ in range(20)]
+
+        keys = asyncio.run(run())
+        assert endpoint.calls == 1
+        assert {k.key_id for k in keys} == {"a"}
+
+    def test_concurrent_cold_requests_share_one_fetch(self):
+        endpoint = _Endpoint(KEY_A)
+        cache = JWKSCache("https://tenant.test/jwks", fetch=endpoint)
+
+        async def run():
+            return await asyncio.gather(*(cache.get_signing_key("a") for _ in range(10)))
+
+        asyncio.run(run())
+        assert endpoint.calls == 1
+
+    def test_rotation_miss_refetches(self):
+        endpoint = _Endpoint(KEY_A)
+        cache = JWKSCache("https://tenant.test/jwks", fetch=endpoint, min_refetch_seconds=0)
+
+        async def run():
+            await cache.get_signing_key("a")
+            endpoint.keys = [KEY_A, KEY_B]  # Auth0 pubblica la nuova chiave
+            return await cache.get_signing_key("b")
+
+        assert asyncio.run(run()).key_id == "b"
+        assert endpoint.calls == 2
+        assert cache.stats()["rotation_misses"] == 2  # primo caricamento + rotazione
+
+    def test_unknown_kids_are_rate_limited(self):
+        endpoint = _Endpoint(KEY_A)
+        cache = JWKSCache("https://tenant.test/jwks", fetch=endpoint, min_refetch_seconds=60)
+
+        async def run():
+            await cache.get_signing_key("a")
+            for kid in ("x", "y", "z"):
+                with pytest.raises(PyJWKClientError):
+                    await cache.get_signing_key(kid)
+
+        asyncio.run(run())
+        assert endpoint.calls == 1
+
+    def test_stale_keys_are_served_while_refreshing(self):
+        endpoint = _Endpoint(KEY_A)
+        cache = JWKSCache("https://tenant.test/jwks", fetch=endpoint, refresh_seconds=0)
+
+        async def run():
+            await cache.get_signing_key("a")
+            key = await cache.get_signing_key("a")  # scaduta: servita subito, refresh in background
+            calls_before_refresh = endpoint.calls
+            await cache._inflight
+            return key, calls_before_refresh
+
+        key, calls_before_refresh = asyncio.run(run())
+        assert key.key_id == "a"
+        assert (calls_before_refresh, endpoint.calls) == (1, 2)
+
+    def test_failed_refresh_keeps_known_keys(self):
+        endpoint = _Endpoint(KEY_A)
+        cache = JWKSCache("https://tenant.test/jwks", fetch=endpoint, refresh_seconds=0)
+
+        def broken():
+            raise OSError("network down")
+
+        async def run():
+            await cache.get_signing_key("a")
+            cache._fetch = broken
+            await cache.get_signing_key("a")
+            await cache._inflight
+            return await cache.get_signing_key("a")
+
+        assert asyncio.run(run()).key_id == "a"
+        assert cache.stats()["failures"] == 1
+
+
+class TestVerifiedTokenCache:
+
+    def test_entry_expires_with_token(self):
+        now = [1000.0]
+        cache = VerifiedTokenCache(maxsize=10, timer=lambda: now[0])
+        cache.set("t1", {"sub": "u", "exp": 1060})
+        assert cache.get("t1") == {"sub": "u", "exp": 1060}
+        now[0] = 1061
+        assert cache.get("t1") is None
+
+    def test_tokens_without_exp_or_expired_are_not_cached(self):
+        cache = VerifiedTokenCache(maxsize=10, timer=lambda: 1000.0)
+        cache.set("no-exp", {"sub": "u"})
+        cache.set("expired", {"sub": "u", "exp": 999})
+        assert cache.get("no-exp") is None and cache.get("expired") is None
+
+    def test_bounded(self):
+        cache = VerifiedTokenCache(maxsize=2, timer=lambda: 0.0)
+        for i in range(5):
+            cache.set(f"t{i}", {"exp": 100})
+        assert cache.stats()["size"] == 2
+
+
+class TestVerifyToken:
+
+    @pytest.fixture
+    def verifier(self):
+        endpoint = _Endpoint(KEY_A)
+        verifier = VerifyToken()
+        verifier.config = SimpleNamespace(auth0_algorithms=["RS256"], auth0_api_audience=AUDIENCE, auth0_issuer=ISSUER)
+        verifier.jwks = JWKSCache("https://tenant.test/jwks", fetch=endpoint)
+        verifier.verified_tokens = VerifiedTokenCache(maxsize=100)
+        verifier.endpoint = endpoint
+        return verifier
+
+    def _verify(self, verifier, token):
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        return asyncio.run(verifier.verify(SecurityScopes(), credentials))
+
+    def test_valid_token_is_verified_once(self, verifier):
+        token = _token(KEY_A)
+        first = self._verify(verifier, token)
+        second = self._verify(verifier, token)
+        assert first == second
+        assert first["sub"] == "user1" and first["token"] == token
+        assert verifier.verified_tokens.stats()["hits"] == 1
+        assert verifier.endpoint.calls == 1
+
+    def test_invalid_tokens_are_rejected_and_not_cached(self, verifier):
+        wrong_audience = _token(KEY_A, aud="https://other")
+        for _ in range(2):
+            with pytest.raises(UnauthorizedException):
+                self._verify(verifier, wrong_audience)
+        assert verifier.verified_tokens.stats()["size"] == 0
+        with pytest.raises(UnauthorizedException):
+            self._verify(verifier, _token(KEY_A, exp_in=-10))
+        with pytest.raises(UnauthorizedException):
+            self._verify(verifier, "not-a-jwt")
+
+    def test_token_signed_by_unpublished_key_is_rejected(self, verifier):
+        with pytest.raises(UnauthorizedException):
+            self._verify(verifier, _token(KEY_B))
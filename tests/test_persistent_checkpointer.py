@@ -0,0 +1,183 @@
+"""
+Unit tests for src/agent/persistent_checkpointer.py and src/agent/checkpoint_store.py
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import pytest
+from unittest.mock import patch
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from mongomock_motor import AsyncMongoMockClient
+
+from src.agent.checkpoint_store import CheckpointStore, MongoCheckpointStore, SQLiteCheckpointStore
+from src.agent.persistent_checkpointer import PersistentCheckpointSaver, create_checkpointer
+from tests.fakes import echo_graph
+
+pytestmark = pytest.mark.unit
+
+
+def _config(thread_id="user-1:v1"):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / "checkpoints.sqlite")
+
+
+class TestPersistentCheckpointSaverSQLite:
+
+    def test_state_survives_new_instance(self, sqlite_path):
+        first = PersistentCheckpointSaver(SQLiteCheckpointStore(sqlite_path))
+        echo_graph(first).invoke({"messages": [HumanMessage("ciao")]}, _config())
+
+        # Nuova "istanza" sullo stesso storage: lo stato è già caldo
+        second = PersistentCheckpointSaver(SQLiteCheckpointStore(sqlite_path))
+        graph = echo_graph(second)
+        graph.invoke({"messages": [HumanMessage("come va?")]}, _config())
+
+        messages = graph.get_state(_config()).values["messages"]
+        assert [m.content for m in messages] == ["ciao", "eco: ciao", "come va?", "eco: come va?"]
+        assert second.stats()["hits"] >= 1
+
+    def test_compaction_keeps_latest_checkpoint(self):
+        store = SQLiteCheckpointStore()
+        saver = PersistentCheckpointSaver(store, max_checkpoints_per_thread=1)
+        graph = echo_graph(saver)
+
+        for text in ("uno", "due", "tre"):
+            graph.invoke({"messages": [HumanMessage(text)]}, _config())
+
+        assert len(store.list_checkpoints("user-1:v1")) == 1
+        assert saver.stats()["compacted"] > 0
+        assert len(graph.get_state(_config()).values["messages"]) == 6
+
+    def test_miss_then_hit_counters(self):
+        saver = PersistentCheckpointSaver(SQLiteCheckpointStore())
+
+        assert saver.get_tuple(_config()) is None
+        echo_graph(saver).invoke({"messages": [HumanMessage("ciao")]}, _config())
+        saver.reset_stats()
+        assert saver.get_tuple(_config()) is not None
+
+        stats = saver.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 0
+        assert stats["hit_rate"] == 1
+
+    def test_expired_thread_is_a_miss_and_is_removed(self):
+        store = SQLiteCheckpointStore()
+        saver = PersistentCheckpointSaver(store, ttl_seconds=60)
+        echo_graph(saver).invoke({"messages": [HumanMessage("ciao")]}, _config())
+
+        future = datetime.now(timezone.utc) + timedelta(seconds=120)
+        with patch("src.agent.persistent_checkpointer.datetime") as mock_datetime:
+            mock_datetime.now.return_value = future
+            assert saver.get_tuple(_config()) is None
+
+        assert saver.stats()["expired"] == 1
+        assert store.list_checkpoints("user-1:v1") == []
+
+    def test_oversized_thread_is_dropped(self):
+        store = SQLiteCheckpointStore()
+        saver = PersistentCheckpointSaver(store, max_thread_bytes=10)
+        echo_graph(saver).invoke({"messages": [HumanMessage("ciao")]}, _config())
+
+        assert saver.get_tuple(_config()) is None
+        assert saver.stats()["oversized"] == 1
+        assert store.list_checkpoints("user-1:v1") == []
+
+    def test_purge_expired_removes_old_threads(self):
+        store = SQLiteCheckpointStore()
+        saver = PersistentCheckpointSaver(store)
+        echo_graph(saver).invoke({"messages": [HumanMessage("ciao")]}, _config("old"))
+
+        assert store.purge_expired(datetime.now(timezone.utc) + timedelta(seconds=1)) == 1
+        assert store.list_checkpoints(None) == []
+
+    def test_async_api_and_seeding_fallback(self):
+        from src.memory.seeding import MemorySeeder
+
+        saver = PersistentCheckpointSaver(SQLiteCheckpointStore())
+        graph = echo_graph(saver)
+
+        async def scenario():
+            await graph.ainvoke({"messages": [HumanMessage("ciao")]}, _config())
+            with patch.object(MemorySeeder, "_abuild_seed_messages") as mock_build:
+                seeded = await MemorySeeder.aseed_agent_memory(graph, _config(), "user-1")
+            return seeded, mock_build
+
+        seeded, mock_build = asyncio.run(scenario())
+        assert seeded is False  # warm path: nessuna lettura della cronologia
+        mock_build.assert_not_called()
+
+    def test_delete_thread(self):
+        saver = PersistentCheckpointSaver(SQLiteCheckpointStore())
+        echo_graph(saver).invoke({"messages": [HumanMessage("ciao")]}, _config())
+
+        saver.delete_thread("user-1:v1")
+
+        assert saver.get_tuple(_config()) is None
+
+
+class TestPersistentCheckpointSaverMongo:
+
+    def test_sync_and_async_share_documents(self):
+        sync_client = mongomock.MongoClient()
+        store = MongoCheckpointStore("test_db", ttl_seconds=3600, client=sync_client)
+        saver = PersistentCheckpointSaver(store)
+        echo_graph(saver).invoke({"messages": [HumanMessage("ciao")]}, _config())
+
+        assert sync_client["test_db"]["agent_checkpoints"].count_documents({}) == 1
+        assert saver.get_tuple(_config()).checkpoint["channel_values"]["messages"][-1].content == "eco: ciao"
+
+    def test_async_api_with_motor(self):
+        async_client = AsyncMongoMockClient()
+        store = MongoCheckpointStore("test_db", async_client=async_client)
+        saver = PersistentCheckpointSaver(store)
+        graph = echo_graph(saver)
+
+        async def scenario():
+            await graph.ainvoke({"messages": [HumanMessage("uno")]}, _config())
+            await graph.ainvoke({"messages": [HumanMessage("due")]}, _config())
+            state = await graph.aget_state(_config())
+            count = await async_client["test_db"]["agent_checkpoints"].count_documents({})
+            return state, count
+
+        state, count = asyncio.run(scenario())
+        assert [m.content for m in state.values["messages"]] == ["uno", "eco: uno", "due", "eco: due"]
+        assert count == 1
+
+
+class TestCreateCheckpointer:
+
+    def test_memory_backend(self):
+        assert isinstance(create_checkpointer("memory"), InMemorySaver)
+
+    def test_sqlite_backend(self, sqlite_path):
+        with patch("src.agent.persistent_checkpointer.settings") as mock_settings:
+            mock_settings.CHECKPOINT_SQLITE_PATH = sqlite_path
+            mock_settings.CHECKPOINT_MAX_PER_THREAD = 1
+            mock_settings.CHECKPOINT_TTL_SECONDS = 0
+            mock_settings.CHECKPOINT_MAX_THREAD_BYTES = 0
+            saver = create_checkpointer("sqlite")
+
+        assert isinstance(saver.store, SQLiteCheckpointStore)
+        assert saver.ttl_seconds is None
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            create_checkpointer("redis")
+
+
+def test_checkpoint_store_is_abstract():
+    class PartialStore(CheckpointStore):
+        def get_checkpoint(self, thread_id, checkpoint_ns, checkpoint_id=None):
+            return None
+
+    with pytest.raises(TypeError):
+        CheckpointStore()
+    with pytest.raises(TypeError):
+        PartialStore()
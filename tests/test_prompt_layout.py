@@ -0,0 +1,115 @@
+"""
+Regression tests for the prefix-stable system prompt layout (src/prompt_personalization.py).
+"""
+import pytest
+from unittest.mock import patch
+
+from src.prompt_personalization import (
+    PromptSegment,
+    assemble_prompt,
+    build_personalized_prompt,
+    build_prompt_segments,
+    get_personalized_prompt_for_user,
+    get_static_prompt_prefix,
+    prefix_hash_for,
+    prompt_prefix_hash,
+)
+from src.utils import format_user_metadata
+
+pytestmark = pytest.mark.unit
+
+DOCS = "# Manuale AIR Coach\n\nContenuto della knowledge base."
+
+USERS = {
+    "auth0|aaaaaaaaaaaaaaaaaaaaaaaa": {"name": "Marco", "jumps": "11_50", "qualifications": "ALLIEVO"},
+    "auth0|bbbbbbbbbbbbbbbbbbbbbbbb": {"name": "Giulia", "surname": "Rossi", "qualifications": "IP", "sex": "FEMMINA"},
+    "google-oauth2|123456789012345": {},
+}
+
+
+@pytest.fixture(autouse=True)
+def _prompt_and_cache():
+    with patch("src.prompt_personalization.get_prompt_with_version", return_value=(DOCS, 3)), \
+            patch("src.prompt_personalization.get_cached_user_data", return_value=None), \
+            patch("src.prompt_personalization.set_cached_user_data"):
+        yield
+
+
+def _prompt_for(user_id):
+    with patch("src.prompt_personalization.get_user_metadata", return_value=USERS[user_id]):
+        prompt, _, _ = get_personalized_prompt_for_user(user_id, token="t")
+    return prompt
+
+
+class TestPrefixStability:
+
+    def test_static_prefix_is_byte_identical_across_users(self):
+        prefix, version = get_static_prompt_prefix()
+        prompts = [_prompt_for(user_id) for user_id in USERS]
+
+        assert version == 3
+        assert all(p.startswith(prefix) for p in prompts)
+        assert len({p.encode("utf-8")[:len(prefix.encode("utf-8"))] for p in prompts}) == 1
+        assert len({prefix_hash_for(p) for p in prompts}) == 1
+        assert len(set(prompts)) == len(USERS)  # la personalizzazione c'è, ma solo dopo il prefisso
+
+    def test_date_does_not_change_prefix(self):
+        monday = build_personalized_prompt(DOCS, "Nome: Marco", today="2026-03-02")
+        tuesday = build_personalized_prompt(DOCS, "Nome: Marco", today="2026-03-03")
+        prefix, _ = get_static_prompt_prefix()
+
+        assert monday != tuesday
+        assert monday.startswith(prefix) and tuesday.startswith(prefix)
+        assert prefix_hash_for(monday) == prefix_hash_for(tuesday)
+
+    def test_prefix_hash_changes_with_docs_version(self):
+        prefix, _ = get_static_prompt_prefix()
+        with patch("src.prompt_personalization.get_prompt_with_version", return_value=(DOCS + "\nNuova sezione", 4)):
+            new_prefix, _ = get_static_prompt_prefix()
+
+        assert prompt_prefix_hash(prefix) != prompt_prefix_hash(new_prefix)
+
+    def test_prefix_and_hash_are_computed_once_per_version(self):
+        prefix, _ = get_static_prompt_prefix()
+        with patch("src.prompt_personalization.prompt_prefix_hash", wraps=prompt_prefix_hash) as hashed:
+            hashes = {prefix_hash_for(build_personalized_prompt(DOCS, f"Nome: {n}")) for n in ("Marco", "Giulia")}
+            assert get_static_prompt_prefix()[0] == prefix
+            hashed.assert_not_called()
+
+            with patch("src.prompt_personalization.get_prompt_with_version", return_value=(DOCS + "\nNuova sezione", 4)):
+                get_static_prompt_prefix()
+                get_static_prompt_prefix()
+            hashed.assert_called_once()
+
+        assert hashes == {prompt_prefix_hash(prefix)}
+
+    def test_prompt_outside_layout_gets_its_own_hash(self):
+        assert prefix_hash_for("Oggi è il 2026-03-02\n" + DOCS) == prompt_prefix_hash("Oggi è il 2026-03-02\n" + DOCS)
+
+
+class TestSegmentOrdering:
+
+    def test_dynamic_segments_follow_canonical_order(self):
+        segments = build_prompt_segments(DOCS, "Nome: Marco", today="2026-03-02")
+        prompt, _ = assemble_prompt(list(reversed(segments)))
+        reference, _ = assemble_prompt(segments)
+
+        assert prompt.index("Oggi è il 2026-03-02") < prompt.index("Nome: Marco")
+        assert assemble_prompt(segments[:2] + segments[2:][::-1])[0] == reference
+
+    def test_static_segments_always_precede_dynamic_ones(self):
+        prompt, prefix = assemble_prompt([
+            PromptSegment("date", "Oggi è il 2026-03-02", static=False),
+            PromptSegment("docs", DOCS, static=True),
+        ])
+
+        assert prefix == DOCS
+        assert prompt.startswith(DOCS)
+
+
+def test_user_metadata_has_no_date():
+    user_info = format_user_metadata(USERS["auth0|aaaaaaaaaaaaaaaaaaaaaaaa"])
+
+    assert "Oggi" not in user_info
+    assert "Nome: Marco" in user_info
+    assert format_user_metadata({}) == ""
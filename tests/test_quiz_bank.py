@@ -0,0 +1,214 @@
+"""
+Unit tests for the in-process quiz bank (src/services/database/quiz_bank.py) and
+QuizMongoDBService serving from it, against a mongomock collection.
+"""
+import mongomock
+import pytest
+from unittest.mock import MagicMock, patch
+
+import src.services.database.quiz_bank as quiz_bank
+from src.services.database.database_quiz_service import QuizMongoDBService
+from src.services.database.quiz_bank import QuizBank, QuizBankLoader
+
+pytestmark = pytest.mark.unit
+
+
+def _question(capitolo, numero, categoria="base"):
+    return {
+        "_id": f"q{capitolo}_{numero}",
+        "capitolo": capitolo,
+        "capitolo_nome": f"Capitolo {capitolo}",
+        "numero": numero,
+        "testo": f"Domanda {numero} del capitolo {capitolo} sulla quota di apertura",
+        "opzioni": [{"id": "A", "testo": "Sì"}, {"id": "B", "testo": "No"}],
+        "risposta_corretta": "A",
+        "categoria": categoria,
+    }
+
+
+QUESTIONS = [_question(c, n) for c in (1, 2, 3) for n in range(1, 6)]
+
+
+@pytest.fixture
+def mongo():
+    client = mongomock.MongoClient()
+    client["quiz"]["prod"].insert_many([dict(q) for q in QUESTIONS])
+    quiz_bank._loaders.clear()
+    with patch("src.services.database.database_service.get_mongo_client", return_value=client):
+        yield client
+    quiz_bank._loaders.clear()
+
+
+class TestQuizBank:
+
+    def test_indexes(self):
+        bank = QuizBank(QUESTIONS, "v1")
+
+        assert bank.get(2, 3)["_id"] == "q2_3"
+        assert bank.get("2", "3") is bank.get(2, 3)
+        assert bank.get(9, 1) is None
+        assert [q["numero"] for q in bank.chapter(1)] == [1, 2, 3, 4, 5]
+        assert bank.chapters() == {1: 5, 2: 5, 3: 5}
+        assert bank.get_by_id("q3_5")["numero"] == 5
+
+    def test_random_in_chapter_stays_in_chapter(self):
+        bank = QuizBank(QUESTIONS, "v1")
+
+        assert {bank.random_in_chapter(3)["capitolo"] for _ in range(50)} == {3}
+        assert bank.random_in_chapter(7) is None
+
+
+class TestQuizBankLoader:
+
+    def _loader(self, versions, data):
+        calls = {"fetch": 0}
+
+        def fetch():
+            calls["fetch"] += 1
+            return list(data)
+
+        loader = QuizBankLoader(fetch, lambda: versions[-1], refresh_seconds=0, background=False)
+        return loader, calls
+
+    def test_reloads_only_when_version_changes(self):
+        versions = ["etag-1"]
+        loader, calls = self._loader(versions, QUESTIONS)
+        first = loader.get()
+        loader.get()
+
+        assert calls["fetch"] == 1
+        assert loader.get() is first
+
+        versions.append("etag-2")
+        loader.get()
+        assert calls["fetch"] == 2
+        assert loader.get() is not first
+        assert loader.get().version == "etag-2"
+
+    def test_without_server_version_compares_content(self):
+        loader, calls = self._loader([None], QUESTIONS)
+        first = loader.get()
+        loader.get()
+
+        assert calls["fetch"] == 2
+        assert loader.get() is first
+        assert loader.reloads_skipped >= 1
+
+    def test_failed_load_is_not_retried_on_every_call(self):
+        calls = {"fetch": 0}
+
+        def fetch():
+            calls["fetch"] += 1
+            raise ConnectionError("mongo down")
+
+        loader = QuizBankLoader(fetch, retry_after_s=60)
+
+        assert loader.get() is None
+        assert loader.get() is None
+        assert calls["fetch"] == 1
+
+
+class TestQuizServiceFromMemory:
+
+    def test_reads_are_served_from_memory(self, mongo):
+        service = QuizMongoDBService()
+        service.get_random_question()  # load
+        with patch.object(service.db, "get_items", side_effect=AssertionError("Mongo queried")), \
+                patch.object(service.db, "get_random_item", side_effect=AssertionError("Mongo queried")), \
+                patch.object(service.db, "get_random_item_by_field", side_effect=AssertionError("Mongo queried")):
+            assert service.get_question_by_capitolo_and_number(capitolo=2, numero=4)["_id"] == "q2_4"
+            assert service.get_random_question_by_field(field="capitolo", value=3)["capitolo"] == 3
+            assert service.get_random_question()["_id"].startswith("q")
+            assert len(service.search_questions_by_text("quota di apertura", limit=0)) == len(QUESTIONS)
+
+    def test_returns_copies(self, mongo):
+        service = QuizMongoDBService()
+        question = service.get_question_by_capitolo_and_number(capitolo=1, numero=1)
+        question["opzioni"].clear()
+
+        assert len(service.get_question_by_capitolo_and_number(capitolo=1, numero=1)["opzioni"]) == 2
+
+    def test_falls_back_to_mongo_when_bank_unavailable(self, mongo):
+        with patch("src.services.database.quiz_bank.QuizBankLoader._build", side_effect=ConnectionError("timeout")):
+            service = QuizMongoDBService()
+            assert service.get_question_bank() is None
+            assert service.get_question_by_capitolo_and_number(capitolo=3, numero=2)["_id"] == "q3_2"
+            assert service.get_random_question_by_field(field="capitolo", value=1)["capitolo"] == 1
+
+    def test_question_added_after_load_is_found(self, mongo):
+        service = QuizMongoDBService()
+        service.get_random_question()
+        mongo["quiz"]["prod"].insert_one(_question(4, 1))
+
+        assert service.get_question_by_capitolo_and_number(capitolo=4, numero=1)["_id"] == "q4_1"
+
+    def test_writes_reload_the_bank(self, mongo):
+        service = QuizMongoDBService()
+        service.get_random_question()
+        service.insert_quiz_questions([_question(5, 1)])
+
+        assert service.get_random_question_by_field(field="capitolo", value=5)["_id"] == "q5_1"
+
+    def test_disabled_bank_queries_mongo(self, mongo):
+        with patch("src.services.database.database_quiz_service.settings.QUIZ_BANK_ENABLED", False):
+            service = QuizMongoDBService()
+
+        assert service.bank_loader is None
+        assert service.get_question_by_capitolo_and_number(capitolo=1, numero=5)["_id"] == "q1_5"
+
+
+SEARCH_QUESTIONS = [
+    {"_id": "s1", "capitolo": 1, "numero": 1, "testo": "Cosa indica la presenza di cumulonembi?",
+     "opzioni": [{"id": "A", "testo": "Temporale in arrivo"}, {"id": "B", "testo": "Bel tempo"}]},
+    {"_id": "s2", "capitolo": 3, "numero": 1, "testo": "Qual è la velocità massima del paracadute principale?",
+     "opzioni": [{"id": "A", "testo": "VNE"}, {"id": "B", "testo": "Nessuna"}]},
+    {"_id": "s3", "capitolo": 9, "numero": 1, "testo": "Cosa deve fare il paracadutista in caso di malfunzionamento?",
+     "opzioni": [{"id": "A", "testo": "Sgancio e apertura della riserva"}, {"id": "B", "testo": "Attendere"}]},
+    {"_id": "s4", "capitolo": 9, "numero": 2, "testo": "Quando si apre la riserva?",
+     "opzioni": [{"id": "A", "testo": "Dopo lo sgancio della vela principale"}, {"id": "B", "testo": "Mai"}]},
+]
+
+
+class TestQuizSearch:
+
+    def test_ranked_by_relevance_with_limit(self):
+        bank = QuizBank(SEARCH_QUESTIONS, "v1")
+
+        assert [q["_id"] for q in bank.search("malfunzionamento del paracadutista", limit=1)] == ["s3"]
+        assert len(bank.search("riserva", limit=1)) == 1
+        assert {q["_id"] for q in bank.search("riserva")} == {"s3", "s4"}
+
+    def test_italian_normalization_and_option_texts(self):
+        bank = QuizBank(SEARCH_QUESTIONS, "v1")
+
+        assert bank.search("velocita paracadute")[0]["_id"] == "s2"  # accento e desinenza
+        assert bank.search("temporale")[0]["_id"] == "s1"  # testo di un'opzione
+        assert bank.search("della") == []  # solo stopword
+
+    def test_service_memory_backend(self, mongo):
+        mongo["quiz"]["prod"].insert_many([dict(q) for q in SEARCH_QUESTIONS])
+        service = QuizMongoDBService()
+
+        assert [q["_id"] for q in service.search_questions_by_text("cumulonembi", limit=1)] == ["s1"]
+
+    def test_service_regex_backend_pushes_limit(self, mongo):
+        with patch("src.services.database.database_quiz_service.settings.QUIZ_SEARCH_BACKEND", "regex"):
+            results = QuizMongoDBService().search_questions_by_text("quota apertura", limit=2)
+
+        assert len(results) == 2
+
+    def test_service_text_backend_query(self, mongo):
+        service = QuizMongoDBService()
+        collection = MagicMock()
+        collection.find.return_value.sort.return_value.limit.return_value = [dict(SEARCH_QUESTIONS[2], _score=2.5)]
+        service.db.db = MagicMock()
+        service.db.db.name = "quiz"
+        service.db.db.__getitem__.return_value = collection
+
+        with patch("src.services.database.database_quiz_service.settings.QUIZ_SEARCH_BACKEND", "text"):
+            results = service.search_questions_by_text("malfunzionamento", limit=1)
+
+        assert collection.create_index.call_args.kwargs["default_language"] == "italian"
+        assert collection.find.call_args.args[0] == {"$text": {"$search": "malfunzionamento"}}
+        collection.find.return_value.sort.return_value.limit.assert_called_once_with(1)
+        assert results[0]["_id"] == "s3" and "_score" not in results[0]
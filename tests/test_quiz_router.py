@@ -0,0 +1,188 @@
+"""
+Unit tests for the quiz command pre-router (src/agent/quiz_router.py) and the LLM-free
+fast path of StreamingHandler.
+
+LABELED_MESSAGES is the labeled set used to measure router precision: a false positive
+would answer a theory question with a quiz card, so precision must stay at 1.0.
+"""
+import asyncio
+import json
+from unittest.mock import Mock, patch
+
+import pytest
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from src.agent.quiz_router import route_quiz_command
+from src.agent.streaming_handler import StreamingHandler
+from src.tools import domanda_teoria
+from tests.fakes import FakeChatModel
+
+pytestmark = pytest.mark.unit
+
+# (messaggio, argomenti attesi per domanda_teoria o None se deve decidere l'LLM)
+LABELED_MESSAGES = [
+    ("domanda 5 del capitolo 2", {"capitolo": 2, "domanda": 5}),
+    ("Domanda 5 del capitolo 2", {"capitolo": 2, "domanda": 5}),
+    ("la domanda 12 del capitolo 3?", {"capitolo": 3, "domanda": 12}),
+    ("Dammi la domanda 7 del capitolo 1", {"capitolo": 1, "domanda": 7}),
+    ("fammi la domanda n. 4 del cap. 9", {"capitolo": 9, "domanda": 4}),
+    ("domanda numero 3 capitolo 10", {"capitolo": 10, "domanda": 3}),
+    ("capitolo 4 domanda 15", {"capitolo": 4, "domanda": 15}),
+    ("capitolo 6, domanda 2", {"capitolo": 6, "domanda": 2}),
+    ("mi fai la domanda cinque del capitolo due per favore", {"capitolo": 2, "domanda": 5}),
+    ("Ok, domanda 8 del capitolo 7!", {"capitolo": 7, "domanda": 8}),
+    ("puoi darmi la domanda 3 del capitolo 5", {"capitolo": 5, "domanda": 3}),
+    ("domanda 20 del capitolo 11", {"capitolo": 11, "domanda": 20}),
+    ("fammi una domanda del capitolo 3", {"capitolo": 3}),
+    ("una domanda sul capitolo 1", {"capitolo": 1}),
+    ("domanda casuale dal capitolo 8", {"capitolo": 8}),
+    ("Dammi un'altra domanda del capitolo 2", {"capitolo": 2}),
+    ("domanda sul capitolo 9 a caso", {"capitolo": 9}),
+    ("prossima domanda del capitolo 4", {"capitolo": 4}),
+    ("fammi una domanda", {}),
+    ("Fammi una domanda di teoria", {}),
+    ("domanda casuale", {}),
+    ("un'altra domanda", {}),
+    ("altra domanda per favore", {}),
+    ("prossima domanda", {}),
+    ("Dammi una nuova domanda!", {}),
+    ("simuliamo un quiz d'esame", {}),
+    ("Simuliamo il quiz", {}),
+    ("iniziamo la simulazione d'esame", {}),
+    ("facciamo un quiz", {}),
+    ("continuiamo il quiz", {}),
+    ("ok prossima domanda grazie", {}),
+    ("domanda", {}),
+    ("vorrei una domanda d'esame", {}),
+    ("passiamo alla domanda successiva", {}),
+    # Negativi: domande di teoria, risposte al quiz, richieste ambigue o per argomento
+    ("ho una domanda sul paracadute di riserva", None),
+    ("una domanda sulla VNE", None),
+    ("fammi una domanda sulla quota di apertura", None),
+    ("cosa dice la domanda 5 del capitolo 2?", None),
+    ("perché la risposta alla domanda 3 del capitolo 1 è B?", None),
+    ("spiegami la domanda 4 del capitolo 6", None),
+    ("non capisco la domanda", None),
+    ("la domanda?", None),
+    ("B", None),
+    ("la risposta è C", None),
+    ("di cosa parla il capitolo 3?", None),
+    ("riassumimi il capitolo 2", None),
+    ("quante domande ci sono nel capitolo 5?", None),
+    ("che cos'è la VNE?", None),
+    ("a che quota si apre il paracadute?", None),
+    ("domanda: cosa succede se perdo l'altimetro?", None),
+    ("mi spieghi meglio la domanda precedente?", None),
+    ("quiz", None),
+    ("come funziona l'esame di teoria?", None),
+    ("posso fare una domanda sul capitolo 3?", None),
+    ("la domanda 5 del capitolo 2 secondo me è sbagliata", None),
+    ("grazie", None),
+    ("ciao", None),
+    ("simuliamo un atterraggio fuori campo", None),
+    ("domanda 5", None),
+    ("capitolo 3", None),
+    ("non voglio una domanda", None),
+]
+
+QUESTION = {
+    "_id": "q2_5", "capitolo": 2, "capitolo_nome": "Aerodinamica applicata al corpo in caduta libera",
+    "numero": 5, "testo": "TEST", "opzioni": [{"id": "A", "testo": "Sì"}, {"id": "B", "testo": "No"}],
+    "risposta_corretta": "A",
+}
+
+
+def _evaluate():
+    tp = fp = fn = 0
+    wrong_args = []
+    for message, expected in LABELED_MESSAGES:
+        command = route_quiz_command(message)
+        if command is not None and expected is not None:
+            tp += 1
+            if command.args != expected:
+                wrong_args.append((message, command.args, expected))
+        elif command is not None:
+            fp += 1
+        elif expected is not None:
+            fn += 1
+    return tp, fp, fn, wrong_args
+
+
+class TestRouterPrecision:
+
+    def test_no_false_positives_on_labeled_set(self):
+        tp, fp, fn, wrong_args = _evaluate()
+
+        assert fp == 0, "Un comando instradato per errore risponderebbe con una domanda d'esame"
+        assert wrong_args == []
+        assert tp / (tp + fp) == 1.0
+
+    def test_recall_on_labeled_set(self):
+        tp, fp, fn, _ = _evaluate()
+
+        assert tp / (tp + fn) >= 0.9
+
+    def test_long_messages_are_left_to_the_llm(self):
+        assert route_quiz_command("fammi una domanda " + "per favore " * 20) is None
+
+
+def _events(chunks):
+    return [json.loads(chunk[len("data: "):]) for chunk in chunks]
+
+
+class TestFastPath:
+
+    @pytest.fixture
+    def quiz_service(self):
+        service = Mock()
+        service.get_question_by_capitolo_and_number.return_value = QUESTION
+        with patch("src.tools.QuizMongoDBService", return_value=service):
+            yield service
+
+    def _agent(self, *responses):
+        model = FakeChatModel(responses=list(responses))
+        return create_react_agent(model, [domanda_teoria], checkpointer=InMemorySaver())
+
+    def test_same_event_and_record_as_llm_path(self, quiz_service):
+        args = {"capitolo": 2, "domanda": 5}
+        agent = self._agent(AIMessage(content="", tool_calls=[{"name": "domanda_teoria", "args": args, "id": "c1"}]))
+
+        async def run():
+            llm, fast = StreamingHandler("m1"), StreamingHandler("m2")
+            llm_chunks = [c async for c in llm.handle_stream_events(agent, "domanda 5 del capitolo 2", {"configurable": {"thread_id": "t1"}})]
+            fast_chunks = [c async for c in fast.handle_direct_tool_call(agent, "domanda 5 del capitolo 2", {"configurable": {"thread_id": "t2"}}, domanda_teoria, args)]
+            return llm, _events(llm_chunks), fast, _events(fast_chunks)
+
+        llm, llm_events, fast, fast_events = asyncio.run(run())
+
+        assert len(llm_events) == len(fast_events) == 1
+        for llm_event, fast_event in zip(llm_events, fast_events):
+            assert llm_event.keys() == fast_event.keys()
+            assert llm_event["data"]["content"] == fast_event["data"]["content"] == QUESTION
+            assert (llm_event["type"], llm_event["tool_name"]) == (fast_event["type"], fast_event["tool_name"])
+        assert [r["data"]["content"] for r in llm.tool_records] == [r["data"]["content"] for r in fast.tool_records]
+        assert fast.get_usage_metadata() == {}
+
+    def test_thread_state_allows_next_llm_turn(self, quiz_service):
+        agent = self._agent(AIMessage(content="Corretto!"))
+        config = {"configurable": {"thread_id": "t1"}}
+
+        async def run():
+            handler = StreamingHandler("m1")
+            async for _ in handler.handle_direct_tool_call(agent, "domanda 5 del capitolo 2", config, domanda_teoria, {"capitolo": 2, "domanda": 5}):
+                pass
+            state = await agent.aget_state(config)
+            answer = [c async for c in StreamingHandler("m2").handle_stream_events(agent, "A", config)]
+            return state, _events(answer), await agent.aget_state(config)
+
+        state, answer, final_state = asyncio.run(run())
+
+        messages = state.values["messages"]
+        assert [type(m).__name__ for m in messages] == ["HumanMessage", "AIMessage", "ToolMessage"]
+        assert messages[1].tool_calls[0]["id"] == messages[2].tool_call_id
+        assert json.loads(messages[2].content)["risposta_corretta"] == "A"
+        assert state.next == ()
+        assert answer == [{"type": "agent_message", "data": "Corretto!", "message_id": "m2"}]
+        assert isinstance(final_state.values["messages"][2], ToolMessage)
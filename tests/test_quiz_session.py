@@ -0,0 +1,109 @@
+"""
+Unit tests for the exam simulation sessions (src/quiz_session.py) and random mode of domanda_teoria.
+"""
+import random
+from collections import Counter
+from unittest.mock import Mock, patch
+
+import pytest
+
+from src.quiz_session import QuizSessionStore, allocate_by_chapter, build_exam_deck
+from src.services.database.quiz_bank import QuizBank
+from src.tools import USER_ID_CONFIG_KEY, domanda_teoria
+
+pytestmark = pytest.mark.unit
+
+# Capitoli di dimensione diversa: 40, 20, 10, 10 domande
+SIZES = {1: 40, 2: 20, 3: 10, 4: 10}
+QUESTIONS = [
+    {"_id": f"q{c}_{n}", "capitolo": c, "numero": n, "testo": f"Domanda {n}", "opzioni": [], "risposta_corretta": "A"}
+    for c, size in SIZES.items() for n in range(1, size + 1)
+]
+
+
+@pytest.fixture
+def bank():
+    return QuizBank(QUESTIONS, "v1")
+
+
+class TestDeck:
+
+    def test_allocation_is_proportional_with_one_per_chapter(self):
+        assert allocate_by_chapter(SIZES, 16) == {1: 8, 2: 4, 3: 2, 4: 2}
+        assert sum(allocate_by_chapter(SIZES, 7).values()) == 7
+        assert set(allocate_by_chapter(SIZES, 5)) == {1, 2, 3, 4}
+        assert allocate_by_chapter({1: 2, 2: 1}, 30) == {1: 2, 2: 1}
+
+    def test_deck_is_stratified_and_without_repeats(self, bank):
+        deck = build_exam_deck(bank, 16, random.Random(1))
+
+        assert len(deck) == len(set(deck)) == 16
+        assert deck.itemsize == 4
+        assert Counter(key // 100000 for key in deck) == {1: 8, 2: 4, 3: 2, 4: 2}
+
+
+class TestSessionStore:
+
+    def test_no_repeats_within_a_simulation_then_new_deck(self, bank):
+        store = QuizSessionStore(exam_questions=16, ttl_seconds=60, rng=random.Random(2))
+        questions = [store.next_question("u1", bank) for _ in range(16)]
+
+        assert len({q["_id"] for q in questions}) == 16
+        assert [q["esame"] for q in questions[:2]] == [{"domanda": 1, "totale": 16}, {"domanda": 2, "totale": 16}]
+        assert store.next_question("u1", bank)["esame"]["domanda"] == 1
+        assert store.decks_built == 2
+
+    def test_sessions_are_per_user_and_resumable(self, bank):
+        store = QuizSessionStore(exam_questions=10, ttl_seconds=60)
+        store.next_question("u1", bank)
+        store.next_question("u1", bank)
+        store.next_question("u2", bank)
+
+        assert store.next_question("u1", bank)["esame"]["domanda"] == 3
+        assert store.get("u2").position == 1
+
+    def test_session_expires(self, bank):
+        now = [1000.0]
+        store = QuizSessionStore(exam_questions=10, ttl_seconds=60, timer=lambda: now[0])
+        store.next_question("u1", bank)
+        now[0] += 61
+
+        assert store.get("u1") is None
+        assert store.next_question("u1", bank)["esame"]["domanda"] == 1
+
+    def test_question_removed_by_reload_is_skipped(self, bank):
+        store = QuizSessionStore(exam_questions=5, ttl_seconds=60, rng=random.Random(3))
+        store.next_question("u1", bank)
+        next_key = divmod(store.get("u1").deck[1], 100000)
+        reloaded = QuizBank([q for q in QUESTIONS if (q["capitolo"], q["numero"]) != next_key], "v2")
+
+        question = store.next_question("u1", reloaded)
+        assert (question["capitolo"], question["numero"]) != next_key
+        assert question["esame"]["domanda"] == 3
+
+
+class TestRandomModeTool:
+
+    def test_known_user_is_served_from_session_without_db(self, bank):
+        service = Mock()
+        service.get_question_bank.return_value = bank
+        store = QuizSessionStore(exam_questions=10, ttl_seconds=60)
+        config = {"configurable": {USER_ID_CONFIG_KEY: "auth0|u1"}}
+
+        with patch("src.tools.QuizMongoDBService", return_value=service), \
+                patch("src.tools.get_quiz_session_store", return_value=store):
+            ids = {domanda_teoria.invoke({}, config=config)["_id"] for _ in range(10)}
+
+        assert len(ids) == 10
+        service.get_random_question.assert_not_called()
+
+    def test_without_bank_falls_back_to_db(self):
+        service = Mock()
+        service.get_question_bank.return_value = None
+        service.get_random_question.return_value = QUESTIONS[0]
+
+        with patch("src.tools.QuizMongoDBService", return_value=service):
+            result = domanda_teoria.invoke({}, config={"configurable": {USER_ID_CONFIG_KEY: "auth0|u1"}})
+
+        assert result["_id"] == "q1_1"
+        service.get_random_question.assert_called_once()
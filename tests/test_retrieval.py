@@ -0,0 +1,113 @@
+"""
+Unit tests for retrieval mode (src/retrieval.py): chunking, BM25 ranking and prompt assembly.
+"""
+import pytest
+from unittest.mock import patch
+
+import src.retrieval as retrieval
+from src.prompt_personalization import get_personalized_prompt_for_user, get_static_prompt_prefix
+from src.retrieval import BM25Index, DocsRetriever, chunk_docs, get_docs_retriever, tokenize
+
+pytestmark = pytest.mark.unit
+
+DOCS = """# AIR Coach
+Sei AIR Coach, assistente per la teoria del paracadutismo.
+
+# Meteorologia
+## Nubi
+I cumuli indicano correnti ascensionali; con cumulonembi il lancio è sospeso.
+
+## Vento
+Il vento in quota si misura prima del decollo con il palloncino.
+
+# Emergenze
+## Malfunzionamenti
+In caso di malfunzionamento della vela principale si esegue lo sgancio e l'apertura della riserva.
+"""
+
+
+@pytest.fixture(autouse=True)
+def _reset_retriever():
+    retrieval._retriever = None
+    yield
+    retrieval._retriever = None
+
+
+class TestChunking:
+
+    def test_splits_on_headings_with_title_path(self):
+        chunks = chunk_docs(DOCS)
+
+        assert [c.title for c in chunks] == [
+            "AIR Coach", "Meteorologia", "Meteorologia > Nubi", "Meteorologia > Vento",
+            "Emergenze", "Emergenze > Malfunzionamenti",
+        ]
+        assert chunks[2].text.startswith("## Nubi")
+        assert [c.start for c in chunks] == sorted(c.start for c in chunks)
+
+    def test_long_sections_respect_max_chars(self):
+        docs = "# Capitolo\n\n" + "\n\n".join(f"Paragrafo {i} " + "x" * 300 for i in range(20))
+        chunks = chunk_docs(docs, max_chars=1000)
+
+        assert len(chunks) > 1
+        assert all(len(c.text) <= 1000 for c in chunks)
+        assert all(c.title == "Capitolo" for c in chunks)
+
+    def test_tokenize_folds_accents_stopwords_and_inflection(self):
+        assert tokenize("Il paracadutista e i paracadutisti") == ["paracadutist", "paracadutist"]
+        assert tokenize("Velocità") == tokenize("velocita")
+
+
+class TestRanking:
+
+    def test_relevant_text_ranks_first(self):
+        index = BM25Index(["vento in quota e turbolenza", "apertura della riserva", "cumuli e nubi"])
+
+        assert index.search("Come si apre la riserva?", k=1)[0][0] == 1
+        assert index.search("parola assente") == []
+
+    def test_retriever_returns_relevant_chunk_not_unrelated(self):
+        retriever = DocsRetriever(DOCS, core_chars=100)
+        hits = retriever.search("cosa fare con un malfunzionamento?", k=1)
+
+        assert [c.title for c in hits] == ["Emergenze > Malfunzionamenti"]
+        assert "AIR Coach" in retriever.core
+        assert all("Sei AIR Coach" not in c.text for c in retriever.chunks)
+
+
+class TestRetrievalPrompt:
+
+    @pytest.fixture(autouse=True)
+    def _retrieval_mode(self):
+        with patch("src.prompt_personalization.settings.RETRIEVAL_MODE", True), \
+                patch("src.prompt_personalization.get_prompt_with_version", return_value=(DOCS, 5)), \
+                patch("src.prompt_personalization.get_cached_user_data", return_value=""), \
+                patch("src.retrieval.settings.RETRIEVAL_CORE_CHARS", 100), \
+                patch("src.retrieval.settings.RETRIEVAL_TOP_K", 1):
+            yield
+
+    def test_prompt_contains_core_and_top_chunks_only(self):
+        prompt, version, _ = get_personalized_prompt_for_user("u1", token=None, query="malfunzionamento della vela")
+
+        assert version == 5
+        assert "Sei AIR Coach" in prompt
+        assert "sgancio" in prompt
+        assert "palloncino" not in prompt and "cumulonembi" not in prompt
+
+    def test_static_prefix_is_stable_across_queries(self):
+        prefix, _ = get_static_prompt_prefix()
+        first, _, _ = get_personalized_prompt_for_user("u1", token=None, query="malfunzionamento")
+        second, _, _ = get_personalized_prompt_for_user("u1", token=None, query="vento in quota")
+
+        assert first != second
+        assert first.startswith(prefix) and second.startswith(prefix)
+        assert "sgancio" not in prefix and "palloncino" not in prefix
+
+
+def test_retriever_is_rebuilt_on_new_prompt_version():
+    first = get_docs_retriever(DOCS, 1)
+
+    assert get_docs_retriever(DOCS, 1) is first
+    second = get_docs_retriever(DOCS + "\n# Nuovo capitolo\nTesto.", 2)
+    assert second is not first
+    assert second.prompt_version == 2
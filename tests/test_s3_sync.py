@@ -0,0 +1,125 @@
+"""
+Unit tests for the incremental S3 docs sync (src/s3_utils.py DocsSync), against a moto S3 bucket.
+"""
+import boto3
+import pytest
+from moto import mock_aws
+
+from src.s3_utils import DocsSync
+
+pytestmark = pytest.mark.unit
+
+BUCKET = "air-coach-test"
+
+
+class _CountingClient:
+    """Wraps the boto3 client and records which keys are downloaded."""
+
+    def __init__(self, client):
+        self._client = client
+        self.downloaded = []
+
+    def get_object(self, **kwargs):
+        self.downloaded.append(kwargs["Key"])
+        return self._client.get_object(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        for name in ("a", "b", "c"):
+            client.put_object(Bucket=BUCKET, Key=f"docs/{name}.md", Body=f"# Documento {name}".encode())
+        client.put_object(Bucket=BUCKET, Key="docs/image.png", Body=b"\x89PNG")
+        yield client
+
+
+def _sync(client, cache_dir, **kwargs):
+    return DocsSync(client=client, bucket=BUCKET, cache_dir=str(cache_dir), **kwargs)
+
+
+class TestDocsSync:
+
+    def test_first_sync_downloads_markdown_only(self, s3, tmp_path):
+        client = _CountingClient(s3)
+        result = _sync(client, tmp_path).sync()
+
+        assert sorted(client.downloaded) == ["docs/a.md", "docs/b.md", "docs/c.md"]
+        assert result["combined_docs"] == "# Documento a\n\n# Documento b\n\n# Documento c"
+        assert [m["title"] for m in result["docs_meta"]] == ["a.md", "b.md", "c.md"]
+        assert result["sync_stats"]["downloaded"] == 3
+        assert result["sync_stats"]["bytes_downloaded"] == 3 * len("# Documento a")
+
+    def test_refresh_downloads_only_changed_file(self, s3, tmp_path):
+        client = _CountingClient(s3)
+        sync = _sync(client, tmp_path)
+        sync.sync()
+        client.downloaded.clear()
+
+        s3.put_object(Bucket=BUCKET, Key="docs/b.md", Body=b"# Documento b aggiornato")
+        result = sync.sync()
+
+        assert client.downloaded == ["docs/b.md"]
+        assert "# Documento b aggiornato" in result["combined_docs"]
+        assert result["sync_stats"]["unchanged"] == 2
+        assert result["sync_stats"]["bytes_downloaded"] == len("# Documento b aggiornato")
+
+    def test_new_process_reuses_disk_cache(self, s3, tmp_path):
+        _sync(s3, tmp_path).sync()
+
+        client = _CountingClient(s3)
+        result = _sync(client, tmp_path).sync()  # nuova istanza, stessa cache locale
+
+        assert client.downloaded == []
+        assert result["sync_stats"]["unchanged"] == 3
+        assert result["combined_docs"].startswith("# Documento a")
+
+    def test_corrupted_cache_entry_is_downloaded_again(self, s3, tmp_path):
+        _sync(s3, tmp_path).sync()
+        for blob in (tmp_path / "objects").iterdir():
+            blob.write_bytes(b"corrotto")
+
+        client = _CountingClient(s3)
+        result = _sync(client, tmp_path).sync()
+
+        assert len(client.downloaded) == 3
+        assert "corrotto" not in result["combined_docs"]
+
+    def test_deleted_file_is_removed_from_cache(self, s3, tmp_path):
+        sync = _sync(s3, tmp_path)
+        sync.sync()
+
+        s3.delete_object(Bucket=BUCKET, Key="docs/c.md")
+        result = sync.sync()
+
+        assert result["sync_stats"]["removed"] == 1
+        assert "Documento c" not in result["combined_docs"]
+        assert len(list((tmp_path / "objects").iterdir())) == 2
+
+    def test_follows_continuation_tokens(self, s3, tmp_path):
+        for i in range(4):
+            s3.put_object(Bucket=BUCKET, Key=f"docs/extra_{i}.md", Body=f"extra {i}".encode())
+
+        result = _sync(s3, tmp_path, page_size=2).sync()
+
+        assert result["sync_stats"]["objects"] == 7
+        assert result["sync_stats"]["pages"] == 4
+
+    def test_failed_download_falls_back_to_cached_copy(self, s3, tmp_path):
+        sync = _sync(s3, tmp_path)
+        sync.sync()
+        s3.put_object(Bucket=BUCKET, Key="docs/a.md", Body=b"# Documento a v2")
+
+        failing = _CountingClient(s3)
+        failing.get_object = lambda **kwargs: (_ for _ in ()).throw(ConnectionError("timeout"))
+        sync._client = failing
+        result = sync.sync()
+
+        assert "# Documento a" in result["combined_docs"]
+        assert result["sync_stats"]["downloaded"] == 0
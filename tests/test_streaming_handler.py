@@ -99,3 +99,185 @@ class TestResetStateClearsUsageMetadata:
         handler._reset_state()
 
         assert handler.usage_metadata == {}
+
+
+def _usage(input_tokens, output_tokens, cached=0, reasoning=0):
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens,
+        "input_token_details": {"cache_read": cached},
+        "output_token_details": {"reasoning": reasoning},
+    }
+
+
+class _FakeAgent:
+    """Agente finto: riproduce una sequenza di eventi astream_events (un numero = pausa in secondi)."""
+
+    def __init__(self, events):
+        self.events = events
+
+    async def astream_events(self, *args, **kwargs):
+        import asyncio
+
+        for event in self.events:
+            if isinstance(event, (int, float)):
+                await asyncio.sleep(event)
+            else:
+                yield event
+
+
+def _run(handler, events):
+    import asyncio
+
+    async def consume():
+        return [chunk async for chunk in handler.handle_stream_events(_FakeAgent(events), "q", {})]
+
+    return asyncio.run(consume())
+
+
+@pytest.mark.unit
+class TestUsageAcrossLLMCalls:
+    """A ReAct turn with a tool makes several LLM calls: all of them are counted."""
+
+    def _react_turn(self):
+        from langchain_core.messages import AIMessage, AIMessageChunk
+
+        meta = {"langgraph_node": "agent"}
+        return [
+            {"event": "on_chat_model_start", "run_id": "r1", "metadata": meta, "data": {}},
+            {"event": "on_chat_model_end", "run_id": "r1", "metadata": meta,
+             "data": {"output": AIMessage(content="", usage_metadata=_usage(1000, 20, cached=800, reasoning=5))}},
+            {"event": "on_tool_start", "run_id": "t1", "name": "domanda_teoria", "data": {"input": {}}},
+            {"event": "on_chat_model_start", "run_id": "r2", "metadata": meta, "data": {}},
+            {"event": "on_chat_model_stream", "run_id": "r2", "metadata": meta,
+             "data": {"chunk": AIMessageChunk(content="Ecco")}},
+            {"event": "on_chat_model_end", "run_id": "r2", "metadata": meta,
+             "data": {"output": AIMessage(content="Ecco", usage_metadata=_usage(1500, 40, cached=800))}},
+        ]
+
+    def test_usage_is_summed_over_calls(self):
+        handler = StreamingHandler(message_id="test-msg")
+        _run(handler, self._react_turn())
+
+        usage = handler.get_usage_metadata()
+        assert usage["input_tokens"] == 2500
+        assert usage["output_tokens"] == 60
+        assert usage["input_token_details"]["cache_read"] == 1600
+        assert usage["output_token_details"]["reasoning"] == 5
+
+    def test_per_call_breakdown(self):
+        handler = StreamingHandler(message_id="test-msg")
+        _run(handler, self._react_turn())
+
+        calls = handler.get_llm_calls()
+        assert [c["call_index"] for c in calls] == [0, 1]
+        assert [c["node"] for c in calls] == ["agent", "agent"]
+        assert calls[0]["cached_tokens"] == 800 and calls[0]["thinking_tokens"] == 5
+        assert calls[1]["input_tokens"] == 1500 and calls[1]["output_tokens"] == 40
+        assert all(c["latency_ms"] is not None for c in calls)
+
+    def test_streamed_usage_is_used_when_model_end_is_missing(self):
+        from langchain_core.messages import AIMessageChunk
+
+        handler = StreamingHandler(message_id="test-msg")
+        _run(handler, [
+            {"event": "on_chat_model_start", "run_id": "r1", "data": {}},
+            {"event": "on_chat_model_stream", "run_id": "r1",
+             "data": {"chunk": AIMessageChunk(content="a", usage_metadata=_usage(1000, 3))}},
+            {"event": "on_chat_model_stream", "run_id": "r1",
+             "data": {"chunk": AIMessageChunk(content="b", usage_metadata=_usage(0, 4))}},
+        ])
+
+        calls = handler.get_llm_calls()
+        assert len(calls) == 1
+        assert (calls[0]["input_tokens"], calls[0]["output_tokens"]) == (1000, 7)
+        assert handler.get_usage_metadata()["output_tokens"] == 7
+
+
+def _text(content):
+    from langchain_core.messages import AIMessageChunk
+
+    return {"event": "on_chat_model_stream", "run_id": "r1", "data": {"chunk": AIMessageChunk(content=content)}}
+
+
+def _frames(chunks):
+    import json
+
+    return [json.loads(c[len("data: "):]) for c in chunks if c.startswith("data: ")]
+
+
+@pytest.mark.unit
+class TestSSEFrames:
+    """Heartbeat during silence and coalescing of agent_message chunks."""
+
+    def _handler(self, heartbeat=0, coalesce_ms=50, coalesce_bytes=512):
+        handler = StreamingHandler(message_id="m1")
+        handler.heartbeat_seconds = heartbeat
+        handler.coalesce_seconds = coalesce_ms / 1000
+        handler.coalesce_bytes = coalesce_bytes
+        return handler
+
+    def test_fast_chunks_are_coalesced_after_the_first(self):
+        handler = self._handler()
+        chunks = _run(handler, [_text("Ciao")] + [_text(f" t{i}") for i in range(20)])
+
+        frames = _frames(chunks)
+        assert frames[0]["data"] == "Ciao"  # il primo token non aspetta
+        assert len(frames) == 2
+        assert "".join(f["data"] for f in frames) == handler.get_final_response()
+
+    def test_byte_budget_splits_frames(self):
+        handler = self._handler(coalesce_bytes=10)
+        chunks = _run(handler, [_text("x" * 4) for _ in range(10)])
+
+        frames = _frames(chunks)
+        assert all(len(f["data"]) <= 12 for f in frames)
+        assert "".join(f["data"] for f in frames) == "x" * 40
+
+    def test_time_budget_flushes_during_a_pause(self):
+        handler = self._handler(coalesce_ms=20)
+        chunks = _run(handler, [_text("a"), _text("b"), 0.2, _text("c")])
+
+        assert [f["data"] for f in _frames(chunks)] == ["a", "b", "c"]
+
+    def test_coalescing_disabled(self):
+        handler = self._handler(coalesce_bytes=0)
+        chunks = _run(handler, [_text(c) for c in "abc"])
+
+        assert [f["data"] for f in _frames(chunks)] == ["a", "b", "c"]
+
+    def test_text_is_flushed_before_tool_result(self):
+        handler = self._handler()
+        tool_end = {"event": "on_tool_end", "run_id": "t1", "name": "domanda_teoria",
+                    "data": {"output": {"testo": "?"}}}
+        chunks = _run(handler, [_text("a"), _text("b"), tool_end])
+
+        assert [f["type"] for f in _frames(chunks)] == ["agent_message", "agent_message", "tool_result"]
+
+    def test_heartbeat_during_silence(self):
+        from src.agent.streaming_handler import HEARTBEAT_FRAME
+
+        handler = self._handler(heartbeat=0.05)
+        chunks = _run(handler, [0.3, _text("Ciao")])
+
+        assert chunks[0] == HEARTBEAT_FRAME
+        assert 3 <= chunks.count(HEARTBEAT_FRAME) <= 7
+        assert _frames(chunks) == [{"type": "agent_message", "data": "Ciao", "message_id": "m1"}]
+
+    def test_no_heartbeat_while_tokens_flow(self):
+        from src.agent.streaming_handler import HEARTBEAT_FRAME
+
+        handler = self._handler(heartbeat=0.05, coalesce_bytes=0)
+        chunks = _run(handler, [x for i in range(10) for x in (_text(str(i)), 0.01)])
+
+        assert HEARTBEAT_FRAME not in chunks
+
+    def test_encode_sse_handles_non_json_types(self):
+        from datetime import datetime
+
+        from src.agent.streaming_handler import encode_sse
+
+        assert encode_sse({"a": "è", 1: 2}) == 'data: {"a":"è","1":2}\n\n'
+        assert encode_sse({"when": datetime(2026, 1, 1)}).startswith('data: {"when":')
+        assert encode_sse({"x": {1, 2}}).startswith("data: ")
@@ -173,3 +173,63 @@ class TestRequestTimer:
         assert timer.duration_ms is not None
         assert timer.duration_ms >= 40  # Allow some tolerance
         assert timer.duration_ms < 200  # But not too much
+
+
+@pytest.mark.unit
+class TestLLMCallBreakdown:
+    """Tests for the per-call breakdown of multi-call (ReAct) requests."""
+
+    @patch("src.monitoring.token_logger._save_metric")
+    def test_persists_sum_and_breakdown(self, mock_save):
+        from src.monitoring.token_logger import log_token_usage
+
+        calls = [
+            {"call_index": 0, "node": "agent", "input_tokens": 1000, "output_tokens": 20,
+             "total_tokens": 1020, "cached_tokens": 800, "thinking_tokens": 5, "latency_ms": 900.0},
+            {"call_index": 1, "node": "agent", "input_tokens": 1500, "output_tokens": 40,
+             "total_tokens": 1540, "cached_tokens": 800, "thinking_tokens": 0, "latency_ms": 1100.0},
+        ]
+        usage = {
+            "input_tokens": 2500, "output_tokens": 60, "total_tokens": 2560,
+            "input_token_details": {"cache_read": 1600}, "output_token_details": {"reasoning": 5},
+        }
+
+        with patch("src.env.settings") as mock_settings:
+            mock_settings.ENABLE_TOKEN_LOGGING = True
+            result = log_token_usage(user_id="u", model="m", usage_metadata=usage, llm_calls=calls)
+
+        assert result["input_tokens"] == 2500
+        assert result["cached_tokens"] == 1600
+        assert result["thinking_tokens"] == 5
+        assert result["llm_call_count"] == 2
+        assert result["llm_calls"] == calls
+
+    def test_sum_usage_adds_nested_details(self):
+        from src.monitoring.token_logger import sum_usage
+
+        total = sum_usage([
+            {"input_tokens": 10, "input_token_details": {"cache_read": 4}},
+            {"input_tokens": 5, "input_token_details": {"cache_read": 1}, "output_tokens": 2},
+        ])
+        assert total == {"input_tokens": 15, "input_token_details": {"cache_read": 5}, "output_tokens": 2}
+
+    def test_request_without_usage_keeps_trace_and_queue_wait(self):
+        from src.monitoring.token_logger import _build_metric, metric_calls
+
+        trace = {"trace_id": "t1", "marks_ms": {"stream_end": 40.0}, "phases_ms": {"stream": 35.0}, "spans": []}
+        with patch("src.env.settings") as mock_settings:
+            mock_settings.ENABLE_TOKEN_LOGGING = True
+            metric = _build_metric("u", "m", {}, 40.0, {"trace": trace, "queue_wait_ms": 12.5})
+            untraced = _build_metric("u", "m", None, 40.0, {"queue_wait_ms": None})
+
+        assert untraced is None
+        assert metric["input_tokens"] == 0 and metric["llm_call_count"] == 0
+        assert metric["phases_ms"] == {"stream": 35.0} and metric["queue_wait_ms"] == 12.5
+        assert metric_calls(metric) == []
+
+    def test_metric_calls_falls_back_to_top_level_counts(self):
+        from src.monitoring.token_logger import metric_calls
+
+        calls = metric_calls({"input_tokens": 100, "output_tokens": 10, "cached_tokens": 50})
+        assert len(calls) == 1
+        assert calls[0]["input_tokens"] == 100 and calls[0]["cached_tokens"] == 50
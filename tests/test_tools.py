@@ -174,7 +174,7 @@ class TestDomandaTeoria:
             assert result["risposta_corretta"] == "A"
             
             # Verifica che sia stato chiamato il metodo corretto
-            mock_quiz_service.search_questions_by_text.assert_called_once_with(testo_ricerca)
+            mock_quiz_service.search_questions_by_text.assert_called_once_with(testo_ricerca, limit=1)
 
     def test_ricerca_testo_troppo_corto(self, mock_quiz_service):
         """Test: Ricerca per testo troppo corto."""
@@ -265,7 +265,7 @@ class TestDomandaTeoria:
             result = domanda_teoria.invoke({"capitolo": 1, "testo": "TEST"})
             
             # Verifica che sia stata chiamata la ricerca per testo
-            mock_quiz_service.search_questions_by_text.assert_called_once_with("TEST")
+            mock_quiz_service.search_questions_by_text.assert_called_once_with("TEST", limit=1)
             mock_quiz_service.get_random_question_by_field.assert_not_called()
 
     def test_formato_output_consistente(self, mock_quiz_service):
@@ -0,0 +1,236 @@
+"""
+Unit tests for src/monitoring/tracing.py: spans, marks, percentiles, OTLP/JSON file export,
+and how traces reach the token metrics and the monitoring report.
+"""
+import asyncio
+import json
+from datetime import datetime, timezone
+from unittest.mock import Mock, patch
+
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.prebuilt import create_react_agent
+
+from src.agent.streaming_handler import StreamingHandler
+from src.history_hooks import build_llm_input_window_hook
+from src.monitoring.tracing import (
+    OTLPJsonFileExporter,
+    RequestTrace,
+    current_trace,
+    percentiles,
+    set_current_trace,
+    start_trace,
+    to_otlp_json,
+    trace_span,
+)
+from src.tools import domanda_teoria
+
+pytestmark = pytest.mark.unit
+
+
+class _FakeChatModel(GenericFakeChatModel):
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+@pytest.fixture(autouse=True)
+def _no_current_trace():
+    set_current_trace(None)
+    yield
+    set_current_trace(None)
+
+
+class TestRequestTrace:
+
+    def test_nested_spans_and_phase_totals(self):
+        trace = start_trace()
+        with trace_span("agent_build"):
+            with trace_span("auth0_metadata"):
+                pass
+        with trace_span("pre_model_hook"):
+            pass
+        with trace_span("pre_model_hook"):
+            pass
+
+        by_name = {}
+        for span in trace.spans:
+            by_name.setdefault(span.name, []).append(span)
+        parent = by_name["agent_build"][0]
+        assert by_name["auth0_metadata"][0].parent_id == parent.span_id
+        assert parent.parent_id is None
+        assert len(by_name["pre_model_hook"]) == 2
+        assert set(trace.phases_ms()) == {"agent_build", "auth0_metadata", "pre_model_hook"}
+
+    def test_trace_span_is_noop_without_trace(self):
+        with trace_span("memory_seed") as attrs:
+            attrs["seeded"] = True
+        assert current_trace() is None
+
+    def test_failed_span_records_error(self):
+        trace = RequestTrace()
+        with pytest.raises(RuntimeError):
+            with trace.span("auth"):
+                raise RuntimeError("boom")
+        assert trace.spans[0].attributes == {"error": "RuntimeError"}
+
+    def test_trace_follows_into_worker_threads(self):
+        async def run():
+            trace = start_trace()
+
+            def work():
+                with trace_span("prompt_init"):
+                    pass
+
+            await asyncio.to_thread(work)
+            return trace
+
+        trace = asyncio.run(run())
+        assert [s.name for s in trace.spans] == ["prompt_init"]
+
+    def test_marks_keep_first_and_last(self):
+        trace = RequestTrace()
+        trace.mark("first_token", first_only=True)
+        first = trace.marks["first_token"]
+        trace.mark("first_token", first_only=True)
+        trace.mark("last_token")
+        assert trace.marks["first_token"] == first
+        assert trace.marks["last_token"] >= first
+
+    def test_document_lists_spans_in_start_order(self):
+        trace = RequestTrace()
+        with trace.span("auth"):
+            pass
+        with trace.span("stream", fast_path=False):
+            pass
+        doc = trace.to_document()
+        assert doc["trace_id"] == trace.trace_id
+        assert [s["name"] for s in doc["spans"]] == ["auth", "stream"]
+        assert doc["spans"][1]["attributes"] == {"fast_path": False}
+
+    def test_disabled_tracing_starts_nothing(self):
+        with patch("src.monitoring.tracing.settings") as settings:
+            settings.TRACING_ENABLED = False
+            assert start_trace() is None
+        assert current_trace() is None
+
+
+def test_percentiles_nearest_rank():
+    values = list(range(1, 101))
+    assert percentiles(values) == {"p50": 50, "p95": 95, "p99": 99}
+    assert percentiles([7.0]) == {"p50": 7.0, "p95": 7.0, "p99": 7.0}
+    assert percentiles([]) == {"p50": 0, "p95": 0, "p99": 0}
+
+
+class TestOTLPExport:
+
+    def test_otlp_json_structure(self):
+        trace = RequestTrace()
+        with trace.span("auth"):
+            with trace.span("jwks"):
+                pass
+        trace.mark("first_token")
+
+        payload = to_otlp_json(trace, {"user_id": "u1"})
+        spans = payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        root, auth, jwks = spans
+        assert {s["traceId"] for s in spans} == {trace.trace_id}
+        assert len(trace.trace_id) == 32 and len(root["spanId"]) == 16
+        assert auth["parentSpanId"] == root["spanId"]
+        assert jwks["parentSpanId"] == auth["spanId"]
+        assert int(jwks["startTimeUnixNano"]) >= int(root["startTimeUnixNano"])
+        assert root["attributes"] == [{"key": "user_id", "value": {"stringValue": "u1"}}]
+        assert root["events"][0]["name"] == "first_token"
+
+    def test_file_exporter_appends_one_line_per_trace(self, tmp_path):
+        path = tmp_path / "traces" / "out.jsonl"
+        exporter = OTLPJsonFileExporter(str(path))
+        for _ in range(2):
+            trace = RequestTrace()
+            with trace.span("persistence"):
+                pass
+            assert exporter.export(trace)
+
+        lines = path.read_text().splitlines()
+        assert len(lines) == 2 and exporter.exported == 2
+        assert all("resourceSpans" in json.loads(line) for line in lines)
+
+
+class TestPipelineIntegration:
+
+    def test_streaming_handler_records_first_token_and_hook(self):
+        model = _FakeChatModel(messages=iter([AIMessage(content="Ciao, come posso aiutarti?")]))
+        agent = create_react_agent(
+            model, [domanda_teoria], pre_model_hook=build_llm_input_window_hook(5), checkpointer=InMemorySaver(),
+        )
+
+        async def run():
+            trace = start_trace()
+            handler = StreamingHandler("m1", trace=trace)
+            chunks = [c async for c in handler.handle_stream_events(agent, "ciao", {"configurable": {"thread_id": "t1"}})]
+            return trace, chunks
+
+        trace, chunks = asyncio.run(run())
+        assert chunks
+        assert "pre_model_hook" in trace.phases_ms()
+        assert trace.marks["first_token"] <= trace.marks["last_token"]
+
+    def test_direct_tool_call_records_tool_span(self):
+        service = Mock()
+        service.get_question_by_capitolo_and_number.return_value = {"capitolo": 2, "numero": 5, "testo": "?"}
+
+        async def run():
+            trace = start_trace()
+            handler = StreamingHandler("m1", trace=trace)
+            agent = create_react_agent(_FakeChatModel(messages=iter([])), [domanda_teoria], checkpointer=InMemorySaver())
+            async for _ in handler.handle_direct_tool_call(
+                agent, "domanda 5 del capitolo 2", {"configurable": {"thread_id": "t1"}},
+                domanda_teoria, {"capitolo": 2, "domanda": 5},
+            ):
+                pass
+            return trace
+
+        with patch("src.tools.QuizMongoDBService", return_value=service):
+            trace = asyncio.run(run())
+        assert [(s.name, s.attributes) for s in trace.spans] == [("tool", {"tool": "domanda_teoria"})]
+        assert "first_token" in trace.marks
+
+    def test_token_metric_carries_trace(self):
+        from src.monitoring.token_logger import _build_metric
+
+        trace = RequestTrace()
+        with trace.span("memory_seed"):
+            pass
+        trace.mark("first_token")
+        metadata = {"message_id": "m1", "trace": trace.to_document()}
+
+        metric = _build_metric("u1", "gemini", {"input_tokens": 10, "output_tokens": 2}, 120.0, metadata)
+
+        assert metric["trace_id"] == trace.trace_id
+        assert metric["ttft_ms"] == trace.marks["first_token"]
+        assert set(metric["phases_ms"]) == {"memory_seed"}
+        assert "trace" not in metric["metadata"] and "trace" in metadata
+
+    @patch("src.monitoring.dashboard.get_rate_limit_events", return_value=[])
+    @patch("src.monitoring.dashboard.get_token_metrics")
+    def test_monitoring_report_latency_percentiles(self, mock_metrics, _):
+        from src.monitoring.dashboard import get_monitoring_report
+
+        mock_metrics.return_value = [
+            {
+                "input_tokens": 100, "output_tokens": 10, "total_tokens": 110, "cached_tokens": 0,
+                "marks_ms": {"first_token": float(i), "last_token": float(i * 2)},
+                "phases_ms": {"auth": 1.0, "memory_seed": float(i)},
+                "timestamp": datetime(2026, 2, 5, 10, 0, tzinfo=timezone.utc),
+            }
+            for i in range(1, 101)
+        ] + [{"input_tokens": 1, "output_tokens": 1, "total_tokens": 2, "cached_tokens": 0}]
+
+        latency = get_monitoring_report(hours=24)["latency"]
+
+        assert latency["traced_requests"] == 100
+        assert latency["ttft_ms"] == {"p50": 50.0, "p95": 95.0, "p99": 99.0}
+        assert latency["last_token_ms"]["p99"] == 198.0
+        assert latency["phases"]["memory_seed"] == {"count": 100, "p50": 50.0, "p95": 95.0, "p99": 99.0}
+        assert latency["phases"]["auth"]["p95"] == 1.0
@@ -0,0 +1,233 @@
+"""
+Unit tests for src/user_profile_cache.py: L1/L2 profile cache with stale-while-revalidate,
+negative caching and change listeners. The shared store is the local Redis-like fake.
+"""
+import asyncio
+
+import pytest
+
+from src.user_profile_cache import (
+    KeyValueProfileStore,
+    LocalKeyValueStore,
+    ProfileEntry,
+    UserProfileCache,
+    create_profile_store,
+)
+from tests.fakes import Clock
+
+pytestmark = pytest.mark.unit
+
+
+class _Auth0:
+    """Fetch finto: profili per utente, None = utente inesistente, Exception = Auth0 giù."""
+
+    def __init__(self, **profiles):
+        self.profiles = profiles
+        self.calls = []
+        self.delay = 0.0
+
+    async def __call__(self, user_id):
+        self.calls.append(user_id)
+        await asyncio.sleep(self.delay)
+        profile = self.profiles.get(user_id)
+        if isinstance(profile, Exception):
+            raise profile
+        return profile
+
+
+def _cache(fetch, clock, store=None):
+    return UserProfileCache(
+        fetch, store=store, maxsize=10, fresh_seconds=60, stale_seconds=3600,
+        negative_seconds=30, timer=clock,
+    )
+
+
+def _store(clock):
+    return KeyValueProfileStore(LocalKeyValueStore(timer=clock))
+
+
+class TestTiers:
+
+    def test_l1_hit_after_first_fetch(self):
+        auth0, clock = _Auth0(u1="Nome: Marco"), Clock()
+        cache = _cache(auth0, clock)
+
+        async def run():
+            return [await cache.get("u1") for _ in range(3)]
+
+        assert asyncio.run(run()) == ["Nome: Marco"] * 3
+        assert auth0.calls == ["u1"]
+        assert cache.stats()["l1_hits"] == 2
+
+    def test_store_is_shared_between_instances(self):
+        auth0, clock = _Auth0(u1="Nome: Marco"), Clock()
+        store = _store(clock)
+        first, second = _cache(auth0, clock, store), _cache(auth0, clock, store)
+
+        async def run():
+            await first.get("u1")
+            return await second.get("u1")
+
+        assert asyncio.run(run()) == "Nome: Marco"
+        assert auth0.calls == ["u1"]
+        assert second.stats()["l2_hits"] == 1
+
+    def test_store_errors_fall_back_to_auth0(self):
+        class _Broken:
+            async def get(self, user_id):
+                raise ConnectionError("store down")
+
+            async def set(self, user_id, entry, ttl_seconds):
+                raise ConnectionError("store down")
+
+            async def delete(self, user_id):
+                raise ConnectionError("store down")
+
+        auth0, clock = _Auth0(u1="Nome: Marco"), Clock()
+        cache = _cache(auth0, clock, _Broken())
+
+        assert asyncio.run(cache.get("u1")) == "Nome: Marco"
+        assert cache.stats()["store_errors"] == 2
+
+    def test_create_profile_store(self):
+        assert create_profile_store("none") is None
+        assert isinstance(create_profile_store("local"), KeyValueProfileStore)
+
+
+class TestStaleWhileRevalidate:
+
+    def test_stale_entry_is_served_and_refreshed_in_background(self):
+        auth0, clock = _Auth0(u1="v1"), Clock()
+        cache = _cache(auth0, clock)
+
+        async def run():
+            await cache.get("u1")
+            auth0.profiles["u1"] = "v2"
+            auth0.delay = 0.02
+            clock.now += 120  # oltre fresh_seconds, entro stale_seconds
+            served = await cache.get("u1")
+            await asyncio.gather(*cache._refreshing.values())
+            return served, await cache.get("u1")
+
+        assert asyncio.run(run()) == ("v1", "v2")
+        assert auth0.calls == ["u1", "u1"]
+        assert cache.stats()["stale_served"] == 1
+
+    def test_concurrent_stale_reads_trigger_one_refresh(self):
+        auth0, clock = _Auth0(u1="v1"), Clock()
+        cache = _cache(auth0, clock)
+
+        async def run():
+            await cache.get("u1")
+            auth0.delay = 0.02
+            clock.now += 120
+            await asyncio.gather(*(cache.get("u1") for _ in range(5)))
+            await asyncio.gather(*cache._refreshing.values())
+
+        asyncio.run(run())
+        assert auth0.calls == ["u1", "u1"]
+
+    def test_expired_entry_waits_for_auth0(self):
+        auth0, clock = _Auth0(u1="v1"), Clock()
+        cache = _cache(auth0, clock)
+
+        async def run():
+            await cache.get("u1")
+            auth0.profiles["u1"] = "v2"
+            clock.now += 4000  # oltre stale_seconds
+            return await cache.get("u1")
+
+        assert asyncio.run(run()) == "v2"
+
+    def test_fetch_error_keeps_serving_previous_profile(self):
+        auth0, clock = _Auth0(u1="v1"), Clock()
+        cache = _cache(auth0, clock)
+
+        async def run():
+            await cache.get("u1")
+            auth0.profiles["u1"] = TimeoutError("Auth0 timeout")
+            clock.now += 4000
+            return await cache.get("u1")
+
+        assert asyncio.run(run()) == "v1"
+        assert cache.stats()["fetch_errors"] == 1
+
+
+class TestNegativeCaching:
+
+    def test_missing_user_is_not_refetched_until_expiry(self):
+        auth0, clock = _Auth0(), Clock()
+        cache = _cache(auth0, clock)
+
+        async def run():
+            results = [await cache.get("ghost") for _ in range(3)]
+            clock.now += 31
+            results.append(await cache.get("ghost"))
+            return results
+
+        assert asyncio.run(run()) == [""] * 4
+        assert auth0.calls == ["ghost", "ghost"]
+        assert cache.stats()["negative_hits"] == 2
+
+    def test_negative_entry_expires_from_store(self):
+        clock = Clock()
+        store = _store(clock)
+        cache = _cache(_Auth0(), clock, store)
+        asyncio.run(cache.get("ghost"))
+        assert asyncio.run(store.get("ghost")) == ProfileEntry("", 1000.0)
+        clock.now += 31
+        assert asyncio.run(store.get("ghost")) is None
+
+
+class TestChangeHook:
+
+    def test_listener_fires_when_refresh_finds_a_new_profile(self):
+        auth0, clock = _Auth0(u1="v1"), Clock()
+        cache = _cache(auth0, clock)
+        changes = []
+        cache.add_listener(lambda *change: changes.append(change))
+
+        async def run():
+            await cache.get("u1")
+            clock.now += 4000
+            await cache.get("u1")  # profilo invariato: nessuna notifica
+            auth0.profiles["u1"] = "v2"
+            clock.now += 4000
+            await cache.get("u1")
+
+        asyncio.run(run())
+        assert changes == [("u1", "v1", "v2")]
+
+    def test_invalidate_clears_both_tiers_and_notifies(self):
+        auth0, clock = _Auth0(u1="v1"), Clock()
+        store = _store(clock)
+        cache = _cache(auth0, clock, store)
+        changes = []
+        cache.add_listener(lambda *change: changes.append(change))
+
+        async def run():
+            await cache.get("u1")
+            await cache.invalidate("u1")
+            in_store = await store.get("u1")
+            auth0.profiles["u1"] = "v2"
+            return in_store, await cache.get("u1")
+
+        assert asyncio.run(run()) == (None, "v2")
+        assert changes == [("u1", "v1", None)]
+
+    def test_failing_listener_does_not_break_reads(self):
+        auth0, clock = _Auth0(u1="v1"), Clock()
+        cache = _cache(auth0, clock)
+
+        def broken(*_):
+            raise RuntimeError("listener bug")
+
+        cache.add_listener(broken)
+
+        async def run():
+            await cache.get("u1")
+            auth0.profiles["u1"] = "v2"
+            clock.now += 4000
+            return await cache.get("u1")
+
+        assert asyncio.run(run()) == "v2"
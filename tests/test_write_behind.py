@@ -0,0 +1,231 @@
+"""
+Unit tests for src/services/database/write_behind.py
+"""
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from src.services.database.async_database_service import AsyncMongoDBService
+from src.services.database.write_behind import WriteBehindQueue
+
+pytestmark = pytest.mark.unit
+
+
+class _RecordingService:
+    """Stand-in for AsyncMongoDBService that records insert_many calls and can fail on demand."""
+
+    def __init__(self, failures=None):
+        self.calls = []
+        self.failures = list(failures or [])
+
+    def __call__(self, database):
+        self.database = database
+        return self
+
+    async def insert_documents(self, collection, documents):
+        self.calls.append((self.database, collection, [dict(d) for d in documents]))
+        if self.failures:
+            raise self.failures.pop(0)
+        return [d.get("_id") for d in documents]
+
+
+def _queue(service, **kwargs):
+    options = dict(max_size=100, batch_size=10, flush_interval_s=0.01, max_retries=3, retry_backoff_s=0)
+    options.update(kwargs)
+    return WriteBehindQueue(service_factory=service, **options)
+
+
+class TestWriteBehindQueue:
+
+    def test_batches_by_collection(self):
+        service = _RecordingService()
+        queue = _queue(service)
+
+        async def scenario():
+            for i in range(3):
+                queue.enqueue("db", "chats", {"n": i})
+            queue.enqueue("metrics", "tokens", {"n": 9})
+            return await queue.flush()
+
+        assert asyncio.run(scenario()) == 4
+        assert [(db, coll, len(docs)) for db, coll, docs in service.calls] == [
+            ("db", "chats", 3),
+            ("metrics", "tokens", 1),
+        ]
+        assert queue.stats()["depth"] == 0
+        assert queue.stats()["written"] == 4
+
+    def test_background_worker_flushes_without_explicit_flush(self):
+        service = _RecordingService()
+        queue = _queue(service)
+
+        async def scenario():
+            queue.enqueue("db", "chats", {"n": 1})
+            assert queue.stats()["depth"] == 1  # enqueue returns before any write
+            await asyncio.sleep(0.1)
+
+        asyncio.run(scenario())
+        assert len(service.calls) == 1
+        assert queue.stats()["flushes"] == 1
+
+    def test_retries_with_backoff_then_succeeds(self):
+        service = _RecordingService(failures=[AutoReconnect("down"), AutoReconnect("down")])
+        queue = _queue(service, retry_backoff_s=0.001)
+
+        async def scenario():
+            queue.enqueue("db", "chats", {"n": 1})
+            with patch("src.services.database.write_behind.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+                persisted = await queue.flush()
+            return persisted, [c.args[0] for c in mock_sleep.call_args_list]
+
+        persisted, delays = asyncio.run(scenario())
+        assert persisted == 1
+        assert delays == [0.001, 0.002]
+        assert queue.stats()["retries"] == 2
+        assert queue.stats()["failed"] == 0
+
+    def test_gives_up_after_max_retries(self):
+        service = _RecordingService(failures=[AutoReconnect("down")] * 5)
+        queue = _queue(service, max_retries=2)
+
+        async def scenario():
+            queue.enqueue("db", "chats", {"n": 1})
+            return await queue.flush()
+
+        assert asyncio.run(scenario()) == 0
+        assert len(service.calls) == 3
+        assert queue.stats()["failed"] == 1
+
+    def test_drop_oldest_policy(self):
+        queue = _queue(_RecordingService(), max_size=2, overflow_policy="drop_oldest")
+
+        for i in range(3):
+            assert queue.enqueue("db", "chats", {"n": i}) is True
+
+        assert [entry[2]["n"] for entry in queue._buffer] == [1, 2]
+        assert queue.stats()["dropped"] == 1
+
+    def test_drop_newest_policy(self):
+        queue = _queue(_RecordingService(), max_size=2, overflow_policy="drop_newest")
+
+        results = [queue.enqueue("db", "chats", {"n": i}) for i in range(3)]
+
+        assert results == [True, True, False]
+        assert [entry[2]["n"] for entry in queue._buffer] == [0, 1]
+        assert queue.stats()["dropped"] == 1
+
+    def test_invalid_overflow_policy(self):
+        with pytest.raises(ValueError):
+            _queue(_RecordingService(), overflow_policy="block")
+
+    def test_partial_bulk_failure_retries_only_failed_documents(self):
+        error = BulkWriteError({
+            "nInserted": 1,
+            "writeErrors": [{"index": 1, "code": 91, "errmsg": "shutdown"}],
+        })
+        service = _RecordingService(failures=[error])
+        queue = _queue(service)
+
+        async def scenario():
+            queue.enqueue("db", "chats", {"n": 0})
+            queue.enqueue("db", "chats", {"n": 1})
+            return await queue.flush()
+
+        assert asyncio.run(scenario()) == 2
+        assert [d["n"] for d in service.calls[1][2]] == [1]
+
+    def test_close_flushes_remaining_documents(self):
+        service = _RecordingService()
+        queue = _queue(service, flush_interval_s=10)
+
+        async def scenario():
+            queue.enqueue("db", "chats", {"n": 1})
+            queue.enqueue("db", "chats", {"n": 2})
+            return await queue.close(timeout_s=1)
+
+        assert asyncio.run(scenario()) == 2
+        assert queue.stats()["depth"] == 0
+
+    def test_close_waits_for_the_batch_being_written(self):
+        service = _SlowService(delay=0.1)
+        queue = _queue(service, flush_interval_s=0)
+
+        async def scenario():
+            for i in range(3):
+                queue.enqueue("db", "chats", {"n": i})
+            await asyncio.sleep(0.02)  # il worker ha già tolto il batch dalla coda
+            assert queue.stats()["depth"] == 0 and service.started
+            return await queue.close(timeout_s=1)
+
+        assert asyncio.run(scenario()) == 3
+        assert [d["n"] for d in service.stored] == [0, 1, 2]
+        assert queue.stats()["failed"] == 0
+
+    def test_close_timeout_counts_the_batch_in_flight(self):
+        service = _SlowService(delay=5)
+        queue = _queue(service, flush_interval_s=0)
+
+        async def scenario():
+            for i in range(3):
+                queue.enqueue("db", "chats", {"n": i})
+            await asyncio.sleep(0.02)
+            queue.enqueue("db", "chats", {"n": 3})
+            return await queue.close(timeout_s=0.05)
+
+        assert asyncio.run(scenario()) == 0
+        assert queue.stats()["failed"] == 4 and queue.stats()["depth"] == 0
+
+    def test_cancelled_flush_puts_the_batch_back(self):
+        service = _SlowService(delay=5)
+        queue = _queue(service)
+
+        async def scenario():
+            for i in range(3):
+                queue.enqueue("db", "chats", {"n": i})
+            flush = asyncio.ensure_future(queue.flush())
+            await asyncio.sleep(0.02)
+            flush.cancel()
+            await asyncio.gather(flush, return_exceptions=True)
+            return [entry[2]["n"] for entry in queue._buffer]
+
+        assert asyncio.run(scenario()) == [0, 1, 2]
+
+
+class _SlowService:
+    """Stand-in for AsyncMongoDBService whose insert_many takes `delay` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.started = False
+        self.stored = []
+
+    def __call__(self, database):
+        return self
+
+    async def insert_documents(self, collection, documents):
+        self.started = True
+        await asyncio.sleep(self.delay)
+        self.stored.extend(documents)
+        return [d.get("_id") for d in documents]
+
+
+class TestWriteBehindWithMongo:
+
+    def test_duplicate_message_id_falls_back_to_object_id(self):
+        client = AsyncMongoMockClient()
+        queue = _queue(lambda database: AsyncMongoDBService(database, client=client))
+
+        async def scenario():
+            await client["db"]["chats"].insert_one({"_id": "dup", "human": "q1"})
+            queue.enqueue("db", "chats", {"_id": "dup", "human": "q2"})
+            queue.enqueue("db", "chats", {"human": "q3"})
+            persisted = await queue.flush()
+            return persisted, await client["db"]["chats"].count_documents({})
+
+        persisted, count = asyncio.run(scenario())
+        assert persisted == 2
+        assert count == 3
+        assert queue.stats()["failed"] == 0